@@ -90,6 +90,7 @@ async def book_game(request: BookGameRequest):
             "user_id": request.user_id,
             "status": "pending",
         },
+        event_id=f"booking.created:{booking_id}",
     )
 
     return BookingResponse(**booking)
@@ -120,7 +121,7 @@ async def cancel_booking(booking_id: str, request: CancelBookingRequest):
     booking["status"] = "canceled"
     bookings_db[booking_id] = booking
 
-    # Publish domain event
+    # Publish domain event (a random id: cancelling again publishes it again)
     await publish_event(
         "booking.canceled",
         {
@@ -0,0 +1,130 @@
+"""
+Benchmark for the segmented event log.
+
+Archives a stream of representative events (JSON and MessagePack bodies),
+then reports the append rate, the bytes per event with and without
+compression, the rate of a full scan, the latency of reading a short time
+range from the middle of the log through the index, and the rate of a
+replay into a projection.
+
+Usage:
+    python benchmarks/bench_segment_log.py [events]
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_codec import encode_event
+from projections import RatingAggregates
+from replay import project_events, select_events
+from segment_log import SegmentLog
+
+
+def sample_events(count: int):
+    events = []
+    for n in range(count):
+        if n % 2:
+            event_type, exchange = "rating.left", "rating_events"
+            data = {
+                "rating_id": str(uuid.uuid4()),
+                "game_id": f"game-{n % 500}",
+                "user_id": str(uuid.uuid4()),
+                "rating": n % 5 + 1,
+            }
+        else:
+            event_type, exchange = "rent.order.created", "rent_events"
+            data = {
+                "order_id": str(uuid.uuid4()),
+                "booking_id": str(uuid.uuid4()),
+                "game_id": f"game-{n % 500}",
+                "user_id": str(uuid.uuid4()),
+                "total_amount": 150.0,
+            }
+        encoded = encode_event(event_type, data, "msgpack" if n % 4 < 2 else "json")
+        events.append((exchange, event_type, data, encoded))
+    return events
+
+
+def archive(directory: str, events, compress_level: int) -> float:
+    log = SegmentLog(
+        directory, segment_bytes=16 * 1024 * 1024, compress_level=compress_level
+    )
+    started = time.perf_counter()
+    for n, (exchange, event_type, data, encoded) in enumerate(events):
+        log.append(
+            exchange,
+            event_type,
+            encoded.body,
+            message_id=f"{event_type}:{n}",
+            event_type=event_type,
+            published_at=time.time(),
+            content_type=encoded.content_type,
+            content_encoding=encoded.content_encoding,
+            timestamp=1_700_000_000.0 + n / 100,
+        )
+        if n % 500 == 499:
+            log.flush()
+    log.close()
+    return time.perf_counter() - started
+
+
+def main(count: int):
+    events = sample_events(count)
+    body_bytes = sum(len(encoded.body) for *_, encoded in events)
+    directory = tempfile.mkdtemp(prefix="bench-archive-")
+    try:
+        raw_dir = os.path.join(directory, "raw")
+        archive(raw_dir, events, compress_level=0)
+        raw_bytes = SegmentLog(raw_dir, readonly=True).stats()["bytes"]
+
+        log_dir = os.path.join(directory, "log")
+        elapsed = archive(log_dir, events, compress_level=6)
+        reader = SegmentLog(log_dir, readonly=True)
+        stats = reader.stats()
+        print(
+            f"{count} events in {stats['segments']} segments, "
+            f"{body_bytes / count:.0f} body bytes per event"
+        )
+        print(f"  append:     {count / elapsed:9.0f} events/s")
+        print(
+            f"  size:       {raw_bytes / count:9.1f} B/event uncompressed, "
+            f"{stats['bytes'] / count:.1f} B/event compressed "
+            f"({stats['bytes'] / raw_bytes:.0%})"
+        )
+
+        started = time.perf_counter()
+        scanned = sum(1 for _ in reader.read())
+        elapsed = time.perf_counter() - started
+        print(
+            f"  full scan:  {scanned / elapsed:9.0f} events/s "
+            f"({stats['bytes'] / elapsed / 1e6:.0f} MB/s of log)"
+        )
+
+        middle = 1_700_000_000.0 + count / 200
+        started = time.perf_counter()
+        for _ in range(100):
+            window = list(reader.read(start_time=middle, end_time=middle + 1))
+        elapsed = (time.perf_counter() - started) / 100
+        print(
+            f"  time range: {elapsed * 1e6:9.0f} µs for {len(window)} events "
+            f"from the middle"
+        )
+
+        projection = RatingAggregates()
+        started = time.perf_counter()
+        applied = asyncio.run(project_events(select_events(reader), projection))
+        elapsed = time.perf_counter() - started
+        print(f"  projection: {applied / elapsed:9.0f} events/s")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
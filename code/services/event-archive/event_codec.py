@@ -0,0 +1,253 @@
+"""
+Event encoding for RabbitMQ domain events.
+
+Events are published as JSON (`application/json`) or as MessagePack
+(`application/x-msgpack`), chosen by `EVENT_ENCODING`. Binary events with a
+registered schema are packed positionally: an array of the schema version
+followed by the field values in schema order, so field names are not sent
+with every event. Keys outside the schema travel in a trailing map and a
+field missing from the event decodes as None. Event types without a schema
+are packed as a plain map.
+
+Bodies larger than `EVENT_COMPRESS_THRESHOLD` bytes are deflated (zlib) and
+marked with content_encoding "deflate" when that makes them smaller.
+
+Consumers decode by the message's content type and encoding, so JSON and
+binary events can share a queue while publishers migrate. To change an event,
+register a new version with the new field list, deploy the consumers, then
+the publishers; old versions stay registered for events still queued.
+
+This module is the same in every service publishing or consuming events;
+keep the schemas in sync.
+"""
+
+import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+import msgpack
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+DEFLATE = "deflate"
+
+ENCODINGS = {"json": JSON, "msgpack": MSGPACK}
+
+# "json" or "msgpack"
+EVENT_ENCODING = os.getenv("EVENT_ENCODING", "json")
+# Bodies above this many bytes are compressed (0: never)
+EVENT_COMPRESS_THRESHOLD = int(os.getenv("EVENT_COMPRESS_THRESHOLD", "1024"))
+EVENT_COMPRESS_LEVEL = 6
+
+
+class EventDecodeError(ValueError):
+    """Raised when an event body cannot be decoded."""
+
+
+@dataclass(frozen=True)
+class EventSchema:
+    """Field order of one version of an event type."""
+
+    event_type: str
+    version: int
+    fields: Tuple[str, ...]
+    field_set: FrozenSet[str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "field_set", frozenset(self.fields))
+
+
+# (event type, version) -> schema
+SCHEMAS: Dict[Tuple[str, int], EventSchema] = {}
+# event type -> latest schema, used for encoding
+LATEST: Dict[str, EventSchema] = {}
+
+
+def register_schema(event_type: str, fields: Tuple[str, ...], version: int = 1):
+    """Register a version of an event type's schema."""
+    schema = EventSchema(event_type, version, tuple(fields))
+    SCHEMAS[(event_type, version)] = schema
+    if event_type not in LATEST or LATEST[event_type].version < version:
+        LATEST[event_type] = schema
+
+
+for _event_type, _fields in {
+    # Booking
+    "booking.created": ("booking_id", "game_id", "user_id", "status"),
+    "booking.canceled": ("booking_id", "user_id", "reason"),
+    # Payment
+    "payment.initiated": ("payment_id", "order_id", "user_id", "amount"),
+    "payment.successful": ("payment_id", "order_id", "status", "transaction_id"),
+    "payment.declined": ("payment_id", "order_id", "status", "transaction_id"),
+    "refund.requested": ("refund_id", "payment_id", "user_id", "amount"),
+    "refund.processed": ("refund_id", "payment_id", "status", "transaction_id"),
+    "refund.declined": ("refund_id", "payment_id", "reason"),
+    # Rent
+    "rent.order.created": (
+        "order_id",
+        "booking_id",
+        "game_id",
+        "user_id",
+        "total_amount",
+    ),
+    "rent.order.confirmed": ("order_id", "payment_id"),
+    "rent.order.cancelled": ("order_id", "reason"),
+    "rent.pickup_notification.sent": ("order_id", "pickup_date", "pickup_location"),
+    "rent.game_receipt.confirmed": ("order_id", "user_id"),
+    "rent.period.extended": (
+        "order_id",
+        "user_id",
+        "additional_days",
+        "rental_days",
+        "due_date",
+        "total_amount",
+    ),
+    "rent.period.ended": ("order_id", "user_id"),
+    "rent.game.returned": ("order_id", "user_id", "return_location"),
+    "rent.penalty.charged": ("order_id", "penalty_amount", "reason"),
+    "rent.game_return.confirmed": (
+        "order_id",
+        "user_id",
+        "game_condition",
+        "penalty_amount",
+    ),
+    # Rating
+    "rating.left": ("rating_id", "game_id", "user_id", "rating"),
+    "rating.updated": ("game_id", "new_rating"),
+    "comment.left": (
+        "comment_id",
+        "game_id",
+        "user_id",
+        "is_moderated",
+        "moderation_status",
+    ),
+    "comment.moderated": (
+        "comment_id",
+        "game_id",
+        "user_id",
+        "is_moderated",
+        "moderation_status",
+        "toxicity",
+    ),
+}.items():
+    register_schema(_event_type, _fields)
+
+# comment.left v2: is_moderated is None while moderation_status is "pending"
+# (v1 sent False, the value of an approved comment)
+register_schema(
+    "comment.left",
+    ("comment_id", "game_id", "user_id", "is_moderated", "moderation_status"),
+    version=2,
+)
+
+
+class EncodedEvent(NamedTuple):
+    body: bytes
+    content_type: str
+    content_encoding: Optional[str]
+
+
+def encode_event(
+    event_type: str,
+    event_data: Dict[str, Any],
+    encoding: str = EVENT_ENCODING,
+    compress_threshold: int = EVENT_COMPRESS_THRESHOLD,
+) -> EncodedEvent:
+    """
+    Encode an event for publishing.
+
+    Args:
+        event_type: Type of event, selects the schema
+        event_data: Event data dictionary
+        encoding: "json" or "msgpack"
+        compress_threshold: Deflate bodies larger than this (0: never)
+
+    Returns:
+        The body with its content type and content encoding
+
+    Raises:
+        ValueError: If the encoding is unknown
+    """
+    if encoding == "json":
+        body = json.dumps(event_data).encode()
+    elif encoding == "msgpack":
+        schema = LATEST.get(event_type)
+        if schema is None:
+            body = msgpack.packb(event_data)
+        else:
+            values = [schema.version]
+            values.extend([event_data.get(name) for name in schema.fields])
+            if event_data.keys() - schema.field_set:
+                values.append(
+                    {
+                        key: value
+                        for key, value in event_data.items()
+                        if key not in schema.field_set
+                    }
+                )
+            body = msgpack.packb(values)
+    else:
+        raise ValueError(f"Unknown event encoding: {encoding}")
+
+    content_encoding = None
+    if compress_threshold and len(body) > compress_threshold:
+        compressed = zlib.compress(body, EVENT_COMPRESS_LEVEL)
+        if len(compressed) < len(body):
+            body, content_encoding = compressed, DEFLATE
+    return EncodedEvent(body, ENCODINGS[encoding], content_encoding)
+
+
+def decode_event(
+    body: bytes,
+    content_type: Optional[str] = None,
+    content_encoding: Optional[str] = None,
+    event_type: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Decode a received event.
+
+    Args:
+        body: Message body
+        content_type: Message content type (None is read as JSON, like
+            events from publishers predating content types)
+        content_encoding: "deflate" for compressed bodies
+        event_type: Type of event, selects the schema of positional events
+
+    Returns:
+        Event data dictionary
+
+    Raises:
+        EventDecodeError: If the body is malformed or its content type,
+            encoding or schema is unknown
+    """
+    try:
+        if content_encoding == DEFLATE:
+            body = zlib.decompress(body)
+        elif content_encoding:
+            raise EventDecodeError(f"Unknown content encoding: {content_encoding}")
+
+        if content_type in (None, "", JSON):
+            return json.loads(body)
+        if content_type != MSGPACK:
+            raise EventDecodeError(f"Unknown content type: {content_type}")
+
+        data = msgpack.unpackb(body)
+    except EventDecodeError:
+        raise
+    except (ValueError, zlib.error) as e:
+        raise EventDecodeError(f"Malformed event body: {e}") from e
+
+    if isinstance(data, dict):
+        return data
+    if not isinstance(data, list) or not data:
+        raise EventDecodeError("Event body is neither a map nor a schema array")
+    schema = SCHEMAS.get((event_type, data[0]))
+    if schema is None:
+        raise EventDecodeError(f"No schema for {event_type} version {data[0]}")
+    count = len(schema.fields)
+    event_data = dict(zip(schema.fields, data[1 : count + 1]))
+    if len(data) > count + 1:
+        event_data.update(data[count + 1])
+    return event_data
@@ -0,0 +1,149 @@
+"""
+Event Archive Service - FastAPI application.
+
+This service keeps the history of all domain events. It includes:
+- An archive consumer bound to every service's exchange (see
+  archive_consumer.py)
+- A segmented, compressed, memory-mapped event log with an offset and time
+  index (see segment_log.py)
+- Replay of archived events into a queue or a projection (see replay.py)
+"""
+
+from fastapi import FastAPI, Query
+from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+import asyncio
+import os
+import uvicorn
+
+from archive_consumer import archive_consumer, archive_log
+from event_codec import decode_event
+from replay import event_matches
+
+# Records one browse request may scan before returning what it found, so a
+# rare filter cannot scan the whole log
+BROWSE_SCAN_LIMIT = int(os.getenv("ARCHIVE_BROWSE_SCAN_LIMIT", "50000"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lifecycle events for the FastAPI application."""
+    print("🚀 Event archive service starting up...")
+    print(f"🗄️ Archive holds {archive_log.stats()['events']} events")
+    archive_consumer.start()
+    yield
+    print("🛑 Event archive service shutting down...")
+    await archive_consumer.stop()
+    archive_log.close()
+
+
+app = FastAPI(
+    title="Event Archive Service",
+    description="Service archiving domain events for replay and projection rebuilds",
+    version="1.0.0",
+    lifespan=lifespan,
+)
+
+# Configure CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+@app.get(
+    "/api/v1/archive/stats",
+    response_model=dict,
+    tags=["Archive"],
+    summary="Archive and consumer statistics",
+)
+async def get_archive_stats():
+    """Events archived, segments, size and time range of the log."""
+    return archive_consumer.stats()
+
+
+def browse_events(
+    start: Optional[float],
+    end: Optional[float],
+    offset: Optional[int],
+    exchange: Optional[str],
+    routing_key: Optional[str],
+    limit: int,
+    scan_limit: int = BROWSE_SCAN_LIMIT,
+) -> Dict[str, Any]:
+    """Matching events from a bounded scan, and the offset to continue from."""
+    exchanges = {exchange} if exchange else None
+    events = []
+    next_offset = None
+    scanned = 0
+    for event in archive_log.read(offset, start, end):
+        if scanned >= scan_limit:
+            next_offset = event.offset
+            break
+        scanned += 1
+        if not event_matches(event, exchanges, routing_key):
+            continue
+        event_type = event.event_type or event.routing_key
+        try:
+            data = decode_event(
+                event.body, event.content_type, event.content_encoding, event_type
+            )
+        except ValueError:
+            data = None
+        events.append(
+            {
+                "offset": event.offset,
+                "archived_at": event.timestamp,
+                "exchange": event.exchange,
+                "routing_key": event.routing_key,
+                "event_type": event_type,
+                "message_id": event.message_id,
+                "published_at": event.published_at,
+                "data": data,
+            }
+        )
+        if len(events) == limit:
+            next_offset = event.offset + 1
+            break
+    return {"events": events, "next_offset": next_offset}
+
+
+@app.get(
+    "/api/v1/archive/events",
+    response_model=dict,
+    tags=["Archive"],
+    summary="Browse archived events",
+)
+async def list_archived_events(
+    start: Optional[float] = Query(None, description="Start, Unix time"),
+    end: Optional[float] = Query(None, description="End (exclusive), Unix time"),
+    offset: Optional[int] = Query(None, ge=0, description="First archive offset"),
+    exchange: Optional[str] = Query(None),
+    routing_key: Optional[str] = Query(None, description="Pattern, e.g. rent.#"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Archived events in archive order, decoded.
+
+    At most ARCHIVE_BROWSE_SCAN_LIMIT records are scanned per request; with
+    fewer matches than the limit, next_offset is where the scan stopped.
+    """
+    # Reading and decompressing the log is blocking work: keep it off the
+    # event loop that runs the archive consumer
+    return await asyncio.to_thread(
+        browse_events, start, end, offset, exchange, routing_key, limit
+    )
+
+
+@app.get("/health", tags=["Health"])
+async def health_check():
+    """Health check endpoint."""
+    return {"status": "healthy", "service": "event-archive"}
+
+
+if __name__ == "__main__":
+    uvicorn.run("main:app", host="0.0.0.0", port=8007, reload=True)
@@ -0,0 +1,54 @@
+"""
+Example projections rebuilt from archived events.
+
+A projection is called with every replayed event as
+`projection(event_type, event_data)` and reports its read model through
+`result()`:
+
+    python replay.py --projection projections:RatingAggregates
+"""
+
+from typing import Any, Dict, Tuple
+
+
+class RatingAggregates:
+    """Rating count and average per game, as the Rating service computes them."""
+
+    def __init__(self):
+        # (game_id, user_id) -> rating; rating a game again replaces it
+        self.ratings: Dict[Tuple[str, str], float] = {}
+
+    def __call__(self, event_type: str, event: Dict[str, Any]):
+        if event_type == "rating.left":
+            self.ratings[(event["game_id"], event["user_id"])] = event["rating"]
+
+    def result(self) -> Dict[str, Dict[str, Any]]:
+        totals: Dict[str, list] = {}
+        for (game_id, _), rating in self.ratings.items():
+            total = totals.setdefault(game_id, [0, 0.0])
+            total[0] += 1
+            total[1] += rating
+        return {
+            game_id: {"rating_count": count, "average_rating": total / count}
+            for game_id, (count, total) in totals.items()
+        }
+
+
+class AvailabilityCounters:
+    """Copies of each game out with customers, from rent order events."""
+
+    def __init__(self):
+        # order_id -> game_id of orders holding a copy
+        self.open_orders: Dict[str, str] = {}
+
+    def __call__(self, event_type: str, event: Dict[str, Any]):
+        if event_type == "rent.order.created":
+            self.open_orders[event["order_id"]] = event["game_id"]
+        elif event_type in ("rent.order.cancelled", "rent.game_return.confirmed"):
+            self.open_orders.pop(event["order_id"], None)
+
+    def result(self) -> Dict[str, int]:
+        rented: Dict[str, int] = {}
+        for game_id in self.open_orders.values():
+            rented[game_id] = rented.get(game_id, 0) + 1
+        return rented
@@ -0,0 +1,481 @@
+"""
+Segmented, compressed event log for the Event Archive service.
+
+The log is a directory of segments named after the offset of their first
+record: `<base offset>.log` holds the records and `<base offset>.index` a
+sparse index. Offsets number the records of the whole log from 0 and are not
+stored; a record's offset is counted from the nearest index entry.
+
+Record layout (little endian):
+
+    length  u32   payload bytes
+    crc32   u32   of the payload
+    time    f64   archive time, Unix seconds (never decreases)
+    flags   u8    RAW or ZLIB
+    payload       msgpack array: exchange, routing key, message id, event
+                  type, published at, content type, content encoding, body
+
+Every record is compressed on its own (raw deflate primed with a dictionary
+of strings common in events, kept only when smaller), so any record can be
+read without the ones before it. The index has an (offset, position, time)
+entry for the first record of a segment and then one per `index_interval`
+bytes; as times never decrease, both an offset and a time are found by
+bisecting the segment's first entries and then its index, then scanning at
+most `index_interval` bytes.
+
+Segments are read through read-only memory maps. A record torn by a crash
+ends the log: the writer truncates it on open, readers stop before it. The
+writer's log may be read from another thread while it appends (e.g. an API
+query off the event loop): such a read sees the records flushed when it
+reaches them.
+"""
+
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import msgpack
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/data/archive")
+# A new segment is started once the active one reaches this size
+ARCHIVE_SEGMENT_BYTES = int(os.getenv("ARCHIVE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# Bytes of records between index entries
+ARCHIVE_INDEX_INTERVAL = int(os.getenv("ARCHIVE_INDEX_INTERVAL", "4096"))
+# fsync on flush (flushed records otherwise survive a crash of the process,
+# not of the machine)
+ARCHIVE_FSYNC = os.getenv("ARCHIVE_FSYNC", "false").lower() == "true"
+ARCHIVE_COMPRESS_LEVEL = 6
+
+HEADER = struct.Struct("<IIdB")
+INDEX_ENTRY = struct.Struct("<QQd")
+
+# Record flags
+RAW = 0
+ZLIB = 1
+
+# Preset dictionary of ZLIB records, most common strings last. Frozen:
+# archived records need it to decompress (use a new flag for a new one).
+ZDICT = "".join(
+    [
+        "false true null ",
+        "additional_days rental_days due_date pickup_date pickup_location ",
+        "return_location game_condition penalty_amount new_rating toxicity ",
+        "is_moderated moderation_status approved rejected pending ",
+        "reason status completed declined canceled cancelled ",
+        "transaction_id txn_ amount total_amount rating_id comment_id ",
+        "refund_id payment_id booking_id user_id game_id order_id ",
+        "rent.pickup_notification.sent rent.game_receipt.confirmed ",
+        "rent.period.extended rent.period.ended rent.game.returned ",
+        "rent.penalty.charged rent.game_return.confirmed ",
+        "refund.requested refund.processed refund.declined ",
+        "rating.left rating.updated comment.left comment.moderated ",
+        "booking.created booking.canceled payment.initiated ",
+        "payment.successful payment.declined ",
+        "rent.order.created rent.order.confirmed rent.order.cancelled ",
+        "booking_events payment_events rating_events rent_events ",
+        "application/x-msgpack deflate application/json",
+    ]
+).encode()
+
+
+class ArchivedEvent(NamedTuple):
+    offset: int
+    timestamp: float
+    exchange: str
+    routing_key: str
+    message_id: Optional[str]
+    event_type: Optional[str]
+    published_at: Optional[float]
+    content_type: Optional[str]
+    content_encoding: Optional[str]
+    body: bytes
+
+
+class ArchiveLockedError(RuntimeError):
+    """Raised when another process is writing to the archive directory."""
+
+
+def encode_record(
+    timestamp: float, fields: list, compress_level: int = ARCHIVE_COMPRESS_LEVEL
+) -> bytes:
+    """Frame one record: header and (possibly compressed) payload."""
+    payload = msgpack.packb(fields)
+    flags = RAW
+    if compress_level:
+        compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15, zdict=ZDICT)
+        compressed = compressor.compress(payload) + compressor.flush()
+        if len(compressed) < len(payload):
+            payload, flags = compressed, ZLIB
+    return HEADER.pack(len(payload), zlib.crc32(payload), timestamp, flags) + payload
+
+
+def decode_payload(payload, flags: int) -> list:
+    if flags == ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=ZDICT)
+        payload = decompressor.decompress(payload) + decompressor.flush()
+    elif flags != RAW:
+        raise ValueError(f"Unknown record flags: {flags}")
+    return msgpack.unpackb(payload)
+
+
+class Segment:
+    """One log file with its sparse index."""
+
+    def __init__(self, directory: str, base_offset: int):
+        self.base_offset = base_offset
+        self.path = os.path.join(directory, f"{base_offset:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_offset:020d}.index")
+        self.offsets: List[int] = []
+        self.positions: List[int] = []
+        self.times: List[float] = []
+        self.size = 0
+        self.next_offset = base_offset
+        self.last_time = 0.0
+
+    @property
+    def first_time(self) -> Optional[float]:
+        return self.times[0] if self.times else None
+
+    def load_index(self):
+        self.offsets, self.positions, self.times = [], [], []
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for offset, position, timestamp in INDEX_ENTRY.iter_unpack(data[:usable]):
+            self.offsets.append(offset)
+            self.positions.append(position)
+            self.times.append(timestamp)
+
+    def add_index_entry(self, offset: int, position: int, timestamp: float):
+        self.offsets.append(offset)
+        self.positions.append(position)
+        self.times.append(timestamp)
+
+    def scan(
+        self, view, position: int, offset: int, end: int
+    ) -> Iterator[Tuple[int, int, float, int, bytes]]:
+        """Yield (offset, position, time, flags, payload) of valid records."""
+        while position + HEADER.size <= end:
+            length, crc, timestamp, flags = HEADER.unpack_from(view, position)
+            start = position + HEADER.size
+            if start + length > end:
+                return
+            payload = view[start : start + length]
+            if zlib.crc32(payload) != crc:
+                return
+            yield offset, position, timestamp, flags, payload
+            position = start + length
+            offset += 1
+
+    def recover(self, index_interval: int) -> bool:
+        """
+        Find the end of the valid records, rebuilding a missing or stale index.
+
+        Returns:
+            True if the file has bytes past the last valid record
+        """
+        file_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if file_size == 0:
+            self.offsets, self.positions, self.times = [], [], []
+            return False
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                while True:
+                    # Resume from the last index entry; an entry whose record
+                    # is missing or torn is dropped and the previous one used
+                    if self.positions:
+                        position, offset = self.positions[-1], self.offsets[-1]
+                        last_indexed = position
+                    else:
+                        position, offset, last_indexed = 0, self.base_offset, None
+                    self.size, self.next_offset = position, offset
+                    for offset, position, timestamp, _, payload in self.scan(
+                        view, position, offset, file_size
+                    ):
+                        if (
+                            last_indexed is None
+                            or position - last_indexed >= index_interval
+                        ):
+                            self.add_index_entry(offset, position, timestamp)
+                            last_indexed = position
+                        self.size = position + HEADER.size + len(payload)
+                        self.next_offset = offset + 1
+                        self.last_time = timestamp
+                    if not self.positions or self.next_offset > self.offsets[-1]:
+                        break
+                    self.offsets.pop()
+                    self.positions.pop()
+                    self.times.pop()
+        return self.size < file_size
+
+    def write_index(self):
+        with open(self.index_path, "wb") as f:
+            for entry in zip(self.offsets, self.positions, self.times):
+                f.write(INDEX_ENTRY.pack(*entry))
+
+    def seek(
+        self, offset: Optional[int] = None, timestamp: Optional[float] = None
+    ) -> Tuple[int, int]:
+        """(offset, position) of the last index entry before the target."""
+        # Entries complete in all three lists (times is appended last)
+        count = len(self.times)
+        entry = 0
+        if offset is not None:
+            entry = max(entry, bisect.bisect_right(self.offsets, offset, 0, count) - 1)
+        if timestamp is not None:
+            # Strictly earlier: records with an equal time may precede an
+            # entry with that time
+            entry = max(entry, bisect.bisect_left(self.times, timestamp, 0, count) - 1)
+        if not count:
+            return self.base_offset, 0
+        return self.offsets[entry], self.positions[entry]
+
+
+class SegmentLog:
+    """
+    Append-only event log split into segments.
+
+    One writer per directory (guarded by a lock file); any number of
+    `readonly` readers, e.g. the replay tool next to the running archive.
+    Appends are buffered until `flush`.
+    """
+
+    def __init__(
+        self,
+        directory: str = ARCHIVE_DIR,
+        segment_bytes: int = ARCHIVE_SEGMENT_BYTES,
+        index_interval: int = ARCHIVE_INDEX_INTERVAL,
+        fsync: bool = ARCHIVE_FSYNC,
+        readonly: bool = False,
+        compress_level: int = ARCHIVE_COMPRESS_LEVEL,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.fsync = fsync
+        self.readonly = readonly
+        self.compress_level = compress_level
+        self._lock_file = None
+        self._log_file = None
+        self._index_file = None
+        self._last_indexed = 0
+        self._dirty = False
+        # Flushes and segment rolls, which readers on other threads trigger
+        self._flush_lock = threading.RLock()
+
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+            self._lock_file = open(os.path.join(directory, ".lock"), "w")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise ArchiveLockedError(f"{directory} is locked by another writer")
+
+        self.segments: List[Segment] = []
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        for base_offset in sorted(
+            int(name[:-4]) for name in names if name.endswith(".log")
+        ):
+            segment = Segment(directory, base_offset)
+            segment.load_index()
+            self.segments.append(segment)
+        for i, segment in enumerate(self.segments):
+            indexed = list(segment.positions)
+            torn = segment.recover(index_interval)
+            if torn and not readonly:
+                print(f"Truncating torn record at the end of {segment.path}")
+                os.truncate(segment.path, segment.size)
+            if segment.positions != indexed and not readonly:
+                segment.write_index()
+            if i + 1 < len(self.segments) and torn:
+                print(
+                    f"Segment {segment.path} is corrupt after offset {segment.next_offset}"
+                )
+
+        if not readonly:
+            if not self.segments:
+                self.segments.append(Segment(directory, 0))
+            self._open_active()
+
+    @property
+    def active(self) -> Segment:
+        return self.segments[-1]
+
+    @property
+    def next_offset(self) -> int:
+        return self.active.next_offset if self.segments else 0
+
+    def _open_active(self):
+        segment = self.active
+        self._log_file = open(segment.path, "ab")
+        self._index_file = open(segment.index_path, "ab")
+        self._last_indexed = segment.positions[-1] if segment.positions else None
+
+    def _roll(self):
+        with self._flush_lock:
+            self.flush()
+            self._log_file.close()
+            self._index_file.close()
+            segment = Segment(self.directory, self.active.next_offset)
+            segment.last_time = self.active.last_time
+            self.segments.append(segment)
+            self._open_active()
+
+    def append(
+        self,
+        exchange: str,
+        routing_key: str,
+        body: bytes,
+        message_id: Optional[str] = None,
+        event_type: Optional[str] = None,
+        published_at: Optional[float] = None,
+        content_type: Optional[str] = None,
+        content_encoding: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ) -> int:
+        """
+        Append an event.
+
+        Args:
+            timestamp: Archive time (default: now); raised to the previous
+                record's time if earlier, so the time index stays sorted
+
+        Returns:
+            Offset of the event
+        """
+        if self.readonly:
+            raise RuntimeError("Log is read-only")
+        segment = self.active
+        if (
+            segment.size >= self.segment_bytes
+            and segment.next_offset > segment.base_offset
+        ):
+            self._roll()
+            segment = self.active
+
+        timestamp = max(
+            time.time() if timestamp is None else timestamp, segment.last_time
+        )
+        record = encode_record(
+            timestamp,
+            [
+                exchange,
+                routing_key,
+                message_id,
+                event_type,
+                published_at,
+                content_type,
+                content_encoding,
+                body,
+            ],
+            self.compress_level,
+        )
+        offset = segment.next_offset
+        position = segment.size
+        if (
+            self._last_indexed is None
+            or position - self._last_indexed >= self.index_interval
+        ):
+            segment.add_index_entry(offset, position, timestamp)
+            self._index_file.write(INDEX_ENTRY.pack(offset, position, timestamp))
+            self._last_indexed = position
+        self._log_file.write(record)
+        segment.size += len(record)
+        segment.next_offset += 1
+        segment.last_time = timestamp
+        self._dirty = True
+        return offset
+
+    def flush(self):
+        """Write buffered records (and fsync them if configured)."""
+        with self._flush_lock:
+            if not self._dirty or self._log_file is None:
+                return
+            # Cleared first: a record appended meanwhile marks the log again
+            self._dirty = False
+            # Log before index: an index entry never points past flushed records
+            self._log_file.flush()
+            self._index_file.flush()
+            if self.fsync:
+                os.fsync(self._log_file.fileno())
+                os.fsync(self._index_file.fileno())
+
+    def read(
+        self,
+        start_offset: Optional[int] = None,
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+    ) -> Iterator[ArchivedEvent]:
+        """
+        Stream events in offset order.
+
+        Args:
+            start_offset: First offset to return
+            start_time: Skip events archived before this Unix time
+            end_time: Stop at the first event archived at or after this time
+        """
+        if not self.readonly:
+            self.flush()
+        segments = [s for s in self.segments if s.next_offset > s.base_offset]
+        first = 0
+        if start_offset is not None:
+            bases = [s.base_offset for s in segments]
+            first = max(first, bisect.bisect_right(bases, start_offset) - 1)
+        if start_time is not None:
+            times = [s.first_time for s in segments]
+            first = max(first, bisect.bisect_left(times, start_time) - 1)
+
+        for segment in segments[first:]:
+            if end_time is not None and segment.first_time >= end_time:
+                return
+            offset, position = segment.seek(start_offset, start_time)
+            with open(segment.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # Its first records are not flushed yet
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    # The writer's size may count records not flushed yet
+                    end = len(view) if self.readonly else min(segment.size, len(view))
+                    for offset, _, timestamp, flags, payload in segment.scan(
+                        view, position, offset, end
+                    ):
+                        if start_offset is not None and offset < start_offset:
+                            continue
+                        if start_time is not None and timestamp < start_time:
+                            continue
+                        if end_time is not None and timestamp >= end_time:
+                            return
+                        fields = decode_payload(payload, flags)
+                        yield ArchivedEvent(offset, timestamp, *fields)
+
+    def stats(self) -> Dict[str, object]:
+        segments = [s for s in self.segments if s.next_offset > s.base_offset]
+        return {
+            "directory": self.directory,
+            "segments": len(segments),
+            "events": self.next_offset - (segments[0].base_offset if segments else 0),
+            "next_offset": self.next_offset,
+            "bytes": sum(s.size for s in segments),
+            "first_time": segments[0].first_time if segments else None,
+            "last_time": segments[-1].last_time if segments else None,
+        }
+
+    def close(self):
+        with self._flush_lock:
+            if self._log_file is not None:
+                self.flush()
+                self._log_file.close()
+                self._index_file.close()
+                self._log_file = self._index_file = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
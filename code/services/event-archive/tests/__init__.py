@@ -0,0 +1 @@
+"""Tests for Event Archive service."""
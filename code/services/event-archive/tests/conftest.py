@@ -0,0 +1,12 @@
+"""Pytest configuration for Event Archive service tests."""
+
+import os
+import sys
+import tempfile
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Archive into a scratch directory (must be set before archive_consumer is
+# imported)
+os.environ.setdefault("ARCHIVE_DIR", tempfile.mkdtemp(prefix="event-archive-"))
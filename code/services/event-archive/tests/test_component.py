@@ -0,0 +1,93 @@
+"""Component tests for Event Archive service.
+
+These tests query the archive API over a log filled directly (no broker).
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from archive_consumer import archive_log
+from event_codec import encode_event
+from main import app, browse_events
+
+
+@pytest.fixture
+def client():
+    """Create a test client."""
+    return TestClient(app)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def archived_events():
+    """Archive a few events of two services."""
+    for n in range(5):
+        encoded = encode_event(
+            "rating.left",
+            {"rating_id": f"r{n}", "game_id": "g1", "user_id": f"u{n}", "rating": n},
+            "msgpack",
+        )
+        archive_log.append(
+            "rating_events",
+            "rating.left",
+            encoded.body,
+            message_id=f"rating.left:r{n}",
+            event_type="rating.left",
+            content_type=encoded.content_type,
+            timestamp=1000.0 + n,
+        )
+    archive_log.append(
+        "rent_events",
+        "rent.order.created",
+        b'{"order_id": "o1"}',
+        content_type="application/json",
+        timestamp=1010.0,
+    )
+
+
+class TestEventArchiveComponent:
+    def test_health(self, client):
+        response = client.get("/health")
+
+        assert response.status_code == 200
+        assert response.json()["service"] == "event-archive"
+
+    def test_stats(self, client):
+        response = client.get("/api/v1/archive/stats")
+
+        assert response.status_code == 200
+        log = response.json()["log"]
+        assert log["events"] == 6
+        assert (log["first_time"], log["last_time"]) == (1000.0, 1010.0)
+
+    def test_browse_decoded_events(self, client):
+        response = client.get(
+            "/api/v1/archive/events",
+            params={"start": 1001, "exchange": "rating_events", "limit": 2},
+        )
+
+        assert response.status_code == 200
+        body = response.json()
+        assert [e["offset"] for e in body["events"]] == [1, 2]
+        assert body["events"][0]["data"] == {
+            "rating_id": "r1",
+            "game_id": "g1",
+            "user_id": "u1",
+            "rating": 1,
+        }
+        assert body["next_offset"] == 3
+
+        response = client.get(
+            "/api/v1/archive/events", params={"offset": 3, "routing_key": "rent.#"}
+        )
+        events = response.json()["events"]
+        assert [(e["offset"], e["data"]) for e in events] == [(5, {"order_id": "o1"})]
+        assert response.json()["next_offset"] is None
+
+    def test_browse_scan_is_bounded(self):
+        # Only the rent event matches: a short scan returns where it stopped
+        page = browse_events(None, None, None, "rent_events", None, 10, scan_limit=3)
+        assert page == {"events": [], "next_offset": 3}
+
+        page = browse_events(None, None, 3, "rent_events", None, 10, scan_limit=3)
+        assert [e["offset"] for e in page["events"]] == [5]
+        assert page["next_offset"] is None
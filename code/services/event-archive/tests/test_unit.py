@@ -0,0 +1,328 @@
+"""Unit tests for Event Archive service components."""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from archive_consumer import ArchiveConsumer
+from event_codec import encode_event
+from projections import AvailabilityCounters, RatingAggregates
+from replay import parse_time, project_events, select_events, topic_matches
+from segment_log import RAW, ZLIB, ArchiveLockedError, SegmentLog, encode_record
+
+
+def order_event(n):
+    return json.dumps({"order_id": f"order-{n}", "total_amount": 10.0 * n}).encode()
+
+
+def fill(log, count, start=1000.0, step=1.0):
+    for n in range(count):
+        log.append(
+            "rent_events",
+            "rent.order.created",
+            order_event(n),
+            message_id=f"rent.order.created:order-{n}",
+            event_type="rent.order.created",
+            published_at=start + n * step - 0.5,
+            content_type="application/json",
+            timestamp=start + n * step,
+        )
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    return str(tmp_path / "archive")
+
+
+class TestSegmentLog:
+    def test_round_trip(self, log_dir):
+        log = SegmentLog(log_dir)
+        fill(log, 3)
+        log.append("rating_events", "rating.left", b"\x00" * 3, timestamp=2000.0)
+
+        events = list(log.read())
+        assert [e.offset for e in events] == [0, 1, 2, 3]
+        first = events[0]
+        assert first.exchange == "rent_events"
+        assert first.routing_key == "rent.order.created"
+        assert first.message_id == "rent.order.created:order-0"
+        assert first.event_type == "rent.order.created"
+        assert first.published_at == 999.5
+        assert first.content_type == "application/json"
+        assert first.content_encoding is None
+        assert first.body == order_event(0)
+        assert events[3].body == b"\x00" * 3
+        assert events[3].message_id is None
+        log.close()
+
+    def test_records_are_compressed_when_smaller(self):
+        fields = ["rent_events", "rent.order.created", None, None, None, None, None]
+        event = json.dumps({"order_id": "order-1", "booking_id": "booking-1"})
+        compressed = encode_record(1.0, fields + [event.encode()])
+        random_body = encode_record(
+            1.0, ["", "", None, None, None, None, None, os.urandom(64)]
+        )
+
+        assert compressed[16] == ZLIB
+        assert random_body[16] == RAW
+
+    def test_rolls_segments_and_reopens(self, log_dir):
+        log = SegmentLog(log_dir, segment_bytes=500, index_interval=100)
+        fill(log, 50)
+        log.close()
+
+        assert len([n for n in os.listdir(log_dir) if n.endswith(".log")]) > 3
+        log = SegmentLog(log_dir, segment_bytes=500, index_interval=100)
+        assert log.next_offset == 50
+        fill(log, 1, start=5000.0)
+        assert [e.offset for e in log.read()] == list(range(51))
+        assert log.stats()["events"] == 51
+        log.close()
+
+    @pytest.mark.parametrize(
+        "start_offset, start_time, end_time, expected",
+        [
+            (None, 1010.0, 1020.0, list(range(10, 20))),
+            (None, 1010.5, 1012.0, [11]),
+            (None, None, 1003.0, [0, 1, 2]),
+            (None, 1100.0, None, []),
+            (37, None, None, list(range(37, 50))),
+            (37, 1040.0, None, list(range(40, 50))),
+            (45, 1030.0, 1047.0, [45, 46]),
+        ],
+    )
+    def test_reads_ranges_through_the_index(
+        self, log_dir, start_offset, start_time, end_time, expected
+    ):
+        log = SegmentLog(log_dir, segment_bytes=500, index_interval=100)
+        fill(log, 50)
+        log.close()
+
+        reader = SegmentLog(log_dir, readonly=True)
+        events = reader.read(start_offset, start_time, end_time)
+        assert [e.offset for e in events] == expected
+
+    def test_equal_timestamps_across_index_entries(self, log_dir):
+        log = SegmentLog(log_dir, index_interval=50)
+        fill(log, 5, start=1000.0)
+        fill(log, 20, start=1005.0, step=0.0)
+
+        assert len(log.active.times) > 3
+        assert [e.offset for e in log.read(start_time=1005.0)] == list(range(5, 25))
+        log.close()
+
+    def test_timestamps_never_decrease(self, log_dir):
+        log = SegmentLog(log_dir)
+        log.append("rent_events", "a", b"1", timestamp=1000.0)
+        log.append("rent_events", "b", b"2", timestamp=900.0)
+
+        assert [e.timestamp for e in log.read()] == [1000.0, 1000.0]
+        log.close()
+
+    def test_torn_tail_is_truncated(self, log_dir):
+        log = SegmentLog(log_dir, index_interval=100)
+        fill(log, 10)
+        log.close()
+        segment = os.path.join(log_dir, f"{0:020d}.log")
+        size = os.path.getsize(segment)
+        with open(segment, "ab") as f:
+            f.write(b"\x40\x00\x00\x00partial record")
+
+        # Readers stop before it, the writer cuts it off and carries on
+        assert len(list(SegmentLog(log_dir, readonly=True).read())) == 10
+        log = SegmentLog(log_dir, index_interval=100)
+        assert os.path.getsize(segment) == size
+        fill(log, 1, start=2000.0)
+        assert [e.offset for e in log.read(start_time=1500.0)] == [10]
+        log.close()
+
+    def test_missing_index_is_rebuilt(self, log_dir):
+        log = SegmentLog(log_dir, index_interval=100)
+        fill(log, 30)
+        entries = list(log.active.offsets)
+        log.close()
+        os.remove(os.path.join(log_dir, f"{0:020d}.index"))
+
+        log = SegmentLog(log_dir, index_interval=100)
+        assert log.active.offsets == entries
+        assert [e.offset for e in log.read(start_time=1025.0)] == [25, 26, 27, 28, 29]
+        log.close()
+
+    def test_one_writer_per_directory(self, log_dir):
+        log = SegmentLog(log_dir)
+        with pytest.raises(ArchiveLockedError):
+            SegmentLog(log_dir)
+        log.close()
+        SegmentLog(log_dir).close()
+
+
+class FakeMessage:
+    def __init__(self, n, acks):
+        self.n = n
+        self.acks = acks
+        self.exchange = "rent_events"
+        self.routing_key = "rent.order.created"
+        self.body = order_event(n)
+        self.message_id = f"rent.order.created:order-{n}"
+        self.headers = {"event_type": "rent.order.created", "published_at": 1.0}
+        self.content_type = "application/json"
+        self.content_encoding = None
+
+    async def ack(self, multiple=False):
+        self.acks.append((self.n, multiple))
+
+
+class TestArchiveConsumer:
+    @pytest.mark.asyncio
+    async def test_acks_flushed_batches(self, log_dir):
+        acks = []
+
+        async def messages():
+            for n in range(7):
+                yield FakeMessage(n, acks)
+
+        log = SegmentLog(log_dir)
+        consumer = ArchiveConsumer(log, exchanges=["rent_events"], batch_size=3)
+        await consumer.process(messages())
+
+        assert acks == [(2, True), (5, True), (6, True)]
+        assert consumer.archived == 7
+        reader = SegmentLog(log_dir, readonly=True)
+        assert [e.message_id for e in reader.read()][-1] == "rent.order.created:order-6"
+        log.close()
+
+    @pytest.mark.asyncio
+    async def test_commits_open_batch_when_idle(self, log_dir):
+        acks = []
+        more = asyncio.Event()
+
+        async def messages():
+            yield FakeMessage(0, acks)
+            yield FakeMessage(1, acks)
+            await more.wait()
+            yield FakeMessage(2, acks)
+
+        log = SegmentLog(log_dir)
+        consumer = ArchiveConsumer(log, batch_size=100, batch_delay=0.01)
+        task = asyncio.create_task(consumer.process(messages()))
+        while not acks:
+            await asyncio.sleep(0.005)
+
+        assert acks == [(1, True)]
+        assert len(list(SegmentLog(log_dir, readonly=True).read())) == 2
+        more.set()
+        await task
+        assert acks == [(1, True), (2, True)]
+        log.close()
+
+
+class TestReplay:
+    def test_topic_matches(self):
+        assert topic_matches("#", "rent.order.created")
+        assert topic_matches("rent.#", "rent.order.created")
+        assert topic_matches("rent.*.created", "rent.order.created")
+        assert topic_matches("rent.order.#", "rent.order")
+        assert not topic_matches("rent.*", "rent.order.created")
+        assert not topic_matches("payment.*", "rent.order")
+
+    def test_parse_time(self):
+        assert parse_time("1700000000.5") == 1700000000.5
+        assert parse_time("2024-01-01T00:00:00") == 1704067200.0
+        assert parse_time("2024-01-01T03:00:00+03:00") == 1704067200.0
+
+    def test_select_events_filters_and_skips_duplicates(self, log_dir):
+        log = SegmentLog(log_dir)
+        fill(log, 3)
+        # Redelivered before its ack, archived again
+        fill(log, 1, start=1003.0)
+        log.append("payment_events", "payment.successful", b"{}", timestamp=1004.0)
+
+        events = select_events(log)
+        assert [e.offset for e in events] == [0, 1, 2, 4]
+        assert [e.offset for e in select_events(log, dedup=False)] == [0, 1, 2, 3, 4]
+        only_payments = select_events(log, exchanges=["payment_events"])
+        assert [e.offset for e in only_payments] == [4]
+        by_key = select_events(log, routing_key="rent.#", limit=2)
+        assert [e.offset for e in by_key] == [0, 1]
+        log.close()
+
+    @pytest.mark.asyncio
+    async def test_re_rating_survives_replay(self, log_dir):
+        log = SegmentLog(log_dir)
+
+        def rate(rating, message_id):
+            encoded = encode_event(
+                "rating.left",
+                {"rating_id": "r1", "game_id": "g1", "user_id": "u1", "rating": rating},
+                "msgpack",
+            )
+            log.append(
+                "rating_events",
+                "rating.left",
+                encoded.body,
+                message_id=message_id,
+                event_type="rating.left",
+                content_type=encoded.content_type,
+            )
+
+        rate(2, "id-1")
+        rate(3, "id-2")
+        fill(log, 5)
+        # Archived before re-ratings got their own ids: same id, far apart
+        rate(5, "id-2")
+        # Redelivered right after being archived
+        rate(5, "id-2")
+
+        events = list(select_events(log, dedup_window=5))
+        assert [e.offset for e in events] == [0, 1, 2, 3, 4, 5, 6, 7]
+        ratings = RatingAggregates()
+        await project_events(events, ratings)
+        assert ratings.result() == {"g1": {"rating_count": 1, "average_rating": 5.0}}
+        log.close()
+
+    @pytest.mark.asyncio
+    async def test_rebuilds_projections(self, log_dir):
+        log = SegmentLog(log_dir)
+        events = [
+            (
+                "rating_events",
+                "rating.left",
+                {"game_id": "g1", "user_id": "u1", "rating": 4},
+            ),
+            (
+                "rating_events",
+                "rating.left",
+                {"game_id": "g1", "user_id": "u2", "rating": 2},
+            ),
+            # Rating a game again replaces the user's rating
+            (
+                "rating_events",
+                "rating.left",
+                {"game_id": "g1", "user_id": "u1", "rating": 5},
+            ),
+            ("rent_events", "rent.order.created", {"order_id": "o1", "game_id": "g1"}),
+            ("rent_events", "rent.order.created", {"order_id": "o2", "game_id": "g1"}),
+            ("rent_events", "rent.order.cancelled", {"order_id": "o2", "reason": "x"}),
+        ]
+        for n, (exchange, event_type, data) in enumerate(events):
+            encoding = "msgpack" if n % 2 else "json"
+            encoded = encode_event(event_type, data, encoding)
+            log.append(
+                exchange,
+                event_type,
+                encoded.body,
+                event_type=event_type,
+                content_type=encoded.content_type,
+                content_encoding=encoded.content_encoding,
+            )
+
+        ratings = RatingAggregates()
+        availability = AvailabilityCounters()
+        assert await project_events(select_events(log), ratings) == 6
+        await project_events(select_events(log), availability)
+
+        assert ratings.result() == {"g1": {"rating_count": 2, "average_rating": 3.5}}
+        assert availability.result() == {"g1": 1}
+        log.close()
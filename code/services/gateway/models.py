@@ -361,7 +361,8 @@ class CommentResponse(BaseModel):
         game_id: Идентификатор игры
         user_id: Идентификатор пользователя
         comment_text: Текст комментария
-        is_moderated: Флаг модерации комментария
+        is_moderated: Флаг модерации комментария (None, пока комментарий
+            ожидает модерации)
         created_at: Дата создания комментария
     """
 
@@ -369,7 +370,9 @@ class CommentResponse(BaseModel):
     game_id: str = Field(..., description="Идентификатор игры")
     user_id: str = Field(..., description="Идентификатор пользователя")
     comment_text: str = Field(..., description="Текст комментария")
-    is_moderated: bool = Field(..., description="Флаг модерации комментария")
+    is_moderated: Optional[bool] = Field(
+        None, description="Флаг модерации комментария (None - ожидает модерации)"
+    )
     created_at: datetime = Field(..., description="Дата создания комментария")
 
 
@@ -0,0 +1,64 @@
+"""
+Benchmark for sustained payment inserts into the ledger.
+
+Runs N payment inserts from C concurrent coroutines against an on-disk
+ledger, once with group commit and once committing every operation on its
+own, and reports payments per second and operations per commit.
+
+Usage:
+    python benchmarks/bench_ledger.py [payments] [concurrency]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import LEDGER_MAX_BATCH, Ledger
+
+
+async def run(max_batch: int, payments: int, concurrency: int):
+    path = os.path.join(tempfile.mkdtemp(), "payment.db")
+    ledger = Ledger(path, max_batch=max_batch)
+    counter = iter(range(payments))
+
+    async def writer():
+        for i in counter:
+            await ledger.add_payment(
+                {
+                    "payment_id": f"pay-{i:09d}",
+                    "order_id": f"order-{i}",
+                    "user_id": f"user-{i % 1000}",
+                    "amount": 315.5,
+                    "status": "initiated",
+                    "payment_method": "card",
+                    "transaction_id": None,
+                    "created_at": datetime.now(),
+                    "completed_at": None,
+                }
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ledger.close()
+    print(
+        f"max_batch={max_batch:>4}: {payments} payments in {elapsed:.2f}s "
+        f"({payments / elapsed:.0f} payments/s, "
+        f"{ledger.operations / ledger.commits:.1f} operations/commit)"
+    )
+
+
+async def main(payments: int, concurrency: int):
+    await run(1, payments, concurrency)
+    await run(LEDGER_MAX_BATCH, payments, concurrency)
+
+
+if __name__ == "__main__":
+    payments = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.run(main(payments, concurrency))
@@ -0,0 +1,94 @@
+"""
+Benchmark for ledger/provider reconciliation.
+
+Builds an on-disk ledger with N settled payments and a provider settlement
+report for the same transactions with a few injected differences, then runs
+the streaming merge-join and reports rows per second, peak memory and the
+projected time for 10M transactions.
+
+Usage:
+    python benchmarks/bench_reconciliation.py [transactions]
+"""
+
+import csv
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import SCHEMA, Ledger
+from payment_gateway import SETTLEMENT_COLUMNS
+from reconciliation import read_settlements, reconcile
+
+# Every MISMATCH_EVERY-th transaction differs on the provider side
+MISMATCH_EVERY = 10000
+
+
+def build(directory: str, transactions: int):
+    path = os.path.join(directory, "payment.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.executemany(
+        "INSERT INTO payments (payment_id, order_id, user_id, amount_minor, status, "
+        "payment_method, transaction_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                f"pay-{i}",
+                f"order-{i}",
+                f"user-{i % 1000}",
+                10000 + i % 5000,
+                "completed",
+                "card",
+                f"TXN_{i:012d}",
+                "2024-06-01T12:00:00",
+            )
+            for i in range(transactions)
+        ),
+    )
+    connection.commit()
+    connection.close()
+
+    settlements = os.path.join(directory, "settlements.csv")
+    with open(settlements, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SETTLEMENT_COLUMNS)
+        for i in range(transactions):
+            amount = (10000 + i % 5000) / 100
+            if i % MISMATCH_EVERY == 0:
+                amount += 1
+            writer.writerow(
+                [f"TXN_{i:012d}", "payment", f"pay-{i}", amount, "completed"]
+            )
+    return path, settlements
+
+
+def main(transactions: int):
+    directory = tempfile.mkdtemp()
+    started = time.perf_counter()
+    path, settlements = build(directory, transactions)
+    print(f"Built {transactions} transactions in {time.perf_counter() - started:.1f}s")
+
+    mismatches = []
+    started = time.perf_counter()
+    result = reconcile(
+        Ledger(path).iter_transactions(),
+        read_settlements(settlements),
+        mismatches.append,
+    )
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    rate = transactions / elapsed
+    print(
+        f"Reconciled in {elapsed:.1f}s ({rate:,.0f} transactions/s), "
+        f"{result.mismatches} mismatches, peak RSS {peak_mb:.0f} MB"
+    )
+    print(f"Projected for 10M transactions: {10_000_000 / rate / 60:.1f} min")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,87 @@
+"""
+Benchmark for payment velocity checks.
+
+Replays a synthetic stream of payment initiations at a given rate (with a
+simulated clock, so the windows slide as they would in production) across a
+user population larger than the LRU bound, and reports the cost of one
+check, the share of a core needed at that rate and the memory held by the
+counters.
+
+Usage:
+    python benchmarks/bench_velocity.py [payments_per_second] [seconds] [users]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from velocity import VelocityChecker, parse_rules
+
+RULES = "count:5/60,count:30/3600,amount:200000/86400"
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def main(rate: int, seconds: int, users: int):
+    clock = SimulatedClock()
+    max_users = users // 2
+    checker = VelocityChecker(parse_rules(RULES), max_users=max_users, clock=clock)
+    total = rate * seconds
+    # A few heavy users among many occasional ones
+    user_ids = [f"user-{i}" for i in range(users)]
+    stream = [
+        (
+            random.choice(user_ids[:100])
+            if random.random() < 0.1
+            else random.choice(user_ids),
+            random.choice((99.0, 450.0, 1200.0, 3500.0)),
+        )
+        for _ in range(total)
+    ]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i, (user_id, amount) in enumerate(stream):
+        clock.now = i / rate
+        checker.check(user_id, amount)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # tracemalloc slows allocation down; time a second pass without it
+    checker = VelocityChecker(parse_rules(RULES), max_users=max_users, clock=clock)
+    started = time.perf_counter()
+    for i, (user_id, amount) in enumerate(stream):
+        clock.now = i / rate
+        checker.check(user_id, amount)
+    elapsed = time.perf_counter() - started
+
+    per_check = elapsed / total
+    print(
+        f"{total} checks over {seconds}s simulated at {rate}/s, "
+        f"{users} users (LRU bound {max_users})"
+    )
+    print(f"  {per_check * 1e6:.2f} us per check, {1 / per_check:,.0f} checks/s")
+    print(f"  {rate * per_check:.1%} of one core at {rate}/s")
+    print(f"  blocked {checker.blocked}, tracked users {len(checker)}")
+    print(
+        f"  counters peak memory {peak / 2**20:.1f} MB "
+        f"(~{peak / max_users:.0f} bytes per tracked user)"
+    )
+
+
+if __name__ == "__main__":
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 200000
+    main(rate, seconds, users)
@@ -0,0 +1,101 @@
+"""
+Simulation of the acquiring gateway under overload and partial failure.
+
+Sends a burst of payment calls at a mock gateway whose latency grows with
+the number of calls in flight beyond its capacity and which fails a share of
+calls, once calling it directly and once through GatewayClient, and reports
+latency percentiles and how each call ended.
+
+Usage:
+    python benchmarks/simulate_gateway.py [calls] [concurrency] [error_rate]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gateway_client import AIMDLimiter, CircuitBreaker, GatewayClient
+from payment_gateway import MockPaymentGateway
+
+
+def make_gateway(error_rate: float) -> MockPaymentGateway:
+    return MockPaymentGateway(
+        latency=0.05,
+        latency_jitter=0.02,
+        decline_rate=0.1,
+        error_rate=error_rate,
+        capacity=16,
+    )
+
+
+async def run(label: str, call, calls: int, concurrency: int):
+    latencies = []
+    outcomes = Counter()
+    counter = iter(range(calls))
+
+    async def caller():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                result = await call(f"pay-{i}")
+                outcomes[result["status"]] += 1
+            except Exception as e:
+                outcomes[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    errors = sum(
+        n for status, n in outcomes.items() if status not in ("completed", "declined")
+    )
+    print(
+        f"{label:>8}: p50 {quantiles[49] * 1000:7.1f} ms, "
+        f"p99 {quantiles[98] * 1000:7.1f} ms, "
+        f"error rate {errors / calls:.1%}, {calls / elapsed:7.0f} calls/s"
+    )
+    print(f"{'':>8}  outcomes: {dict(outcomes)}")
+
+
+async def main(calls: int, concurrency: int, error_rate: float):
+    print(
+        f"{calls} calls from {concurrency} callers, gateway capacity 16, "
+        f"error rate {error_rate:.0%}"
+    )
+
+    direct = make_gateway(error_rate)
+    await run(
+        "direct",
+        lambda payment_id: direct.process_payment(payment_id, 100.0, "card"),
+        calls,
+        concurrency,
+    )
+
+    client = GatewayClient(
+        make_gateway(error_rate),
+        limiter=AIMDLimiter(initial=8, minimum=2, maximum=64, latency_target=0.2),
+        breaker=CircuitBreaker(failure_rate=0.5, window=20, reset_timeout=1.0),
+        timeout=0.5,
+        acquire_timeout=1.0,
+    )
+    await run(
+        "client",
+        lambda payment_id: client.process_payment(payment_id, 100.0, "card"),
+        calls,
+        concurrency,
+    )
+    print(f"{'':>8}  metrics: {client.metrics()}")
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    asyncio.run(main(calls, concurrency, error_rate))
@@ -0,0 +1,288 @@
+"""
+Acquiring gateway client for Payment service.
+
+Wraps a payment provider with the protections needed when it slows down:
+
+- an adaptive concurrency limit (AIMD): grows by one call per limit's worth of
+  fast responses and halves when responses exceed the latency target or time
+  out
+- a bound on how long a call may wait for a slot, and a timeout per call
+- a circuit breaker that fails fast while the provider keeps failing and lets
+  a single probe through after a cool-down
+
+Declines are normal answers and count as successes; timeouts and gateway
+errors count as failures for the breaker. Only slow calls and timeouts shrink
+the concurrency limit, since a fast error is not a sign of overload. A call
+cancelled by its caller says nothing about the provider and counts as neither.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from payment_gateway import MockPaymentGateway, payment_gateway as mock_gateway
+
+GATEWAY_TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT", "2.0"))
+GATEWAY_ACQUIRE_TIMEOUT = float(os.getenv("GATEWAY_ACQUIRE_TIMEOUT", "1.0"))
+GATEWAY_LATENCY_TARGET = float(os.getenv("GATEWAY_LATENCY_TARGET", "1.0"))
+GATEWAY_MIN_CONCURRENCY = int(os.getenv("GATEWAY_MIN_CONCURRENCY", "2"))
+GATEWAY_MAX_CONCURRENCY = int(os.getenv("GATEWAY_MAX_CONCURRENCY", "64"))
+BREAKER_FAILURE_RATE = float(os.getenv("GATEWAY_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_WINDOW = int(os.getenv("GATEWAY_BREAKER_WINDOW", "20"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("GATEWAY_BREAKER_RESET_TIMEOUT", "5.0"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class GatewayUnavailableError(Exception):
+    """Raised when a call is rejected or fails because the gateway is degraded."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens when the failure rate over the last calls exceeds a threshold."""
+
+    def __init__(
+        self,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        window: int = BREAKER_WINDOW,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Whether a call may go through now (claims the probe when half-open)."""
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def cancel_probe(self):
+        """Give back a claimed half-open probe that was never sent."""
+        self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+
+    def record(self, success: bool):
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+            if success:
+                self.state = CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        self._outcomes.append(success)
+        if len(self._outcomes) == self.window:
+            failures = self._outcomes.count(False)
+            if failures / self.window >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self._outcomes.clear()
+
+
+class AIMDLimiter:
+    """Concurrency limit adjusted by additive increase, multiplicative decrease."""
+
+    def __init__(
+        self,
+        initial: int = GATEWAY_MIN_CONCURRENCY * 4,
+        minimum: int = GATEWAY_MIN_CONCURRENCY,
+        maximum: int = GATEWAY_MAX_CONCURRENCY,
+        latency_target: float = GATEWAY_LATENCY_TARGET,
+        backoff: float = 0.5,
+    ):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self, timeout: float):
+        """Wait up to timeout seconds for a slot; raises asyncio.TimeoutError."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we gave up: pass the slot on
+                self._release_slot()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, latency: float, dropped: bool = False):
+        """Give back a slot and adapt the limit to the observed call."""
+        if not dropped and latency <= self.latency_target:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        else:
+            # Back off once per latency target: the calls already in flight
+            # report the same congestion
+            now = time.monotonic()
+            if now - self._last_decrease >= self.latency_target:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+        self._release_slot()
+
+    def discard(self):
+        """Give back a slot without adapting the limit (the call has no outcome)."""
+        self._release_slot()
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class GatewayClient:
+    """Protected client for one acquiring provider."""
+
+    def __init__(
+        self,
+        gateway: MockPaymentGateway,
+        name: str = "acquiring",
+        limiter: Optional[AIMDLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        timeout: float = GATEWAY_TIMEOUT,
+        acquire_timeout: float = GATEWAY_ACQUIRE_TIMEOUT,
+    ):
+        self.gateway = gateway
+        self.name = name
+        self.limiter = limiter or AIMDLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self._counters = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "rejected_open": 0,
+            "rejected_busy": 0,
+            "cancelled": 0,
+        }
+
+    async def _call(self, operation: Callable[[], Awaitable[Dict[str, str]]]):
+        self._counters["calls"] += 1
+        if not self.breaker.allow():
+            self._counters["rejected_open"] += 1
+            raise GatewayUnavailableError(
+                f"{self.name} gateway is unavailable", self.breaker.retry_after()
+            )
+        try:
+            await self.limiter.acquire(self.acquire_timeout)
+        except BaseException as e:
+            # Not the provider's fault (no slot in time, or the caller went
+            # away while waiting): give back a half-open probe untouched
+            self.breaker.cancel_probe()
+            if not isinstance(e, asyncio.TimeoutError):
+                raise
+            self._counters["rejected_busy"] += 1
+            raise GatewayUnavailableError(f"{self.name} gateway is overloaded") from e
+
+        started = time.monotonic()
+        success = False
+        timed_out = False
+        cancelled = False
+        try:
+            result = await asyncio.wait_for(operation(), self.timeout)
+            success = True
+            self._counters["succeeded"] += 1
+            return result
+        except asyncio.CancelledError:
+            # The caller went away (e.g. its request was dropped), not the
+            # provider: a half-open probe is given back for the next call
+            cancelled = True
+            self._counters["cancelled"] += 1
+            raise
+        except asyncio.TimeoutError as e:
+            # The provider may still have carried the call out: only the
+            # idempotency key makes retrying it safe
+            timed_out = True
+            self._counters["timed_out"] += 1
+            raise GatewayUnavailableError(f"{self.name} gateway timed out") from e
+        except Exception as e:
+            self._counters["failed"] += 1
+            raise GatewayUnavailableError(f"{self.name} gateway error: {e}") from e
+        finally:
+            if cancelled:
+                self.limiter.discard()
+                self.breaker.cancel_probe()
+            else:
+                self.limiter.release(time.monotonic() - started, dropped=timed_out)
+                self.breaker.record(success)
+
+    async def process_payment(
+        self, payment_id: str, amount: float, payment_method: str
+    ) -> Dict[str, str]:
+        """
+        Charge a payment through the provider.
+
+        payment_id is the provider's idempotency key: charging it again after
+        a timeout returns the first outcome instead of charging twice.
+
+        Raises:
+            GatewayUnavailableError: If the provider is degraded, overloaded
+                or did not answer in time
+        """
+        return await self._call(
+            lambda: self.gateway.process_payment(payment_id, amount, payment_method)
+        )
+
+    async def process_refund(
+        self, refund_id: str, payment_id: str, amount: float
+    ) -> Dict[str, str]:
+        """Refund a payment through the provider (refund_id is the idempotency key)."""
+        return await self._call(
+            lambda: self.gateway.process_refund(refund_id, payment_id, amount)
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "breaker_state": self.breaker.state,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            **self._counters,
+        }
+
+
+# Global instance
+payment_gateway = GatewayClient(mock_gateway)
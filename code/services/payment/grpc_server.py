@@ -5,41 +5,47 @@ gRPC server for Payment service.
 import grpc
 from concurrent import futures
 import asyncio
-from datetime import datetime
-import uuid
 
 # Import generated proto files (will be generated from .proto file)
 # For now, we'll use a simple implementation
-from payment_gateway import payment_gateway
+from ledger import Ledger
+from gateway_client import GatewayUnavailableError
+from payments import (
+    PaymentRejectedError,
+    VelocityLimitExceededError,
+    create_payment,
+    execute_payment,
+)
 
 
 class PaymentServiceServicer:
     """gRPC service implementation for Payment."""
 
-    def __init__(self, payments_db, refunds_db):
-        self.payments_db = payments_db
-        self.refunds_db = refunds_db
+    def __init__(self, ledger: Ledger):
+        self.ledger = ledger
 
     async def InitiatePayment(self, request, context):
         """Initiate a payment (gRPC method)."""
         from payment_pb2 import InitiatePaymentResponse
 
-        payment_id = str(uuid.uuid4())
-
-        # Store payment
-        payment = {
-            "payment_id": payment_id,
-            "order_id": request.order_id,
-            "user_id": request.user_id,
-            "amount": request.amount,
-            "status": "initiated",
-            "payment_method": request.payment_method,
-            "created_at": datetime.now(),
-        }
-        self.payments_db[payment_id] = payment
+        # Same velocity limits and event as the REST endpoint
+        try:
+            payment = await create_payment(
+                request.order_id,
+                request.user_id,
+                request.amount,
+                request.payment_method,
+            )
+        except VelocityLimitExceededError as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            context.set_trailing_metadata(
+                (("retry-after", str(max(1, round(e.retry_after)))),)
+            )
+            return InitiatePaymentResponse()
 
         return InitiatePaymentResponse(
-            payment_id=payment_id,
+            payment_id=payment["payment_id"],
             status="initiated",
             message="Payment initiated successfully",
         )
@@ -48,38 +54,41 @@ class PaymentServiceServicer:
         """Process a payment (gRPC method)."""
         from payment_pb2 import ProcessPaymentResponse
 
-        payment = self.payments_db.get(request.payment_id)
-        if not payment:
-            context.set_code(grpc.StatusCode.NOT_FOUND)
-            context.set_details("Payment not found")
+        # Same claim, gateway call, receipt and events as the REST endpoint
+        try:
+            payment = await execute_payment(request.payment_id)
+        except PaymentRejectedError as e:
+            if e.not_found:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+            elif e.conflict:
+                context.set_code(grpc.StatusCode.ABORTED)
+            else:
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details(str(e))
+            return ProcessPaymentResponse()
+        except GatewayUnavailableError as e:
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            context.set_details(str(e))
+            context.set_trailing_metadata(
+                (("retry-after", str(max(1, round(e.retry_after)))),)
+            )
             return ProcessPaymentResponse()
-
-        # Process payment through gateway
-        result = await payment_gateway.process_payment(
-            request.payment_id, payment["amount"], payment["payment_method"]
-        )
-
-        # Update payment status
-        payment["status"] = result["status"]
-        payment["transaction_id"] = result["transaction_id"]
-        if result["status"] == "completed":
-            payment["completed_at"] = datetime.now()
 
         return ProcessPaymentResponse(
-            payment_id=request.payment_id,
-            status=result["status"],
-            transaction_id=result["transaction_id"],
-            message=f"Payment {result['status']}",
+            payment_id=payment["payment_id"],
+            status=payment["status"],
+            transaction_id=payment["transaction_id"],
+            message=f"Payment {payment['status']}",
         )
 
 
-async def serve_grpc(payments_db, refunds_db, port=50051):
+async def serve_grpc(ledger: Ledger, port=50051):
     """Start gRPC server."""
     server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
 
     # Add servicer (will be properly implemented after proto generation)
     # For now, we'll use a simpler approach
-    servicer = PaymentServiceServicer(payments_db, refunds_db)
+    servicer = PaymentServiceServicer(ledger)
 
     # Register service (will be done after proto generation)
     # payment_pb2_grpc.add_PaymentServiceServicer_to_server(servicer, server)
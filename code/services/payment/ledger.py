@@ -0,0 +1,828 @@
+"""
+Durable payment ledger for Payment service.
+
+Payments and refunds are stored in SQLite (WAL mode) with amounts as integer
+minor units (kopecks). Every change also appends a row to `ledger_entries`,
+which is never updated or deleted. Fiscal receipts are inserted in the same
+transaction that completes their payment or refund, so none is lost between
+the two.
+
+One ledger thread owns the connection. Requests are queued to it and the
+thread runs everything that is waiting as one transaction, so concurrent
+writes share a single commit (and fsync) instead of paying for one each.
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PAYMENT_DB_PATH = os.getenv("PAYMENT_DB_PATH", "payment.db")
+# Upper bound on the operations committed together
+LEDGER_MAX_BATCH = int(os.getenv("LEDGER_MAX_BATCH", "256"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id TEXT PRIMARY KEY,
+    order_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    refunded_minor INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    payment_method TEXT NOT NULL,
+    transaction_id TEXT,
+    created_at TEXT NOT NULL,
+    completed_at TEXT
+);
+-- Newest-first listings per order and per user (keyset pagination)
+DROP INDEX IF EXISTS ix_payments_order_id;
+DROP INDEX IF EXISTS ix_payments_user_id;
+CREATE INDEX IF NOT EXISTS ix_payments_order_id_created_at
+    ON payments (order_id, created_at, payment_id);
+CREATE INDEX IF NOT EXISTS ix_payments_user_id_created_at
+    ON payments (user_id, created_at, payment_id);
+CREATE INDEX IF NOT EXISTS ix_payments_transaction_id ON payments (transaction_id);
+
+CREATE TABLE IF NOT EXISTS refunds (
+    refund_id TEXT PRIMARY KEY,
+    payment_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    transaction_id TEXT,
+    created_at TEXT NOT NULL,
+    completed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_refunds_payment_id ON refunds (payment_id);
+CREATE INDEX IF NOT EXISTS ix_refunds_user_id ON refunds (user_id);
+CREATE INDEX IF NOT EXISTS ix_refunds_transaction_id ON refunds (transaction_id);
+
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payment_id TEXT NOT NULL,
+    refund_id TEXT,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    transaction_id TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_ledger_entries_payment_id
+    ON ledger_entries (payment_id, entry_id);
+
+CREATE TABLE IF NOT EXISTS receipts (
+    receipt_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payment_id TEXT NOT NULL,
+    refund_id TEXT,
+    user_id TEXT NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    document TEXT NOT NULL,
+    fiscal_sign TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_receipts_payment_id ON receipts (payment_id);
+-- Reloading the OFD queue on startup
+CREATE INDEX IF NOT EXISTS ix_receipts_status_created_at
+    ON receipts (status, created_at, receipt_id);
+"""
+
+# Columns added to existing tables after their first release
+ADDED_COLUMNS = {
+    "payments": {"refunded_minor": "INTEGER NOT NULL DEFAULT 0"},
+}
+
+DATETIME_COLUMNS = ("created_at", "completed_at", "sent_at")
+
+# Refunds in these statuses count against the payment amount (declined and
+# failed refunds do not)
+ACTIVE_REFUND_STATUSES = ("requested", "processing", "completed")
+
+
+class RefundLimitExceededError(Exception):
+    """Raised when a refund would take the refunds above the payment amount."""
+
+    def __init__(self, payment_id: str, available: float):
+        self.payment_id = payment_id
+        self.available = available
+        super().__init__(
+            f"Refund exceeds the amount left to refund for payment {payment_id} "
+            f"({available:.2f})"
+        )
+
+
+def to_minor(amount: float) -> int:
+    """Convert an amount in rubles to integer kopecks (half-up rounding)."""
+    return int(
+        (Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP)
+    )
+
+
+def from_minor(amount_minor: int) -> float:
+    """Convert integer kopecks back to rubles."""
+    return amount_minor / 100
+
+
+def _encode(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Dict in API form -> column values."""
+    row = dict(record)
+    if "amount" in row:
+        row["amount_minor"] = to_minor(row.pop("amount"))
+    for name in DATETIME_COLUMNS:
+        if isinstance(row.get(name), datetime):
+            row[name] = row[name].isoformat()
+    return row
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    """Column values -> dict in API form."""
+    record = dict(row)
+    record["amount"] = from_minor(record.pop("amount_minor"))
+    if "refunded_minor" in record:
+        record["refunded_amount"] = from_minor(record.pop("refunded_minor"))
+    for name in DATETIME_COLUMNS:
+        if record.get(name):
+            record[name] = datetime.fromisoformat(record[name])
+    return record
+
+
+class _Operation:
+    __slots__ = ("fn", "future", "loop")
+
+    def __init__(self, fn, future, loop):
+        self.fn = fn
+        self.future = future
+        self.loop = loop
+
+
+class Ledger:
+    """SQLite-backed payment store with group-committed writes."""
+
+    def __init__(self, path: str = PAYMENT_DB_PATH, max_batch: int = LEDGER_MAX_BATCH):
+        self.path = path
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[_Operation]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.commits = 0
+        self.operations = 0
+        # Called with the payment after every committed change to it
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        # fsync every commit: a payment acknowledged to a caller is on disk
+        connection.execute("PRAGMA synchronous=FULL")
+        connection.executescript(SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {
+                row["name"] for row in connection.execute(f"PRAGMA table_info({table})")
+            }
+            for name, definition in columns.items():
+                if name not in existing:
+                    connection.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {name} {definition}"
+                    )
+        return connection
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    ready = threading.Event()
+                    errors: List[BaseException] = []
+                    self._thread = threading.Thread(
+                        target=self._run, args=(ready, errors), daemon=True
+                    )
+                    self._thread.start()
+                    ready.wait()
+                    if errors:
+                        self._thread = None
+                        raise errors[0]
+
+    def _run(self, ready: threading.Event, errors: List[BaseException]):
+        try:
+            connection = self._connect()
+        except BaseException as e:
+            errors.append(e)
+            ready.set()
+            return
+        ready.set()
+
+        while True:
+            operation = self._queue.get()
+            if operation is None:
+                break
+            batch = [operation]
+            while len(batch) < self.max_batch:
+                try:
+                    operation = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if operation is None:
+                    self._queue.put(None)
+                    break
+                batch.append(operation)
+            self._execute_batch(connection, batch)
+        connection.close()
+
+    def _execute_batch(self, connection: sqlite3.Connection, batch: List[_Operation]):
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            results = []
+            for operation in batch:
+                # A failing operation only rolls back its own savepoint
+                connection.execute("SAVEPOINT operation")
+                try:
+                    results.append((True, operation.fn(connection)))
+                    connection.execute("RELEASE operation")
+                except Exception as e:
+                    connection.execute("ROLLBACK TO operation")
+                    connection.execute("RELEASE operation")
+                    results.append((False, e))
+            connection.execute("COMMIT")
+        except Exception as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            results = [(False, e)] * len(batch)
+        self.commits += 1
+        self.operations += len(batch)
+
+        for operation, (ok, value) in zip(batch, results):
+            try:
+                operation.loop.call_soon_threadsafe(
+                    _resolve, operation.future, ok, value
+                )
+            except RuntimeError:
+                # The caller's event loop is gone, nobody is waiting
+                pass
+
+    def _notify(self, payment: Optional[Dict[str, Any]]):
+        if payment is None:
+            return
+        for listener in self.listeners:
+            listener(payment)
+
+    async def _submit(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(_Operation(fn, future, loop))
+        return await future
+
+    def close(self):
+        """Finish queued operations and close the connection."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    # Payments
+
+    async def add_payment(self, payment: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a new payment and its ledger entry."""
+        row = _encode(payment)
+
+        def write(connection):
+            connection.execute(
+                "INSERT INTO payments (payment_id, order_id, user_id, amount_minor, "
+                "status, payment_method, transaction_id, created_at, completed_at) "
+                "VALUES (:payment_id, :order_id, :user_id, :amount_minor, :status, "
+                ":payment_method, :transaction_id, :created_at, :completed_at)",
+                row,
+            )
+            _append_entry(connection, row["payment_id"], None, "payment", row)
+
+        await self._submit(write)
+        self._notify(payment)
+        return payment
+
+    async def get_payment(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        def read(connection):
+            row = connection.execute(
+                "SELECT * FROM payments WHERE payment_id = ?", (payment_id,)
+            ).fetchone()
+            return _decode(row) if row else None
+
+        return await self._submit(read)
+
+    async def update_payment(
+        self,
+        payment_id: str,
+        receipt: Optional[Dict[str, Any]] = None,
+        from_status: Optional[str] = None,
+        **fields: Any,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Update payment fields, append a ledger entry and return the payment.
+
+        Args:
+            payment_id: Payment identifier
+            receipt: Fiscal receipt to store in the same transaction
+            from_status: Only update the payment if it is in this status, so
+                a gateway result cannot overwrite e.g. a refunded payment
+            **fields: Payment columns to update
+
+        Returns:
+            The updated payment, or None if it is missing (or not in
+            from_status)
+        """
+        values = _encode(fields)
+        condition = "payment_id = :payment_id"
+        if from_status is not None:
+            condition += " AND status = :from_status"
+
+        def write(connection):
+            assignments = ", ".join(f"{name} = :{name}" for name in values)
+            cursor = connection.execute(
+                f"UPDATE payments SET {assignments} WHERE {condition}",
+                {**values, "payment_id": payment_id, "from_status": from_status},
+            )
+            if cursor.rowcount == 0:
+                return None
+            row = connection.execute(
+                "SELECT * FROM payments WHERE payment_id = ?", (payment_id,)
+            ).fetchone()
+            _append_entry(connection, payment_id, None, "payment", dict(row))
+            if receipt is not None:
+                _insert_receipt(connection, receipt)
+            return _decode(row)
+
+        payment = await self._submit(write)
+        self._notify(payment)
+        return payment
+
+    async def move_payment(
+        self, payment_id: str, from_status: str, to_status: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Change a payment's status if it is still from_status.
+
+        The check and the update run in the ledger thread, so of concurrent
+        moves of one payment out of a status only the first succeeds; claiming
+        a payment (initiated -> processing) before sending it to the gateway
+        relies on it.
+
+        Returns:
+            The updated payment, or None if it is missing or not in from_status
+        """
+
+        def write(connection):
+            row = connection.execute(
+                "UPDATE payments SET status = ? "
+                "WHERE payment_id = ? AND status = ? RETURNING *",
+                (to_status, payment_id, from_status),
+            ).fetchone()
+            if row is None:
+                return None
+            _append_entry(connection, payment_id, None, "payment", dict(row))
+            return _decode(row)
+
+        payment = await self._submit(write)
+        self._notify(payment)
+        return payment
+
+    async def release_processing_payments(self) -> int:
+        """
+        Move payments left processing (by a restart) back to initiated.
+
+        Their gateway call may or may not have happened; it is keyed by the
+        payment id, so processing them again cannot charge twice.
+
+        Returns:
+            Number of payments released
+        """
+
+        def write(connection):
+            rows = connection.execute(
+                "UPDATE payments SET status = 'initiated' "
+                "WHERE status = 'processing' RETURNING *"
+            ).fetchall()
+            for row in rows:
+                _append_entry(connection, row["payment_id"], None, "payment", dict(row))
+            return [_decode(row) for row in rows]
+
+        payments = await self._submit(write)
+        for payment in payments:
+            self._notify(payment)
+        return len(payments)
+
+    async def payments_by_order(
+        self,
+        order_id: str,
+        after: Optional[Tuple[datetime, str]] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Payments of an order, newest first, after a (created_at, id) key."""
+        return await self._list_payments("order_id", order_id, after, limit)
+
+    async def payments_by_user(
+        self,
+        user_id: str,
+        after: Optional[Tuple[datetime, str]] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Payments of a user, newest first, after a (created_at, id) key."""
+        return await self._list_payments("user_id", user_id, after, limit)
+
+    async def _list_payments(
+        self,
+        column: str,
+        value: str,
+        after: Optional[Tuple[datetime, str]],
+        limit: int,
+    ) -> List[Dict[str, Any]]:
+        sql = f"SELECT * FROM payments WHERE {column} = ?"
+        params: List[Any] = [value]
+        if after is not None:
+            sql += " AND (created_at, payment_id) < (?, ?)"
+            params += [after[0].isoformat(), after[1]]
+        sql += " ORDER BY created_at DESC, payment_id DESC LIMIT ?"
+        params.append(limit)
+
+        def read(connection):
+            rows = connection.execute(sql, params).fetchall()
+            return [_decode(row) for row in rows]
+
+        return await self._submit(read)
+
+    # Refunds
+
+    async def add_refund(self, refund: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a new refund and its ledger entry.
+
+        The check against the payment amount runs in the ledger thread, so
+        concurrent refunds of one payment cannot together exceed it.
+
+        Raises:
+            ValueError: If the amount is not positive (in kopecks)
+            RefundLimitExceededError: If the refunds requested, in progress
+                and completed plus this one exceed the payment amount
+        """
+        row = _encode(refund)
+        if row["amount_minor"] <= 0:
+            raise ValueError(f"Refund amount must be positive, got {refund['amount']}")
+
+        def write(connection):
+            payment = connection.execute(
+                "SELECT amount_minor FROM payments WHERE payment_id = ?",
+                (row["payment_id"],),
+            ).fetchone()
+            reserved = connection.execute(
+                "SELECT COALESCE(SUM(amount_minor), 0) FROM refunds "
+                f"WHERE payment_id = ? AND status IN {ACTIVE_REFUND_STATUSES}",
+                (row["payment_id"],),
+            ).fetchone()[0]
+            available = payment["amount_minor"] - reserved if payment else 0
+            if row["amount_minor"] > available:
+                raise RefundLimitExceededError(
+                    row["payment_id"], from_minor(max(available, 0))
+                )
+            connection.execute(
+                "INSERT INTO refunds (refund_id, payment_id, user_id, amount_minor, "
+                "status, reason, transaction_id, created_at, completed_at) "
+                "VALUES (:refund_id, :payment_id, :user_id, :amount_minor, :status, "
+                ":reason, :transaction_id, :created_at, :completed_at)",
+                row,
+            )
+            _append_entry(
+                connection, row["payment_id"], row["refund_id"], "refund", row
+            )
+
+        await self._submit(write)
+        return refund
+
+    async def get_refund(self, refund_id: str) -> Optional[Dict[str, Any]]:
+        def read(connection):
+            row = connection.execute(
+                "SELECT * FROM refunds WHERE refund_id = ?", (refund_id,)
+            ).fetchone()
+            return _decode(row) if row else None
+
+        return await self._submit(read)
+
+    async def move_refund(
+        self, refund_id: str, from_status: str, to_status: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Change a refund's status if it is still from_status.
+
+        The check and the update run in the ledger thread, so of concurrent
+        moves of one refund out of a status only the first succeeds; claiming
+        a refund (requested -> processing) before sending it to the gateway
+        relies on it. Only for statuses that do not touch the payment's
+        refunded amount (use update_refund to complete a refund).
+
+        Returns:
+            The updated refund, or None if it is missing or not in from_status
+        """
+
+        def write(connection):
+            row = connection.execute(
+                "UPDATE refunds SET status = ? "
+                "WHERE refund_id = ? AND status = ? RETURNING *",
+                (to_status, refund_id, from_status),
+            ).fetchone()
+            if row is None:
+                return None
+            _append_entry(connection, row["payment_id"], refund_id, "refund", dict(row))
+            return _decode(row)
+
+        return await self._submit(write)
+
+    async def release_processing_refunds(self) -> int:
+        """
+        Move refunds left processing (by a restart) back to requested.
+
+        Their gateway call may or may not have happened; it is keyed by the
+        refund id, so processing them again cannot refund twice.
+
+        Returns:
+            Number of refunds released
+        """
+
+        def write(connection):
+            rows = connection.execute(
+                "UPDATE refunds SET status = 'requested' "
+                "WHERE status = 'processing' RETURNING *"
+            ).fetchall()
+            for row in rows:
+                _append_entry(
+                    connection, row["payment_id"], row["refund_id"], "refund", dict(row)
+                )
+            return len(rows)
+
+        return await self._submit(write)
+
+    async def update_refund(
+        self,
+        refund_id: str,
+        receipt: Optional[Dict[str, Any]] = None,
+        **fields: Any,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Update refund fields and append a ledger entry.
+
+        When the refund becomes completed its amount is added to the payment's
+        refunded amount in the same transaction, and the payment becomes
+        refunded (fully) or partially_refunded.
+
+        Args:
+            refund_id: Refund identifier
+            receipt: Fiscal receipt to store in the same transaction
+            **fields: Refund columns to update
+        """
+        values = _encode(fields)
+
+        def write(connection):
+            previous = connection.execute(
+                "SELECT status FROM refunds WHERE refund_id = ?", (refund_id,)
+            ).fetchone()
+            if previous is None:
+                return None
+            assignments = ", ".join(f"{name} = :{name}" for name in values)
+            cursor = connection.execute(
+                f"UPDATE refunds SET {assignments} WHERE refund_id = :refund_id",
+                {**values, "refund_id": refund_id},
+            )
+            if cursor.rowcount == 0:
+                return None
+            row = connection.execute(
+                "SELECT * FROM refunds WHERE refund_id = ?", (refund_id,)
+            ).fetchone()
+            _append_entry(connection, row["payment_id"], refund_id, "refund", dict(row))
+            if receipt is not None:
+                _insert_receipt(connection, receipt)
+            payment = None
+            if row["status"] == "completed" and previous["status"] != "completed":
+                connection.execute(
+                    "UPDATE payments SET refunded_minor = refunded_minor + ?, "
+                    "status = CASE WHEN refunded_minor + ? >= amount_minor "
+                    "THEN 'refunded' ELSE 'partially_refunded' END "
+                    "WHERE payment_id = ?",
+                    (row["amount_minor"], row["amount_minor"], row["payment_id"]),
+                )
+                payment = connection.execute(
+                    "SELECT * FROM payments WHERE payment_id = ?", (row["payment_id"],)
+                ).fetchone()
+            return _decode(row), _decode(payment) if payment else None
+
+        result = await self._submit(write)
+        if result is None:
+            return None
+        refund, payment = result
+        self._notify(payment)
+        return refund
+
+    async def refunds_by_payment(self, payment_id: str) -> List[Dict[str, Any]]:
+        return await self._select("refunds", "payment_id", payment_id)
+
+    async def entries(self, payment_id: str) -> List[Dict[str, Any]]:
+        """Ledger entries of a payment and its refunds, oldest first."""
+
+        def read(connection):
+            rows = connection.execute(
+                "SELECT * FROM ledger_entries WHERE payment_id = ? ORDER BY entry_id",
+                (payment_id,),
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        return await self._submit(read)
+
+    def iter_transactions(self, batch_size: int = 10000) -> Iterator[Dict[str, Any]]:
+        """
+        Stream payments and refunds that reached the gateway, by transaction_id.
+
+        Reads through its own read-only connection (WAL lets it run alongside
+        the ledger thread), walking the transaction_id indexes of both tables
+        and merging them, so memory stays bounded by batch_size. Needs an
+        on-disk ledger.
+
+        Yields:
+            Dicts with transaction_id, kind ("payment" or "refund"),
+            payment_id, refund_id, amount_minor and status
+        """
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            payments = _stream(
+                connection,
+                "SELECT transaction_id, 'payment', payment_id, NULL, amount_minor, "
+                "status FROM payments WHERE transaction_id IS NOT NULL "
+                "ORDER BY transaction_id",
+                batch_size,
+            )
+            refunds = _stream(
+                connection,
+                "SELECT transaction_id, 'refund', payment_id, refund_id, "
+                "amount_minor, status FROM refunds WHERE transaction_id IS NOT NULL "
+                "ORDER BY transaction_id",
+                batch_size,
+            )
+            for row in heapq.merge(payments, refunds, key=lambda row: row[0]):
+                yield dict(zip(TRANSACTION_FIELDS, row))
+        finally:
+            connection.close()
+
+    # Receipts
+
+    async def get_receipt(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        def read(connection):
+            row = connection.execute(
+                "SELECT * FROM receipts WHERE receipt_id = ?", (receipt_id,)
+            ).fetchone()
+            return _decode_receipt(row) if row else None
+
+        return await self._submit(read)
+
+    async def receipts_by_payment(self, payment_id: str) -> List[Dict[str, Any]]:
+        """Receipts of a payment and its refunds, oldest first."""
+
+        def read(connection):
+            rows = connection.execute(
+                "SELECT * FROM receipts WHERE payment_id = ? "
+                "ORDER BY created_at, receipt_id",
+                (payment_id,),
+            ).fetchall()
+            return [_decode_receipt(row) for row in rows]
+
+        return await self._submit(read)
+
+    async def receipts_by_status(
+        self,
+        status: str,
+        after: Optional[Tuple[datetime, str]] = None,
+        limit: int = 500,
+    ) -> List[Dict[str, Any]]:
+        """Receipts in a status, oldest first, after a (created_at, id) key."""
+        sql = "SELECT * FROM receipts WHERE status = ?"
+        params: List[Any] = [status]
+        if after is not None:
+            sql += " AND (created_at, receipt_id) > (?, ?)"
+            params += [after[0].isoformat(), after[1]]
+        sql += " ORDER BY created_at, receipt_id LIMIT ?"
+        params.append(limit)
+
+        def read(connection):
+            rows = connection.execute(sql, params).fetchall()
+            return [_decode_receipt(row) for row in rows]
+
+        return await self._submit(read)
+
+    async def update_receipts(self, updates: List[Dict[str, Any]]):
+        """
+        Record the outcome of an OFD batch in one statement.
+
+        Args:
+            updates: Dicts with receipt_id, status, fiscal_sign, attempts,
+                last_error and sent_at
+        """
+        rows = [_encode(update) for update in updates]
+
+        def write(connection):
+            connection.executemany(
+                "UPDATE receipts SET status = :status, fiscal_sign = :fiscal_sign, "
+                "attempts = :attempts, last_error = :last_error, sent_at = :sent_at "
+                "WHERE receipt_id = :receipt_id",
+                rows,
+            )
+
+        await self._submit(write)
+
+    async def _select(self, table: str, column: str, value: str) -> List[Dict]:
+        def read(connection):
+            rows = connection.execute(
+                f"SELECT * FROM {table} WHERE {column} = ? ORDER BY created_at",
+                (value,),
+            ).fetchall()
+            return [_decode(row) for row in rows]
+
+        return await self._submit(read)
+
+
+def _append_entry(
+    connection: sqlite3.Connection,
+    payment_id: str,
+    refund_id: Optional[str],
+    kind: str,
+    row: Dict[str, Any],
+):
+    connection.execute(
+        "INSERT INTO ledger_entries (payment_id, refund_id, kind, status, "
+        "amount_minor, transaction_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            payment_id,
+            refund_id,
+            kind,
+            row["status"],
+            row["amount_minor"],
+            row.get("transaction_id"),
+            datetime.now().isoformat(),
+        ),
+    )
+
+
+TRANSACTION_FIELDS = (
+    "transaction_id",
+    "kind",
+    "payment_id",
+    "refund_id",
+    "amount_minor",
+    "status",
+)
+
+
+def _stream(
+    connection: sqlite3.Connection, sql: str, batch_size: int
+) -> Iterator[Tuple]:
+    cursor = connection.execute(sql)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def _insert_receipt(connection: sqlite3.Connection, receipt: Dict[str, Any]):
+    row = _encode(receipt)
+    row["document"] = json.dumps(row["document"], ensure_ascii=False)
+    connection.execute(
+        "INSERT INTO receipts (receipt_id, kind, payment_id, refund_id, user_id, "
+        "amount_minor, status, document, fiscal_sign, attempts, last_error, "
+        "created_at, sent_at) VALUES (:receipt_id, :kind, :payment_id, "
+        ":refund_id, :user_id, :amount_minor, :status, :document, :fiscal_sign, "
+        ":attempts, :last_error, :created_at, :sent_at)",
+        row,
+    )
+
+
+def _decode_receipt(row: sqlite3.Row) -> Dict[str, Any]:
+    receipt = _decode(row)
+    receipt["document"] = json.loads(receipt["document"])
+    return receipt
+
+
+def _resolve(future: asyncio.Future, ok: bool, value: Any):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+# Global instance
+ledger = Ledger()
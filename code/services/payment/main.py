@@ -4,36 +4,69 @@ Payment Service - FastAPI application with gRPC server.
 This service handles payments and refunds. It includes:
 - gRPC server for synchronous communication with Rent service
 - Mocked payment gateway (Эквайринг)
-- Mocked OFD (fiscal data operator)
+- Mocked OFD (fiscal data operator) fed by a batched receipt pipeline
 - RabbitMQ for publishing domain events
 """
 
-from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi import FastAPI, HTTPException, status, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from datetime import datetime
+from typing import Any, Dict, List, Optional
 import uvicorn
-import uuid
 import asyncio
 import grpc
 from concurrent import futures
 
 from schemas import (
+    BulkRefundJobResponse,
+    BulkRefundRequest,
     InitiatePaymentRequest,
     ProcessPaymentRequest,
     RequestRefundRequest,
     ProcessRefundRequest,
     DeclineRefundRequest,
     PaymentResponse,
+    PaymentListResponse,
+    ReceiptResponse,
     RefundResponse,
 )
-from payment_gateway import payment_gateway
+from ledger import ledger
+from pagination import InvalidCursorError, decode_cursor, encode_cursor
+from gateway_client import GatewayUnavailableError, payment_gateway
+from ofd import receipt_pipeline
+from payments import (
+    PaymentRejectedError,
+    VelocityLimitExceededError,
+    create_payment,
+    execute_payment,
+)
 from rabbitmq_client import publish_event
+from refunds import RefundRejectedError, bulk_refunds, execute_refund, request_refund
+from response_cache import response_cache
+
+# Payments in these statuses only change through a refund
+TERMINAL_PAYMENT_STATUSES = ("completed", "declined", "partially_refunded", "refunded")
+
+
+def invalidate_payment(payment: Dict[str, Any]):
+    """Drop cached responses that include a payment after it changed."""
+    response_cache.invalidate(
+        ("payment", payment["payment_id"]),
+        ("order", payment["order_id"]),
+        ("user", payment["user_id"]),
+    )
+
 
+ledger.listeners.append(invalidate_payment)
 
-# In-memory storage (in production, use a database)
-payments_db = {}
-refunds_db = {}
+
+def gateway_unavailable(error: GatewayUnavailableError) -> HTTPException:
+    """503 telling the client when to retry a call the gateway could not take."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, round(error.retry_after)))},
+    )
 
 
 @asynccontextmanager
@@ -42,11 +75,24 @@ async def lifespan(app: FastAPI):
     print("🚀 Payment service starting up...")
 
     # Start gRPC server in background
-    # grpc_task = asyncio.create_task(serve_grpc(payments_db, refunds_db))
+    # grpc_task = asyncio.create_task(serve_grpc(ledger))
+
+    await receipt_pipeline.start()
+    # Payments and refunds a previous run was sending to the gateway can be
+    # processed again
+    released = await ledger.release_processing_payments()
+    if released:
+        print(f"↩️ {released} payments interrupted by a restart are initiated again")
+    released = await ledger.release_processing_refunds()
+    if released:
+        print(f"↩️ {released} refunds interrupted by a restart are requested again")
 
     yield
 
     print("🛑 Payment service shutting down...")
+    await bulk_refunds.stop()
+    await receipt_pipeline.stop()
+    ledger.close()
 
 
 app = FastAPI(
@@ -74,33 +120,17 @@ app.add_middleware(
     summary="Initiate payment",
 )
 async def initiate_payment(request: InitiatePaymentRequest):
-    """Initiate a new payment."""
-    payment_id = str(uuid.uuid4())
-
-    payment = {
-        "payment_id": payment_id,
-        "order_id": request.order_id,
-        "user_id": request.user_id,
-        "amount": request.amount,
-        "status": "initiated",
-        "payment_method": request.payment_method,
-        "transaction_id": None,
-        "created_at": datetime.now(),
-        "completed_at": None,
-    }
-
-    payments_db[payment_id] = payment
-
-    # Publish domain event
-    await publish_event(
-        "payment.initiated",
-        {
-            "payment_id": payment_id,
-            "order_id": request.order_id,
-            "user_id": request.user_id,
-            "amount": request.amount,
-        },
-    )
+    """Initiate a new payment (subject to per-user velocity limits)."""
+    try:
+        payment = await create_payment(
+            request.order_id, request.user_id, request.amount, request.payment_method
+        )
+    except VelocityLimitExceededError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        ) from e
 
     return PaymentResponse(**payment)
 
@@ -113,38 +143,22 @@ async def initiate_payment(request: InitiatePaymentRequest):
 )
 async def process_payment(payment_id: str, request: ProcessPaymentRequest):
     """Process a payment through the payment gateway."""
-    payment = payments_db.get(payment_id)
-    if not payment:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found"
-        )
-
-    # Process through mocked gateway
-    result = await payment_gateway.process_payment(
-        payment_id, payment["amount"], payment["payment_method"]
-    )
-
-    # Update payment
-    payment["status"] = result["status"]
-    payment["transaction_id"] = result["transaction_id"]
-    if result["status"] == "completed":
-        payment["completed_at"] = datetime.now()
-        # Mock OFD (fiscal data operator) - just log
-        print(f"[OFD] Fiscal receipt generated for payment {payment_id}")
-
-    # Publish domain event
-    event_type = (
-        "payment.successful" if result["status"] == "completed" else "payment.declined"
-    )
-    await publish_event(
-        event_type,
-        {
-            "payment_id": payment_id,
-            "order_id": payment["order_id"],
-            "status": result["status"],
-            "transaction_id": result["transaction_id"],
-        },
-    )
+    # The payment is claimed first, so a processed payment or a concurrent
+    # call for it gets 400 here; on 503 the payment goes back to initiated.
+    # The fiscal receipt is stored with the result and sent to the OFD in the
+    # background.
+    try:
+        payment = await execute_payment(payment_id)
+    except PaymentRejectedError as e:
+        if e.not_found:
+            code = status.HTTP_404_NOT_FOUND
+        elif e.conflict:
+            code = status.HTTP_409_CONFLICT
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        raise HTTPException(status_code=code, detail=str(e)) from e
+    except GatewayUnavailableError as e:
+        raise gateway_unavailable(e) from e
 
     return PaymentResponse(**payment)
 
@@ -156,49 +170,52 @@ async def process_payment(payment_id: str, request: ProcessPaymentRequest):
     tags=["Refunds"],
     summary="Request refund",
 )
-async def request_refund(request: RequestRefundRequest):
-    """Request a refund for a payment."""
-    payment = payments_db.get(request.payment_id)
-    if not payment:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found"
+async def create_refund(request: RequestRefundRequest):
+    """Request a refund for a payment (at most the amount left to refund)."""
+    try:
+        refund = await request_refund(
+            request.payment_id, request.user_id, request.reason, request.amount
         )
-
-    if payment["status"] != "completed":
+    except RefundRejectedError as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Can only refund completed payments",
-        )
-
-    refund_id = str(uuid.uuid4())
-    refund_amount = request.amount or payment["amount"]
+            status_code=status.HTTP_404_NOT_FOUND
+            if e.not_found
+            else status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        ) from e
 
-    refund = {
-        "refund_id": refund_id,
-        "payment_id": request.payment_id,
-        "user_id": request.user_id,
-        "amount": refund_amount,
-        "status": "requested",
-        "reason": request.reason,
-        "transaction_id": None,
-        "created_at": datetime.now(),
-        "completed_at": None,
-    }
+    return RefundResponse(**refund)
 
-    refunds_db[refund_id] = refund
 
-    # Publish domain event
-    await publish_event(
-        "refund.requested",
-        {
-            "refund_id": refund_id,
-            "payment_id": request.payment_id,
-            "user_id": request.user_id,
-            "amount": refund_amount,
-        },
+@app.post(
+    "/api/v1/refunds/bulk",
+    response_model=BulkRefundJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Refunds"],
+    summary="Refund many payments",
+)
+async def create_bulk_refund(request: BulkRefundRequest):
+    """Queue refunds for many payments; poll the job for progress."""
+    job = bulk_refunds.submit(
+        [item.model_dump() for item in request.items], request.reason
     )
+    return BulkRefundJobResponse.model_validate(job)
 
-    return RefundResponse(**refund)
+
+@app.get(
+    "/api/v1/refunds/bulk/{job_id}",
+    response_model=BulkRefundJobResponse,
+    tags=["Refunds"],
+    summary="Get bulk refund progress",
+)
+async def get_bulk_refund(job_id: str):
+    """Get the progress of a bulk refund job."""
+    job = bulk_refunds.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Bulk refund job not found"
+        )
+    return BulkRefundJobResponse.model_validate(job)
 
 
 @app.post(
@@ -209,38 +226,32 @@ async def request_refund(request: RequestRefundRequest):
 )
 async def process_refund(refund_id: str, request: ProcessRefundRequest):
     """Process a refund through the payment gateway."""
-    refund = refunds_db.get(refund_id)
+    refund = await ledger.get_refund(refund_id)
     if not refund:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Refund not found"
         )
 
-    payment = payments_db.get(refund["payment_id"])
-
-    # Process through mocked gateway
-    result = await payment_gateway.process_refund(
-        refund_id, refund["payment_id"], refund["amount"]
-    )
-
-    # Update refund
-    refund["status"] = result["status"]
-    refund["transaction_id"] = result["transaction_id"]
-    if result["status"] == "completed":
-        refund["completed_at"] = datetime.now()
-        # Update payment status
-        if payment:
-            payment["status"] = "refunded"
+    if refund["status"] != "requested":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Refund is already {refund['status']}",
+        )
 
-    # Publish domain event
-    await publish_event(
-        "refund.processed",
-        {
-            "refund_id": refund_id,
-            "payment_id": refund["payment_id"],
-            "status": result["status"],
-            "transaction_id": result["transaction_id"],
-        },
-    )
+    # Process through the acquiring gateway; the payment's refunded amount,
+    # status and the receipt are updated in the same transaction. The refund
+    # is claimed first, so a concurrent call for it gets 400 here.
+    try:
+        refund = await execute_refund(refund)
+    except RefundRejectedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND
+            if e.not_found
+            else status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        ) from e
+    except GatewayUnavailableError as e:
+        raise gateway_unavailable(e) from e
 
     return RefundResponse(**refund)
 
@@ -253,15 +264,13 @@ async def process_refund(refund_id: str, request: ProcessRefundRequest):
 )
 async def decline_refund(refund_id: str, request: DeclineRefundRequest):
     """Decline a refund request."""
-    refund = refunds_db.get(refund_id)
+    refund = await ledger.update_refund(refund_id, status="declined")
     if not refund:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Refund not found"
         )
 
-    refund["status"] = "declined"
-
-    # Publish domain event
+    # Publish domain event (a random id: declining again publishes it again)
     await publish_event(
         "refund.declined",
         {
@@ -282,12 +291,86 @@ async def decline_refund(refund_id: str, request: DeclineRefundRequest):
 )
 async def get_payment(payment_id: str):
     """Get payment information by ID."""
-    payment = payments_db.get(payment_id)
+    key = ("payment", payment_id)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    payment = await ledger.get_payment(payment_id)
     if not payment:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found"
         )
-    return PaymentResponse(**payment)
+    response = PaymentResponse(**payment)
+    if payment["status"] in TERMINAL_PAYMENT_STATUSES:
+        response_cache.put(key, response, tags=[key])
+    return response
+
+
+async def list_payments(
+    scope: str, value: str, cursor: Optional[str], limit: int
+) -> PaymentListResponse:
+    """Return one newest-first page of an order's or user's payments."""
+    key = (scope, value, cursor, limit)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except InvalidCursorError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+            ) from e
+
+    fetch = ledger.payments_by_order if scope == "order" else ledger.payments_by_user
+    payments = await fetch(value, after, limit + 1)
+    next_cursor = None
+    if len(payments) > limit:
+        payments = payments[:limit]
+        last = payments[-1]
+        next_cursor = encode_cursor(last["created_at"], last["payment_id"])
+
+    page = PaymentListResponse(
+        items=[PaymentResponse(**payment) for payment in payments],
+        next_cursor=next_cursor,
+    )
+    # Only cache pages that will not change until a write invalidates them
+    if all(p["status"] in TERMINAL_PAYMENT_STATUSES for p in payments):
+        response_cache.put(key, page, tags=[(scope, value)])
+    return page
+
+
+@app.get(
+    "/api/v1/orders/{order_id}/payments",
+    response_model=PaymentListResponse,
+    tags=["Payments"],
+    summary="List order payments",
+)
+async def list_order_payments(
+    order_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    """List the payments of an order, newest first."""
+    return await list_payments("order", order_id, cursor, limit)
+
+
+@app.get(
+    "/api/v1/users/{user_id}/payments",
+    response_model=PaymentListResponse,
+    tags=["Payments"],
+    summary="List user payments",
+)
+async def list_user_payments(
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    """List a user's payment history, newest first."""
+    return await list_payments("user", user_id, cursor, limit)
 
 
 @app.get(
@@ -298,7 +381,7 @@ async def get_payment(payment_id: str):
 )
 async def get_refund(refund_id: str):
     """Get refund information by ID."""
-    refund = refunds_db.get(refund_id)
+    refund = await ledger.get_refund(refund_id)
     if not refund:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Refund not found"
@@ -306,6 +389,56 @@ async def get_refund(refund_id: str):
     return RefundResponse(**refund)
 
 
+@app.get(
+    "/api/v1/receipts/metrics",
+    response_model=dict,
+    tags=["Receipts"],
+    summary="Fiscal receipt pipeline metrics",
+)
+async def get_receipt_metrics():
+    """Get the OFD queue length and receipt counters."""
+    return receipt_pipeline.metrics()
+
+
+@app.get(
+    "/api/v1/receipts/{receipt_id}",
+    response_model=ReceiptResponse,
+    tags=["Receipts"],
+    summary="Get fiscal receipt",
+)
+async def get_receipt(receipt_id: str):
+    """Get a fiscal receipt and its OFD status."""
+    receipt = await ledger.get_receipt(receipt_id)
+    if not receipt:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Receipt not found"
+        )
+    return ReceiptResponse(**receipt)
+
+
+@app.get(
+    "/api/v1/payments/{payment_id}/receipts",
+    response_model=List[ReceiptResponse],
+    tags=["Receipts"],
+    summary="List payment receipts",
+)
+async def list_payment_receipts(payment_id: str):
+    """List the fiscal receipts of a payment and its refunds."""
+    receipts = await ledger.receipts_by_payment(payment_id)
+    return [ReceiptResponse(**receipt) for receipt in receipts]
+
+
+@app.get(
+    "/api/v1/gateway/metrics",
+    response_model=dict,
+    tags=["Payments"],
+    summary="Acquiring gateway client metrics",
+)
+async def get_gateway_metrics():
+    """Get the gateway concurrency limit, circuit breaker state and counters."""
+    return payment_gateway.metrics()
+
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     """Health check endpoint."""
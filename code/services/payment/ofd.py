@@ -0,0 +1,331 @@
+"""
+Fiscal receipt pipeline (ОФД) for Payment service.
+
+A receipt is rendered for every completed payment and refund and stored in
+the ledger together with the payment change, so payment processing never
+waits for the fiscal data operator. A background worker ships queued
+receipts to the OFD in batches - as soon as a batch is full or the oldest
+receipt has waited `OFD_BATCH_INTERVAL` seconds - and records the result of
+each receipt: accepted with its fiscal sign, rejected by the OFD, or failed
+after `OFD_MAX_ATTEMPTS` unsuccessful deliveries. Receipts still queued at
+shutdown are reloaded from the ledger on the next start.
+"""
+
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from ledger import Ledger, ledger
+
+OFD_BATCH_SIZE = int(os.getenv("OFD_BATCH_SIZE", "100"))
+OFD_BATCH_INTERVAL = float(os.getenv("OFD_BATCH_INTERVAL", "1.0"))
+OFD_MAX_ATTEMPTS = int(os.getenv("OFD_MAX_ATTEMPTS", "8"))
+OFD_RETRY_BASE_DELAY = float(os.getenv("OFD_RETRY_BASE_DELAY", "1.0"))
+OFD_RELOAD_CHUNK_SIZE = 500
+
+# Receipt kinds (признак расчета)
+SALE = "income"
+REFUND = "income_return"
+
+# Receipt statuses
+QUEUED = "queued"
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+FAILED = "failed"
+
+
+class OFDUnavailableError(Exception):
+    """Raised when a batch could not be delivered to the OFD."""
+
+
+class MockOFDEndpoint:
+    """Mocked fiscal data operator accepting receipts in batches."""
+
+    def __init__(
+        self,
+        latency: float = 0.3,
+        latency_per_receipt: float = 0.002,
+        failure_rate: float = 0.0,
+        max_batch: int = 1000,
+    ):
+        """
+        Args:
+            latency: Base response time of a batch in seconds
+            latency_per_receipt: Extra response time per receipt in the batch
+            failure_rate: Share of batches failing as a whole
+            max_batch: Largest batch the OFD accepts
+        """
+        self.latency = latency
+        self.latency_per_receipt = latency_per_receipt
+        self.failure_rate = failure_rate
+        self.max_batch = max_batch
+        self.batches = 0
+
+    async def submit_batch(
+        self, documents: List[Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Register a batch of receipts.
+
+        Returns:
+            Result per receipt_id: status "accepted" with a fiscal_sign, or
+            "rejected" with an error
+
+        Raises:
+            OFDUnavailableError: If the batch was not processed
+        """
+        if len(documents) > self.max_batch:
+            raise OFDUnavailableError(
+                f"Batch of {len(documents)} exceeds OFD limit {self.max_batch}"
+            )
+        await asyncio.sleep(self.latency + self.latency_per_receipt * len(documents))
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise OFDUnavailableError("OFD service unavailable")
+        self.batches += 1
+
+        results = {}
+        for document in documents:
+            if document["total"] <= 0:
+                results[document["receipt_id"]] = {
+                    "status": REJECTED,
+                    "error": "Receipt total must be positive",
+                }
+            else:
+                results[document["receipt_id"]] = {
+                    "status": ACCEPTED,
+                    "fiscal_sign": str(random.randint(10**9, 10**10 - 1)),
+                }
+        return results
+
+
+def render_receipt(
+    kind: str,
+    payment_id: str,
+    user_id: str,
+    amount: float,
+    transaction_id: Optional[str],
+    order_id: Optional[str] = None,
+    refund_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Render a fiscal receipt ready to be stored and queued.
+
+    Args:
+        kind: SALE for a payment, REFUND for a refund
+        payment_id: Payment identifier
+        user_id: Customer identifier
+        amount: Receipt total
+        transaction_id: Acquiring transaction of the payment or refund
+        order_id: Rental order the payment is for
+        refund_id: Refund identifier, for refund receipts
+
+    Returns:
+        Receipt record with the OFD document in "document"
+    """
+    receipt_id = str(uuid.uuid4())
+    created_at = datetime.now()
+    return {
+        "receipt_id": receipt_id,
+        "kind": kind,
+        "payment_id": payment_id,
+        "refund_id": refund_id,
+        "user_id": user_id,
+        "amount": amount,
+        "status": QUEUED,
+        "document": {
+            "receipt_id": receipt_id,
+            "operation": kind,
+            "issued_at": created_at.isoformat(),
+            "customer": user_id,
+            "transaction_id": transaction_id,
+            "items": [
+                {
+                    "name": f"Game rental, order {order_id}"
+                    if order_id
+                    else f"Refund for payment {payment_id}",
+                    "price": amount,
+                    "quantity": 1,
+                    "vat": "none",
+                }
+            ],
+            "total": amount,
+            "payment_type": "electronic",
+        },
+        "fiscal_sign": None,
+        "attempts": 0,
+        "last_error": None,
+        "created_at": created_at,
+        "sent_at": None,
+    }
+
+
+class ReceiptPipeline:
+    """Ships queued receipts to the OFD in size- and time-bounded batches."""
+
+    def __init__(
+        self,
+        ledger: Ledger,
+        endpoint: MockOFDEndpoint,
+        batch_size: int = OFD_BATCH_SIZE,
+        batch_interval: float = OFD_BATCH_INTERVAL,
+        max_attempts: int = OFD_MAX_ATTEMPTS,
+        retry_base_delay: float = OFD_RETRY_BASE_DELAY,
+    ):
+        self.ledger = ledger
+        self.endpoint = endpoint
+        self.batch_size = min(batch_size, endpoint.max_batch)
+        self.batch_interval = batch_interval
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self._pending: Deque[Dict[str, Any]] = deque()
+        # (due time, receipt) of receipts waiting to be retried
+        self._retrying: List[Tuple[float, Dict[str, Any]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {
+            "batches": 0,
+            "failed_batches": 0,
+            ACCEPTED: 0,
+            REJECTED: 0,
+            FAILED: 0,
+        }
+
+    def enqueue(self, receipt: Dict[str, Any]):
+        """Queue a receipt already stored in the ledger."""
+        self._pending.append(receipt)
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        due = [receipt for at, receipt in self._retrying if at <= now]
+        if due:
+            self._retrying = [(at, r) for at, r in self._retrying if at > now]
+            self._pending.extendleft(reversed(due))
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            batch.append(self._pending.popleft())
+        return batch
+
+    async def _send(self, batch: List[Dict[str, Any]]):
+        sent_at = datetime.now()
+        try:
+            results = await self.endpoint.submit_batch(
+                [receipt["document"] for receipt in batch]
+            )
+        except OFDUnavailableError as e:
+            self.counters["failed_batches"] += 1
+            print(f"[OFD] Batch of {len(batch)} receipts failed: {e}")
+            results = {}
+            error = str(e)
+        else:
+            self.counters["batches"] += 1
+            error = "No result from OFD"
+
+        updates = []
+        for receipt in batch:
+            result = results.get(receipt["receipt_id"])
+            receipt["attempts"] += 1
+            if result is not None:
+                receipt["status"] = result["status"]
+                receipt["fiscal_sign"] = result.get("fiscal_sign")
+                receipt["last_error"] = result.get("error")
+                receipt["sent_at"] = sent_at
+            else:
+                receipt["last_error"] = error
+                if receipt["attempts"] >= self.max_attempts:
+                    receipt["status"] = FAILED
+                else:
+                    delay = self.retry_base_delay * 2 ** (receipt["attempts"] - 1)
+                    self._retrying.append(
+                        (time.monotonic() + random.uniform(delay / 2, delay), receipt)
+                    )
+            if receipt["status"] != QUEUED:
+                self.counters[receipt["status"]] += 1
+            updates.append(
+                {
+                    name: receipt[name]
+                    for name in (
+                        "receipt_id",
+                        "status",
+                        "fiscal_sign",
+                        "attempts",
+                        "last_error",
+                        "sent_at",
+                    )
+                }
+            )
+        await self.ledger.update_receipts(updates)
+
+    async def flush(self) -> int:
+        """Send every receipt that is due now; returns the number sent."""
+        sent = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return sent
+            await self._send(batch)
+            sent += len(batch)
+
+    async def _loop(self):
+        while True:
+            if len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.batch_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[OFD] Error sending receipts: {e}")
+
+    async def reload(self) -> int:
+        """Queue the receipts left queued in the ledger; returns count."""
+        queued = {receipt["receipt_id"] for receipt in self._pending}
+        queued.update(receipt["receipt_id"] for _, receipt in self._retrying)
+        reloaded = 0
+        after = None
+        while True:
+            receipts = await self.ledger.receipts_by_status(
+                QUEUED, after, OFD_RELOAD_CHUNK_SIZE
+            )
+            for receipt in receipts:
+                if receipt["receipt_id"] not in queued:
+                    self._pending.append(receipt)
+                    reloaded += 1
+            if len(receipts) < OFD_RELOAD_CHUNK_SIZE:
+                return reloaded
+            after = (receipts[-1]["created_at"], receipts[-1]["receipt_id"])
+
+    async def start(self):
+        """Reload queued receipts and start the background sender."""
+        reloaded = await self.reload()
+        if reloaded:
+            print(f"[OFD] Reloaded {reloaded} queued receipts")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Stop the sender; receipts not sent stay queued in the ledger."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._wakeup = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "retrying": len(self._retrying),
+            **self.counters,
+        }
+
+
+# Global instance
+receipt_pipeline = ReceiptPipeline(ledger, MockOFDEndpoint())
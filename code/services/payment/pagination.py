@@ -0,0 +1,31 @@
+"""
+Keyset (cursor) pagination helpers for Payment service.
+
+A cursor encodes the sort key of the last row of a page, so the next page is
+an index range scan starting after it instead of an OFFSET scan.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(created_at: datetime, payment_id: str) -> str:
+    """Encode the (created_at, payment_id) sort key of the last row of a page."""
+    raw = json.dumps([created_at.isoformat(), payment_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by encode_cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, payment_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(payment_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError("Invalid pagination cursor") from e
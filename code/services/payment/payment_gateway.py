@@ -2,16 +2,64 @@
 Mocked payment gateway (Эквайринг) for Payment service.
 """
 
+import csv
 import random
 import asyncio
-from typing import Dict, Optional
+from typing import Any, Dict, Iterator, Optional
+
+# Columns of the provider settlement report, sorted by transaction_id
+SETTLEMENT_COLUMNS = ("transaction_id", "kind", "payment_id", "amount", "status")
+
+
+class GatewayError(Exception):
+    """Raised by the gateway on a technical failure (not a decline)."""
 
 
 class MockPaymentGateway:
     """Mocked payment gateway that simulates payment processing."""
 
-    def __init__(self):
+    def __init__(
+        self,
+        latency: float = 0.5,
+        latency_jitter: float = 0.0,
+        decline_rate: float = 0.1,
+        error_rate: float = 0.0,
+        capacity: Optional[int] = None,
+    ):
+        """
+        Args:
+            latency: Base response time in seconds
+            latency_jitter: Extra response time drawn from an exponential
+                distribution with this mean (long tail)
+            decline_rate: Share of payments declined by the issuer
+            error_rate: Share of calls failing with GatewayError
+            capacity: Concurrent calls served at base latency; above it
+                latency grows proportionally to the overload (None: unlimited)
+        """
         self.transactions: Dict[str, Dict] = {}
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.in_flight = 0
+        # Answers by idempotency key: a repeated call returns the first one
+        self.responses: Dict[str, Dict[str, str]] = {}
+
+    async def _simulate_call(self):
+        """Wait like the provider would and fail some calls."""
+        self.in_flight += 1
+        try:
+            delay = self.latency
+            if self.latency_jitter:
+                delay += random.expovariate(1 / self.latency_jitter)
+            if self.capacity and self.in_flight > self.capacity:
+                delay *= self.in_flight / self.capacity
+            await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+        if self.error_rate and random.random() < self.error_rate:
+            raise GatewayError("Gateway internal error")
 
     async def process_payment(
         self, payment_id: str, amount: float, payment_method: str
@@ -20,7 +68,8 @@ class MockPaymentGateway:
         Simulate payment processing with random success/failure.
 
         Args:
-            payment_id: Payment identifier
+            payment_id: Payment identifier, also the idempotency key: the
+                same payment is charged at most once
             amount: Payment amount
             payment_method: Payment method
 
@@ -28,27 +77,29 @@ class MockPaymentGateway:
             Dictionary with transaction_id and status
         """
         # Simulate network delay
-        await asyncio.sleep(0.5)
+        await self._simulate_call()
+        key = f"payment:{payment_id}"
+        if key in self.responses:
+            return dict(self.responses[key])
 
-        # Randomly succeed or fail (90% success rate)
-        success = random.random() > 0.1
+        # Randomly succeed or fail (90% success rate by default)
+        success = random.random() >= self.decline_rate
 
         transaction_id = f"TXN_{payment_id[:8]}_{random.randint(100000, 999999)}"
 
-        if success:
-            status = "completed"
-            self.transactions[transaction_id] = {
-                "payment_id": payment_id,
-                "status": status,
-                "amount": amount,
-            }
-        else:
-            status = "declined"
+        status = "completed" if success else "declined"
+        self.transactions[transaction_id] = {
+            "kind": "payment",
+            "payment_id": payment_id,
+            "status": status,
+            "amount": amount,
+        }
 
-        return {
+        self.responses[key] = {
             "transaction_id": transaction_id,
             "status": status,
         }
+        return dict(self.responses[key])
 
     async def process_refund(
         self, refund_id: str, payment_id: str, amount: float
@@ -57,7 +108,7 @@ class MockPaymentGateway:
         Simulate refund processing.
 
         Args:
-            refund_id: Refund identifier
+            refund_id: Refund identifier, also the idempotency key
             payment_id: Original payment identifier
             amount: Refund amount
 
@@ -65,15 +116,44 @@ class MockPaymentGateway:
             Dictionary with transaction_id and status
         """
         # Simulate network delay
-        await asyncio.sleep(0.5)
+        await self._simulate_call()
+        key = f"refund:{refund_id}"
+        if key in self.responses:
+            return dict(self.responses[key])
 
         # Refunds usually succeed
         transaction_id = f"REF_{refund_id[:8]}_{random.randint(100000, 999999)}"
+        self.transactions[transaction_id] = {
+            "kind": "refund",
+            "payment_id": payment_id,
+            "status": "completed",
+            "amount": amount,
+        }
 
-        return {
+        self.responses[key] = {
             "transaction_id": transaction_id,
             "status": "completed",
         }
+        return dict(self.responses[key])
+
+    def iter_transactions(self) -> Iterator[Dict[str, Any]]:
+        """Provider-side transactions sorted by transaction_id."""
+        for transaction_id in sorted(self.transactions):
+            yield {
+                "transaction_id": transaction_id,
+                **self.transactions[transaction_id],
+            }
+
+    def export_settlements(self, path: str) -> int:
+        """Write the settlement report the provider would send; returns rows."""
+        rows = 0
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SETTLEMENT_COLUMNS)
+            writer.writeheader()
+            for transaction in self.iter_transactions():
+                writer.writerow(transaction)
+                rows += 1
+        return rows
 
 
 # Global instance
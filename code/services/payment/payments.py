@@ -0,0 +1,159 @@
+"""
+Payment creation and processing for Payment service.
+
+`create_payment` and `execute_payment` are shared by the REST and gRPC
+endpoints, so both apply the same velocity limits, claims and receipts. New
+payments are checked against the per-user velocity rules before they are
+stored. A payment is claimed in the ledger (initiated -> processing) before
+it is sent to the gateway, so concurrent or repeated calls cannot both reach
+the gateway and a payment gets at most one fiscal receipt; the gateway call
+is also keyed by the payment id.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Any, Dict
+
+from gateway_client import payment_gateway
+from ledger import ledger
+from ofd import SALE, receipt_pipeline, render_receipt
+from rabbitmq_client import publish_event
+from velocity import VelocityViolation, velocity_checker
+
+
+class PaymentRejectedError(Exception):
+    """Raised when a payment cannot be processed."""
+
+    def __init__(self, message: str, not_found: bool = False, conflict: bool = False):
+        super().__init__(message)
+        self.not_found = not_found
+        self.conflict = conflict
+
+
+class VelocityLimitExceededError(Exception):
+    """Raised when a new payment would break a per-user velocity rule."""
+
+    def __init__(self, violation: VelocityViolation):
+        super().__init__(f"Payment velocity limit {violation.rule} exceeded")
+        self.retry_after = violation.retry_after
+
+
+async def create_payment(
+    order_id: str, user_id: str, amount: float, payment_method: str
+) -> Dict[str, Any]:
+    """
+    Create a payment and publish payment.initiated.
+
+    Returns:
+        The initiated payment
+
+    Raises:
+        VelocityLimitExceededError: If the user made too many payments, or
+            paid too much, within a velocity window
+    """
+    violation = velocity_checker.check(user_id, amount)
+    if violation:
+        raise VelocityLimitExceededError(violation)
+
+    payment = {
+        "payment_id": str(uuid.uuid4()),
+        "order_id": order_id,
+        "user_id": user_id,
+        "amount": amount,
+        "status": "initiated",
+        "payment_method": payment_method,
+        "transaction_id": None,
+        "created_at": datetime.now(),
+        "completed_at": None,
+    }
+    await ledger.add_payment(payment)
+
+    await publish_event(
+        "payment.initiated",
+        {
+            "payment_id": payment["payment_id"],
+            "order_id": order_id,
+            "user_id": user_id,
+            "amount": amount,
+        },
+        event_id=f"payment.initiated:{payment['payment_id']}",
+    )
+    return payment
+
+
+async def execute_payment(payment_id: str) -> Dict[str, Any]:
+    """
+    Claim an initiated payment, send it to the gateway and record the result.
+
+    A completed payment gets its fiscal receipt stored in the same transaction
+    and queued for the OFD. Publishes payment.successful or payment.declined.
+
+    Returns:
+        The processed payment
+
+    Raises:
+        PaymentRejectedError: If the payment is missing, no longer initiated
+            (e.g. claimed by a concurrent call) or changed while it was
+            processed (conflict)
+        GatewayUnavailableError: If the gateway could not take the payment;
+            the payment goes back to initiated
+    """
+    payment = await ledger.get_payment(payment_id)
+    if not payment:
+        raise PaymentRejectedError("Payment not found", not_found=True)
+
+    if await ledger.move_payment(payment_id, "initiated", "processing") is None:
+        current = await ledger.get_payment(payment_id)
+        raise PaymentRejectedError(f"Payment is already {current['status']}")
+
+    # After a timeout the charge may have gone through, but payment_id is the
+    # gateway's idempotency key, so a retry returns that outcome instead of
+    # charging again
+    try:
+        result = await payment_gateway.process_payment(
+            payment_id, payment["amount"], payment["payment_method"]
+        )
+    except Exception:
+        await ledger.move_payment(payment_id, "processing", "initiated")
+        raise
+
+    completed = result["status"] == "completed"
+    receipt = None
+    if completed:
+        receipt = render_receipt(
+            SALE,
+            payment_id,
+            payment["user_id"],
+            payment["amount"],
+            result["transaction_id"],
+            order_id=payment["order_id"],
+        )
+    # Only the claimed payment is updated; a refunded payment is never set
+    # back to completed
+    payment = await ledger.update_payment(
+        payment_id,
+        receipt=receipt,
+        from_status="processing",
+        status=result["status"],
+        transaction_id=result["transaction_id"],
+        completed_at=datetime.now() if completed else None,
+    )
+    if payment is None:
+        raise PaymentRejectedError(
+            "Payment was changed while it was processed", conflict=True
+        )
+    if receipt is not None:
+        receipt_pipeline.enqueue(receipt)
+
+    event_type = "payment.successful" if completed else "payment.declined"
+    await publish_event(
+        event_type,
+        {
+            "payment_id": payment_id,
+            "order_id": payment["order_id"],
+            "status": result["status"],
+            "transaction_id": result["transaction_id"],
+        },
+        event_id=f"{event_type}:{payment_id}",
+    )
+    return payment
@@ -0,0 +1,224 @@
+"""
+Reconciliation between the payment ledger and the acquiring provider.
+
+Both sides are streamed sorted by transaction_id and merge-joined in a single
+pass, so memory does not grow with the number of transactions and mismatches
+are written out as they are found. Reported mismatches:
+
+- missing_in_provider: the ledger has a transaction the provider does not
+- missing_in_ledger: the provider settled a transaction the ledger does not
+  know about
+- amount_mismatch / status_mismatch: both sides have it but disagree
+
+Usage:
+    python reconciliation.py settlements.csv [--db payment.db] [--output report.csv]
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from ledger import PAYMENT_DB_PATH, Ledger, to_minor
+
+MISSING_IN_PROVIDER = "missing_in_provider"
+MISSING_IN_LEDGER = "missing_in_ledger"
+AMOUNT_MISMATCH = "amount_mismatch"
+STATUS_MISMATCH = "status_mismatch"
+
+REPORT_COLUMNS = (
+    "transaction_id",
+    "mismatch",
+    "kind",
+    "payment_id",
+    "ledger_amount",
+    "provider_amount",
+    "ledger_status",
+    "provider_status",
+)
+
+# A refunded payment was still completed at the provider; refunds are
+# separate transactions
+LEDGER_STATUS_AT_PROVIDER = {
+    "refunded": "completed",
+    "partially_refunded": "completed",
+}
+
+
+class UnsortedInputError(ValueError):
+    """Raised when a side is not strictly ordered by transaction_id."""
+
+
+@dataclass
+class Mismatch:
+    """One transaction the two sides disagree on."""
+
+    transaction_id: str
+    mismatch: str
+    ledger: Optional[Dict[str, Any]]
+    provider: Optional[Dict[str, Any]]
+
+    def to_row(self) -> Dict[str, Any]:
+        ledger = self.ledger or {}
+        provider = self.provider or {}
+        return {
+            "transaction_id": self.transaction_id,
+            "mismatch": self.mismatch,
+            "kind": ledger.get("kind") or provider.get("kind"),
+            "payment_id": ledger.get("payment_id") or provider.get("payment_id"),
+            "ledger_amount": _amount(ledger),
+            "provider_amount": _amount(provider),
+            "ledger_status": ledger.get("status"),
+            "provider_status": provider.get("status"),
+        }
+
+
+@dataclass
+class ReconciliationResult:
+    """Counts of one reconciliation run."""
+
+    ledger_rows: int = 0
+    provider_rows: int = 0
+    matched: int = 0
+    missing_in_provider: int = 0
+    missing_in_ledger: int = 0
+    amount_mismatch: int = 0
+    status_mismatch: int = 0
+    duration_seconds: float = 0.0
+
+    @property
+    def mismatches(self) -> int:
+        return (
+            self.missing_in_provider
+            + self.missing_in_ledger
+            + self.amount_mismatch
+            + self.status_mismatch
+        )
+
+
+def _amount(row: Dict[str, Any]) -> Optional[float]:
+    return row["amount_minor"] / 100 if "amount_minor" in row else None
+
+
+def _checked(rows: Iterable[Dict[str, Any]], side: str) -> Iterator[Dict[str, Any]]:
+    """Pass rows through, failing on the first out-of-order transaction_id."""
+    previous = None
+    for row in rows:
+        transaction_id = row["transaction_id"]
+        if previous is not None and transaction_id <= previous:
+            raise UnsortedInputError(
+                f"{side} rows are not sorted by transaction_id: "
+                f"{transaction_id!r} after {previous!r}"
+            )
+        previous = transaction_id
+        yield row
+
+
+def read_settlements(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream a provider settlement report (CSV sorted by transaction_id)."""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield provider_row(row)
+
+
+def provider_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize a provider record to the shape compared with the ledger."""
+    return {
+        "transaction_id": record["transaction_id"],
+        "kind": record["kind"],
+        "payment_id": record["payment_id"],
+        "amount_minor": to_minor(float(record["amount"])),
+        "status": record["status"],
+    }
+
+
+def reconcile(
+    ledger_rows: Iterable[Dict[str, Any]],
+    provider_rows: Iterable[Dict[str, Any]],
+    on_mismatch: Callable[[Mismatch], None] = lambda mismatch: None,
+) -> ReconciliationResult:
+    """
+    Merge-join both sides by transaction_id.
+
+    Args:
+        ledger_rows: Ledger transactions sorted by transaction_id (see
+            Ledger.iter_transactions)
+        provider_rows: Provider transactions sorted by transaction_id, with
+            amount_minor and status
+        on_mismatch: Called for every mismatch as soon as it is found
+
+    Returns:
+        Counts of matched and mismatched transactions
+
+    Raises:
+        UnsortedInputError: If either side is out of order
+    """
+    started = time.monotonic()
+    result = ReconciliationResult()
+    ledger_iter = _checked(ledger_rows, "Ledger")
+    provider_iter = _checked(provider_rows, "Provider")
+    ours = next(ledger_iter, None)
+    theirs = next(provider_iter, None)
+
+    def report(kind: str, transaction_id: str, ledger, provider):
+        setattr(result, kind, getattr(result, kind) + 1)
+        on_mismatch(Mismatch(transaction_id, kind, ledger, provider))
+
+    while ours is not None or theirs is not None:
+        if theirs is None or (
+            ours is not None and ours["transaction_id"] < theirs["transaction_id"]
+        ):
+            result.ledger_rows += 1
+            report(MISSING_IN_PROVIDER, ours["transaction_id"], ours, None)
+            ours = next(ledger_iter, None)
+        elif ours is None or theirs["transaction_id"] < ours["transaction_id"]:
+            result.provider_rows += 1
+            report(MISSING_IN_LEDGER, theirs["transaction_id"], None, theirs)
+            theirs = next(provider_iter, None)
+        else:
+            result.ledger_rows += 1
+            result.provider_rows += 1
+            status = LEDGER_STATUS_AT_PROVIDER.get(ours["status"], ours["status"])
+            if ours["amount_minor"] != theirs["amount_minor"]:
+                report(AMOUNT_MISMATCH, ours["transaction_id"], ours, theirs)
+            elif status != theirs["status"]:
+                report(STATUS_MISMATCH, ours["transaction_id"], ours, theirs)
+            else:
+                result.matched += 1
+            ours = next(ledger_iter, None)
+            theirs = next(provider_iter, None)
+
+    result.duration_seconds = round(time.monotonic() - started, 3)
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Reconcile the payment ledger with a provider settlement report"
+    )
+    parser.add_argument("settlements", help="Provider CSV sorted by transaction_id")
+    parser.add_argument("--db", default=PAYMENT_DB_PATH, help="Ledger database")
+    parser.add_argument("--output", help="Mismatch report CSV (default: stdout)")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(output, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        result = reconcile(
+            Ledger(args.db).iter_transactions(),
+            read_settlements(args.settlements),
+            lambda mismatch: writer.writerow(mismatch.to_row()),
+        )
+    finally:
+        if args.output:
+            output.close()
+    print(json.dumps(asdict(result)), file=sys.stderr)
+    return 1 if result.mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
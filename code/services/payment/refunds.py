@@ -0,0 +1,325 @@
+"""
+Refund requests, execution and bulk refund jobs for Payment service.
+
+Single refunds go through `request_refund` and `execute_refund`, which the
+REST endpoints call directly. Bulk refunds (mass cancellations) are accepted
+as a job: every item is queued and a pool of at most `REFUND_WORKERS`
+workers, shared by all jobs, requests and executes the refunds through the
+gateway client, retrying while the gateway is unavailable; a refund still not
+taken after the last attempt becomes `failed`, which frees its amount. Job
+progress is kept in memory; refunds themselves are in the ledger, so a refund
+left `requested` by a restart can still be processed through its endpoint.
+
+A refund is claimed in the ledger (requested -> processing) before it is sent
+to the gateway, so concurrent executions of one refund cannot both reach the
+gateway; the gateway call is also keyed by the refund id.
+"""
+
+import asyncio
+import os
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from gateway_client import GatewayUnavailableError, payment_gateway
+from ledger import RefundLimitExceededError, ledger
+from ofd import REFUND, receipt_pipeline, render_receipt
+from rabbitmq_client import publish_event
+
+REFUND_WORKERS = int(os.getenv("REFUND_WORKERS", "16"))
+REFUND_MAX_ATTEMPTS = int(os.getenv("REFUND_MAX_ATTEMPTS", "5"))
+# Finished jobs kept for progress queries
+REFUND_JOB_RETENTION = int(os.getenv("REFUND_JOB_RETENTION", "1000"))
+
+# Payment statuses that still have an amount left to refund
+REFUNDABLE_PAYMENT_STATUSES = ("completed", "partially_refunded")
+
+# Job statuses
+RUNNING = "running"
+FINISHED = "finished"
+
+
+class RefundRejectedError(Exception):
+    """Raised when a refund cannot be requested for a payment."""
+
+    def __init__(self, message: str, not_found: bool = False):
+        super().__init__(message)
+        self.not_found = not_found
+
+
+async def request_refund(
+    payment_id: str, user_id: str, reason: str, amount: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Create a refund for a payment and publish refund.requested.
+
+    Args:
+        payment_id: Payment to refund
+        user_id: User requesting the refund
+        reason: Refund reason
+        amount: Amount to refund; defaults to what is left to refund
+
+    Returns:
+        The requested refund
+
+    Raises:
+        RefundRejectedError: If the payment does not exist, is not refundable,
+            nothing is left to refund or the amount exceeds what is left
+    """
+    payment = await ledger.get_payment(payment_id)
+    if not payment:
+        raise RefundRejectedError("Payment not found", not_found=True)
+    if payment["status"] not in REFUNDABLE_PAYMENT_STATUSES:
+        raise RefundRejectedError("Can only refund completed payments")
+    if amount is None:
+        amount = round(payment["amount"] - payment["refunded_amount"], 2)
+        if amount <= 0:
+            raise RefundRejectedError("Nothing is left to refund")
+
+    refund = {
+        "refund_id": str(uuid.uuid4()),
+        "payment_id": payment_id,
+        "user_id": user_id,
+        "amount": amount,
+        "status": "requested",
+        "reason": reason,
+        "transaction_id": None,
+        "created_at": datetime.now(),
+        "completed_at": None,
+    }
+    try:
+        await ledger.add_refund(refund)
+    except (RefundLimitExceededError, ValueError) as e:
+        raise RefundRejectedError(str(e)) from e
+
+    await publish_event(
+        "refund.requested",
+        {
+            "refund_id": refund["refund_id"],
+            "payment_id": payment_id,
+            "user_id": user_id,
+            "amount": refund["amount"],
+        },
+        event_id=f"refund.requested:{refund['refund_id']}",
+    )
+    return refund
+
+
+async def execute_refund(refund: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Claim a requested refund, send it to the gateway and record the result.
+
+    A completed refund gets its fiscal receipt stored in the same transaction
+    and queued for the OFD.
+
+    Raises:
+        RefundRejectedError: If the refund is missing or no longer requested,
+            e.g. claimed by a concurrent call
+        GatewayUnavailableError: If the gateway could not take the refund;
+            the refund goes back to requested
+    """
+    claimed = await ledger.move_refund(refund["refund_id"], "requested", "processing")
+    if claimed is None:
+        current = await ledger.get_refund(refund["refund_id"])
+        if current is None:
+            raise RefundRejectedError("Refund not found", not_found=True)
+        raise RefundRejectedError(f"Refund is already {current['status']}")
+
+    try:
+        result = await payment_gateway.process_refund(
+            refund["refund_id"], refund["payment_id"], refund["amount"]
+        )
+    except Exception:
+        # Not taken (or unknown): a retry with the same refund id is safe
+        await ledger.move_refund(refund["refund_id"], "processing", "requested")
+        raise
+
+    completed = result["status"] == "completed"
+    receipt = None
+    if completed:
+        receipt = render_receipt(
+            REFUND,
+            refund["payment_id"],
+            refund["user_id"],
+            refund["amount"],
+            result["transaction_id"],
+            refund_id=refund["refund_id"],
+        )
+    refund = await ledger.update_refund(
+        refund["refund_id"],
+        receipt=receipt,
+        status=result["status"],
+        transaction_id=result["transaction_id"],
+        completed_at=datetime.now() if completed else None,
+    )
+    if receipt is not None:
+        receipt_pipeline.enqueue(receipt)
+
+    await publish_event(
+        "refund.processed",
+        {
+            "refund_id": refund["refund_id"],
+            "payment_id": refund["payment_id"],
+            "status": result["status"],
+            "transaction_id": result["transaction_id"],
+        },
+        event_id=f"refund.processed:{refund['refund_id']}",
+    )
+    return refund
+
+
+async def fail_refund(refund: Dict[str, Any], reason: str):
+    """
+    Give up on a requested refund the gateway never took.
+
+    A failed refund no longer counts against the payment amount, so the
+    payment can be refunded again. Publishes refund.processed with status
+    failed.
+    """
+    failed = await ledger.move_refund(refund["refund_id"], "requested", "failed")
+    if failed is None:
+        return  # Claimed again meanwhile, e.g. through the endpoint
+    print(f"Refund {refund['refund_id']} failed: {reason}")
+    await publish_event(
+        "refund.processed",
+        {
+            "refund_id": refund["refund_id"],
+            "payment_id": refund["payment_id"],
+            "status": "failed",
+            "transaction_id": None,
+        },
+        event_id=f"refund.processed:{refund['refund_id']}",
+    )
+
+
+@dataclass
+class RefundJob:
+    """Progress of one bulk refund request."""
+
+    job_id: str
+    reason: str
+    total: int
+    status: str = RUNNING
+    succeeded: int = 0
+    failed: int = 0
+    refunded_amount: float = 0.0
+    created_at: datetime = field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+    errors: List[Dict[str, str]] = field(default_factory=list)
+
+    @property
+    def processed(self) -> int:
+        return self.succeeded + self.failed
+
+
+class BulkRefundQueue:
+    """Work queue of bulk refund items drained by a bounded worker pool."""
+
+    def __init__(
+        self,
+        workers: int = REFUND_WORKERS,
+        max_attempts: int = REFUND_MAX_ATTEMPTS,
+        retention: int = REFUND_JOB_RETENTION,
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.jobs: "OrderedDict[str, RefundJob]" = OrderedDict()
+        self._items: Deque[Tuple[RefundJob, Dict[str, Any]]] = deque()
+        self._workers: Set[asyncio.Task] = set()
+
+    def submit(self, items: List[Dict[str, Any]], reason: str) -> RefundJob:
+        """
+        Queue a bulk refund and start workers as needed.
+
+        Args:
+            items: Dicts with payment_id and an optional amount (default:
+                what is left to refund)
+            reason: Refund reason recorded on every refund
+
+        Returns:
+            The new job
+        """
+        job = RefundJob(job_id=str(uuid.uuid4()), reason=reason, total=len(items))
+        self.jobs[job.job_id] = job
+        self._items.extend((job, item) for item in items)
+        self._evict()
+        if not items:
+            self._finish(job)
+        while len(self._workers) < min(self.workers, len(self._items)):
+            task = asyncio.create_task(self._work())
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[RefundJob]:
+        return self.jobs.get(job_id)
+
+    def _evict(self):
+        finished = [
+            job_id for job_id, job in self.jobs.items() if job.status == FINISHED
+        ]
+        for job_id in finished[: max(0, len(self.jobs) - self.retention)]:
+            del self.jobs[job_id]
+
+    def _finish(self, job: RefundJob):
+        job.status = FINISHED
+        job.finished_at = datetime.now()
+        print(
+            f"Bulk refund {job.job_id} finished: {job.succeeded} refunded, "
+            f"{job.failed} failed"
+        )
+
+    async def _work(self):
+        while self._items:
+            job, item = self._items.popleft()
+            try:
+                refund = await self._refund(job, item)
+            except Exception as e:
+                job.failed += 1
+                job.errors.append({"payment_id": item["payment_id"], "error": str(e)})
+            else:
+                if refund["status"] == "completed":
+                    job.succeeded += 1
+                    job.refunded_amount = round(
+                        job.refunded_amount + refund["amount"], 2
+                    )
+                else:
+                    job.failed += 1
+                    job.errors.append(
+                        {
+                            "payment_id": item["payment_id"],
+                            "error": f"Refund {refund['status']} by gateway",
+                        }
+                    )
+            if job.processed == job.total:
+                self._finish(job)
+
+    async def _refund(self, job: RefundJob, item: Dict[str, Any]) -> Dict[str, Any]:
+        payment = await ledger.get_payment(item["payment_id"])
+        if not payment:
+            raise RefundRejectedError("Payment not found", not_found=True)
+        refund = await request_refund(
+            item["payment_id"], payment["user_id"], job.reason, item.get("amount")
+        )
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await execute_refund(refund)
+            except GatewayUnavailableError as e:
+                if attempt == self.max_attempts:
+                    await fail_refund(refund, str(e))
+                    raise
+                await asyncio.sleep(max(e.retry_after, 0.1 * 2**attempt))
+
+    async def stop(self):
+        """Cancel the workers; queued items are dropped, refunds stay in the ledger."""
+        for task in list(self._workers):
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._items.clear()
+
+
+# Global instance
+bulk_refunds = BulkRefundQueue()
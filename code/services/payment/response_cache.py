@@ -0,0 +1,67 @@
+"""
+In-process response cache for Payment service.
+
+Entries are kept in LRU order and carry tags (e.g. the order and user a page
+of payments belongs to). Writes invalidate every entry with a matching tag, so
+cached responses never outlive the data they were built from.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+
+
+class ResponseCache:
+    """Bounded LRU cache with tag-based invalidation."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        self._entry_tags: Dict[Hashable, Iterable[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, tags: Iterable[Hashable] = ()):
+        """Cache a value; it is dropped when any of its tags is invalidated."""
+        self._drop(key)
+        self._entries[key] = value
+        self._entry_tags[key] = tuple(tags)
+        for tag in self._entry_tags[key]:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def invalidate(self, *tags: Hashable):
+        """Drop all entries carrying any of the given tags."""
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+
+    def _drop(self, key: Hashable):
+        if self._entries.pop(key, None) is None:
+            return
+        for tag in self._entry_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Global instance
+response_cache = ResponseCache()
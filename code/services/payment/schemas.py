@@ -3,7 +3,7 @@ Pydantic schemas for Payment service.
 """
 
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -29,7 +29,7 @@ class RequestRefundRequest(BaseModel):
     payment_id: str
     user_id: str
     reason: str = Field(..., max_length=500)
-    amount: Optional[float] = Field(None, ge=0)
+    amount: Optional[float] = Field(None, gt=0)  # default: all that is left
 
 
 class ProcessRefundRequest(BaseModel):
@@ -53,7 +53,9 @@ class PaymentResponse(BaseModel):
     order_id: str
     user_id: str
     amount: float
-    status: str  # initiated, processing, completed, declined, refunded
+    # initiated, processing, completed, declined, partially_refunded, refunded
+    status: str
+    refunded_amount: float = 0.0
     payment_method: str
     transaction_id: Optional[str]
     created_at: datetime
@@ -69,10 +71,71 @@ class RefundResponse(BaseModel):
     payment_id: str
     user_id: str
     amount: float
-    status: str  # requested, processing, completed, declined
+    status: str  # requested, processing, completed, declined, failed
     reason: str
     transaction_id: Optional[str]
     created_at: datetime
     completed_at: Optional[datetime]
 
     model_config = {"from_attributes": True}
+
+
+class PaymentListResponse(BaseModel):
+    """Response schema for a page of payments."""
+
+    items: List[PaymentResponse]
+    next_cursor: Optional[str]  # pass back as ?cursor= for the next page
+
+
+class ReceiptResponse(BaseModel):
+    """Response schema for a fiscal receipt."""
+
+    receipt_id: str
+    kind: str  # income, income_return
+    payment_id: str
+    refund_id: Optional[str]
+    amount: float
+    status: str  # queued, accepted, rejected, failed
+    fiscal_sign: Optional[str]
+    attempts: int
+    last_error: Optional[str]
+    created_at: datetime
+    sent_at: Optional[datetime]
+
+
+class BulkRefundItem(BaseModel):
+    """One payment to refund in a bulk refund."""
+
+    payment_id: str
+    amount: Optional[float] = Field(None, gt=0)  # default: all that is left
+
+
+class BulkRefundRequest(BaseModel):
+    """Request schema for refunding many payments at once."""
+
+    items: List[BulkRefundItem] = Field(..., min_length=1, max_length=10000)
+    reason: str = Field(..., max_length=500)
+
+
+class BulkRefundError(BaseModel):
+    """A bulk refund item that could not be refunded."""
+
+    payment_id: str
+    error: str
+
+
+class BulkRefundJobResponse(BaseModel):
+    """Response schema for bulk refund progress."""
+
+    job_id: str
+    status: str  # running, finished
+    total: int
+    processed: int
+    succeeded: int
+    failed: int
+    refunded_amount: float
+    created_at: datetime
+    finished_at: Optional[datetime]
+    errors: List[BulkRefundError]
+
+    model_config = {"from_attributes": True}
@@ -0,0 +1,12 @@
+"""Pytest configuration for Payment service tests."""
+
+import os
+import sys
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the ledger in memory (must be set before the ledger module is imported)
+os.environ.setdefault("PAYMENT_DB_PATH", ":memory:")
+# Tests reuse user ids freely; velocity rules are tested explicitly
+os.environ.setdefault("VELOCITY_RULES", "")
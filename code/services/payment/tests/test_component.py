@@ -3,11 +3,15 @@
 These tests verify payment processing with mocked payment gateway.
 """
 
+import time
+
 import pytest
 from unittest.mock import AsyncMock, patch
 from fastapi.testclient import TestClient
 
+from gateway_client import GatewayUnavailableError
 from main import app
+from velocity import VelocityChecker, parse_rules
 
 
 @pytest.fixture
@@ -19,7 +23,7 @@ def client():
 @pytest.fixture
 def mock_payment_gateway():
     """Mock payment gateway."""
-    with patch("main.payment_gateway") as mock:
+    with patch("payments.payment_gateway") as mock:
         yield mock
 
 
@@ -117,7 +121,7 @@ class TestPaymentComponent:
         payment_id = initiate_response.json()["payment_id"]
 
         # Mock successful payment
-        with patch("main.payment_gateway") as mock_gateway:
+        with patch("payments.payment_gateway") as mock_gateway:
             mock_gateway.process_payment = AsyncMock(
                 return_value={"transaction_id": "TXN-123", "status": "completed"}
             )
@@ -142,6 +146,46 @@ class TestPaymentComponent:
         assert data["status"] == "requested"
         assert data["reason"] == "Order cancellation"
 
+    def test_refund_of_nothing_is_rejected(self, client, mock_payment_gateway):
+        """Test that a zero refund or one of a fully refunded payment is rejected."""
+        payment_id = client.post(
+            "/api/v1/payments",
+            json={
+                "order_id": "order-zero",
+                "user_id": "user-zero",
+                "amount": 200.0,
+                "payment_method": "card",
+            },
+        ).json()["payment_id"]
+        mock_payment_gateway.process_payment = AsyncMock(
+            return_value={"transaction_id": "TXN-Z", "status": "completed"}
+        )
+        client.post(
+            f"/api/v1/payments/{payment_id}/process",
+            json={"payment_id": payment_id, "transaction_id": "TXN-Z"},
+        )
+        refund = {"payment_id": payment_id, "user_id": "user-zero", "reason": "Test"}
+
+        response = client.post("/api/v1/refunds", json={**refund, "amount": 0})
+        assert response.status_code == 422
+
+        refund_id = client.post("/api/v1/refunds", json=refund).json()["refund_id"]
+        with (
+            patch("refunds.payment_gateway") as refunds_gw,
+            patch("refunds.publish_event", AsyncMock()),
+        ):
+            refunds_gw.process_refund = AsyncMock(
+                return_value={"transaction_id": "REF-Z", "status": "completed"}
+            )
+            response = client.post(
+                f"/api/v1/refunds/{refund_id}/process",
+                json={"refund_id": refund_id, "transaction_id": "REF-Z"},
+            )
+        assert response.json()["status"] == "completed"
+
+        response = client.post("/api/v1/refunds", json=refund)
+        assert response.status_code == 400
+
     def test_get_payment(self, client):
         """Test getting payment information."""
         # Create payment
@@ -162,3 +206,242 @@ class TestPaymentComponent:
         data = response.json()
         assert data["payment_id"] == payment_id
         assert data["amount"] == 1000.0
+
+    def test_list_order_and_user_payments(self, client, mock_payment_gateway):
+        """Test listing payments by order and user with cursor pagination."""
+        payment_ids = []
+        for _ in range(3):
+            response = client.post(
+                "/api/v1/payments",
+                json={
+                    "order_id": "order-list",
+                    "user_id": "user-list",
+                    "amount": 500.0,
+                    "payment_method": "card",
+                },
+            )
+            payment_ids.append(response.json()["payment_id"])
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/api/v1/users/user-list/payments", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            seen.extend(payment["payment_id"] for payment in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert sorted(seen) == sorted(payment_ids)
+        assert len(seen) == 3
+
+        # Cached order page is invalidated when a payment changes
+        mock_payment_gateway.process_payment = AsyncMock(
+            return_value={"transaction_id": "TXN-1", "status": "declined"}
+        )
+        for payment_id in payment_ids:
+            client.post(
+                f"/api/v1/payments/{payment_id}/process",
+                json={"payment_id": payment_id, "transaction_id": "TXN-1"},
+            )
+        first = client.get("/api/v1/orders/order-list/payments").json()
+        assert {p["status"] for p in first["items"]} == {"declined"}
+
+        mock_payment_gateway.process_payment = AsyncMock(
+            return_value={"transaction_id": "TXN-2", "status": "completed"}
+        )
+        client.post(
+            "/api/v1/payments",
+            json={
+                "order_id": "order-list",
+                "user_id": "user-list",
+                "amount": 100.0,
+                "payment_method": "card",
+            },
+        )
+        second = client.get("/api/v1/orders/order-list/payments").json()
+        assert len(second["items"]) == 4
+
+        invalid = client.get(
+            "/api/v1/orders/order-list/payments", params={"cursor": "bad"}
+        )
+        assert invalid.status_code == 400
+
+    def test_process_payment_gateway_unavailable(self, client, mock_payment_gateway):
+        """Test that a degraded gateway returns 503 and keeps the payment open."""
+        payment_id = client.post(
+            "/api/v1/payments",
+            json={
+                "order_id": "order-503",
+                "user_id": "user-503",
+                "amount": 500.0,
+                "payment_method": "card",
+            },
+        ).json()["payment_id"]
+
+        mock_payment_gateway.process_payment = AsyncMock(
+            side_effect=GatewayUnavailableError("acquiring gateway is unavailable", 4.2)
+        )
+        response = client.post(
+            f"/api/v1/payments/{payment_id}/process",
+            json={"payment_id": payment_id, "transaction_id": ""},
+        )
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "4"
+
+        payment = client.get(f"/api/v1/payments/{payment_id}").json()
+        assert payment["status"] == "initiated"
+
+    def test_processed_payment_is_not_processed_again(
+        self, client, mock_payment_gateway
+    ):
+        """Test that re-processing a payment is rejected and fiscalizes it once."""
+        payment_id = client.post(
+            "/api/v1/payments",
+            json={
+                "order_id": "order-twice",
+                "user_id": "user-twice",
+                "amount": 300.0,
+                "payment_method": "card",
+            },
+        ).json()["payment_id"]
+        mock_payment_gateway.process_payment = AsyncMock(
+            return_value={"transaction_id": "TXN-T1", "status": "completed"}
+        )
+        request = {"payment_id": payment_id, "transaction_id": "TXN-T1"}
+
+        assert (
+            client.post(f"/api/v1/payments/{payment_id}/process", json=request)
+        ).status_code == 200
+        response = client.post(f"/api/v1/payments/{payment_id}/process", json=request)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Payment is already completed"
+
+        mock_payment_gateway.process_payment.assert_awaited_once()
+        receipts = client.get(f"/api/v1/payments/{payment_id}/receipts").json()
+        assert [r["kind"] for r in receipts] == ["income"]
+
+    def test_gateway_metrics(self, client):
+        """Test the gateway client metrics endpoint."""
+        response = client.get("/api/v1/gateway/metrics")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["breaker_state"] == "closed"
+        assert data["concurrency_limit"] > 0
+
+    def test_completed_payment_gets_queued_receipt(self, client, mock_payment_gateway):
+        """Test that a completed payment stores a fiscal receipt for the OFD."""
+        payment_id = client.post(
+            "/api/v1/payments",
+            json={
+                "order_id": "order-receipt",
+                "user_id": "user-receipt",
+                "amount": 750.0,
+                "payment_method": "card",
+            },
+        ).json()["payment_id"]
+        mock_payment_gateway.process_payment = AsyncMock(
+            return_value={"transaction_id": "TXN-R1", "status": "completed"}
+        )
+        client.post(
+            f"/api/v1/payments/{payment_id}/process",
+            json={"payment_id": payment_id, "transaction_id": "TXN-R1"},
+        )
+
+        response = client.get(f"/api/v1/payments/{payment_id}/receipts")
+        assert response.status_code == 200
+        receipts = response.json()
+        assert len(receipts) == 1
+        assert receipts[0]["kind"] == "income"
+        assert receipts[0]["amount"] == 750.0
+        assert receipts[0]["status"] == "queued"
+
+        response = client.get(f"/api/v1/receipts/{receipts[0]['receipt_id']}")
+        assert response.status_code == 200
+        assert response.json()["payment_id"] == payment_id
+        assert client.get("/api/v1/receipts/unknown").status_code == 404
+
+    def test_bulk_refund(self, mock_payment_gateway):
+        """Test refunding many payments as one job with progress."""
+        mock_payment_gateway.process_payment = AsyncMock(
+            return_value={"transaction_id": "TXN-B", "status": "completed"}
+        )
+        # The lifespan keeps one event loop for the whole test; keep broker
+        # connection attempts out of it
+        with (
+            patch("main.publish_event", AsyncMock()),
+            patch("payments.publish_event", AsyncMock()),
+            patch("refunds.publish_event", AsyncMock()),
+            patch("refunds.payment_gateway") as refunds_gw,
+            TestClient(app) as client,
+        ):
+            refunds_gw.process_refund = AsyncMock(
+                return_value={"transaction_id": "REF-B", "status": "completed"}
+            )
+            payment_ids = []
+            for _ in range(5):
+                payment_id = client.post(
+                    "/api/v1/payments",
+                    json={
+                        "order_id": "order-bulk",
+                        "user_id": "user-bulk",
+                        "amount": 300.0,
+                        "payment_method": "card",
+                    },
+                ).json()["payment_id"]
+                client.post(
+                    f"/api/v1/payments/{payment_id}/process",
+                    json={"payment_id": payment_id, "transaction_id": "TXN-B"},
+                )
+                payment_ids.append(payment_id)
+
+            items = [{"payment_id": payment_id} for payment_id in payment_ids[:3]]
+            items += [
+                {"payment_id": payment_ids[3], "amount": 100.0},
+                {"payment_id": payment_ids[4], "amount": 500.0},
+                {"payment_id": "unknown"},
+            ]
+            response = client.post(
+                "/api/v1/refunds/bulk", json={"items": items, "reason": "Store closed"}
+            )
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+
+            for _ in range(100):
+                job = client.get(f"/api/v1/refunds/bulk/{job_id}").json()
+                if job["status"] == "finished":
+                    break
+                time.sleep(0.02)
+            assert job["status"] == "finished"
+            assert job["processed"] == job["total"] == 6
+            assert job["succeeded"] == 4
+            assert job["refunded_amount"] == 1000.0
+            assert sorted(e["payment_id"] for e in job["errors"]) == sorted(
+                [payment_ids[4], "unknown"]
+            )
+
+            partial = client.get(f"/api/v1/payments/{payment_ids[3]}").json()
+            assert partial["status"] == "partially_refunded"
+            assert partial["refunded_amount"] == 100.0
+            full = client.get(f"/api/v1/payments/{payment_ids[0]}").json()
+            assert full["status"] == "refunded"
+
+    def test_initiate_payment_velocity_limit(self, client):
+        """Test that too many payments in a window are rejected with 429."""
+        checker = VelocityChecker(parse_rules("count:2/60"))
+        with patch("payments.velocity_checker", checker):
+            request = {
+                "order_id": "order-velocity",
+                "user_id": "user-velocity",
+                "amount": 100.0,
+                "payment_method": "card",
+            }
+            for _ in range(2):
+                assert client.post("/api/v1/payments", json=request).status_code == 201
+            response = client.post("/api/v1/payments", json=request)
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 1
+            assert "count:2/60" in response.json()["detail"]
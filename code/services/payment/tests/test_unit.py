@@ -0,0 +1,814 @@
+"""Unit tests for Payment service components."""
+
+import asyncio
+import sqlite3
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import grpc
+import pytest
+
+from gateway_client import (
+    AIMDLimiter,
+    CircuitBreaker,
+    GatewayClient,
+    GatewayUnavailableError,
+)
+from grpc_server import PaymentServiceServicer
+from ledger import Ledger, RefundLimitExceededError, from_minor, to_minor
+from ofd import SALE, MockOFDEndpoint, ReceiptPipeline, render_receipt
+from payment_gateway import GatewayError, MockPaymentGateway
+from reconciliation import UnsortedInputError, main as reconcile_main, reconcile
+from refunds import BulkRefundQueue, RefundRejectedError, execute_refund
+from response_cache import ResponseCache
+from velocity import VelocityChecker, parse_rules
+
+
+def make_payment(payment_id, order_id="order-1", user_id="user-1", amount=100.0):
+    return {
+        "payment_id": payment_id,
+        "order_id": order_id,
+        "user_id": user_id,
+        "amount": amount,
+        "status": "initiated",
+        "payment_method": "card",
+        "transaction_id": None,
+        "created_at": datetime(2024, 6, 1, 12, 0),
+        "completed_at": None,
+    }
+
+
+class TestLedger:
+    def test_minor_units(self):
+        assert to_minor(1000.0) == 100000
+        assert to_minor(0.1 + 0.2) == 30
+        assert to_minor(19.995) == 2000
+        assert from_minor(31500) == 315.0
+
+    @pytest.mark.asyncio
+    async def test_group_commits_concurrent_writes(self):
+        ledger = Ledger(":memory:")
+        await asyncio.gather(
+            *(ledger.add_payment(make_payment(f"pay-{i}")) for i in range(200))
+        )
+        assert ledger.operations == 200
+        assert ledger.commits < 200
+
+        payments = await ledger.payments_by_order("order-1", limit=500)
+        assert len(payments) == 200
+        assert payments[0]["amount"] == 100.0
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_operation_does_not_affect_batch(self):
+        ledger = Ledger(":memory:")
+        results = await asyncio.gather(
+            ledger.add_payment(make_payment("pay-1")),
+            ledger.add_payment(make_payment("pay-1")),
+            ledger.add_payment(make_payment("pay-2")),
+            return_exceptions=True,
+        )
+        assert isinstance(results[1], sqlite3.IntegrityError)
+        assert await ledger.get_payment("pay-2") is not None
+        # The duplicate left no ledger entry behind
+        assert len(await ledger.entries("pay-1")) == 1
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_updates_are_durable_and_append_entries(self, tmp_path):
+        path = str(tmp_path / "payment.db")
+        ledger = Ledger(path)
+        await ledger.add_payment(make_payment("pay-1", amount=315.5))
+        await ledger.update_payment("pay-1", status="completed", transaction_id="TXN-1")
+        await ledger.add_refund(
+            {
+                "refund_id": "ref-1",
+                "payment_id": "pay-1",
+                "user_id": "user-1",
+                "amount": 315.5,
+                "status": "requested",
+                "reason": "Order cancellation",
+                "transaction_id": None,
+                "created_at": datetime(2024, 6, 2),
+                "completed_at": None,
+            }
+        )
+        await ledger.update_refund("ref-1", status="completed")
+        assert await ledger.update_payment("missing", status="completed") is None
+        ledger.close()
+
+        reopened = Ledger(path)
+        payment = await reopened.get_payment("pay-1")
+        assert payment["status"] == "refunded"
+        assert payment["amount"] == 315.5
+        assert [entry["status"] for entry in await reopened.entries("pay-1")] == [
+            "initiated",
+            "completed",
+            "requested",
+            "completed",
+        ]
+        assert (await reopened.payments_by_user("user-1"))[0]["payment_id"] == "pay-1"
+        reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_lists_payments_newest_first_after_cursor(self):
+        ledger = Ledger(":memory:")
+        for i in range(5):
+            payment = make_payment(f"pay-{i}", user_id="user-1" if i != 2 else "x")
+            # Two payments share a timestamp to exercise the tiebreaker
+            payment["created_at"] = datetime(2024, 6, 1, 12, min(i, 3))
+            await ledger.add_payment(payment)
+
+        first = await ledger.payments_by_user("user-1", limit=2)
+        assert [p["payment_id"] for p in first] == ["pay-4", "pay-3"]
+        last = first[-1]
+        rest = await ledger.payments_by_user(
+            "user-1", after=(last["created_at"], last["payment_id"])
+        )
+        assert [p["payment_id"] for p in rest] == ["pay-1", "pay-0"]
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_notifies_listeners_on_payment_changes(self):
+        ledger = Ledger(":memory:")
+        changed = []
+        ledger.listeners.append(lambda payment: changed.append(payment["status"]))
+        await ledger.add_payment(make_payment("pay-1"))
+        await ledger.update_payment("pay-1", status="completed")
+        await ledger.add_refund(
+            {
+                "refund_id": "ref-1",
+                "payment_id": "pay-1",
+                "user_id": "user-1",
+                "amount": 100.0,
+                "status": "requested",
+                "reason": "Order cancellation",
+                "transaction_id": None,
+                "created_at": datetime(2024, 6, 2),
+                "completed_at": None,
+            }
+        )
+        await ledger.update_refund("ref-1", status="completed")
+        assert changed == ["initiated", "completed", "refunded"]
+        ledger.close()
+
+
+def make_refund(refund_id, payment_id="pay-1", amount=100.0):
+    return {
+        "refund_id": refund_id,
+        "payment_id": payment_id,
+        "user_id": "user-1",
+        "amount": amount,
+        "status": "requested",
+        "reason": "Store closure",
+        "transaction_id": None,
+        "created_at": datetime(2024, 6, 2),
+        "completed_at": None,
+    }
+
+
+class TestPartialRefunds:
+    @pytest.mark.asyncio
+    async def test_refunds_never_exceed_payment_amount(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1", amount=100.0))
+        await ledger.update_payment("pay-1", status="completed")
+
+        results = await asyncio.gather(
+            *(
+                ledger.add_refund(make_refund(f"ref-{i}", amount=40.0))
+                for i in range(3)
+            ),
+            return_exceptions=True,
+        )
+        rejected = [r for r in results if isinstance(r, RefundLimitExceededError)]
+        assert len(rejected) == 1
+        assert rejected[0].available == 20.0
+
+        await ledger.update_refund("ref-0", status="completed")
+        await ledger.update_refund("ref-0", status="completed")
+        payment = await ledger.get_payment("pay-1")
+        assert payment["status"] == "partially_refunded"
+        assert payment["refunded_amount"] == 40.0
+
+        # A declined refund frees its amount again
+        await ledger.update_refund("ref-1", status="declined")
+        await ledger.add_refund(make_refund("ref-3", amount=60.0))
+        await ledger.update_refund("ref-3", status="completed")
+        payment = await ledger.get_payment("pay-1")
+        assert payment["status"] == "refunded"
+        assert payment["refunded_amount"] == 100.0
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_rejects_refund_of_nothing(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1", amount=100.0))
+        await ledger.update_payment("pay-1", status="completed")
+
+        for amount in (0.0, 0.004):
+            with pytest.raises(ValueError):
+                await ledger.add_refund(make_refund("ref-1", amount=amount))
+        assert await ledger.refunds_by_payment("pay-1") == []
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_gateway_result_does_not_overwrite_refunded_payment(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1", amount=100.0))
+        await ledger.update_payment("pay-1", status="completed")
+        await ledger.add_refund(make_refund("ref-1", amount=100.0))
+        await ledger.update_refund("ref-1", status="completed")
+
+        assert await ledger.move_payment("pay-1", "initiated", "processing") is None
+        updated = await ledger.update_payment(
+            "pay-1", from_status="processing", status="completed"
+        )
+        assert updated is None
+        payment = await ledger.get_payment("pay-1")
+        assert payment["status"] == "refunded"
+        assert payment["refunded_amount"] == 100.0
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_adds_refunded_column_to_existing_ledger(self, tmp_path):
+        path = str(tmp_path / "payment.db")
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "CREATE TABLE payments (payment_id TEXT PRIMARY KEY, order_id TEXT, "
+            "user_id TEXT, amount_minor INTEGER, status TEXT, payment_method TEXT, "
+            "transaction_id TEXT, created_at TEXT, completed_at TEXT)"
+        )
+        connection.execute(
+            "INSERT INTO payments VALUES ('pay-1', 'order-1', 'user-1', 10000, "
+            "'completed', 'card', 'TXN-1', '2024-06-01T12:00:00', NULL)"
+        )
+        connection.commit()
+        connection.close()
+
+        ledger = Ledger(path)
+        payment = await ledger.get_payment("pay-1")
+        assert payment["refunded_amount"] == 0.0
+        ledger.close()
+
+
+class TestRefundExecution:
+    @pytest.mark.asyncio
+    async def test_concurrent_executions_refund_once(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1", amount=100.0))
+        await ledger.update_payment("pay-1", status="completed")
+        refund = await ledger.add_refund(make_refund("ref-1", amount=100.0))
+
+        async def process_refund(refund_id, payment_id, amount):
+            await asyncio.sleep(0.01)
+            return {"transaction_id": "REF-1", "status": "completed"}
+
+        gateway = AsyncMock()
+        gateway.process_refund = AsyncMock(side_effect=process_refund)
+        with (
+            patch("refunds.ledger", ledger),
+            patch("refunds.payment_gateway", gateway),
+            patch("refunds.publish_event", AsyncMock()),
+        ):
+            results = await asyncio.gather(
+                execute_refund(refund), execute_refund(refund), return_exceptions=True
+            )
+
+        assert gateway.process_refund.await_count == 1
+        assert sum(isinstance(r, RefundRejectedError) for r in results) == 1
+        payment = await ledger.get_payment("pay-1")
+        assert payment["refunded_amount"] == 100.0
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_unavailable_gateway_returns_claim(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1"))
+        await ledger.update_payment("pay-1", status="completed")
+        refund = await ledger.add_refund(make_refund("ref-1"))
+
+        gateway = AsyncMock()
+        gateway.process_refund = AsyncMock(side_effect=GatewayUnavailableError("down"))
+        with (
+            patch("refunds.ledger", ledger),
+            patch("refunds.payment_gateway", gateway),
+        ):
+            with pytest.raises(GatewayUnavailableError):
+                await execute_refund(refund)
+        assert (await ledger.get_refund("ref-1"))["status"] == "requested"
+
+        # Interrupted by a restart: processing again on startup
+        await ledger.move_refund("ref-1", "requested", "processing")
+        assert await ledger.release_processing_refunds() == 1
+        assert (await ledger.get_refund("ref-1"))["status"] == "requested"
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_exhausted_retries_fail_refund_and_free_amount(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1", amount=100.0))
+        await ledger.update_payment("pay-1", status="completed")
+
+        gateway = AsyncMock()
+        gateway.process_refund = AsyncMock(
+            side_effect=GatewayUnavailableError("down", retry_after=0)
+        )
+        queue = BulkRefundQueue(workers=1, max_attempts=2)
+        with (
+            patch("refunds.ledger", ledger),
+            patch("refunds.payment_gateway", gateway),
+            patch("refunds.publish_event", AsyncMock()) as publish,
+        ):
+            job = queue.submit([{"payment_id": "pay-1"}], "Store closed")
+            while job.status != "finished":
+                await asyncio.sleep(0.01)
+
+        assert job.failed == 1
+        assert gateway.process_refund.await_count == 2
+        [refund] = await ledger.refunds_by_payment("pay-1")
+        assert refund["status"] == "failed"
+        assert publish.call_args.args[1]["status"] == "failed"
+        # The failed refund no longer reserves the payment amount
+        await ledger.add_refund(make_refund("ref-2", amount=100.0))
+        ledger.close()
+
+
+# Stand-in for the generated payment_pb2 module
+payment_pb2 = SimpleNamespace(
+    InitiatePaymentResponse=lambda **fields: fields,
+    ProcessPaymentResponse=lambda **fields: fields,
+)
+
+
+class TestGrpcServicer:
+    @pytest.mark.asyncio
+    async def test_initiate_payment_applies_velocity_limits(self):
+        ledger = Ledger(":memory:")
+        servicer = PaymentServiceServicer(ledger)
+        request = SimpleNamespace(
+            order_id="order-1", user_id="user-1", amount=100.0, payment_method="card"
+        )
+        context = MagicMock()
+        with (
+            patch.dict(sys.modules, {"payment_pb2": payment_pb2}),
+            patch("payments.ledger", ledger),
+            patch(
+                "payments.velocity_checker", VelocityChecker(parse_rules("count:1/60"))
+            ),
+            patch("payments.publish_event", AsyncMock()) as publish,
+        ):
+            first = await servicer.InitiatePayment(request, MagicMock())
+            second = await servicer.InitiatePayment(request, context)
+
+        assert (await ledger.get_payment(first["payment_id"]))["status"] == "initiated"
+        assert publish.call_args.args[0] == "payment.initiated"
+        assert second == {}
+        context.set_code.assert_called_once_with(grpc.StatusCode.RESOURCE_EXHAUSTED)
+        assert "count:1/60" in context.set_details.call_args.args[0]
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_process_payment_matches_rest(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1", amount=100.0))
+        gateway = AsyncMock()
+        gateway.process_payment = AsyncMock(
+            return_value={"transaction_id": "TXN-1", "status": "completed"}
+        )
+        servicer = PaymentServiceServicer(ledger)
+        request = SimpleNamespace(payment_id="pay-1")
+        with (
+            patch.dict(sys.modules, {"payment_pb2": payment_pb2}),
+            patch("payments.ledger", ledger),
+            patch("payments.payment_gateway", gateway),
+            patch("payments.receipt_pipeline") as pipeline,
+            patch("payments.publish_event", AsyncMock()) as publish,
+        ):
+            response = await servicer.ProcessPayment(request, MagicMock())
+            again_context = MagicMock()
+            await servicer.ProcessPayment(request, again_context)
+
+        assert response["status"] == "completed"
+        assert response["transaction_id"] == "TXN-1"
+        [receipt] = await ledger.receipts_by_payment("pay-1")
+        pipeline.enqueue.assert_called_once()
+        assert publish.call_args.args[0] == "payment.successful"
+        # Processed once: the second call is rejected before the gateway
+        gateway.process_payment.assert_awaited_once()
+        again_context.set_code.assert_called_once_with(
+            grpc.StatusCode.FAILED_PRECONDITION
+        )
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_process_payment_gateway_unavailable(self):
+        ledger = Ledger(":memory:")
+        await ledger.add_payment(make_payment("pay-1"))
+        gateway = AsyncMock()
+        gateway.process_payment = AsyncMock(
+            side_effect=GatewayUnavailableError("down", retry_after=3)
+        )
+        context = MagicMock()
+        with (
+            patch.dict(sys.modules, {"payment_pb2": payment_pb2}),
+            patch("payments.ledger", ledger),
+            patch("payments.payment_gateway", gateway),
+        ):
+            await PaymentServiceServicer(ledger).ProcessPayment(
+                SimpleNamespace(payment_id="pay-1"), context
+            )
+
+        context.set_code.assert_called_once_with(grpc.StatusCode.UNAVAILABLE)
+        context.set_trailing_metadata.assert_called_once_with((("retry-after", "3"),))
+        assert (await ledger.get_payment("pay-1"))["status"] == "initiated"
+        ledger.close()
+
+
+class TestResponseCache:
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert len(cache) == 2
+
+    def test_invalidates_by_tag(self):
+        cache = ResponseCache()
+        cache.put(("order", "o1", None, 20), "page-1", tags=[("order", "o1")])
+        cache.put(("order", "o1", "c", 20), "page-2", tags=[("order", "o1")])
+        cache.put(("order", "o2", None, 20), "other", tags=[("order", "o2")])
+        cache.invalidate(("order", "o1"))
+        assert cache.get(("order", "o1", None, 20)) is None
+        assert cache.get(("order", "o1", "c", 20)) is None
+        assert cache.get(("order", "o2", None, 20)) == "other"
+
+
+async def complete_with_receipt(ledger, payment_id, amount=100.0):
+    await ledger.add_payment(make_payment(payment_id, amount=amount))
+    receipt = render_receipt(
+        SALE, payment_id, "user-1", amount, f"TXN-{payment_id}", order_id="order-1"
+    )
+    await ledger.update_payment(payment_id, receipt=receipt, status="completed")
+    return receipt
+
+
+class TestReceiptPipeline:
+    @pytest.mark.asyncio
+    async def test_sends_in_batches_and_records_each_result(self):
+        ledger = Ledger(":memory:")
+        endpoint = MockOFDEndpoint(latency=0, latency_per_receipt=0)
+        pipeline = ReceiptPipeline(ledger, endpoint, batch_size=2)
+        receipts = [
+            await complete_with_receipt(ledger, f"pay-{i}", amount=100.0 * i)
+            for i in range(5)
+        ]
+        for receipt in receipts:
+            pipeline.enqueue(receipt)
+
+        assert await pipeline.flush() == 5
+        assert endpoint.batches == 3
+        stored = [await ledger.get_receipt(r["receipt_id"]) for r in receipts]
+        # Zero total is rejected by the OFD, the rest get a fiscal sign
+        assert stored[0]["status"] == "rejected"
+        assert stored[0]["last_error"]
+        assert all(r["status"] == "accepted" and r["fiscal_sign"] for r in stored[1:])
+        assert stored[1]["document"]["total"] == 100.0
+        assert pipeline.metrics()["accepted"] == 4
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_batches_are_retried_then_marked_failed(self):
+        ledger = Ledger(":memory:")
+        endpoint = MockOFDEndpoint(latency=0, latency_per_receipt=0, failure_rate=1)
+        pipeline = ReceiptPipeline(ledger, endpoint, max_attempts=3, retry_base_delay=0)
+        receipt = await complete_with_receipt(ledger, "pay-1")
+        pipeline.enqueue(receipt)
+
+        await pipeline.flush()
+        stored = await ledger.get_receipt(receipt["receipt_id"])
+        assert stored["status"] == "failed"
+        assert stored["attempts"] == 3
+        assert stored["last_error"] == "OFD service unavailable"
+        assert pipeline.metrics()["failed_batches"] == 3
+        ledger.close()
+
+    @pytest.mark.asyncio
+    async def test_reloads_receipts_left_queued(self, tmp_path):
+        path = str(tmp_path / "payment.db")
+        ledger = Ledger(path)
+        receipt = await complete_with_receipt(ledger, "pay-1")
+        ledger.close()
+
+        ledger = Ledger(path)
+        pipeline = ReceiptPipeline(
+            ledger, MockOFDEndpoint(latency=0, latency_per_receipt=0)
+        )
+        assert await pipeline.reload() == 1
+        assert await pipeline.reload() == 0
+        assert await pipeline.flush() == 1
+        stored = await ledger.receipts_by_payment("pay-1")
+        assert [r["receipt_id"] for r in stored] == [receipt["receipt_id"]]
+        assert stored[0]["status"] == "accepted"
+        ledger.close()
+
+
+def txn(transaction_id, amount_minor=10000, status="completed", kind="payment"):
+    return {
+        "transaction_id": transaction_id,
+        "kind": kind,
+        "payment_id": f"pay-{transaction_id}",
+        "amount_minor": amount_minor,
+        "status": status,
+    }
+
+
+class TestReconciliation:
+    def test_reports_each_kind_of_mismatch(self):
+        ours = [
+            txn("T1"),
+            txn("T2", status="refunded"),
+            txn("T3", amount_minor=500),
+            txn("T4", status="declined"),
+            txn("T6"),
+        ]
+        theirs = [txn("T1"), txn("T2"), txn("T3"), txn("T4"), txn("T5")]
+        found = []
+        result = reconcile(ours, theirs, found.append)
+        assert [(m.transaction_id, m.mismatch) for m in found] == [
+            ("T3", "amount_mismatch"),
+            ("T4", "status_mismatch"),
+            ("T5", "missing_in_ledger"),
+            ("T6", "missing_in_provider"),
+        ]
+        assert result.matched == 2
+        assert result.ledger_rows == 5
+        assert result.provider_rows == 5
+        assert result.mismatches == 4
+
+    def test_rejects_unsorted_input(self):
+        with pytest.raises(UnsortedInputError):
+            reconcile([txn("T2"), txn("T1")], [])
+
+    @pytest.mark.asyncio
+    async def test_reconciles_ledger_file_with_settlement_report(self, tmp_path):
+        path = str(tmp_path / "payment.db")
+        ledger = Ledger(path)
+        gateway = MockPaymentGateway(latency=0, decline_rate=0)
+        for i in range(3):
+            await ledger.add_payment(make_payment(f"pay-{i}"))
+            result = await gateway.process_payment(f"pay-{i}", 100.0, "card")
+            await ledger.update_payment(f"pay-{i}", **result)
+        await ledger.add_refund(
+            {
+                "refund_id": "ref-1",
+                "payment_id": "pay-0",
+                "user_id": "user-1",
+                "amount": 100.0,
+                "status": "requested",
+                "reason": "Order cancellation",
+                "transaction_id": None,
+                "created_at": datetime(2024, 6, 2),
+                "completed_at": None,
+            }
+        )
+        result = await gateway.process_refund("ref-1", "pay-0", 100.0)
+        await ledger.update_refund("ref-1", **result)
+        ledger.close()
+
+        settlements = str(tmp_path / "settlements.csv")
+        report = str(tmp_path / "report.csv")
+        assert gateway.export_settlements(settlements) == 4
+        assert reconcile_main([settlements, "--db", path, "--output", report]) == 0
+
+        # The provider settled a payment for a different amount
+        transaction_id = min(gateway.transactions)
+        gateway.transactions[transaction_id]["amount"] = 90.0
+        gateway.export_settlements(settlements)
+        assert reconcile_main([settlements, "--db", path, "--output", report]) == 1
+        with open(report) as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 2
+        assert lines[1].startswith(f"{transaction_id},amount_mismatch,")
+
+
+class TestVelocityChecker:
+    def test_parses_rules(self):
+        count, amount = parse_rules("count:3/60, amount:1000.50/3600")
+        assert (count.metric, count.limit, count.window) == ("count", 3, 60)
+        assert (amount.metric, amount.limit) == ("amount", 100050)
+        assert str(amount) == "amount:1000.5/3600"
+        assert parse_rules("") == []
+        with pytest.raises(ValueError):
+            parse_rules("count:3")
+        with pytest.raises(ValueError):
+            parse_rules("speed:3/60")
+
+    def test_blocks_within_window_and_slides(self):
+        clock = FakeClock()
+        checker = VelocityChecker(parse_rules("count:3/60"), resolution=6, clock=clock)
+        for second in (0, 15, 30):
+            clock.now = second
+            assert checker.check("user-1", 100.0) is None
+        clock.now = 45
+        violation = checker.check("user-1", 100.0)
+        assert violation.current == 3
+        assert violation.retry_after == 15
+        # Other users are independent
+        assert checker.check("user-2", 100.0) is None
+
+        # The payment at t=0 has left the window
+        clock.now = 61
+        assert checker.check("user-1", 100.0) is None
+        assert checker.check("user-1", 100.0) is not None
+        assert checker.blocked == 2
+
+    def test_limits_amount(self):
+        clock = FakeClock()
+        checker = VelocityChecker(parse_rules("amount:1000/3600"), clock=clock)
+        assert checker.check("user-1", 600.0) is None
+        assert checker.check("user-1", 500.0) is not None
+        assert checker.check("user-1", 400.0) is None
+        clock.now = 3600
+        assert checker.check("user-1", 1000.0) is None
+
+    def test_evicts_least_recently_active_users(self):
+        checker = VelocityChecker(parse_rules("count:1/60"), max_users=2)
+        checker.check("user-1", 1.0)
+        checker.check("user-2", 1.0)
+        checker.check("user-1", 1.0)
+        checker.check("user-3", 1.0)
+        assert len(checker) == 2
+        # user-1 is still limited; user-2 was evicted and starts over
+        assert checker.check("user-1", 1.0) is not None
+        assert checker.check("user-2", 1.0) is None
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker:
+    def test_opens_on_failure_rate_and_probes_after_reset(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            failure_rate=0.5, window=4, reset_timeout=10, clock=clock
+        )
+        for success in (True, False, True, False):
+            assert breaker.allow()
+            breaker.record(success)
+        assert breaker.state == "open"
+        assert not breaker.allow()
+        assert breaker.retry_after() == 10
+
+        clock.now = 10
+        assert breaker.allow()
+        assert breaker.state == "half_open"
+        # Only one probe at a time
+        assert not breaker.allow()
+        breaker.record(False)
+        assert breaker.state == "open"
+
+        clock.now = 20
+        assert breaker.allow()
+        breaker.record(True)
+        assert breaker.state == "closed"
+
+
+class TestAIMDLimiter:
+    def test_grows_on_fast_calls_and_halves_on_slow_ones(self):
+        limiter = AIMDLimiter(initial=4, minimum=1, maximum=8, latency_target=1.0)
+        for _ in range(8):
+            limiter.in_flight += 1
+            limiter.release(0.1)
+        assert 5 < limiter.limit < 7
+        limit = limiter.limit
+        limiter.in_flight += 1
+        limiter.release(2.0)
+        assert limiter.limit == limit / 2
+        # The rest of the same congested round does not halve again
+        limiter.in_flight += 1
+        limiter.release(0.1, dropped=True)
+        assert limiter.limit == limit / 2
+
+    @pytest.mark.asyncio
+    async def test_waiters_time_out_when_no_slot_frees(self):
+        limiter = AIMDLimiter(initial=1, minimum=1, maximum=1)
+        await limiter.acquire(0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await limiter.acquire(0.05)
+        waiter = asyncio.create_task(limiter.acquire(1.0))
+        await asyncio.sleep(0)
+        limiter.release(0.1)
+        await waiter
+        assert limiter.in_flight == 1
+
+
+class TestGatewayClient:
+    @pytest.mark.asyncio
+    async def test_declines_count_as_success(self):
+        client = GatewayClient(MockPaymentGateway(latency=0, decline_rate=1.0))
+        result = await client.process_payment("pay-1", 100.0, "card")
+        assert result["status"] == "declined"
+        assert client.metrics()["succeeded"] == 1
+        assert client.breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_timeouts_open_breaker_and_fail_fast(self):
+        gateway = MockPaymentGateway(latency=1.0, decline_rate=0)
+        client = GatewayClient(
+            gateway,
+            breaker=CircuitBreaker(failure_rate=0.5, window=2, reset_timeout=30),
+            timeout=0.01,
+        )
+        for _ in range(2):
+            with pytest.raises(GatewayUnavailableError, match="timed out"):
+                await client.process_payment("pay-1", 100.0, "card")
+        with pytest.raises(GatewayUnavailableError) as exc_info:
+            await client.process_refund("ref-1", "pay-1", 100.0)
+        assert exc_info.value.retry_after > 29
+        metrics = client.metrics()
+        assert metrics["breaker_state"] == "open"
+        assert metrics["timed_out"] == 2
+        assert metrics["rejected_open"] == 1
+
+    @pytest.mark.asyncio
+    async def test_gateway_errors_are_reported_as_unavailable(self):
+        client = GatewayClient(MockPaymentGateway(latency=0, error_rate=1.0))
+        with pytest.raises(GatewayUnavailableError) as exc_info:
+            await client.process_payment("pay-1", 100.0, "card")
+        assert isinstance(exc_info.value.__cause__, GatewayError)
+        assert client.metrics()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_cancelled_wait_for_slot_gives_back_probe(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(window=1, reset_timeout=10, clock=clock)
+        breaker.record(False)
+        limiter = AIMDLimiter(initial=1, minimum=1, maximum=1)
+        client = GatewayClient(
+            MockPaymentGateway(latency=0, decline_rate=0),
+            limiter=limiter,
+            breaker=breaker,
+        )
+        await limiter.acquire(0.1)
+        clock.now = 10
+
+        # The caller goes away while the probe waits for a slot
+        waiting = asyncio.create_task(client.process_payment("pay-1", 100.0, "card"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert breaker.state == "half_open"
+
+        limiter.release(0.1)
+        result = await client.process_payment("pay-2", 100.0, "card")
+        assert result["status"] == "completed"
+        assert breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_cancelled_calls_do_not_open_breaker(self):
+        breaker = CircuitBreaker(failure_rate=0.5, window=2)
+        limiter = AIMDLimiter(initial=2, minimum=1, maximum=4)
+        client = GatewayClient(
+            MockPaymentGateway(latency=1.0, decline_rate=0),
+            limiter=limiter,
+            breaker=breaker,
+        )
+
+        # Callers go away while the provider is still working on their calls
+        for i in range(3):
+            call = asyncio.create_task(
+                client.process_payment(f"pay-{i}", 100.0, "card")
+            )
+            await asyncio.sleep(0.01)
+            call.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await call
+
+        assert breaker.state == "closed"
+        assert limiter.in_flight == 0
+        assert limiter.limit == 2
+        metrics = client.metrics()
+        assert metrics["cancelled"] == 3
+        assert metrics["failed"] == metrics["timed_out"] == 0
+
+    @pytest.mark.asyncio
+    async def test_retry_after_timeout_does_not_charge_twice(self):
+        gateway = MockPaymentGateway(latency=0, decline_rate=0)
+        first = await gateway.process_payment("pay-1", 100.0, "card")
+        # The answer was lost on the way back; the retry carries the same key
+        again = await gateway.process_payment("pay-1", 100.0, "card")
+
+        assert again == first
+        assert len(gateway.transactions) == 1
@@ -0,0 +1,193 @@
+"""
+Velocity checks for payment initiation in Payment service.
+
+Each rule limits what one user may do within a sliding window, e.g. at most
+5 payments a minute or 200000 rubles a day. Per user and rule a ring of
+`VELOCITY_RESOLUTION` buckets covers the window, with a running total, so a
+check only clears the buckets that expired since the user's last payment and
+compares the total: constant time and memory per user. Users are kept in LRU
+order and the least recently active are dropped beyond `VELOCITY_MAX_USERS`,
+which bounds total memory (an evicted user simply starts from zero).
+
+Rules are configured with `VELOCITY_RULES`, a comma-separated list of
+`<metric>:<limit>/<window seconds>` where metric is `count` or `amount`.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+from ledger import to_minor
+
+VELOCITY_RULES = os.getenv(
+    "VELOCITY_RULES", "count:5/60,count:30/3600,amount:200000/86400"
+)
+VELOCITY_MAX_USERS = int(os.getenv("VELOCITY_MAX_USERS", "100000"))
+VELOCITY_RESOLUTION = int(os.getenv("VELOCITY_RESOLUTION", "12"))
+
+COUNT = "count"
+AMOUNT = "amount"
+
+
+@dataclass(frozen=True)
+class VelocityRule:
+    """At most `limit` payments (or kopecks, for amount) per `window` seconds."""
+
+    metric: str
+    limit: int
+    window: float
+
+    def __str__(self) -> str:
+        limit = self.limit if self.metric == COUNT else self.limit / 100
+        return f"{self.metric}:{limit:g}/{self.window:g}"
+
+
+@dataclass
+class VelocityViolation:
+    """The rule a payment would break and when the user may try again."""
+
+    rule: VelocityRule
+    current: int
+    retry_after: float
+
+
+def parse_rules(spec: str) -> List[VelocityRule]:
+    """
+    Parse a VELOCITY_RULES value.
+
+    Raises:
+        ValueError: If a rule is malformed
+    """
+    rules = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        try:
+            metric, rest = part.split(":")
+            limit, window = rest.split("/")
+            limit = float(limit)
+            window = float(window)
+        except ValueError:
+            raise ValueError(f"Invalid velocity rule {part!r}") from None
+        if metric not in (COUNT, AMOUNT) or limit < 0 or window <= 0:
+            raise ValueError(f"Invalid velocity rule {part!r}")
+        rules.append(
+            VelocityRule(
+                metric, int(limit) if metric == COUNT else to_minor(limit), window
+            )
+        )
+    return rules
+
+
+class _Ring:
+    """Sliding-window sum over a fixed number of time buckets."""
+
+    __slots__ = ("values", "head", "total")
+
+    def __init__(self, resolution: int, bucket: int):
+        self.values = [0] * resolution
+        self.head = bucket
+        self.total = 0
+
+    def advance(self, bucket: int):
+        """Expire the buckets that left the window by `bucket`."""
+        steps = bucket - self.head
+        if steps <= 0:
+            return
+        size = len(self.values)
+        if steps >= size:
+            self.values = [0] * size
+            self.total = 0
+        else:
+            values = self.values
+            for b in range(self.head + 1, bucket + 1):
+                i = b % size
+                self.total -= values[i]
+                values[i] = 0
+        self.head = bucket
+
+
+class VelocityChecker:
+    """Per-user sliding-window counters checked before a payment is created."""
+
+    def __init__(
+        self,
+        rules: Optional[List[VelocityRule]] = None,
+        max_users: int = VELOCITY_MAX_USERS,
+        resolution: int = VELOCITY_RESOLUTION,
+        clock=time.monotonic,
+    ):
+        self.rules = parse_rules(VELOCITY_RULES) if rules is None else rules
+        self.max_users = max_users
+        self.resolution = resolution
+        self.clock = clock
+        self._widths = [rule.window / resolution for rule in self.rules]
+        # (rule, bucket width, counts payments rather than amounts) per rule
+        self._plan = [
+            (rule, width, rule.metric == COUNT)
+            for rule, width in zip(self.rules, self._widths)
+        ]
+        self._has_amount = any(rule.metric == AMOUNT for rule in self.rules)
+        self._users: "OrderedDict[str, List[_Ring]]" = OrderedDict()
+        self.blocked = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def check(self, user_id: str, amount: float) -> Optional[VelocityViolation]:
+        """
+        Record a payment unless it breaks a rule.
+
+        Blocked payments are not recorded, so a user can pay again as soon as
+        the window allows.
+
+        Returns:
+            The first rule the payment would break, or None if it was recorded
+        """
+        if not self._plan:
+            return None
+        now = self.clock()
+        # Float rounding is precise enough for a limit and much cheaper than
+        # to_minor on this path
+        amount_minor = round(amount * 100) if self._has_amount else 0
+
+        users = self._users
+        rings = users.get(user_id)
+        if rings is None:
+            rings = [_Ring(self.resolution, int(now / w)) for w in self._widths]
+            users[user_id] = rings
+            if len(users) > self.max_users:
+                users.popitem(last=False)
+        else:
+            users.move_to_end(user_id)
+
+        slots = []
+        for (rule, width, is_count), ring in zip(self._plan, rings):
+            bucket = int(now / width)
+            if bucket > ring.head:
+                ring.advance(bucket)
+            value = 1 if is_count else amount_minor
+            if ring.total + value > rule.limit:
+                self.blocked += 1
+                return VelocityViolation(
+                    rule, ring.total, self._retry_after(rule, ring, now)
+                )
+            slots.append((ring, bucket % self.resolution, value))
+
+        for ring, index, value in slots:
+            ring.values[index] += value
+            ring.total += value
+        return None
+
+    def _retry_after(self, rule: VelocityRule, ring: _Ring, now: float) -> float:
+        """Seconds until the oldest bucket with activity leaves the window."""
+        width = rule.window / self.resolution
+        for age in range(self.resolution - 1, -1, -1):
+            if ring.values[(ring.head - age) % self.resolution]:
+                expires = (ring.head - age + self.resolution) * width
+                return max(0.0, expires - now)
+        return 0.0
+
+
+# Global instance
+velocity_checker = VelocityChecker()
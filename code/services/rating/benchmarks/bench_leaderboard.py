@@ -0,0 +1,66 @@
+"""
+Benchmark for the rating leaderboard.
+
+Loads a catalog of games spread over categories, then applies a stream of
+rating updates (popular games rated more often) and reads top-N boards,
+reporting the cost of one update and one read.
+
+Usage:
+    python benchmarks/bench_leaderboard.py [games] [updates] [categories]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leaderboard import Leaderboard
+
+
+def main(games: int, updates: int, categories: int):
+    board = Leaderboard()
+    category_of = {f"game-{i}": f"category-{i % categories}" for i in range(games)}
+    totals = {game_id: [0, 0] for game_id in category_of}
+
+    started = time.perf_counter()
+    board.rebuild(
+        (game_id, category, 1, random.randint(1, 5))
+        for game_id, category in category_of.items()
+    )
+    rebuilt = time.perf_counter() - started
+
+    game_ids = list(category_of)
+    stream = [
+        (
+            game_ids[min(int(random.paretovariate(1.2)) - 1, games - 1)],
+            random.randint(1, 5),
+        )
+        for _ in range(updates)
+    ]
+    started = time.perf_counter()
+    for game_id, rating in stream:
+        total = totals[game_id]
+        total[0] += 1
+        total[1] += rating
+        board.update(game_id, category_of[game_id], total[0], total[1] / total[0])
+    updated = time.perf_counter() - started
+
+    reads = 10000
+    started = time.perf_counter()
+    for i in range(reads):
+        board.top(f"category-{i % categories}" if i % 2 else None, 20)
+    read = time.perf_counter() - started
+
+    print(f"{games} games in {categories} categories, {updates} rating updates")
+    print(f"  rebuild {rebuilt * 1000:.0f} ms")
+    print(f"  update {updated / updates * 1e6:.2f} us")
+    print(f"  top 20 {read / reads * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+    categories = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    main(games, updates, categories)
@@ -0,0 +1,110 @@
+"""
+Benchmark for the asynchronous moderation worker.
+
+Feeds comment.left events for pending comments through the event consumer
+(without a broker) into moderation workers calling a simulated Perspective
+API with a fixed latency, for increasing worker counts. Throughput should
+grow linearly with the workers until the API rate limit caps it.
+
+Usage:
+    python benchmarks/bench_moderation.py [comments] [api_latency_seconds] [rate_limit]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import moderation
+from moderation import ModerationWorker
+from rabbitmq_client import Consumer
+from storage import PENDING, InMemoryRatingStore
+
+
+class SimulatedAPI:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def analyze_comment(self, comment_text: str):
+        await asyncio.sleep(self.latency)
+        return False, {"toxicity": 0.2}
+
+
+class Message:
+    def __init__(self, delivery_tag, event):
+        self.delivery_tag = delivery_tag
+        self.body = json.dumps(event).encode()
+        self.headers = {}
+        self.content_type = "application/json"
+        self.content_encoding = None
+        self.message_id = f"comment.left:{event['comment_id']}"
+
+    async def ack(self, multiple=False):
+        pass
+
+    async def nack(self, requeue=True):
+        pass
+
+
+async def no_publish(event_type, event_data, event_id=None):
+    pass
+
+
+async def run(workers: int, comments: int, latency: float, rate_limit: float):
+    store = InMemoryRatingStore()
+    events = []
+    for i in range(comments):
+        await store.add_comment(
+            {
+                "comment_id": f"comment-{i}",
+                "game_id": f"game-{i % 50}",
+                "user_id": f"user-{i}",
+                "comment_text": "Is this boss fight bad or terrible?",
+                "is_moderated": None,
+                "moderation_status": PENDING,
+                "created_at": datetime.now(),
+            }
+        )
+        events.append(
+            Message(i + 1, {"comment_id": f"comment-{i}", "moderation_status": PENDING})
+        )
+
+    async def messages():
+        for message in events:
+            yield message
+
+    worker = ModerationWorker(
+        store, SimulatedAPI(latency), workers=workers, rate_limit=rate_limit
+    )
+    started = time.perf_counter()
+    consumer = Consumer("rating_moderation", worker.handle_comment_left, workers)
+    await consumer.process(messages())
+    elapsed = time.perf_counter() - started
+    assert worker.moderated == comments
+    return comments / elapsed
+
+
+def main(comments: int, latency: float, rate_limit: float):
+    moderation.publish_event = no_publish
+    print(
+        f"{comments} pending comments, API latency {latency * 1000:.0f} ms, "
+        f"rate limit {rate_limit:g}/s"
+    )
+    for workers in (1, 2, 4, 8, 16, 32):
+        throughput = asyncio.run(run(workers, comments, latency, rate_limit))
+        ideal = min(workers / latency, rate_limit)
+        print(
+            f"  {workers:>2} workers: {throughput:7.1f} comments/s "
+            f"(ideal {ideal:.0f}/s)"
+        )
+
+
+if __name__ == "__main__":
+    comments = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    rate_limit = float(sys.argv[3]) if len(sys.argv) > 3 else 400
+    main(comments, latency, rate_limit)
@@ -0,0 +1,113 @@
+"""
+Benchmark for rating storage backends.
+
+Writes ratings from many users across many games (a share of them re-rating
+a game they already rated), then reads per-game averages as the catalog
+update does after every rating, for the in-memory and SQLite stores. The
+SQLite store uses a file in a temporary directory, as in production.
+Finally reads first pages of game comment feeds from SQLite directly and
+through the cached feed.
+
+Usage:
+    python benchmarks/bench_storage.py [ratings] [games] [users]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comment_feed import CommentFeed
+from storage import InMemoryRatingStore, SQLiteRatingStore
+
+
+async def run(store, stream, games):
+    started = time.perf_counter()
+    for i, (user_id, game_id, rating) in enumerate(stream):
+        await store.upsert_rating(
+            {
+                "rating_id": f"rating-{i}",
+                "game_id": game_id,
+                "user_id": user_id,
+                "rating": rating,
+                "created_at": datetime.now(),
+            }
+        )
+    writes = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for game_id in games:
+        await store.game_rating_stats(game_id)
+    reads = time.perf_counter() - started
+    return writes, reads
+
+
+async def read_feeds(store, stream, games):
+    for i, (user_id, game_id, _) in enumerate(stream):
+        await store.add_comment(
+            {
+                "comment_id": f"comment-{i}",
+                "game_id": game_id,
+                "user_id": user_id,
+                "comment_text": "Great game",
+                "is_moderated": i % 10 == 0,
+                "created_at": datetime.now(),
+            }
+        )
+    feed = CommentFeed(store)
+    reads = [random.choice(games) for _ in range(len(stream))]
+
+    started = time.perf_counter()
+    for game_id in reads:
+        await store.list_comments(game_id, 21)
+    uncached = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for game_id in reads:
+        await feed.page(game_id, 20)
+    cached = time.perf_counter() - started
+    return uncached / len(reads), cached / len(reads), feed.hits / len(reads)
+
+
+def main(ratings: int, games: int, users: int):
+    game_ids = [f"game-{i}" for i in range(games)]
+    user_ids = [f"user-{i}" for i in range(users)]
+    stream = [
+        (random.choice(user_ids), random.choice(game_ids), random.randint(1, 5))
+        for _ in range(ratings)
+    ]
+    print(f"{ratings} ratings, {games} games, {users} users")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, store in (
+            ("memory", InMemoryRatingStore()),
+            ("sqlite", SQLiteRatingStore(os.path.join(directory, "rating.db"))),
+        ):
+            writes, reads = asyncio.run(run(store, stream, game_ids))
+            count = sum(asyncio.run(store.game_rating_stats(g))[0] for g in game_ids)
+            store.close()
+            print(
+                f"  {name:<6} upsert {writes / ratings * 1e6:8.1f} us, "
+                f"game average {reads / games * 1e6:8.1f} us, "
+                f"{count} stored ratings"
+            )
+
+        store = SQLiteRatingStore(os.path.join(directory, "feed.db"))
+        uncached, cached, hit_rate = asyncio.run(read_feeds(store, stream, game_ids))
+        store.close()
+        print(
+            f"  feed first page: sqlite {uncached * 1e6:.1f} us, "
+            f"cached {cached * 1e6:.1f} us (hit rate {hit_rate:.1%})"
+        )
+
+
+if __name__ == "__main__":
+    ratings = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    games = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+    main(ratings, games, users)
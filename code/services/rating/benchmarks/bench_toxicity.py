@@ -0,0 +1,136 @@
+"""
+Benchmark for the local toxicity pre-filter.
+
+Builds a synthetic corpus of game comments (mostly clean, some insults, some
+borderline, some obfuscated with lookalike letters or leetspeak) and
+classifies it with the bundled lexicon and with the lexicon padded by
+synthetic terms, to show the scan cost does not grow with the lexicon.
+For comparison it also runs the naive per-word substring scan the mocked
+Perspective API uses, over the same large lexicon.
+
+Usage:
+    python benchmarks/bench_toxicity.py [comments] [extra_lexicon_terms]
+"""
+
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from toxicity_filter import AMBIGUOUS, LexiconTerm, ToxicityFilter, load_lexicon
+
+# Remote moderation latency simulated by the mocked Perspective API
+REMOTE_LATENCY = 0.3
+
+CLEAN_PHRASES = [
+    "Great game, the soundtrack is amazing",
+    "Played it for 40 hours with friends and still want more",
+    "The second act drags a little but the ending is worth it",
+    "Controls feel tight, level design is clever",
+    "Отличная игра, всем рекомендую",
+    "Сюжет затягивает, графика на уровне",
+    "Co-op mode is the best part, boss fights are brutal",
+    "Needs a patch for the inventory UI but otherwise solid",
+]
+TOXIC_PHRASES = [
+    "the devs are idiots",
+    "shut up and uninstall, moron",
+    "ты дебил если купил это",
+]
+BORDERLINE_PHRASES = [
+    "I hate the last level",
+    "graphics are bad and the story is terrible",
+    "this boss will kill you a hundred times",
+]
+OBFUSCATED_PHRASES = [
+    "the devs are 1d10ts",
+    "what a m\u043er\u043en",  # Cyrillic o
+    "stfu n00b",
+]
+
+
+def make_corpus(size: int):
+    corpus = []
+    for _ in range(size):
+        roll = random.random()
+        if roll < 0.85:
+            phrases = random.sample(CLEAN_PHRASES, random.randint(1, 3))
+        elif roll < 0.92:
+            phrases = [random.choice(CLEAN_PHRASES), random.choice(BORDERLINE_PHRASES)]
+        elif roll < 0.97:
+            phrases = [random.choice(TOXIC_PHRASES)]
+        else:
+            phrases = [random.choice(OBFUSCATED_PHRASES)]
+        corpus.append(". ".join(phrases))
+    return corpus
+
+
+def synthetic_terms(count: int):
+    return [
+        LexiconTerm(
+            "".join(random.choices(string.ascii_lowercase, k=random.randint(7, 12))),
+            random.choice((0.5, 1.0)),
+        )
+        for _ in range(count)
+    ]
+
+
+def run_filter(name, terms, corpus):
+    started = time.perf_counter()
+    toxicity = ToxicityFilter(terms)
+    built = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for text in corpus:
+        toxicity.classify(text)
+    elapsed = time.perf_counter() - started
+
+    remote = toxicity.counts[AMBIGUOUS]
+    print(
+        f"  {name}: {len(terms)} terms, {len(toxicity._matcher)} states, "
+        f"built in {built * 1000:.0f} ms"
+    )
+    print(
+        f"    {elapsed / len(corpus) * 1e6:.1f} us per comment, "
+        f"{len(corpus) / elapsed:,.0f} comments/s"
+    )
+    print(
+        f"    verdicts {toxicity.counts}; {remote / len(corpus):.1%} sent to the "
+        f"remote API, saving {(len(corpus) - remote) * REMOTE_LATENCY / 3600:.1f} "
+        f"hours of remote latency"
+    )
+
+
+def run_naive(terms, corpus):
+    words = [term.term for term in terms]
+    sample = corpus[: max(1, len(corpus) // 100)]
+    started = time.perf_counter()
+    for text in sample:
+        lowered = text.lower()
+        any(word in lowered for word in words)
+    elapsed = time.perf_counter() - started
+    print(
+        f"  naive substring scan, {len(words)} terms: "
+        f"{elapsed / len(sample) * 1e6:.1f} us per comment (1% sample)"
+    )
+
+
+def main(size: int, extra_terms: int):
+    corpus = make_corpus(size)
+    average = sum(map(len, corpus)) / size
+    print(f"{size} comments, {average:.0f} characters on average")
+
+    bundled = load_lexicon()
+    large = bundled + synthetic_terms(extra_terms)
+    run_filter("bundled lexicon", bundled, corpus)
+    run_filter("large lexicon", large, corpus)
+    run_naive(large, corpus)
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    extra_terms = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    main(size, extra_terms)
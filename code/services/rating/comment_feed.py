@@ -0,0 +1,86 @@
+"""
+Per-game comment feed with a cached first page for Rating service.
+
+Almost all feed reads are for the first page of a game, so the newest
+`FEED_CACHE_PAGE_SIZE` visible comments of each recently read game are kept
+in memory and any first page up to that size is served by slicing them.
+A new comment invalidates its game's entry; a per-game generation counter
+keeps a read that raced with the invalidation from caching a stale page.
+At most `FEED_CACHE_GAMES` games are cached, least recently read evicted.
+Later pages go to the store through the cursor.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import FeedKey, rating_store
+
+FEED_CACHE_GAMES = int(os.getenv("FEED_CACHE_GAMES", "10000"))
+# Also the largest page size the feed endpoint accepts
+FEED_CACHE_PAGE_SIZE = int(os.getenv("FEED_CACHE_PAGE_SIZE", "100"))
+
+
+class CommentFeed:
+    """Newest-first comment pages of a game, first page cached."""
+
+    def __init__(
+        self,
+        store=rating_store,
+        max_games: int = FEED_CACHE_GAMES,
+        page_size: int = FEED_CACHE_PAGE_SIZE,
+    ):
+        self.store = store
+        self.max_games = max_games
+        self.page_size = page_size
+        # game_id -> (newest comments, whether older ones exist)
+        self._pages: "OrderedDict[str, Tuple[List[Dict[str, Any]], bool]]" = (
+            OrderedDict()
+        )
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def page(
+        self, game_id: str, limit: int, before: Optional[FeedKey] = None
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        One page of a game's visible comments, newest first.
+
+        Args:
+            game_id: Game ID
+            limit: Page size
+            before: Sort key of the last comment of the previous page
+
+        Returns:
+            The comments and whether older comments exist
+        """
+        if before is not None or limit > self.page_size:
+            comments = await self.store.list_comments(game_id, limit + 1, before)
+            return comments[:limit], len(comments) > limit
+
+        cached = self._pages.get(game_id)
+        if cached is not None:
+            self.hits += 1
+            self._pages.move_to_end(game_id)
+        else:
+            self.misses += 1
+            generation = self._generations.get(game_id, 0)
+            comments = await self.store.list_comments(game_id, self.page_size + 1)
+            cached = (comments[: self.page_size], len(comments) > self.page_size)
+            if self._generations.get(game_id, 0) == generation:
+                self._pages[game_id] = cached
+                if len(self._pages) > self.max_games:
+                    self._pages.popitem(last=False)
+
+        comments, more = cached
+        return comments[:limit], more or len(comments) > limit
+
+    def invalidate(self, game_id: str):
+        """Drop a game's cached page after its comments changed."""
+        self._pages.pop(game_id, None)
+        self._generations[game_id] = self._generations.get(game_id, 0) + 1
+
+
+# Global instance
+comment_feed = CommentFeed()
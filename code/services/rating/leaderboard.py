@@ -0,0 +1,173 @@
+"""
+Bayesian-weighted game leaderboard for Rating service.
+
+A game's score is its average rating pulled towards a prior:
+
+    score = (prior_votes * prior_mean + sum of ratings) / (prior_votes + count)
+
+so a single 5-star vote barely moves a game while established titles score
+close to their real average. The prior is fixed (`LEADERBOARD_PRIOR_MEAN`,
+`LEADERBOARD_PRIOR_VOTES`) rather than the moving global mean, so a new
+rating changes only its own game's score.
+
+Every category (and the overall board) keeps its games sorted by score in a
+list of bounded chunks: an update bisects the chunk maxima, then removes the
+game's old entry and inserts the new one within a chunk, so it costs
+O(log n) comparisons and moves at most a chunk of entries; top-N reads the
+first chunks. The boards are rebuilt from the store on startup and then
+kept current by every rating, so reads never touch the store or the catalog.
+"""
+
+import bisect
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+LEADERBOARD_PRIOR_MEAN = float(os.getenv("LEADERBOARD_PRIOR_MEAN", "3.0"))
+LEADERBOARD_PRIOR_VOTES = float(os.getenv("LEADERBOARD_PRIOR_VOTES", "10"))
+
+# Sort key: best score first, then more ratings, then game_id for stability
+BoardKey = Tuple[float, int, str]
+
+
+class SortedKeys:
+    """Sorted list split into chunks of at most 2 * CHUNK_SIZE keys."""
+
+    CHUNK_SIZE = 512
+
+    def __init__(self, keys: Iterable[BoardKey] = ()):
+        keys = sorted(keys)
+        size = self.CHUNK_SIZE
+        self._chunks = [keys[i : i + size] for i in range(0, len(keys), size)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(keys)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, key: BoardKey):
+        self._len += 1
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            return
+        i = min(bisect.bisect_left(self._maxes, key), len(self._maxes) - 1)
+        chunk = self._chunks[i]
+        bisect.insort(chunk, key)
+        self._maxes[i] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            half = self.CHUNK_SIZE
+            self._chunks[i : i + 1] = [chunk[:half], chunk[half:]]
+            self._maxes[i : i + 1] = [chunk[half - 1], chunk[-1]]
+
+    def remove(self, key: BoardKey):
+        """Remove a key that is present."""
+        self._len -= 1
+        i = bisect.bisect_left(self._maxes, key)
+        chunk = self._chunks[i]
+        del chunk[bisect.bisect_left(chunk, key)]
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+
+    def head(self, n: int) -> List[BoardKey]:
+        """The n smallest keys."""
+        keys: List[BoardKey] = []
+        for chunk in self._chunks:
+            if len(keys) >= n:
+                break
+            keys.extend(chunk[: n - len(keys)])
+        return keys
+
+
+class Leaderboard:
+    """Per-category games sorted by Bayesian score."""
+
+    def __init__(
+        self,
+        prior_mean: float = LEADERBOARD_PRIOR_MEAN,
+        prior_votes: float = LEADERBOARD_PRIOR_VOTES,
+    ):
+        self.prior_mean = prior_mean
+        self.prior_votes = prior_votes
+        # category (None for the overall board) -> keys sorted best first
+        self._boards: Dict[Optional[str], SortedKeys] = {None: SortedKeys()}
+        # game_id -> (category, key, average rating)
+        self._games: Dict[str, Tuple[Optional[str], BoardKey, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def score(self, count: int, average: float) -> float:
+        return (self.prior_votes * self.prior_mean + count * average) / (
+            self.prior_votes + count
+        )
+
+    def update(self, game_id: str, category: Optional[str], count: int, average: float):
+        """
+        Set a game's rating statistics and re-rank it.
+
+        Args:
+            game_id: Game ID
+            category: Game category from the catalog (None if unknown)
+            count: Number of ratings
+            average: Average rating
+        """
+        self._remove(game_id)
+        key = (-self.score(count, average), -count, game_id)
+        self._games[game_id] = (category, key, average)
+        self._boards[None].add(key)
+        if category is not None:
+            if category not in self._boards:
+                self._boards[category] = SortedKeys()
+            self._boards[category].add(key)
+
+    def _remove(self, game_id: str):
+        entry = self._games.pop(game_id, None)
+        if entry is None:
+            return
+        category, key, _ = entry
+        boards = [self._boards[None]]
+        if category is not None:
+            boards.append(self._boards[category])
+        for board in boards:
+            board.remove(key)
+        if category is not None and not self._boards[category]:
+            del self._boards[category]
+
+    def top(self, category: Optional[str] = None, n: int = 10) -> List[Dict[str, Any]]:
+        """The n best games of a category, or overall if category is None."""
+        board = self._boards.get(category)
+        if board is None:
+            return []
+        entries = []
+        for rank, (score, count, game_id) in enumerate(board.head(n), 1):
+            game_category, _, average = self._games[game_id]
+            entries.append(
+                {
+                    "rank": rank,
+                    "game_id": game_id,
+                    "category": game_category,
+                    "score": -score,
+                    "rating_count": -count,
+                    "average_rating": average,
+                }
+            )
+        return entries
+
+    def rebuild(self, stats: Iterable[Tuple[str, Optional[str], int, float]]):
+        """Replace all boards from (game_id, category, count, average) rows."""
+        self._games = {}
+        keys: Dict[Optional[str], List[BoardKey]] = {None: []}
+        for game_id, category, count, average in stats:
+            key = (-self.score(count, average), -count, game_id)
+            self._games[game_id] = (category, key, average)
+            keys[None].append(key)
+            if category is not None:
+                keys.setdefault(category, []).append(key)
+        self._boards = {category: SortedKeys(board) for category, board in keys.items()}
+
+
+# Global instance
+leaderboard = Leaderboard()
@@ -2,14 +2,19 @@
 Rating Service - FastAPI application.
 
 This service handles game ratings and comments. It includes:
-- Mocked Perspective API for content moderation
+- Local toxicity pre-filter; ambiguous comments are moderated
+  asynchronously through the mocked Perspective API (see moderation.py)
+- SQLite storage for ratings and comments (see storage.py)
 - RabbitMQ for publishing domain events
 """
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import os
 import uvicorn
 import uuid
 import httpx
@@ -20,24 +25,37 @@ from schemas import (
     UpdateGameRatingRequest,
     RatingResponse,
     CommentResponse,
+    CommentListResponse,
+    LeaderboardResponse,
 )
-from perspective_api import perspective_api
-from rabbitmq_client import publish_event
-
-# In-memory storage (in production, use a database)
-ratings_db = {}
-comments_db = {}
+from comment_feed import FEED_CACHE_PAGE_SIZE, comment_feed
+from leaderboard import leaderboard
+from pagination import InvalidCursorError, decode_cursor, encode_cursor
+from moderation import moderation_worker
+from toxicity_filter import CLEAN, TOXIC, toxicity_filter
+from rabbitmq_client import consumer_metrics, publish_event
+from storage import APPROVED, PENDING, REJECTED, rating_store
 
 # External service URL
 GAME_CATALOG_SERVICE_URL = "http://game-catalog:8002"
+# How long a game's category fetched from the catalog is reused
+GAME_CATEGORY_TTL = float(os.getenv("GAME_CATEGORY_TTL", "3600"))
+
+# game_id -> [lock, requests holding or waiting for it]; dropped when unused
+game_locks: Dict[str, list] = {}
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle events for the FastAPI application."""
     print("🚀 Rating service starting up...")
+    leaderboard.rebuild(await rating_store.all_game_stats())
+    print(f"🏆 Leaderboard loaded with {len(leaderboard)} games")
+    moderation_worker.start()
     yield
     print("🛑 Rating service shutting down...")
+    await moderation_worker.stop()
+    rating_store.close()
 
 
 app = FastAPI(
@@ -57,22 +75,71 @@ app.add_middleware(
 )
 
 
-async def update_game_rating(game_id: str):
+async def game_category(game_id: str) -> Optional[str]:
+    """Get a game's category, cached from Game Catalog for GAME_CATEGORY_TTL."""
+    cached = await rating_store.get_game_category(game_id)
+    if cached and (datetime.now() - cached[1]).total_seconds() < GAME_CATEGORY_TTL:
+        return cached[0]
+
+    async with httpx.AsyncClient() as client:
+        try:
+            response = await client.get(
+                f"{GAME_CATALOG_SERVICE_URL}/api/v1/games/{game_id}"
+            )
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Error fetching game category: {e}")
+            return cached[0] if cached else None
+
+    category = response.json().get("category")
+    await rating_store.set_game_category(game_id, category)
+    return category
+
+
+@asynccontextmanager
+async def game_lock(game_id: str):
+    """Hold a game's lock; ratings of other games are not blocked."""
+    entry = game_locks.setdefault(game_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del game_locks[game_id]
+
+
+async def store_rating(rating: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+    """
+    Store a rating and re-rank its game on the leaderboard.
+
+    Returns:
+        The stored rating and the game's new average rating
+    """
+    game_id = rating["game_id"]
+    # Category first: its catalog round trip must not sit inside the game's
+    # lock. The lock keeps concurrent ratings of the game from ranking an
+    # older write after a newer one (the write yields to a worker thread); the
+    # write returns the game's totals, so ranking needs no further read.
+    category = await game_category(game_id)
+    async with game_lock(game_id):
+        stored, count, total = await rating_store.upsert_rating(rating)
+        avg_rating = total / count
+        leaderboard.update(game_id, category, count, avg_rating)
+    return stored, avg_rating
+
+
+async def update_game_rating(game_id: str, avg_rating: float):
     """Update game rating in Game Catalog service."""
-    # Calculate average rating
-    game_ratings = [r["rating"] for r in ratings_db.values() if r["game_id"] == game_id]
-    if game_ratings:
-        avg_rating = sum(game_ratings) / len(game_ratings)
-
-        # Update in Game Catalog service
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.put(
-                    f"{GAME_CATALOG_SERVICE_URL}/api/v1/games/{game_id}",
-                    json={"rating": avg_rating},
-                )
-            except Exception as e:
-                print(f"Error updating game rating: {e}")
+    async with httpx.AsyncClient() as client:
+        try:
+            await client.put(
+                f"{GAME_CATALOG_SERVICE_URL}/api/v1/games/{game_id}",
+                json={"rating": avg_rating},
+            )
+        except Exception as e:
+            print(f"Error updating game rating: {e}")
 
 
 @app.post(
@@ -83,23 +150,23 @@ async def update_game_rating(game_id: str):
     summary="Leave a rating",
 )
 async def leave_rating(request: LeaveRatingRequest):
-    """Leave a rating for a game."""
-    rating_id = str(uuid.uuid4())
-
-    rating = {
-        "rating_id": rating_id,
-        "game_id": request.game_id,
-        "user_id": request.user_id,
-        "rating": request.rating,
-        "created_at": datetime.now(),
-    }
-
-    ratings_db[rating_id] = rating
+    """Leave a rating for a game; rating it again replaces the user's rating."""
+    rating, avg_rating = await store_rating(
+        {
+            "rating_id": str(uuid.uuid4()),
+            "game_id": request.game_id,
+            "user_id": request.user_id,
+            "rating": request.rating,
+            "created_at": datetime.now(),
+        }
+    )
+    rating_id = rating["rating_id"]
 
     # Update game rating in Game Catalog
-    await update_game_rating(request.game_id)
+    await update_game_rating(request.game_id, avg_rating)
 
-    # Publish domain event
+    # Publish domain event (a random id: a re-rating keeps the rating_id but
+    # is a new event, not a duplicate of the first one)
     await publish_event(
         "rating.left",
         {
@@ -122,9 +189,13 @@ async def leave_rating(request: LeaveRatingRequest):
 )
 async def leave_comment(request: LeaveCommentRequest):
     """Leave a comment for a game (with content moderation)."""
-    # Analyze comment via mocked Perspective API
-    is_moderated, scores = await perspective_api.analyze_comment(request.comment_text)
-
+    # Clearly clean or toxic comments are decided by the local pre-filter;
+    # ambiguous ones stay pending until the moderation worker has asked the
+    # (mocked) Perspective API
+    prefilter = toxicity_filter.classify(request.comment_text)
+    moderation_status = {CLEAN: APPROVED, TOXIC: REJECTED}.get(
+        prefilter.verdict, PENDING
+    )
     comment_id = str(uuid.uuid4())
 
     comment = {
@@ -132,21 +203,29 @@ async def leave_comment(request: LeaveCommentRequest):
         "game_id": request.game_id,
         "user_id": request.user_id,
         "comment_text": request.comment_text,
-        "is_moderated": is_moderated,
+        # Tri-state: None until pending comments have been moderated
+        "is_moderated": (
+            None if moderation_status == PENDING else moderation_status == REJECTED
+        ),
+        "moderation_status": moderation_status,
         "created_at": datetime.now(),
     }
 
-    comments_db[comment_id] = comment
+    await rating_store.add_comment(comment)
+    if moderation_status == APPROVED:
+        comment_feed.invalidate(request.game_id)
 
-    # Publish domain event
+    # Publish domain event (the moderation worker picks up pending comments)
     await publish_event(
         "comment.left",
         {
             "comment_id": comment_id,
             "game_id": request.game_id,
             "user_id": request.user_id,
-            "is_moderated": is_moderated,
+            "is_moderated": comment["is_moderated"],
+            "moderation_status": moderation_status,
         },
+        event_id=f"comment.left:{comment_id}",
     )
 
     return CommentResponse(**comment)
@@ -183,7 +262,7 @@ async def update_game_rating_endpoint(game_id: str, request: UpdateGameRatingReq
 )
 async def get_rating(rating_id: str):
     """Get rating information by ID."""
-    rating = ratings_db.get(rating_id)
+    rating = await rating_store.get_rating(rating_id)
     if not rating:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Rating not found"
@@ -199,7 +278,7 @@ async def get_rating(rating_id: str):
 )
 async def get_comment(comment_id: str):
     """Get comment information by ID."""
-    comment = comments_db.get(comment_id)
+    comment = await rating_store.get_comment(comment_id)
     if not comment:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found"
@@ -207,6 +286,63 @@ async def get_comment(comment_id: str):
     return CommentResponse(**comment)
 
 
+@app.get(
+    "/api/v1/games/{game_id}/comments",
+    response_model=CommentListResponse,
+    tags=["Comments"],
+    summary="List game comments",
+)
+async def list_game_comments(
+    game_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=FEED_CACHE_PAGE_SIZE),
+):
+    """List a game's comments that passed moderation, newest first."""
+    before = None
+    if cursor:
+        try:
+            before = decode_cursor(cursor)
+        except InvalidCursorError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+            ) from e
+
+    comments, more = await comment_feed.page(game_id, limit, before)
+    next_cursor = None
+    if more and comments:
+        next_cursor = encode_cursor(
+            comments[-1]["created_at"], comments[-1]["comment_id"]
+        )
+    return CommentListResponse(
+        items=[CommentResponse(**comment) for comment in comments],
+        next_cursor=next_cursor,
+    )
+
+
+@app.get(
+    "/api/v1/leaderboard",
+    response_model=LeaderboardResponse,
+    tags=["Ratings"],
+    summary="Get top rated games",
+)
+async def get_leaderboard(
+    category: Optional[str] = None, n: int = Query(10, ge=1, le=100)
+):
+    """Get the n best games by Bayesian-weighted rating, overall or in a category."""
+    return LeaderboardResponse(category=category, items=leaderboard.top(category, n))
+
+
+@app.get(
+    "/api/v1/events/metrics",
+    response_model=dict,
+    tags=["Events"],
+    summary="Event consumer metrics",
+)
+async def get_event_metrics():
+    """Get per-queue consumer counters, queue lag and processing time."""
+    return consumer_metrics()
+
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     """Health check endpoint."""
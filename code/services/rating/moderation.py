@@ -0,0 +1,185 @@
+"""
+Asynchronous comment moderation for Rating service.
+
+Comments the local pre-filter finds ambiguous are stored as pending (hidden
+from feeds) and announced with comment.left. The moderation worker consumes
+those events from `MODERATION_QUEUE` with up to `MODERATION_WORKERS`
+handlers at once, the broker pushing at most `MODERATION_PREFETCH` unacked
+messages ahead. Every handler waits for a token of a bucket refilled at
+`MODERATION_RATE_LIMIT` calls per second, calls the Perspective API, records
+the verdict and publishes comment.moderated. Throughput therefore grows with
+the number of workers (workers / API latency) until it reaches the API's
+rate limit.
+
+Comments left pending because an event was lost or the service stopped
+mid-way are picked up from the store on startup.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional, Set
+
+from comment_feed import comment_feed
+from perspective_api import perspective_api
+from rabbitmq_client import Consumer, publish_event
+from storage import APPROVED, PENDING, rating_store
+
+MODERATION_QUEUE = os.getenv("MODERATION_QUEUE", "rating_moderation")
+MODERATION_WORKERS = int(os.getenv("MODERATION_WORKERS", "8"))
+# Unacked messages the broker may push ahead (default: twice the workers)
+MODERATION_PREFETCH = int(os.getenv("MODERATION_PREFETCH", "0"))
+# Perspective API calls per second across all workers (0: unlimited)
+MODERATION_RATE_LIMIT = float(os.getenv("MODERATION_RATE_LIMIT", "20"))
+MODERATION_RESUME_CHUNK_SIZE = int(os.getenv("MODERATION_RESUME_CHUNK_SIZE", "500"))
+
+
+class RateLimiter:
+    """Token bucket: `rate` acquisitions per second, bursts up to `burst`."""
+
+    def __init__(
+        self, rate: float, burst: Optional[float] = None, clock=time.monotonic
+    ):
+        self.rate = rate
+        # A tenth of a second of calls by default, so late wake-ups from sleep
+        # do not lose capacity (a single token caps well below the rate)
+        self.burst = burst if burst is not None else max(1.0, rate / 10)
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ModerationWorker:
+    """Moderates pending comments through the Perspective API."""
+
+    def __init__(
+        self,
+        store=rating_store,
+        api=perspective_api,
+        workers: int = MODERATION_WORKERS,
+        prefetch: int = MODERATION_PREFETCH,
+        rate_limit: float = MODERATION_RATE_LIMIT,
+    ):
+        self.store = store
+        self.api = api
+        self.workers = workers
+        self.prefetch = prefetch or 2 * workers
+        self.limiter = RateLimiter(rate_limit)
+        self.moderated = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._consumer: Optional[Consumer] = None
+
+    async def handle_comment_left(self, event: Dict[str, Any]):
+        """Handle a comment.left event; only pending comments need moderation."""
+        if event.get("moderation_status") == PENDING:
+            await self.moderate(event["comment_id"])
+
+    async def moderate(self, comment_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Moderate a pending comment and publish comment.moderated.
+
+        Returns:
+            The moderated comment, or None if it was not pending (already
+            moderated, e.g. by a redelivered event)
+        """
+        comment = await self.store.get_comment(comment_id)
+        if comment is None or comment["moderation_status"] != PENDING:
+            return None
+
+        await self.limiter.acquire()
+        is_moderated, scores = await self.api.analyze_comment(comment["comment_text"])
+        comment = await self.store.set_comment_moderation(comment_id, is_moderated)
+        if comment is None:
+            return None
+        if comment["moderation_status"] == APPROVED:
+            comment_feed.invalidate(comment["game_id"])
+        self.moderated += 1
+
+        await publish_event(
+            "comment.moderated",
+            {
+                "comment_id": comment_id,
+                "game_id": comment["game_id"],
+                "user_id": comment["user_id"],
+                "is_moderated": is_moderated,
+                "moderation_status": comment["moderation_status"],
+                "toxicity": scores.get("toxicity"),
+            },
+            event_id=f"comment.moderated:{comment_id}",
+        )
+        return comment
+
+    async def resume(self) -> int:
+        """Moderate every comment left pending; returns how many were found."""
+        slots = asyncio.Semaphore(self.workers)
+
+        async def moderate(comment_id: str):
+            async with slots:
+                try:
+                    await self.moderate(comment_id)
+                except Exception as e:
+                    print(f"Error moderating comment {comment_id}: {e}")
+
+        found = 0
+        after = None
+        while True:
+            comments = await self.store.pending_comments(
+                MODERATION_RESUME_CHUNK_SIZE, after
+            )
+            await asyncio.gather(*(moderate(c["comment_id"]) for c in comments))
+            found += len(comments)
+            if len(comments) < MODERATION_RESUME_CHUNK_SIZE:
+                return found
+            after = (comments[-1]["created_at"], comments[-1]["comment_id"])
+
+    async def _resume(self):
+        try:
+            resumed = await self.resume()
+            if resumed:
+                print(f"Resumed moderation of {resumed} pending comments")
+        except Exception as e:
+            print(f"Error resuming moderation: {e}")
+
+    def start(self):
+        """Resume pending comments and start consuming comment.left events."""
+        self._consumer = Consumer(
+            MODERATION_QUEUE,
+            self.handle_comment_left,
+            concurrency=self.workers,
+            prefetch_count=self.prefetch,
+        )
+        for coroutine in (
+            self._resume(),
+            self._consumer.run("rating_events", "comment.left"),
+        ):
+            task = asyncio.create_task(coroutine)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        """Drain the consumer; unacked events are redelivered to the next one."""
+        if self._consumer is not None:
+            await self._consumer.stop()
+            self._consumer = None
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global instance
+moderation_worker = ModerationWorker()
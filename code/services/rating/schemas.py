@@ -3,7 +3,7 @@ Pydantic schemas for Rating service.
 """
 
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -38,6 +38,7 @@ class RatingResponse(BaseModel):
     user_id: str
     rating: int
     created_at: datetime
+    updated_at: Optional[datetime] = None
 
     model_config = {"from_attributes": True}
 
@@ -49,7 +50,33 @@ class CommentResponse(BaseModel):
     game_id: str
     user_id: str
     comment_text: str
-    is_moderated: bool
+    is_moderated: Optional[bool]  # True if rejected, None while pending
+    moderation_status: str = "approved"  # pending, approved, rejected
     created_at: datetime
 
     model_config = {"from_attributes": True}
+
+
+class CommentListResponse(BaseModel):
+    """Response schema for a page of a game's comments."""
+
+    items: List[CommentResponse]
+    next_cursor: Optional[str]  # pass back as ?cursor= for the next page
+
+
+class LeaderboardEntry(BaseModel):
+    """One ranked game of the leaderboard."""
+
+    rank: int
+    game_id: str
+    category: Optional[str]
+    score: float  # average rating weighted towards the prior
+    rating_count: int
+    average_rating: float
+
+
+class LeaderboardResponse(BaseModel):
+    """Response schema for the leaderboard."""
+
+    category: Optional[str]
+    items: List[LeaderboardEntry]
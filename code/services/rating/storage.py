@@ -0,0 +1,592 @@
+"""
+Rating and comment storage for Rating service.
+
+Two interchangeable backends with the same async interface:
+
+- SQLiteRatingStore (default): durable, with a unique (user_id, game_id)
+  constraint so re-rating a game updates the user's rating in place,
+  (game_id, created_at) indexes for per-game queries and per-game rating
+  totals kept in the same transaction as each rating write. Blocking sqlite
+  calls run in a worker thread.
+- InMemoryRatingStore: dicts with the same per-game and per-user indexes and
+  totals, kept for tests and as a baseline for benchmarks; lost on restart.
+
+The backend is chosen with `RATING_STORE` (`sqlite` or `memory`) and the
+database file with `RATING_DB_PATH`.
+"""
+
+import asyncio
+import bisect
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+RATING_STORE = os.getenv("RATING_STORE", "sqlite")
+RATING_DB_PATH = os.getenv("RATING_DB_PATH", "rating.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    rating_id TEXT PRIMARY KEY,
+    game_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    -- One rating per user per game; also serves (user_id, game_id) lookups
+    UNIQUE (user_id, game_id)
+);
+CREATE INDEX IF NOT EXISTS ix_ratings_game_id_created_at
+    ON ratings (game_id, created_at);
+
+-- Running rating count and sum per game, written with each rating
+CREATE TABLE IF NOT EXISTS game_rating_totals (
+    game_id TEXT PRIMARY KEY,
+    rating_count INTEGER NOT NULL,
+    rating_sum INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS comments (
+    comment_id TEXT PRIMARY KEY,
+    game_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    comment_text TEXT NOT NULL,
+    -- NULL while the comment is pending moderation
+    is_moderated INTEGER,
+    moderation_status TEXT NOT NULL DEFAULT 'approved',
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_comments_game_id_created_at
+    ON comments (game_id, created_at, comment_id);
+CREATE INDEX IF NOT EXISTS ix_comments_user_id_game_id
+    ON comments (user_id, game_id);
+
+-- Game categories cached from Game Catalog for the leaderboard
+CREATE TABLE IF NOT EXISTS game_categories (
+    game_id TEXT PRIMARY KEY,
+    category TEXT,
+    fetched_at TEXT NOT NULL
+);
+"""
+
+# Tables added after the first release -> statement filling them from the
+# existing rows, run when the table is created
+ADDED_TABLES = {
+    "game_rating_totals": (
+        "INSERT INTO game_rating_totals (game_id, rating_count, rating_sum) "
+        "SELECT game_id, COUNT(*), SUM(rating) FROM ratings GROUP BY game_id"
+    ),
+}
+
+# Columns added to existing tables after their first release:
+# table -> column -> (definition, statement backfilling existing rows)
+ADDED_COLUMNS = {
+    "comments": {
+        "moderation_status": (
+            "TEXT NOT NULL DEFAULT 'approved'",
+            "UPDATE comments SET moderation_status = 'rejected' WHERE is_moderated = 1",
+        ),
+    },
+}
+
+# Columns made nullable after their first release: (table, column) -> script
+# rebuilding the table, as SQLite cannot drop a NOT NULL constraint in place.
+# Indexes of the old table go with it and are recreated from SCHEMA.
+RELAXED_COLUMNS = {
+    ("comments", "is_moderated"): """
+BEGIN;
+CREATE TABLE comments_rebuilt (
+    comment_id TEXT PRIMARY KEY,
+    game_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    comment_text TEXT NOT NULL,
+    is_moderated INTEGER,
+    moderation_status TEXT NOT NULL DEFAULT 'approved',
+    created_at TEXT NOT NULL
+);
+INSERT INTO comments_rebuilt (comment_id, game_id, user_id, comment_text,
+    is_moderated, moderation_status, created_at)
+SELECT comment_id, game_id, user_id, comment_text,
+    CASE WHEN moderation_status = 'pending' THEN NULL ELSE is_moderated END,
+    moderation_status, created_at
+FROM comments;
+DROP TABLE comments;
+ALTER TABLE comments_rebuilt RENAME TO comments;
+COMMIT;
+""",
+}
+
+# Indexes on added columns, created once the columns exist
+ADDED_INDEXES = """
+-- Comments awaiting moderation, resumed on startup
+CREATE INDEX IF NOT EXISTS ix_comments_pending
+    ON comments (created_at, comment_id) WHERE moderation_status = 'pending';
+"""
+
+# Comment moderation statuses; only approved comments are shown in feeds.
+# A comment's is_moderated flag is True when rejected, False when approved and
+# None while pending.
+PENDING = "pending"
+APPROVED = "approved"
+REJECTED = "rejected"
+
+DATETIME_COLUMNS = ("created_at", "updated_at", "fetched_at")
+
+# (created_at, comment_id): the feed sort key and pagination cursor
+FeedKey = Tuple[datetime, str]
+# (game_id, category, rating count, average rating)
+GameStats = Tuple[str, Optional[str], int, float]
+# (stored rating, rating count of its game, sum of the game's ratings)
+StoredRating = Tuple[Dict[str, Any], int, int]
+
+
+def _decided_status(comment: Dict[str, Any]) -> str:
+    if comment["is_moderated"] is None:
+        return PENDING
+    return REJECTED if comment["is_moderated"] else APPROVED
+
+
+def _encode(record: Dict[str, Any]) -> Dict[str, Any]:
+    row = dict(record)
+    for name in DATETIME_COLUMNS:
+        if isinstance(row.get(name), datetime):
+            row[name] = row[name].isoformat()
+    return row
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    record = dict(row)
+    for name in DATETIME_COLUMNS:
+        if record.get(name):
+            record[name] = datetime.fromisoformat(record[name])
+    if record.get("is_moderated") is not None:
+        record["is_moderated"] = bool(record["is_moderated"])
+    return record
+
+
+class InMemoryRatingStore:
+    """Dict-backed store with per-game running totals."""
+
+    def __init__(self):
+        self.ratings: Dict[str, Dict[str, Any]] = {}
+        self.comments: Dict[str, Dict[str, Any]] = {}
+        # (user_id, game_id) -> rating_id
+        self._by_user_game: Dict[Tuple[str, str], str] = {}
+        # game_id -> [count, sum of ratings]
+        self._game_totals: Dict[str, list] = {}
+        # game_id -> feed keys of visible comments, oldest first
+        self._game_feeds: Dict[str, List[FeedKey]] = {}
+        # game_id -> (category, fetched_at)
+        self.game_categories: Dict[str, Tuple[Optional[str], datetime]] = {}
+
+    async def upsert_rating(self, rating: Dict[str, Any]) -> StoredRating:
+        """
+        Store a user's rating of a game, replacing their previous one.
+
+        Returns:
+            The stored rating (a re-rating keeps the original rating_id and
+            created_at and sets updated_at), and the game's rating count and
+            sum including it
+        """
+        key = (rating["user_id"], rating["game_id"])
+        totals = self._game_totals.setdefault(rating["game_id"], [0, 0])
+        rating_id = self._by_user_game.get(key)
+        if rating_id is None:
+            stored = {**rating, "updated_at": None}
+            self.ratings[stored["rating_id"]] = stored
+            self._by_user_game[key] = stored["rating_id"]
+            totals[0] += 1
+            totals[1] += stored["rating"]
+        else:
+            stored = self.ratings[rating_id]
+            totals[1] += rating["rating"] - stored["rating"]
+            stored["rating"] = rating["rating"]
+            stored["updated_at"] = rating["created_at"]
+        return dict(stored), totals[0], totals[1]
+
+    async def get_rating(self, rating_id: str) -> Optional[Dict[str, Any]]:
+        rating = self.ratings.get(rating_id)
+        return dict(rating) if rating else None
+
+    async def game_rating_stats(self, game_id: str) -> Tuple[int, Optional[float]]:
+        """Number of ratings of a game and their average (None if unrated)."""
+        count, total = self._game_totals.get(game_id, (0, 0))
+        return count, total / count if count else None
+
+    async def all_game_stats(self) -> List[GameStats]:
+        """Rating count, average and cached category of every rated game."""
+        return [
+            (
+                game_id,
+                self.game_categories.get(game_id, (None,))[0],
+                count,
+                total / count,
+            )
+            for game_id, (count, total) in self._game_totals.items()
+            if count
+        ]
+
+    async def get_game_category(
+        self, game_id: str
+    ) -> Optional[Tuple[Optional[str], datetime]]:
+        """Cached (category, fetched_at) of a game, or None if never fetched."""
+        return self.game_categories.get(game_id)
+
+    async def set_game_category(self, game_id: str, category: Optional[str]):
+        self.game_categories[game_id] = (category, datetime.now())
+
+    async def add_comment(self, comment: Dict[str, Any]) -> Dict[str, Any]:
+        comment = {"moderation_status": _decided_status(comment), **comment}
+        self.comments[comment["comment_id"]] = comment
+        if comment["moderation_status"] == APPROVED:
+            self._show_in_feed(comment)
+        return dict(comment)
+
+    def _show_in_feed(self, comment: Dict[str, Any]):
+        bisect.insort(
+            self._game_feeds.setdefault(comment["game_id"], []),
+            (comment["created_at"], comment["comment_id"]),
+        )
+
+    async def set_comment_moderation(
+        self, comment_id: str, is_moderated: bool
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Record the moderation result of a pending comment.
+
+        Returns:
+            The updated comment, or None if it is missing or not pending
+        """
+        comment = self.comments.get(comment_id)
+        if comment is None or comment["moderation_status"] != PENDING:
+            return None
+        comment["is_moderated"] = is_moderated
+        comment["moderation_status"] = _decided_status(comment)
+        if not is_moderated:
+            self._show_in_feed(comment)
+        return dict(comment)
+
+    async def pending_comments(
+        self, limit: int, after: Optional[FeedKey] = None
+    ) -> List[Dict[str, Any]]:
+        """Comments awaiting moderation, oldest first, after a (created_at, comment_id)."""
+        pending = sorted(
+            (c["created_at"], c["comment_id"])
+            for c in self.comments.values()
+            if c["moderation_status"] == PENDING
+            and (after is None or (c["created_at"], c["comment_id"]) > after)
+        )
+        return [dict(self.comments[comment_id]) for _, comment_id in pending[:limit]]
+
+    async def get_comment(self, comment_id: str) -> Optional[Dict[str, Any]]:
+        comment = self.comments.get(comment_id)
+        return dict(comment) if comment else None
+
+    async def list_comments(
+        self, game_id: str, limit: int, before: Optional[FeedKey] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Approved comments of a game, newest first.
+
+        Args:
+            game_id: Game ID
+            limit: Maximum number of comments
+            before: Only comments sorting before this (created_at, comment_id)
+        """
+        feed = self._game_feeds.get(game_id, [])
+        end = bisect.bisect_left(feed, before) if before else len(feed)
+        keys = feed[max(0, end - limit) : end]
+        return [dict(self.comments[comment_id]) for _, comment_id in reversed(keys)]
+
+    def close(self):
+        pass
+
+
+class SQLiteRatingStore:
+    """SQLite-backed store; calls run in a worker thread."""
+
+    def __init__(self, path: str = RATING_DB_PATH):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Survives process crashes; a power loss may drop the last ratings
+            connection.execute("PRAGMA synchronous=NORMAL")
+            tables = {
+                row["name"]
+                for row in connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"
+                )
+            }
+            connection.executescript(SCHEMA)
+            for table, backfill in ADDED_TABLES.items():
+                if table not in tables:
+                    connection.execute(backfill)
+            for table, columns in ADDED_COLUMNS.items():
+                existing = {
+                    row["name"]
+                    for row in connection.execute(f"PRAGMA table_info({table})")
+                }
+                for name, (definition, backfill) in columns.items():
+                    if name not in existing:
+                        connection.execute(
+                            f"ALTER TABLE {table} ADD COLUMN {name} {definition}"
+                        )
+                        connection.execute(backfill)
+            for (table, name), rebuild in RELAXED_COLUMNS.items():
+                if any(
+                    row["name"] == name and row["notnull"]
+                    for row in connection.execute(f"PRAGMA table_info({table})")
+                ):
+                    connection.executescript(rebuild)
+                    connection.executescript(SCHEMA)
+            connection.executescript(ADDED_INDEXES)
+            self._connection = connection
+        return self._connection
+
+    def _run(self, fn):
+        # One connection shared by the worker threads, used one call at a time
+        with self._lock:
+            return fn(self._connect())
+
+    async def _call(self, fn):
+        return await asyncio.to_thread(self._run, fn)
+
+    async def upsert_rating(self, rating: Dict[str, Any]) -> StoredRating:
+        """
+        Store a user's rating of a game, replacing their previous one.
+
+        Returns:
+            The stored rating (a re-rating keeps the original rating_id and
+            created_at and sets updated_at), and the game's rating count and
+            sum including it
+        """
+        row = _encode(rating)
+
+        def write(connection):
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                previous = connection.execute(
+                    "SELECT rating FROM ratings WHERE user_id = ? AND game_id = ?",
+                    (row["user_id"], row["game_id"]),
+                ).fetchone()
+                stored = connection.execute(
+                    "INSERT INTO ratings "
+                    "(rating_id, game_id, user_id, rating, created_at) "
+                    "VALUES (:rating_id, :game_id, :user_id, :rating, :created_at) "
+                    "ON CONFLICT (user_id, game_id) DO UPDATE SET "
+                    "rating = excluded.rating, updated_at = excluded.created_at "
+                    "RETURNING *",
+                    row,
+                ).fetchone()
+                count, total = connection.execute(
+                    "INSERT INTO game_rating_totals "
+                    "(game_id, rating_count, rating_sum) VALUES (?, ?, ?) "
+                    "ON CONFLICT (game_id) DO UPDATE SET "
+                    "rating_count = rating_count + excluded.rating_count, "
+                    "rating_sum = rating_sum + excluded.rating_sum "
+                    "RETURNING rating_count, rating_sum",
+                    (
+                        row["game_id"],
+                        0 if previous else 1,
+                        row["rating"] - (previous["rating"] if previous else 0),
+                    ),
+                ).fetchone()
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return _decode(stored), count, total
+
+        return await self._call(write)
+
+    async def get_rating(self, rating_id: str) -> Optional[Dict[str, Any]]:
+        def read(connection):
+            row = connection.execute(
+                "SELECT * FROM ratings WHERE rating_id = ?", (rating_id,)
+            ).fetchone()
+            return _decode(row) if row else None
+
+        return await self._call(read)
+
+    async def game_rating_stats(self, game_id: str) -> Tuple[int, Optional[float]]:
+        """Number of ratings of a game and their average (None if unrated)."""
+
+        def read(connection):
+            return connection.execute(
+                "SELECT rating_count, rating_sum FROM game_rating_totals "
+                "WHERE game_id = ?",
+                (game_id,),
+            ).fetchone()
+
+        row = await self._call(read)
+        count, total = row if row else (0, 0)
+        return count, total / count if count else None
+
+    async def all_game_stats(self) -> List[GameStats]:
+        """Rating count, average and cached category of every rated game."""
+
+        def read(connection):
+            return connection.execute(
+                "SELECT t.game_id, g.category, t.rating_count, "
+                "CAST(t.rating_sum AS REAL) / t.rating_count "
+                "FROM game_rating_totals t LEFT JOIN game_categories g USING (game_id) "
+                "WHERE t.rating_count > 0"
+            ).fetchall()
+
+        return [tuple(row) for row in await self._call(read)]
+
+    async def get_game_category(
+        self, game_id: str
+    ) -> Optional[Tuple[Optional[str], datetime]]:
+        """Cached (category, fetched_at) of a game, or None if never fetched."""
+
+        def read(connection):
+            return connection.execute(
+                "SELECT category, fetched_at FROM game_categories WHERE game_id = ?",
+                (game_id,),
+            ).fetchone()
+
+        row = await self._call(read)
+        return (
+            (row["category"], datetime.fromisoformat(row["fetched_at"]))
+            if row
+            else None
+        )
+
+    async def set_game_category(self, game_id: str, category: Optional[str]):
+        def write(connection):
+            connection.execute(
+                "INSERT INTO game_categories (game_id, category, fetched_at) "
+                "VALUES (?, ?, ?) ON CONFLICT (game_id) DO UPDATE SET "
+                "category = excluded.category, fetched_at = excluded.fetched_at",
+                (game_id, category, datetime.now().isoformat()),
+            )
+
+        await self._call(write)
+
+    async def add_comment(self, comment: Dict[str, Any]) -> Dict[str, Any]:
+        comment = {"moderation_status": _decided_status(comment), **comment}
+        row = _encode(comment)
+
+        def write(connection):
+            connection.execute(
+                "INSERT INTO comments (comment_id, game_id, user_id, comment_text, "
+                "is_moderated, moderation_status, created_at) VALUES (:comment_id, "
+                ":game_id, :user_id, :comment_text, :is_moderated, "
+                ":moderation_status, :created_at)",
+                row,
+            )
+
+        await self._call(write)
+        return comment
+
+    async def set_comment_moderation(
+        self, comment_id: str, is_moderated: bool
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Record the moderation result of a pending comment.
+
+        Returns:
+            The updated comment, or None if it is missing or not pending
+        """
+        params = (
+            int(is_moderated),
+            REJECTED if is_moderated else APPROVED,
+            comment_id,
+            PENDING,
+        )
+
+        def write(connection):
+            row = connection.execute(
+                "UPDATE comments SET is_moderated = ?, moderation_status = ? "
+                "WHERE comment_id = ? AND moderation_status = ? RETURNING *",
+                params,
+            ).fetchone()
+            return _decode(row) if row else None
+
+        return await self._call(write)
+
+    async def pending_comments(
+        self, limit: int, after: Optional[FeedKey] = None
+    ) -> List[Dict[str, Any]]:
+        """Comments awaiting moderation, oldest first, after a (created_at, comment_id)."""
+        # Literal status, so the planner can use the partial index
+        query = f"SELECT * FROM comments WHERE moderation_status = '{PENDING}'"
+        params: list = []
+        if after:
+            query += " AND (created_at, comment_id) > (?, ?)"
+            params += [after[0].isoformat(), after[1]]
+        query += " ORDER BY created_at, comment_id LIMIT ?"
+        params.append(limit)
+
+        def read(connection):
+            return [_decode(row) for row in connection.execute(query, params)]
+
+        return await self._call(read)
+
+    async def get_comment(self, comment_id: str) -> Optional[Dict[str, Any]]:
+        def read(connection):
+            row = connection.execute(
+                "SELECT * FROM comments WHERE comment_id = ?", (comment_id,)
+            ).fetchone()
+            return _decode(row) if row else None
+
+        return await self._call(read)
+
+    async def list_comments(
+        self, game_id: str, limit: int, before: Optional[FeedKey] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Approved comments of a game, newest first.
+
+        Args:
+            game_id: Game ID
+            limit: Maximum number of comments
+            before: Only comments sorting before this (created_at, comment_id)
+        """
+        query = "SELECT * FROM comments WHERE game_id = ? AND moderation_status = ?"
+        params: list = [game_id, APPROVED]
+        if before:
+            # Row-value comparison is a range scan on ix_comments_game_id_created_at
+            query += " AND (created_at, comment_id) < (?, ?)"
+            params += [before[0].isoformat(), before[1]]
+        query += " ORDER BY created_at DESC, comment_id DESC LIMIT ?"
+        params.append(limit)
+
+        def read(connection):
+            return [_decode(row) for row in connection.execute(query, params)]
+
+        return await self._call(read)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def create_store(kind: str = RATING_STORE, path: str = RATING_DB_PATH):
+    """
+    Build the configured store.
+
+    Raises:
+        ValueError: If kind is not "sqlite" or "memory"
+    """
+    if kind == "sqlite":
+        return SQLiteRatingStore(path)
+    if kind == "memory":
+        return InMemoryRatingStore()
+    raise ValueError(f"Unknown RATING_STORE {kind!r}, expected sqlite or memory")
+
+
+# Global instance
+rating_store = create_store()
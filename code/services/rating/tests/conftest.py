@@ -0,0 +1,10 @@
+"""Pytest configuration for Rating service tests."""
+
+import os
+import sys
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the store in memory (must be set before the storage module is imported)
+os.environ.setdefault("RATING_DB_PATH", ":memory:")
@@ -3,11 +3,15 @@
 These tests verify rating and comment functionality with mocked Perspective API.
 """
 
+import asyncio
+
 import pytest
 from unittest.mock import AsyncMock, patch
 from fastapi.testclient import TestClient
 
+from leaderboard import Leaderboard
 from main import app
+from moderation import moderation_worker
 
 
 @pytest.fixture
@@ -19,7 +23,7 @@ def client():
 @pytest.fixture
 def mock_perspective_api():
     """Mock Perspective API."""
-    with patch("main.perspective_api") as mock:
+    with patch.object(moderation_worker, "api") as mock:
         yield mock
 
 
@@ -42,6 +46,24 @@ class TestRatingComponent:
             assert data["rating"] == 5
             assert "rating_id" in data
 
+    def test_re_rating_is_published_as_a_new_event(self, client):
+        """A re-rating keeps the rating_id but must not look like a duplicate."""
+        with (
+            patch("main.update_game_rating"),
+            patch("main.publish_event", AsyncMock()) as publish,
+        ):
+            for rating in (2, 5):
+                client.post(
+                    "/api/v1/ratings",
+                    json={"game_id": "game-9", "user_id": "user-9", "rating": rating},
+                )
+
+        first, second = publish.call_args_list
+        assert first.args[1]["rating_id"] == second.args[1]["rating_id"]
+        assert second.args[1]["rating"] == 5
+        assert first.kwargs.get("event_id") is None
+        assert second.kwargs.get("event_id") is None
+
     def test_leave_comment_approved(self, client, mock_perspective_api):
         """Test leaving a comment that gets approved by moderation."""
         # Mock Perspective API to return non-toxic comment
@@ -68,7 +90,7 @@ class TestRatingComponent:
         assert data["is_moderated"] is False
 
     def test_leave_comment_toxic(self, client, mock_perspective_api):
-        """Test leaving a toxic comment that gets moderated."""
+        """Test an ambiguous comment that is moderated asynchronously."""
         # Mock Perspective API to return toxic comment
         mock_perspective_api.analyze_comment = AsyncMock(
             return_value=(
@@ -87,7 +109,46 @@ class TestRatingComponent:
         )
         assert response.status_code == 201
         data = response.json()
-        assert data["is_moderated"] is True
+        assert data["is_moderated"] is None
+        assert data["moderation_status"] == "pending"
+        mock_perspective_api.analyze_comment.assert_not_called()
+        pending = client.get(f"/api/v1/comments/{data['comment_id']}").json()
+        assert pending["is_moderated"] is None
+
+        # The moderation worker consumes the comment.left event
+        with patch("moderation.publish_event", AsyncMock()) as publish:
+            asyncio.run(
+                moderation_worker.handle_comment_left(
+                    {"comment_id": data["comment_id"], "moderation_status": "pending"}
+                )
+            )
+
+        comment = client.get(f"/api/v1/comments/{data['comment_id']}").json()
+        assert comment["is_moderated"] is True
+        assert comment["moderation_status"] == "rejected"
+        publish.assert_awaited_once()
+        assert publish.call_args.args[0] == "comment.moderated"
+
+    def test_comment_prefilter_skips_remote_api(self, client, mock_perspective_api):
+        """Test that clearly clean or toxic comments skip the Perspective API."""
+        mock_perspective_api.analyze_comment = AsyncMock()
+
+        clean = client.post(
+            "/api/v1/comments",
+            json={"game_id": "game-123", "user_id": "user-456", "comment_text": "Fun"},
+        )
+        toxic = client.post(
+            "/api/v1/comments",
+            json={
+                "game_id": "game-123",
+                "user_id": "user-456",
+                "comment_text": "The dev is an 1d10t",
+            },
+        )
+
+        assert clean.json()["is_moderated"] is False
+        assert toxic.json()["is_moderated"] is True
+        mock_perspective_api.analyze_comment.assert_not_called()
 
     def test_get_rating(self, client):
         """Test getting rating information."""
@@ -132,3 +193,64 @@ class TestRatingComponent:
         data = response.json()
         assert data["comment_id"] == comment_id
         assert data["comment_text"] == "Nice game"
+
+    def test_list_game_comments(self, client):
+        """Test paging through a game's comments, newest first."""
+        for i in range(5):
+            client.post(
+                "/api/v1/comments",
+                json={
+                    "game_id": "game-feed",
+                    "user_id": "user-456",
+                    # The pre-filter moderates the third one
+                    "comment_text": "Comment 2, idiot" if i == 2 else f"Comment {i}",
+                },
+            )
+
+        texts = []
+        params = {"limit": 2}
+        while True:
+            response = client.get("/api/v1/games/game-feed/comments", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            texts += [c["comment_text"] for c in page["items"]]
+            if not page["next_cursor"]:
+                break
+            params["cursor"] = page["next_cursor"]
+
+        # The moderated comment is left out
+        assert texts == ["Comment 4", "Comment 3", "Comment 1", "Comment 0"]
+
+    def test_list_game_comments_invalid_cursor(self, client):
+        """Test that a malformed cursor is rejected."""
+        response = client.get(
+            "/api/v1/games/game-feed/comments", params={"cursor": "not-a-cursor"}
+        )
+        assert response.status_code == 400
+
+    def test_leaderboard(self, client):
+        """Test reading the top games of a category."""
+        board = Leaderboard()
+        board.update("game-1", "party", 40, 4.5)
+        board.update("game-2", "party", 1, 5.0)
+        board.update("game-3", "strategy", 100, 4.9)
+
+        with patch("main.leaderboard", board):
+            response = client.get(
+                "/api/v1/leaderboard", params={"category": "party", "n": 1}
+            )
+            overall = client.get("/api/v1/leaderboard")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["category"] == "party"
+        assert [item["game_id"] for item in data["items"]] == ["game-1"]
+        assert [item["game_id"] for item in overall.json()["items"]] == [
+            "game-3",
+            "game-1",
+            "game-2",
+        ]
+
+    def test_leaderboard_invalid_n(self, client):
+        """Test that n is bounded."""
+        assert client.get("/api/v1/leaderboard", params={"n": 0}).status_code == 422
@@ -1,9 +1,30 @@
+import asyncio
+import bisect
+import json
+import random
+import sqlite3
+
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from main import update_game_rating
+from comment_feed import CommentFeed
+from event_codec import encode_event
+from leaderboard import Leaderboard, SortedKeys
+from main import game_locks, store_rating, update_game_rating
+from moderation import ModerationWorker, RateLimiter
 from perspective_api import MockPerspectiveAPI
+from rabbitmq_client import Consumer
+from storage import InMemoryRatingStore, SQLiteRatingStore, create_store
+from toxicity_filter import (
+    AMBIGUOUS,
+    CLEAN,
+    TOXIC,
+    AhoCorasick,
+    ToxicityFilter,
+    load_lexicon,
+    parse_lexicon,
+)
 
 
 class TestUpdateGameRating:
@@ -48,43 +69,121 @@ class TestUpdateGameRating:
 
     @pytest.mark.asyncio
     async def test_update_game_rating_with_ratings(self):
-        # Mock the ratings_db and httpx client
+        store = InMemoryRatingStore()
+        board = Leaderboard(prior_mean=3.0, prior_votes=2)
+        # Mock the store, leaderboard and httpx client
         with (
-            patch(
-                "main.ratings_db",
-                {
-                    "rating1": {
-                        "rating_id": "rating1",
-                        "game_id": "game-123",
-                        "rating": 5,
-                    },
-                    "rating2": {
-                        "rating_id": "rating2",
-                        "game_id": "game-123",
-                        "rating": 4,
-                    },
-                },
-            ),
+            patch("main.rating_store", store),
+            patch("main.leaderboard", board),
             patch("httpx.AsyncClient") as mock_client,
         ):
             mock_response = MagicMock()
             mock_response.status_code = 200
-            mock_client.return_value.__aenter__.return_value.put = AsyncMock(
-                return_value=mock_response
+            mock_response.json.return_value = {"category": "strategy"}
+            client = mock_client.return_value.__aenter__.return_value
+            client.get = AsyncMock(return_value=mock_response)
+            client.put = AsyncMock(return_value=mock_response)
+
+            for user_id, rating in (("user1", 5), ("user2", 4)):
+                stored, avg_rating = await store_rating(
+                    {
+                        "rating_id": f"rating-{user_id}",
+                        "game_id": "game-123",
+                        "user_id": user_id,
+                        "rating": rating,
+                        "created_at": datetime.now(),
+                    }
+                )
+            assert stored["rating_id"] == "rating-user2"
+            assert avg_rating == 4.5
+            await update_game_rating("game-123", avg_rating)
+
+            # Verify HTTP call was made with the average
+            client.put.assert_called_once()
+            assert client.put.call_args.kwargs["json"] == {"rating": 4.5}
+            # The category is fetched once and cached
+            client.get.assert_called_once()
+
+        assert (await store.get_game_category("game-123"))[0] == "strategy"
+        assert board.top("strategy") == [
+            {
+                "rank": 1,
+                "game_id": "game-123",
+                "category": "strategy",
+                "score": 3.75,
+                "rating_count": 2,
+                "average_rating": 4.5,
+            }
+        ]
+        assert game_locks == {}
+
+    @pytest.mark.asyncio
+    async def test_slow_category_fetch_does_not_rank_older_stats(self):
+        store = InMemoryRatingStore()
+        board = Leaderboard(prior_mean=3.0, prior_votes=2)
+        delays = [0.05, 0.0]
+
+        async def get(url):
+            await asyncio.sleep(delays.pop(0))
+            response = MagicMock()
+            response.json.return_value = {"category": "strategy"}
+            return response
+
+        async def rate(user_id, rating):
+            await store_rating(
+                {
+                    "rating_id": f"rating-{user_id}",
+                    "game_id": "game-123",
+                    "user_id": user_id,
+                    "rating": rating,
+                    "created_at": datetime.now(),
+                }
             )
 
-            await update_game_rating("game-123")
+        with (
+            patch("main.rating_store", store),
+            patch("main.leaderboard", board),
+            patch("httpx.AsyncClient") as mock_client,
+        ):
+            client = mock_client.return_value.__aenter__.return_value
+            client.get = get
+            client.put = AsyncMock()
 
-            # Verify HTTP call was made
-            mock_client.return_value.__aenter__.return_value.put.assert_called_once()
+            # The first rating's catalog lookup finishes after the second's
+            await asyncio.gather(rate("user1", 5), rate("user2", 1))
+
+        [entry] = board.top(None)
+        assert entry["rating_count"] == 2
+        assert entry["average_rating"] == 3.0
 
     @pytest.mark.asyncio
-    async def test_update_game_rating_no_ratings(self):
-        with patch("main.ratings_db", {}), patch("httpx.AsyncClient") as mock_client:
-            await update_game_rating("game-123")
+    async def test_rating_waits_only_for_its_own_game(self):
+        store = InMemoryRatingStore()
+        written = []
+        upsert = store.upsert_rating
+
+        async def slow_upsert(rating):
+            if rating["game_id"] == "slow-game":
+                await asyncio.sleep(0.05)
+            written.append(rating["game_id"])
+            return await upsert(rating)
+
+        with (
+            patch("main.rating_store", store),
+            patch("main.leaderboard", Leaderboard()),
+            patch("main.game_category", AsyncMock(return_value=None)),
+            patch.object(store, "upsert_rating", slow_upsert),
+        ):
+            await asyncio.gather(
+                store_rating(make_rating("user1", "slow-game", 5)),
+                store_rating(make_rating("user2", "slow-game", 4)),
+                store_rating(make_rating("user1", "fast-game", 3)),
+            )
 
-            # Should not make HTTP call if no ratings
-            mock_client.return_value.__aenter__.return_value.put.assert_not_called()
+        # The other game is not held up by the slow one's lock
+        assert written == ["fast-game", "slow-game", "slow-game"]
+        assert await store.game_rating_stats("slow-game") == (2, 4.5)
+        assert game_locks == {}
 
 
 class TestMockPerspectiveAPI:
@@ -190,3 +289,616 @@ class TestCommentLogic:
 
         assert moderated_comment["is_moderated"] is True
         assert non_moderated_comment["is_moderated"] is False
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request):
+    store = create_store(request.param, ":memory:")
+    yield store
+    store.close()
+
+
+def make_rating(user_id, game_id, rating, rating_id=None):
+    return {
+        "rating_id": rating_id or f"{user_id}-{game_id}",
+        "game_id": game_id,
+        "user_id": user_id,
+        "rating": rating,
+        "created_at": datetime.now(),
+    }
+
+
+class TestRatingStore:
+    @pytest.mark.asyncio
+    async def test_rerating_updates_in_place(self, store):
+        first, count, total = await store.upsert_rating(
+            make_rating("user1", "game-1", 2, "r1")
+        )
+        assert (count, total) == (1, 2)
+        second, count, total = await store.upsert_rating(
+            make_rating("user1", "game-1", 5, "r2")
+        )
+        assert (count, total) == (1, 5)
+        _, count, total = await store.upsert_rating(make_rating("user2", "game-1", 4))
+        assert (count, total) == (2, 9)
+
+        assert second["rating_id"] == first["rating_id"] == "r1"
+        assert second["rating"] == 5
+        assert second["created_at"] == first["created_at"]
+        assert second["updated_at"] is not None
+        assert await store.get_rating("r2") is None
+        assert (await store.get_rating("r1"))["rating"] == 5
+
+    @pytest.mark.asyncio
+    async def test_game_rating_stats(self, store):
+        await store.upsert_rating(make_rating("user1", "game-1", 5))
+        await store.upsert_rating(make_rating("user2", "game-1", 4))
+        await store.upsert_rating(make_rating("user2", "game-1", 2))
+        await store.upsert_rating(make_rating("user1", "game-2", 1))
+
+        assert await store.game_rating_stats("game-1") == (2, 3.5)
+        assert await store.game_rating_stats("game-2") == (1, 1.0)
+        assert await store.game_rating_stats("game-3") == (0, None)
+
+    @pytest.mark.asyncio
+    async def test_comment_roundtrip(self, store):
+        comment = {
+            "comment_id": "c1",
+            "game_id": "game-1",
+            "user_id": "user1",
+            "comment_text": "Nice",
+            "is_moderated": False,
+            "created_at": datetime.now(),
+        }
+        await store.add_comment(comment)
+
+        assert await store.get_comment("c1") == {
+            **comment,
+            "moderation_status": "approved",
+        }
+        assert await store.get_comment("missing") is None
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            create_store("postgres")
+
+
+class TestSQLiteRatingStore:
+    @pytest.mark.asyncio
+    async def test_persists_across_reopen(self, tmp_path):
+        path = str(tmp_path / "rating.db")
+        store = SQLiteRatingStore(path)
+        await store.upsert_rating(make_rating("user1", "game-1", 4, "r1"))
+        store.close()
+
+        store = SQLiteRatingStore(path)
+        assert (await store.get_rating("r1"))["rating"] == 4
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_game_totals_filled_for_existing_ratings(self, tmp_path):
+        path = str(tmp_path / "rating.db")
+        store = SQLiteRatingStore(path)
+        await store.upsert_rating(make_rating("user1", "game-1", 4))
+        await store.upsert_rating(make_rating("user2", "game-1", 1))
+        # A database from before the totals table
+        store._connection.execute("DROP TABLE game_rating_totals")
+        store.close()
+
+        store = SQLiteRatingStore(path)
+        assert await store.game_rating_stats("game-1") == (2, 2.5)
+        _, count, total = await store.upsert_rating(make_rating("user3", "game-1", 4))
+        assert (count, total) == (3, 9)
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_game_queries_use_index(self):
+        store = SQLiteRatingStore(":memory:")
+        await store.game_rating_stats("game-1")
+        plan = store._connection.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*), AVG(rating) FROM ratings "
+            "WHERE game_id = ?",
+            ("game-1",),
+        ).fetchall()
+        store.close()
+
+        assert "ix_ratings_game_id_created_at" in " ".join(row[3] for row in plan)
+
+
+def make_comment(comment_id, game_id, created_at, is_moderated=False):
+    return {
+        "comment_id": comment_id,
+        "game_id": game_id,
+        "user_id": "user1",
+        "comment_text": f"Comment {comment_id}",
+        "is_moderated": is_moderated,
+        "created_at": created_at,
+    }
+
+
+class TestListComments:
+    @pytest.mark.asyncio
+    async def test_newest_first_by_cursor(self, store):
+        start = datetime(2024, 1, 1)
+        for i in range(5):
+            await store.add_comment(
+                make_comment(f"c{i}", "game-1", start + timedelta(minutes=i))
+            )
+        # Same timestamp: comment_id breaks the tie
+        await store.add_comment(
+            make_comment("c3b", "game-1", start + timedelta(minutes=3))
+        )
+        await store.add_comment(make_comment("other", "game-2", start))
+        await store.add_comment(
+            make_comment("hidden", "game-1", start + timedelta(minutes=9), True)
+        )
+
+        first = await store.list_comments("game-1", 3)
+        assert [c["comment_id"] for c in first] == ["c4", "c3b", "c3"]
+
+        last = first[-1]
+        rest = await store.list_comments(
+            "game-1", 10, (last["created_at"], last["comment_id"])
+        )
+        assert [c["comment_id"] for c in rest] == ["c2", "c1", "c0"]
+
+
+class TestCommentFeed:
+    @pytest.mark.asyncio
+    async def test_first_page_cached_until_invalidated(self):
+        store = InMemoryRatingStore()
+        feed = CommentFeed(store, page_size=3)
+        start = datetime(2024, 1, 1)
+        for i in range(4):
+            await store.add_comment(
+                make_comment(f"c{i}", "game-1", start + timedelta(minutes=i))
+            )
+
+        comments, more = await feed.page("game-1", 2)
+        assert [c["comment_id"] for c in comments] == ["c3", "c2"]
+        assert more is True
+        comments, more = await feed.page("game-1", 3)
+        assert [c["comment_id"] for c in comments] == ["c3", "c2", "c1"]
+        assert more is True
+        assert (feed.hits, feed.misses) == (1, 1)
+
+        await store.add_comment(
+            make_comment("c4", "game-1", start + timedelta(hours=1))
+        )
+        comments, _ = await feed.page("game-1", 1)
+        assert comments[0]["comment_id"] == "c3"  # still cached
+
+        feed.invalidate("game-1")
+        comments, _ = await feed.page("game-1", 1)
+        assert comments[0]["comment_id"] == "c4"
+        assert feed.misses == 2
+
+    @pytest.mark.asyncio
+    async def test_read_racing_invalidation_is_not_cached(self):
+        store = InMemoryRatingStore()
+        feed = CommentFeed(store)
+        list_comments = store.list_comments
+
+        async def slow_list(*args):
+            comments = await list_comments(*args)
+            feed.invalidate("game-1")  # a comment lands mid-read
+            return comments
+
+        with patch.object(store, "list_comments", slow_list):
+            await feed.page("game-1", 10)
+        await feed.page("game-1", 10)
+
+        assert feed.misses == 2
+
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_read_game(self):
+        feed = CommentFeed(InMemoryRatingStore(), max_games=2)
+        for game_id in ("game-1", "game-2", "game-1", "game-3", "game-1"):
+            await feed.page(game_id, 10)
+
+        assert (feed.hits, feed.misses) == (2, 3)
+        await feed.page("game-2", 10)
+        assert feed.misses == 4
+
+
+class TestAhoCorasick:
+    def test_overlapping_matches(self):
+        matcher = AhoCorasick(["he", "she", "his", "hers"])
+        matches = sorted(matcher.iter_matches("ushers"))
+
+        assert matches == [(1, 4, 1), (2, 4, 0), (2, 6, 3)]
+
+    def test_no_match(self):
+        assert list(AhoCorasick(["abc"]).iter_matches("ababab")) == []
+
+
+class TestToxicityFilter:
+    @pytest.fixture
+    def toxicity(self):
+        return ToxicityFilter(
+            parse_lexicon(["idiot*", "shut up 0.9", "bad 0.4", "terrible 0.5"])
+        )
+
+    def test_clean(self, toxicity):
+        result = toxicity.classify("Great game! Highly recommend it.")
+        assert result.verdict == CLEAN
+        assert result.score == 0.0
+
+    def test_toxic(self, toxicity):
+        assert toxicity.classify("What an IDIOT").verdict == TOXIC
+        assert toxicity.classify("idiots everywhere").verdict == TOXIC
+        assert toxicity.classify("shut up").verdict == TOXIC
+
+    def test_weak_terms_are_ambiguous(self, toxicity):
+        result = toxicity.classify("This game is bad and terrible")
+        assert result.verdict == AMBIGUOUS
+        assert result.score == 0.7
+        assert sorted(result.matches) == ["bad", "terrible"]
+
+    def test_whole_words_only(self, toxicity):
+        assert toxicity.classify("Got the badge, no terribleness").verdict == CLEAN
+
+    def test_obfuscation_is_folded(self, toxicity):
+        # Cyrillic lookalikes, leetspeak, fullwidth letters and a zero-width space
+        for text in ("\u0456d\u0456\u043et", "1d10t", "ｉｄｉｏｔ", "id\u200biot"):
+            assert toxicity.classify(text).verdict == TOXIC, text
+
+    def test_mixed_script_word_is_ambiguous(self, toxicity):
+        assert toxicity.classify("G\u043e\u043ed game").verdict == AMBIGUOUS
+        assert toxicity.classify("Хорошая игра, good game").verdict == CLEAN
+
+    def test_invalid_weight(self):
+        with pytest.raises(ValueError):
+            parse_lexicon(["idiot 2"])
+
+    def test_bundled_lexicon_loads(self):
+        terms = load_lexicon()
+        assert len(terms) > 50
+        assert all(0 < term.weight <= 1 for term in terms)
+
+
+class TestSortedKeys:
+    def test_matches_sorted_list(self):
+        rng = random.Random(7)
+        with patch.object(SortedKeys, "CHUNK_SIZE", 4):
+            keys = SortedKeys([(rng.random(), 0, str(i)) for i in range(30)])
+            expected = sorted(keys.head(30))
+            for i in range(500):
+                if expected and rng.random() < 0.5:
+                    key = expected.pop(rng.randrange(len(expected)))
+                    keys.remove(key)
+                else:
+                    key = (rng.random(), 0, f"new-{i}")
+                    keys.add(key)
+                    bisect.insort(expected, key)
+
+                assert len(keys) == len(expected)
+                assert keys.head(len(expected) + 1) == expected
+                assert keys.head(3) == expected[:3]
+
+
+class TestLeaderboard:
+    def test_few_votes_do_not_outrank_established_games(self):
+        board = Leaderboard(prior_mean=3.0, prior_votes=10)
+        board.update("newcomer", "party", 1, 5.0)
+        board.update("classic", "party", 200, 4.6)
+        board.update("flop", "party", 50, 2.0)
+
+        assert [e["game_id"] for e in board.top("party")] == [
+            "classic",
+            "newcomer",
+            "flop",
+        ]
+        assert board.top("party")[1]["score"] == pytest.approx(3.1818, abs=1e-4)
+
+    def test_update_moves_game_between_categories(self):
+        board = Leaderboard()
+        board.update("game-1", "party", 10, 4.0)
+        board.update("game-2", "strategy", 10, 3.5)
+        board.update("game-1", "strategy", 11, 4.1)
+
+        assert board.top("party") == []
+        assert [e["game_id"] for e in board.top("strategy")] == ["game-1", "game-2"]
+        assert [e["game_id"] for e in board.top()] == ["game-1", "game-2"]
+        assert len(board) == 2
+
+    def test_top_n(self):
+        board = Leaderboard()
+        for i in range(20):
+            board.update(f"game-{i:02}", None, 10 + i, 4.0)
+
+        top = board.top(n=3)
+        assert [e["game_id"] for e in top] == ["game-19", "game-18", "game-17"]
+        assert [e["rank"] for e in top] == [1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def test_rebuild_matches_incremental_updates(self, store):
+        incremental = Leaderboard()
+        for user_id, game_id, rating in [
+            ("u1", "g1", 5),
+            ("u2", "g1", 3),
+            ("u1", "g2", 4),
+            ("u3", "g3", 1),
+        ]:
+            await store.upsert_rating(make_rating(user_id, game_id, rating))
+            await store.set_game_category(game_id, "party" if game_id != "g3" else None)
+            count, average = await store.game_rating_stats(game_id)
+            incremental.update(
+                game_id, (await store.get_game_category(game_id))[0], count, average
+            )
+
+        rebuilt = Leaderboard()
+        rebuilt.rebuild(await store.all_game_stats())
+
+        assert rebuilt.top() == incremental.top()
+        assert rebuilt.top("party") == incremental.top("party")
+
+
+class FakeChannel:
+    """Records acks like a broker: multiple acks cover every earlier tag."""
+
+    def __init__(self):
+        self.unacked = []
+        self.acked = []
+        self.requeued = []
+        self.ack_frames = 0
+
+    def message(self, event):
+        message = FakeMessage(self, len(self.unacked) + len(self.acked) + 1, event)
+        self.unacked.append(message.delivery_tag)
+        return message
+
+    def ack(self, delivery_tag, multiple):
+        # Acking an unknown tag closes a real channel
+        assert delivery_tag in self.unacked
+        tags = (
+            [t for t in self.unacked if t <= delivery_tag]
+            if multiple
+            else [delivery_tag]
+        )
+        self.unacked = [t for t in self.unacked if t not in tags]
+        self.acked.extend(tags)
+        self.ack_frames += 1
+
+    def nack(self, delivery_tag):
+        self.unacked.remove(delivery_tag)
+        self.requeued.append(delivery_tag)
+
+
+class FakeMessage:
+    def __init__(self, channel, delivery_tag, event):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = json.dumps(event).encode()
+        self.headers = {"event_type": "comment.left"}
+        self.content_type = "application/json"
+        self.content_encoding = None
+        self.message_id = None
+
+    async def ack(self, multiple=False):
+        self.channel.ack(self.delivery_tag, multiple)
+
+    async def nack(self, requeue=True):
+        self.channel.nack(self.delivery_tag)
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+class TestConsumer:
+    @pytest.mark.asyncio
+    async def test_bounded_concurrency(self):
+        running = 0
+        peak = 0
+
+        async def handler(event):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if event["n"] == 3:
+                raise ValueError("broken event")
+
+        channel = FakeChannel()
+        messages = [channel.message({"n": n}) for n in range(10)]
+        consumer = Consumer("test_queue", handler, concurrency=4)
+        await consumer.process(iterate(messages))
+
+        assert peak == 4
+        # Failed handlers are logged and acked too
+        assert sorted(channel.acked) == list(range(1, 11))
+        assert consumer.metrics()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_cancel_requeues_running(self):
+        started = asyncio.Event()
+        channel = FakeChannel()
+        message = channel.message({"n": 0})
+
+        async def handler(event):
+            started.set()
+            await asyncio.sleep(10)
+
+        async def messages():
+            yield message
+            await asyncio.sleep(10)
+
+        consumer = Consumer("test_queue", handler, concurrency=2)
+        task = asyncio.create_task(consumer.process(messages()))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert channel.requeued == [1]
+        assert channel.acked == []
+
+    @pytest.mark.asyncio
+    async def test_decodes_binary_events(self):
+        received = []
+        channel = FakeChannel()
+        message = channel.message({})
+        event = {"comment_id": "c1", "moderation_status": "pending"}
+        message.body, message.content_type, message.content_encoding = encode_event(
+            "comment.left", event, "msgpack"
+        )
+
+        consumer = Consumer("test_queue", received.append)
+        await consumer.process(iterate([message]))
+
+        assert received == [
+            {
+                "comment_id": "c1",
+                "game_id": None,
+                "user_id": None,
+                "is_moderated": None,
+                "moderation_status": "pending",
+            }
+        ]
+
+
+class TestRateLimiter:
+    @pytest.mark.asyncio
+    async def test_waits_for_tokens(self):
+        now = [0.0]
+        limiter = RateLimiter(rate=2, burst=2, clock=lambda: now[0])
+        await limiter.acquire()
+        await limiter.acquire()
+
+        sleeps = []
+
+        async def fake_sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        with patch("moderation.asyncio.sleep", fake_sleep):
+            await limiter.acquire()
+
+        assert sleeps == [0.5]
+
+
+class TestModerationWorker:
+    @pytest.fixture
+    def worker(self, store):
+        api = MagicMock()
+        api.analyze_comment = AsyncMock(return_value=(False, {"toxicity": 0.2}))
+        with patch("moderation.publish_event", AsyncMock()) as publish:
+            worker = ModerationWorker(store, api, workers=2, rate_limit=0)
+            worker.publish = publish
+            yield worker
+
+    @pytest.mark.asyncio
+    async def test_approved_comment_enters_feed(self, worker, store):
+        comment = make_comment("c1", "game-1", datetime(2024, 1, 1))
+        await store.add_comment({**comment, "moderation_status": "pending"})
+        assert await store.list_comments("game-1", 10) == []
+
+        await worker.handle_comment_left(
+            {"comment_id": "c1", "moderation_status": "pending"}
+        )
+
+        feed = await store.list_comments("game-1", 10)
+        assert [c["comment_id"] for c in feed] == ["c1"]
+        assert feed[0]["moderation_status"] == "approved"
+        assert worker.publish.call_args.args[1]["moderation_status"] == "approved"
+
+    @pytest.mark.asyncio
+    async def test_redelivered_event_is_ignored(self, worker, store):
+        comment = make_comment("c1", "game-1", datetime(2024, 1, 1))
+        await store.add_comment({**comment, "moderation_status": "pending"})
+        event = {"comment_id": "c1", "moderation_status": "pending"}
+
+        await worker.handle_comment_left(event)
+        await worker.handle_comment_left(event)
+        # Comments decided by the pre-filter are not moderated again
+        await worker.handle_comment_left(
+            {"comment_id": "c1", "moderation_status": "approved"}
+        )
+
+        worker.api.analyze_comment.assert_awaited_once()
+        assert worker.moderated == 1
+
+    @pytest.mark.asyncio
+    async def test_resume_moderates_pending_comments(self, worker, store):
+        start = datetime(2024, 1, 1)
+        for i in range(5):
+            await store.add_comment(
+                {
+                    **make_comment(f"c{i}", "game-1", start + timedelta(minutes=i)),
+                    "moderation_status": "pending" if i % 2 else "approved",
+                }
+            )
+
+        with patch("moderation.MODERATION_RESUME_CHUNK_SIZE", 1):
+            assert await worker.resume() == 2
+
+        assert await store.pending_comments(10) == []
+        assert worker.moderated == 2
+
+
+class TestCommentsMigration:
+    @pytest.mark.asyncio
+    async def test_moderation_status_added_to_existing_table(self, tmp_path):
+        path = str(tmp_path / "rating.db")
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "CREATE TABLE comments (comment_id TEXT PRIMARY KEY, game_id TEXT NOT NULL, "
+            "user_id TEXT NOT NULL, comment_text TEXT NOT NULL, "
+            "is_moderated INTEGER NOT NULL, created_at TEXT NOT NULL)"
+        )
+        for comment_id, is_moderated in (("ok", 0), ("toxic", 1)):
+            connection.execute(
+                "INSERT INTO comments VALUES (?, 'game-1', 'user1', 'text', ?, ?)",
+                (comment_id, is_moderated, datetime(2024, 1, 1).isoformat()),
+            )
+        connection.commit()
+        connection.close()
+
+        store = SQLiteRatingStore(path)
+        assert (await store.get_comment("ok"))["moderation_status"] == "approved"
+        assert (await store.get_comment("toxic"))["moderation_status"] == "rejected"
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_pending_comments_lose_is_moderated_flag(self, tmp_path):
+        path = str(tmp_path / "rating.db")
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "CREATE TABLE comments (comment_id TEXT PRIMARY KEY, game_id TEXT NOT NULL, "
+            "user_id TEXT NOT NULL, comment_text TEXT NOT NULL, "
+            "is_moderated INTEGER NOT NULL, moderation_status TEXT NOT NULL "
+            "DEFAULT 'approved', created_at TEXT NOT NULL)"
+        )
+        for comment_id, is_moderated, moderation_status in (
+            ("ok", 0, "approved"),
+            ("toxic", 1, "rejected"),
+            ("waiting", 0, "pending"),
+        ):
+            connection.execute(
+                "INSERT INTO comments VALUES (?, 'game-1', 'user1', 'text', ?, ?, ?)",
+                (
+                    comment_id,
+                    is_moderated,
+                    moderation_status,
+                    datetime(2024, 1, 1).isoformat(),
+                ),
+            )
+        connection.commit()
+        connection.close()
+
+        store = SQLiteRatingStore(path)
+        assert (await store.get_comment("ok"))["is_moderated"] is False
+        assert (await store.get_comment("toxic"))["is_moderated"] is True
+        assert (await store.get_comment("waiting"))["is_moderated"] is None
+        assert [c["comment_id"] for c in await store.pending_comments(10)] == [
+            "waiting"
+        ]
+        await store.add_comment(
+            make_comment("new", "game-1", datetime(2024, 1, 2), is_moderated=None)
+        )
+        assert (await store.get_comment("new"))["moderation_status"] == "pending"
+        assert await store.set_comment_moderation("new", False) is not None
+        store.close()
@@ -0,0 +1,272 @@
+"""
+Local toxicity pre-filter for comments in Rating service.
+
+Comments are normalized (NFKC, casefold, zero-width characters removed,
+Cyrillic/Greek lookalikes and leetspeak digits folded to Latin letters) and
+scanned once with an Aho-Corasick automaton compiled from the lexicon, so
+the cost depends on the comment length, not on the number of terms.
+
+Every lexicon term has a weight in (0, 1]: 1 for unambiguous insults, lower
+for words that are often harmless ("this boss is brutal"). The weights of
+the distinct terms found are combined as independent signals
+(1 - prod(1 - w)). A comment is
+
+- clean when nothing matched and no word mixes Cyrillic and Latin letters
+  (a common way to dodge filters),
+- toxic when the combined score reaches `TOXICITY_TOXIC_THRESHOLD`,
+- ambiguous otherwise; only these need the remote moderation API.
+
+The lexicon is read from `TOXICITY_LEXICON_PATH`: one term per line,
+optionally followed by whitespace and its weight (default 1). A trailing `*`
+matches the term as a word prefix ("hate*" also matches "hater"); otherwise
+terms match whole words. Lines starting with `#` are comments.
+"""
+
+import os
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+TOXICITY_LEXICON_PATH = os.getenv(
+    "TOXICITY_LEXICON_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "toxicity_lexicon.txt"),
+)
+TOXICITY_TOXIC_THRESHOLD = float(os.getenv("TOXICITY_TOXIC_THRESHOLD", "0.9"))
+
+CLEAN = "clean"
+TOXIC = "toxic"
+AMBIGUOUS = "ambiguous"
+
+# Lookalikes folded to the Latin letter they imitate, and invisible
+# characters dropped. Applied after NFKC and casefold.
+HOMOGLYPHS = {
+    # Cyrillic
+    "а": "a",
+    "в": "b",
+    "е": "e",
+    "ё": "e",
+    "к": "k",
+    "м": "m",
+    "н": "h",
+    "о": "o",
+    "р": "p",
+    "с": "c",
+    "т": "t",
+    "у": "y",
+    "х": "x",
+    "і": "i",
+    "ї": "i",
+    "ј": "j",
+    "ѕ": "s",
+    "ԁ": "d",
+    # Greek
+    "α": "a",
+    "ε": "e",
+    "ι": "i",
+    "κ": "k",
+    "ν": "v",
+    "ο": "o",
+    "ρ": "p",
+    "τ": "t",
+    "υ": "u",
+    # Leetspeak
+    "0": "o",
+    "1": "i",
+    "3": "e",
+    "4": "a",
+    "5": "s",
+    "7": "t",
+    "@": "a",
+    "$": "s",
+}
+INVISIBLE = "\u00ad\u200b\u200c\u200d\u2060"
+
+
+def _fold_table() -> List[Optional[str]]:
+    # A list indexed by code point translates several times faster than a
+    # dict, which raises an internal KeyError for every unmapped character.
+    # Characters past its end are left unchanged.
+    table: List[Optional[str]] = [
+        chr(i) for i in range(max(map(ord, [*HOMOGLYPHS, *INVISIBLE])) + 1)
+    ]
+    for ch, folded in HOMOGLYPHS.items():
+        table[ord(ch)] = folded
+    for ch in INVISIBLE:
+        table[ord(ch)] = None
+    return table
+
+
+FOLD_TABLE = _fold_table()
+
+MIXED_SCRIPT_WORD = re.compile(r"[A-Za-z]\w*[\u0400-\u04ff]|[\u0400-\u04ff]\w*[A-Za-z]")
+
+
+def normalize(text: str) -> str:
+    """Fold a text the same way lexicon terms are folded."""
+    return unicodedata.normalize("NFKC", text).casefold().translate(FOLD_TABLE)
+
+
+def has_mixed_script_word(text: str) -> bool:
+    """Whether a word mixes Cyrillic and Latin letters (before folding)."""
+    return not text.isascii() and MIXED_SCRIPT_WORD.search(text) is not None
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher compiled into a trie with failure links."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: (pattern index, pattern length) of every pattern ending there
+        self._out: List[Tuple[Tuple[int, int], ...]] = [()]
+        for index, pattern in enumerate(patterns):
+            self._add(index, pattern)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def _add(self, index: int, pattern: str):
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] += ((index, len(pattern)),)
+
+    def _link(self):
+        # Breadth-first, so a state's failure target is final before its children
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._out[child] += self._out[self._fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield (start, end, pattern index) for every occurrence in text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        root = goto[0]
+        state = 0
+        for position, ch in enumerate(text, 1):
+            if state:
+                next_state = goto[state].get(ch)
+                while next_state is None:
+                    state = fail[state]
+                    if not state:
+                        next_state = root.get(ch, 0)
+                        break
+                    next_state = goto[state].get(ch)
+                state = next_state
+            else:
+                state = root.get(ch, 0)
+            if out[state]:
+                for index, length in out[state]:
+                    yield position - length, position, index
+
+
+@dataclass(frozen=True)
+class LexiconTerm:
+    """One lexicon entry, already normalized."""
+
+    term: str
+    weight: float
+    prefix: bool = False
+
+
+@dataclass
+class FilterResult:
+    """Pre-filter verdict for one comment."""
+
+    verdict: str
+    score: float
+    matches: List[str] = field(default_factory=list)
+
+
+def parse_lexicon(lines: Iterable[str]) -> List[LexiconTerm]:
+    """
+    Parse lexicon lines (see module docstring).
+
+    Raises:
+        ValueError: If a weight is not in (0, 1]
+    """
+    terms = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        term, weight = line, 1.0
+        parts = line.rsplit(None, 1)
+        if len(parts) == 2:
+            try:
+                term, weight = parts[0], float(parts[1])
+            except ValueError:
+                pass
+        if not 0 < weight <= 1:
+            raise ValueError(f"Invalid weight in lexicon line {line!r}")
+        prefix = term.endswith("*")
+        term = normalize(term.rstrip("*").strip())
+        if term:
+            terms[term, prefix] = LexiconTerm(term, weight, prefix)
+    return list(terms.values())
+
+
+def load_lexicon(path: str = TOXICITY_LEXICON_PATH) -> List[LexiconTerm]:
+    with open(path, encoding="utf-8") as f:
+        return parse_lexicon(f)
+
+
+class ToxicityFilter:
+    """Classifies comments as clean, toxic or ambiguous."""
+
+    def __init__(
+        self,
+        terms: Iterable[LexiconTerm],
+        toxic_threshold: float = TOXICITY_TOXIC_THRESHOLD,
+    ):
+        self.terms = list(terms)
+        self.toxic_threshold = toxic_threshold
+        self._matcher = AhoCorasick(term.term for term in self.terms)
+        self.counts = {CLEAN: 0, TOXIC: 0, AMBIGUOUS: 0}
+
+    def classify(self, text: str) -> FilterResult:
+        folded = normalize(text)
+        size = len(folded)
+        found: Dict[int, LexiconTerm] = {}
+        for start, end, index in self._matcher.iter_matches(folded):
+            term = self.terms[index]
+            # Whole words only, except at the end of prefix terms
+            if start and folded[start - 1].isalnum():
+                continue
+            if not term.prefix and end < size and folded[end].isalnum():
+                continue
+            found[index] = term
+
+        survival = 1.0
+        for term in found.values():
+            survival *= 1 - term.weight
+        score = round(1 - survival, 4)
+
+        if score >= self.toxic_threshold:
+            verdict = TOXIC
+        elif found or has_mixed_script_word(text):
+            verdict = AMBIGUOUS
+        else:
+            verdict = CLEAN
+        self.counts[verdict] += 1
+        return FilterResult(verdict, score, [term.term for term in found.values()])
+
+
+# Global instance
+toxicity_filter = ToxicityFilter(load_lexicon())
@@ -0,0 +1,129 @@
+"""
+Benchmark for the RabbitMQ event consumer runtime.
+
+Runs the same stream of events through the previous consumer loop (one
+message at a time, each acked on its own) and through `Consumer` with an
+increasing handler pool, against in-process messages that count ack frames
+instead of a broker. The handler awaits a fixed latency, like the payment
+saga's database round trips; a second pass with an instant handler shows the
+runtime's own cost per message.
+
+Usage:
+    python benchmarks/bench_consumer.py [events] [handler_latency_seconds]
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rabbitmq_client import Consumer
+
+
+class Channel:
+    def __init__(self):
+        self.ack_frames = 0
+
+
+class Message:
+    def __init__(self, channel: Channel, delivery_tag: int, event):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = json.dumps(event).encode()
+        self.headers = {"event_type": "payment.successful", "published_at": time.time()}
+        self.content_type = "application/json"
+        self.content_encoding = None
+        self.message_id = f"event-{delivery_tag}"
+
+    async def ack(self, multiple=False):
+        self.channel.ack_frames += 1
+
+    async def nack(self, requeue=True):
+        pass
+
+    @asynccontextmanager
+    async def process(self, requeue=False):
+        yield
+        await self.ack()
+
+
+async def messages(channel: Channel, events: int):
+    for i in range(events):
+        yield Message(channel, i + 1, {"order_id": f"order-{i}", "status": "completed"})
+
+
+async def sequential_loop(queue_iter, callback):
+    """The consumer loop before the runtime, as it was in consume_events."""
+    async for message in queue_iter:
+        async with message.process():
+            try:
+                event_data = json.loads(message.body.decode())
+                result = callback(event_data)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error processing event: {e}")
+
+
+def make_handler(latency: float):
+    async def handler(event):
+        await asyncio.sleep(latency)
+
+    async def instant(event):
+        pass
+
+    return handler if latency > 0 else instant
+
+
+async def run_sequential(events: int, latency: float):
+    channel = Channel()
+    started = time.perf_counter()
+    await sequential_loop(messages(channel, events), make_handler(latency))
+    return time.perf_counter() - started, channel.ack_frames, None
+
+
+async def run_consumer(events: int, latency: float, concurrency: int):
+    channel = Channel()
+    consumer = Consumer("bench", make_handler(latency), concurrency)
+    started = time.perf_counter()
+    await consumer.process(messages(channel, events))
+    elapsed = time.perf_counter() - started
+    return elapsed, channel.ack_frames, consumer.metrics()
+
+
+def report(name: str, events: int, result):
+    elapsed, ack_frames, metrics = result
+    line = (
+        f"  {name:<22} {events / elapsed:9.0f} events/s  "
+        f"{elapsed / events * 1e6:8.1f} us/event  {ack_frames:6d} ack frames"
+    )
+    if metrics is not None:
+        line += f"  processing p99 {metrics['processing_ms']['p99']:.2f} ms"
+    print(line)
+
+
+def main(events: int, latency: float):
+    for handler_latency, count in ((latency, events), (0.0, events * 20)):
+        print(f"{count} events, handler latency {handler_latency * 1000:g} ms")
+        report(
+            "sequential loop",
+            count,
+            asyncio.run(run_sequential(count, handler_latency)),
+        )
+        for concurrency in (1, 4, 16, 64):
+            report(
+                f"consumer x{concurrency}",
+                count,
+                asyncio.run(run_consumer(count, handler_latency, concurrency)),
+            )
+
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+    main(events, latency)
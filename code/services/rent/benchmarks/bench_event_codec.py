@@ -0,0 +1,106 @@
+"""
+Benchmark for domain event encoding.
+
+Encodes and decodes representative events of each service as JSON and as
+positional MessagePack, reporting the cost per event and the bytes on the
+wire, plus a large event above the compression threshold.
+
+Usage:
+    python benchmarks/bench_event_codec.py [iterations]
+"""
+
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_codec import decode_event, encode_event
+
+
+def sample_events():
+    return {
+        "booking.created": {
+            "booking_id": str(uuid.uuid4()),
+            "game_id": str(uuid.uuid4()),
+            "user_id": str(uuid.uuid4()),
+            "status": "pending",
+        },
+        "payment.successful": {
+            "payment_id": str(uuid.uuid4()),
+            "order_id": str(uuid.uuid4()),
+            "status": "completed",
+            "transaction_id": f"txn_{uuid.uuid4().hex[:16]}",
+        },
+        "rent.period.extended": {
+            "order_id": str(uuid.uuid4()),
+            "user_id": str(uuid.uuid4()),
+            "additional_days": 3,
+            "rental_days": 10,
+            "due_date": "2026-10-29T12:00:00",
+            "total_amount": 1499.5,
+        },
+        "rating.left": {
+            "rating_id": str(uuid.uuid4()),
+            "game_id": str(uuid.uuid4()),
+            "user_id": str(uuid.uuid4()),
+            "rating": 4,
+        },
+        "comment.moderated": {
+            "comment_id": str(uuid.uuid4()),
+            "game_id": str(uuid.uuid4()),
+            "user_id": str(uuid.uuid4()),
+            "is_moderated": False,
+            "moderation_status": "approved",
+            "toxicity": 0.12,
+        },
+        # Above the compression threshold
+        "rent.order.cancelled": {
+            "order_id": str(uuid.uuid4()),
+            "reason": "; ".join(
+                f"Booking {uuid.uuid4()} could not be cancelled, retried"
+                for _ in range(30)
+            ),
+        },
+    }
+
+
+def measure(event_type, event, encoding, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        encoded = encode_event(event_type, event, encoding)
+    encode_us = (time.perf_counter() - started) / iterations * 1e6
+
+    body, content_type, content_encoding = encoded
+    started = time.perf_counter()
+    for _ in range(iterations):
+        decoded = decode_event(body, content_type, content_encoding, event_type)
+    decode_us = (time.perf_counter() - started) / iterations * 1e6
+
+    assert decoded == event
+    return encode_us, decode_us, len(body), content_encoding
+
+
+def main(iterations: int):
+    print(f"{iterations} iterations per event type")
+    print(
+        f"  {'event type':<24} {'encoding':<8} {'encode':>9} {'decode':>9} {'bytes':>6}"
+    )
+    for event_type, event in sample_events().items():
+        sizes = {}
+        for encoding in ("json", "msgpack"):
+            encode_us, decode_us, size, compressed = measure(
+                event_type, event, encoding, iterations
+            )
+            sizes[encoding] = size
+            print(
+                f"  {event_type:<24} {encoding:<8} {encode_us:7.2f}us "
+                f"{decode_us:7.2f}us {size:6d}" + (" (deflated)" if compressed else "")
+            )
+        print(f"  {'':<24} msgpack is {sizes['msgpack'] / sizes['json']:.0%} of JSON")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    main(iterations)
@@ -0,0 +1,120 @@
+"""
+Benchmark for optimistic concurrency on orders under conflicting updates.
+
+Worker threads repeatedly read a random order from a small "hot" set, change
+it and commit; a commit that loses the version race is retried. Reports
+committed updates per second, the conflict rate and checks that no update was
+lost. Fewer hot orders means more conflicts.
+
+Usage:
+    python benchmarks/bench_optimistic_concurrency.py [workers] [updates] [hot_orders] [database_url]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+
+from database import Base
+from models import Order
+
+
+def seed(engine, orders: int):
+    pickup_date = datetime(2024, 6, 1, 12, 0)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(Order.__table__),
+            [
+                {
+                    "order_id": f"order-{i:06d}",
+                    "booking_id": f"booking-{i}",
+                    "game_id": "game-1",
+                    "user_id": f"user-{i}",
+                    "status": "active",
+                    "pickup_date": pickup_date,
+                    "pickup_location": "Москва",
+                    "rental_days": 7,
+                    "total_amount": 700.0,
+                    "penalty_amount": 0.0,
+                }
+                for i in range(orders)
+            ],
+        )
+
+
+def worker(Session, order_ids, updates, stats, lock):
+    db = Session()
+    conflicts = 0
+    for _ in range(updates):
+        order_id = random.choice(order_ids)
+        while True:
+            order = db.get(Order, order_id)
+            order.penalty_amount += 1.0
+            try:
+                db.commit()
+                break
+            except StaleDataError:
+                db.rollback()
+                conflicts += 1
+    db.close()
+    with lock:
+        stats["conflicts"] += conflicts
+
+
+def main(workers: int, updates: int, hot_orders: int, database_url: str):
+    if database_url.startswith("sqlite"):
+        engine = create_engine(database_url, connect_args={"timeout": 60})
+    else:
+        engine = create_engine(database_url, pool_size=workers)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    seed(engine, hot_orders)
+    Session = sessionmaker(bind=engine)
+    order_ids = [f"order-{i:06d}" for i in range(hot_orders)]
+
+    stats = {"conflicts": 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(Session, order_ids, updates, stats, lock))
+        for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db = Session()
+    penalties = sum(order.penalty_amount for order in db.query(Order).all())
+    db.close()
+    committed = workers * updates
+    attempts = committed + stats["conflicts"]
+    print(
+        f"{workers} workers, {hot_orders} hot orders: {committed} updates in "
+        f"{elapsed:.2f}s ({committed / elapsed:.0f} updates/s), "
+        f"{stats['conflicts']} conflicts ({stats['conflicts'] / attempts:.1%} of commits)"
+    )
+    print(f"Lost updates: {committed - int(penalties)}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    hot_orders = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    database_url = (
+        sys.argv[4]
+        if len(sys.argv) > 4
+        else f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'concurrency.db')}"
+    )
+    main(workers, updates, hot_orders, database_url)
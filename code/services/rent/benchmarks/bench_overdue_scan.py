@@ -0,0 +1,103 @@
+"""
+Benchmark for the overdue scan on a large number of active orders.
+
+Seeds a SQLite database with N active orders (a mix of overdue, due-soon and
+not-yet-due) and runs one scan, reporting throughput and peak Python memory.
+
+Usage:
+    python benchmarks/bench_overdue_scan.py [orders] [chunk_size]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models import Order
+from overdue_scheduler import OverdueScheduler
+
+
+class CountingDispatcher:
+    """Dispatcher stub that only counts queued reminders."""
+
+    def __init__(self):
+        self.queued = 0
+
+    async def put_push(self, user_id, title, message):
+        self.queued += 1
+
+    async def put_email(self, user_id, subject, body, email=None):
+        self.queued += 1
+
+
+def seed(engine, orders: int, now: datetime):
+    batch = []
+    with engine.begin() as connection:
+        for i in range(orders):
+            # Due dates spread from 10 days overdue to 10 days ahead
+            due_date = now + timedelta(minutes=(i % 28800) - 14400)
+            batch.append(
+                {
+                    "order_id": f"order-{i:09d}",
+                    "booking_id": f"booking-{i}",
+                    "game_id": f"game-{i % 500}",
+                    "user_id": f"user-{i % 50000}",
+                    "status": "active",
+                    "pickup_date": due_date - timedelta(days=7),
+                    "pickup_location": "Москва",
+                    "rental_days": 7,
+                    "due_date": due_date,
+                    "total_amount": 700.0,
+                    "penalty_amount": 0.0,
+                }
+            )
+            if len(batch) == 10000:
+                connection.execute(insert(Order.__table__), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(Order.__table__), batch)
+
+
+async def main(orders: int, chunk_size: int):
+    path = os.path.join(tempfile.mkdtemp(), "overdue.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    now = datetime(2024, 6, 10, 12, 0)
+
+    started = time.perf_counter()
+    seed(engine, orders, now)
+    print(f"Seeded {orders} orders in {time.perf_counter() - started:.1f}s")
+
+    dispatcher = CountingDispatcher()
+    scheduler = OverdueScheduler(
+        session_factory=sessionmaker(bind=engine),
+        dispatcher=dispatcher,
+        chunk_size=chunk_size,
+    )
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = await scheduler.run_once(now=now)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Scanned {result.scanned} orders in {result.chunks} chunks")
+    print(f"Penalized {result.penalized}, reminders {result.reminders}")
+    print(f"Throughput: {result.scanned / elapsed:,.0f} orders/s ({elapsed:.1f}s)")
+    print(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    asyncio.run(main(orders, chunk_size))
@@ -0,0 +1,88 @@
+"""
+Latency benchmark for order pricing.
+
+Game Catalog is simulated with an httpx mock transport that adds a fixed
+network latency, so the numbers show what the pricing step adds to the
+create_order hot path for cold, warm and stale cache entries.
+
+Usage:
+    python benchmarks/bench_pricing.py [catalog_latency_ms] [orders]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from pricing import CatalogPriceClient, PricingEngine
+
+
+def summarize(name: str, samples: list):
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    print(
+        f"{name:<28} n={len(ordered):<6} p50={percentile(0.5):8.3f}ms "
+        f"p99={percentile(0.99):8.3f}ms"
+    )
+
+
+async def main(latency_ms: float, orders: int):
+    calls = 0
+
+    async def handler(request):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(latency_ms / 1000)
+        return httpx.Response(200, json={"price_per_day": 100.0})
+
+    client = CatalogPriceClient(
+        base_url="http://catalog", transport=httpx.MockTransport(handler)
+    )
+    engine = PricingEngine(client)
+    game_ids = [f"game-{i}" for i in range(200)]
+
+    cold = []
+    for game_id in game_ids:
+        started = time.perf_counter()
+        await engine.quote(game_id, 7)
+        cold.append(time.perf_counter() - started)
+    summarize("quote (cold, catalog hop)", cold)
+
+    warm = []
+    for i in range(orders):
+        started = time.perf_counter()
+        await engine.quote(game_ids[i % len(game_ids)], 7)
+        warm.append(time.perf_counter() - started)
+    summarize("quote (warm cache)", warm)
+
+    # Expire every entry: quotes are answered from cache, refreshes run behind
+    client.ttl = 0
+    stale = []
+    for game_id in game_ids:
+        started = time.perf_counter()
+        await engine.quote(game_id, 7)
+        stale.append(time.perf_counter() - started)
+    summarize("quote (stale, async refresh)", stale)
+    await asyncio.sleep(latency_ms / 1000 * 2)
+    client.ttl = 300
+
+    items = [(game_ids[i % len(game_ids)], 1 + i % 30) for i in range(orders)]
+    started = time.perf_counter()
+    await engine.quote_many(items)
+    summarize(f"quote_many ({orders} orders)", [time.perf_counter() - started])
+
+    print(f"catalog requests: {calls}")
+    await client.close()
+
+
+if __name__ == "__main__":
+    latency_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    orders = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    asyncio.run(main(latency_ms, orders))
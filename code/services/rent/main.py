@@ -8,28 +8,65 @@ This service handles game rentals. It includes:
 - RabbitMQ for event-driven communication
 """
 
-from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi import FastAPI, HTTPException, status, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import text, tuple_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from contextlib import asynccontextmanager
-from datetime import datetime
+from sqlalchemy.orm.exc import StaleDataError
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+from dataclasses import asdict
+from typing import List, Optional
+import asyncio
 import uvicorn
 import httpx
 
 from database import get_db, engine, Base
+from migrations import run_migrations
 from models import Order
+from order_state import (
+    CANCELLED,
+    CHARGE_PENALTY,
+    CONFIRM_RECEIPT,
+    CONFIRM_RETURN,
+    CREATE,
+    END_RENTAL,
+    EXTEND,
+    RETURN_GAME,
+    InvalidTransitionError,
+    apply_transition,
+    order_projection,
+    stream_events,
+)
 from schemas import (
     BookingResponse,
     CreateOrderRequest,
     SendPickupNotificationRequest,
     ConfirmGameReceiptRequest,
+    ExtendRentalPeriodRequest,
+    EndRentalPeriodRequest,
     ReturnGameRequest,
     ChargePenaltyRequest,
+    ConfirmGameReturnRequest,
     OrderResponse,
+    OrderListResponse,
+    OrderEventResponse,
+    QuoteRequest,
+    QuoteResponse,
 )
 from grpc_client import initiate_payment_grpc
-from notification_service import notification_service
-from rabbitmq_client import publish_event
+from notification_dispatcher import notification_dispatcher, NotificationQueueFull
+from overdue_scheduler import overdue_scheduler
+from pagination import InvalidCursorError, decode_cursor, encode_cursor
+from payment_saga import begin_saga, fail_saga, payment_saga
+from pricing import (
+    GameNotFoundError,
+    PriceUnavailableError,
+    catalog_price_client,
+    pricing_engine,
+)
+from rabbitmq_client import consumer_metrics, publish_event
 
 # External service URLs
 BOOKING_SERVICE_URL = "http://booking:8003"
@@ -42,8 +79,16 @@ async def lifespan(app: FastAPI):
     """Lifecycle events for the FastAPI application."""
     print("🚀 Rent service starting up...")
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    await notification_dispatcher.start(resolve_email=get_user_email)
+    await payment_saga.start()
+    overdue_scheduler.start()
     yield
     print("🛑 Rent service shutting down...")
+    await overdue_scheduler.stop()
+    await payment_saga.stop()
+    await notification_dispatcher.stop()
+    await catalog_price_client.close()
 
 
 app = FastAPI(
@@ -86,6 +131,58 @@ async def get_user_email(user_id: str) -> str:
         return "user@example.com"
 
 
+def get_order_or_404(db: Session, order_id: str) -> Order:
+    """Load an order or raise 404."""
+    order = db.query(Order).filter(Order.order_id == order_id).first()
+    if not order:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
+        )
+    return order
+
+
+def transition(db: Session, order: Order, action: str, payload: dict = None):
+    """Apply a state machine action to an order, raising 409 if not allowed."""
+    try:
+        apply_transition(db, order, action, payload)
+    except InvalidTransitionError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+
+
+@contextmanager
+def pricing_errors():
+    """Report a game the catalog does not know as 404, no price as 503."""
+    try:
+        yield
+    except GameNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    except PriceUnavailableError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        ) from e
+
+
+def commit_or_conflict(db: Session, order: Order):
+    """
+    Commit changes to an order using its version as an optimistic lock.
+
+    The UPDATE only matches the version that was read, so a concurrent change
+    makes it affect no rows instead of being overwritten.
+
+    Raises:
+        HTTPException: 409 if the order was modified concurrently
+    """
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Order was modified concurrently, reload and retry",
+        )
+    db.refresh(order)
+
+
 @app.post(
     "/api/v1/orders",
     response_model=OrderResponse,
@@ -95,6 +192,23 @@ async def get_user_email(user_id: str) -> str:
 )
 async def create_order(request: CreateOrderRequest, db: Session = Depends(get_db)):
     """Create a new rental order and initiate payment via gRPC."""
+    # One live order per booking. Checked up front to fail fast; the unique
+    # index decides between concurrent requests (literal status, so the
+    # planner can use that partial index)
+    existing = (
+        db.query(Order.order_id)
+        .filter(
+            Order.booking_id == request.booking_id,
+            text(f"orders.status <> '{CANCELLED}'"),
+        )
+        .first()
+    )
+    if existing:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Order {existing.order_id} already exists for this booking",
+        )
+
     # Get booking information
     booking = await get_booking(request.booking_id)
     if not booking:
@@ -108,10 +222,12 @@ async def create_order(request: CreateOrderRequest, db: Session = Depends(get_db
             detail="Booking must be confirmed before creating order",
         )
 
-    # Calculate total amount (mock: 100 per day)
-    total_amount = request.rental_days * 100.0
+    # Price from the cached catalog price with long-rental discounts
+    with pricing_errors():
+        quote = await pricing_engine.quote(booking.game_id, request.rental_days)
+    total_amount = quote.total_amount
 
-    # Create order
+    # Create order (with its "create" event)
     db_order = Order(
         booking_id=request.booking_id,
         game_id=booking.game_id,
@@ -120,10 +236,26 @@ async def create_order(request: CreateOrderRequest, db: Session = Depends(get_db
         pickup_date=booking.pickup_date,
         pickup_location=request.pickup_location,
         rental_days=request.rental_days,
+        due_date=booking.pickup_date + timedelta(days=request.rental_days),
         total_amount=total_amount,
     )
-    db.add(db_order)
-    db.commit()
+    try:
+        transition(
+            db,
+            db_order,
+            CREATE,
+            {"total_amount": total_amount, "rental_days": request.rental_days},
+        )
+        # The payment saga finishes the order when payment.* events arrive
+        saga = begin_saga(db, db_order)
+        db.commit()
+    except IntegrityError as e:
+        # Another request created an order for the booking meanwhile
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="An order already exists for this booking",
+        ) from e
     db.refresh(db_order)
 
     # Initiate payment via gRPC (synchronous communication)
@@ -134,10 +266,25 @@ async def create_order(request: CreateOrderRequest, db: Session = Depends(get_db
         payment_method="card",
     )
 
-    if payment_result:
-        db_order.payment_id = payment_result.get("payment_id")
-        db.commit()
-        db.refresh(db_order)
+    if not payment_result:
+        reason = "Payment could not be initiated"
+        compensate = fail_saga(db, db_order, saga, reason)
+        commit_or_conflict(db, db_order)
+        await publish_event(
+            "rent.order.cancelled",
+            {"order_id": db_order.order_id, "reason": reason},
+            event_id=f"rent.order.cancelled:{db_order.order_id}",
+        )
+        if compensate:
+            payment_saga.schedule_compensation(db_order.order_id)
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"{reason}, order {db_order.order_id} cancelled",
+        )
+
+    db_order.payment_id = payment_result.get("payment_id")
+    saga.payment_id = db_order.payment_id
+    commit_or_conflict(db, db_order)
 
     # Publish domain event
     await publish_event(
@@ -149,11 +296,27 @@ async def create_order(request: CreateOrderRequest, db: Session = Depends(get_db
             "user_id": request.user_id,
             "total_amount": total_amount,
         },
+        event_id=f"rent.order.created:{db_order.order_id}",
     )
 
     return OrderResponse.model_validate(db_order)
 
 
+@app.post(
+    "/api/v1/orders/quotes",
+    response_model=List[QuoteResponse],
+    tags=["Orders"],
+    summary="Quote rentals",
+)
+async def quote_orders(request: QuoteRequest):
+    """Price many rentals at once using catalog prices and discounts."""
+    with pricing_errors():
+        quotes = await pricing_engine.quote_many(
+            (item.game_id, item.rental_days) for item in request.items
+        )
+    return [QuoteResponse.model_validate(quote) for quote in quotes]
+
+
 @app.post(
     "/api/v1/orders/{order_id}/pickup-notification",
     response_model=dict,
@@ -163,28 +326,32 @@ async def create_order(request: CreateOrderRequest, db: Session = Depends(get_db
 async def send_pickup_notification(
     order_id: str, request: SendPickupNotificationRequest, db: Session = Depends(get_db)
 ):
-    """Send pickup notification via OneSignal and SendGrid."""
+    """Queue pickup notifications for delivery via OneSignal and SendGrid."""
     order = db.query(Order).filter(Order.order_id == order_id).first()
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
         )
 
-    user_email = await get_user_email(order.user_id)
-
-    # Send push notification (OneSignal)
-    await notification_service.send_push_notification(
-        order.user_id,
-        "Pickup Reminder",
-        f"Your game pickup is scheduled for {request.pickup_date}",
-    )
+    try:
+        # Push notification (OneSignal)
+        notification_dispatcher.enqueue_push(
+            order.user_id,
+            "Pickup Reminder",
+            f"Your game pickup is scheduled for {request.pickup_date}",
+        )
 
-    # Send email (SendGrid)
-    await notification_service.send_email(
-        user_email,
-        "Game Pickup Reminder",
-        f"Your game pickup is scheduled for {request.pickup_date} at {request.pickup_location}",
-    )
+        # Email (SendGrid); the address is looked up by the dispatcher worker
+        notification_dispatcher.enqueue_email(
+            order.user_id,
+            "Game Pickup Reminder",
+            f"Your game pickup is scheduled for {request.pickup_date} at {request.pickup_location}",
+        )
+    except NotificationQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Notification queue is full, try again later",
+        )
 
     # Publish domain event
     await publish_event(
@@ -196,7 +363,7 @@ async def send_pickup_notification(
         },
     )
 
-    return {"success": True, "message": "Notifications sent"}
+    return {"success": True, "message": "Notifications queued"}
 
 
 @app.post(
@@ -209,11 +376,7 @@ async def confirm_game_receipt(
     order_id: str, request: ConfirmGameReceiptRequest, db: Session = Depends(get_db)
 ):
     """Confirm that user received the game."""
-    order = db.query(Order).filter(Order.order_id == order_id).first()
-    if not order:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
-        )
+    order = get_order_or_404(db, order_id)
 
     if order.user_id != request.user_id:
         raise HTTPException(
@@ -221,9 +384,8 @@ async def confirm_game_receipt(
             detail="You don't have permission to confirm this order",
         )
 
-    order.status = "active"
-    db.commit()
-    db.refresh(order)
+    transition(db, order, CONFIRM_RECEIPT)
+    commit_or_conflict(db, order)
 
     # Publish domain event
     await publish_event(
@@ -237,6 +399,88 @@ async def confirm_game_receipt(
     return OrderResponse.model_validate(order)
 
 
+@app.post(
+    "/api/v1/orders/{order_id}/extend",
+    response_model=OrderResponse,
+    tags=["Orders"],
+    summary="Extend rental period",
+)
+async def extend_rental_period(
+    order_id: str, request: ExtendRentalPeriodRequest, db: Session = Depends(get_db)
+):
+    """Extend an active rental and reprice it for the new length."""
+    order = get_order_or_404(db, order_id)
+
+    if order.user_id != request.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have permission to extend this order",
+        )
+
+    rental_days = order.rental_days + request.additional_days
+    with pricing_errors():
+        quote = await pricing_engine.quote(order.game_id, rental_days)
+
+    order.rental_days = rental_days
+    order.due_date = order.pickup_date + timedelta(days=rental_days)
+    order.total_amount = quote.total_amount
+    # The new due date gets its own "return soon" reminder
+    order.reminder_sent_at = None
+    transition(
+        db,
+        order,
+        EXTEND,
+        {
+            "additional_days": request.additional_days,
+            "rental_days": rental_days,
+            "total_amount": quote.total_amount,
+        },
+    )
+    commit_or_conflict(db, order)
+
+    # Publish domain event
+    await publish_event(
+        "rent.period.extended",
+        {
+            "order_id": order_id,
+            "user_id": request.user_id,
+            "additional_days": request.additional_days,
+            "rental_days": order.rental_days,
+            "due_date": order.due_date.isoformat(),
+            "total_amount": order.total_amount,
+        },
+    )
+
+    return OrderResponse.model_validate(order)
+
+
+@app.post(
+    "/api/v1/orders/{order_id}/end",
+    response_model=OrderResponse,
+    tags=["Orders"],
+    summary="End rental period (system command)",
+)
+async def end_rental_period(
+    order_id: str, request: EndRentalPeriodRequest, db: Session = Depends(get_db)
+):
+    """End the rental period once the due date is reached."""
+    order = get_order_or_404(db, order_id)
+
+    transition(db, order, END_RENTAL)
+    commit_or_conflict(db, order)
+
+    # Publish domain event
+    await publish_event(
+        "rent.period.ended",
+        {
+            "order_id": order_id,
+            "user_id": order.user_id,
+        },
+    )
+
+    return OrderResponse.model_validate(order)
+
+
 @app.post(
     "/api/v1/orders/{order_id}/return",
     response_model=OrderResponse,
@@ -247,11 +491,7 @@ async def return_game(
     order_id: str, request: ReturnGameRequest, db: Session = Depends(get_db)
 ):
     """Initiate game return."""
-    order = db.query(Order).filter(Order.order_id == order_id).first()
-    if not order:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
-        )
+    order = get_order_or_404(db, order_id)
 
     if order.user_id != request.user_id:
         raise HTTPException(
@@ -259,10 +499,9 @@ async def return_game(
             detail="You don't have permission to return this order",
         )
 
-    order.status = "returned"
+    transition(db, order, RETURN_GAME, {"return_location": request.return_location})
     order.return_date = datetime.now()
-    db.commit()
-    db.refresh(order)
+    commit_or_conflict(db, order)
 
     # Publish domain event
     await publish_event(
@@ -287,15 +526,16 @@ async def charge_penalty(
     order_id: str, request: ChargePenaltyRequest, db: Session = Depends(get_db)
 ):
     """Charge penalty for late return."""
-    order = db.query(Order).filter(Order.order_id == order_id).first()
-    if not order:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
-        )
+    order = get_order_or_404(db, order_id)
 
+    transition(
+        db,
+        order,
+        CHARGE_PENALTY,
+        {"penalty_amount": request.penalty_amount, "reason": request.reason},
+    )
     order.penalty_amount = request.penalty_amount
-    db.commit()
-    db.refresh(order)
+    commit_or_conflict(db, order)
 
     # Publish domain event
     await publish_event(
@@ -310,6 +550,140 @@ async def charge_penalty(
     return OrderResponse.model_validate(order)
 
 
+@app.post(
+    "/api/v1/orders/{order_id}/confirm-return",
+    response_model=OrderResponse,
+    tags=["Orders"],
+    summary="Confirm game return",
+)
+async def confirm_game_return(
+    order_id: str, request: ConfirmGameReturnRequest, db: Session = Depends(get_db)
+):
+    """Record the condition of a returned game and complete the rental."""
+    order = get_order_or_404(db, order_id)
+
+    transition(db, order, CONFIRM_RETURN, {"game_condition": request.game_condition})
+    order.game_condition = request.game_condition
+    commit_or_conflict(db, order)
+
+    # Publish domain event
+    await publish_event(
+        "rent.game_return.confirmed",
+        {
+            "order_id": order_id,
+            "user_id": order.user_id,
+            "game_condition": request.game_condition,
+            "penalty_amount": order.penalty_amount,
+        },
+    )
+
+    return OrderResponse.model_validate(order)
+
+
+@app.post(
+    "/api/v1/orders/overdue-scan",
+    response_model=dict,
+    tags=["Orders"],
+    summary="Run overdue scan (system command)",
+)
+async def run_overdue_scan():
+    """Send return reminders and charge penalties for overdue active orders."""
+    result = await overdue_scheduler.run_once()
+    return asdict(result)
+
+
+def paginate_orders(query, cursor: Optional[str], limit: int) -> OrderListResponse:
+    """Return one newest-first page of orders using keyset pagination."""
+    if cursor:
+        try:
+            created_at, order_id = decode_cursor(cursor)
+        except InvalidCursorError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+            ) from e
+        query = query.filter(
+            tuple_(Order.created_at, Order.order_id) < tuple_(created_at, order_id)
+        )
+
+    orders = (
+        query.order_by(Order.created_at.desc(), Order.order_id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1].created_at, orders[-1].order_id)
+
+    return OrderListResponse(
+        items=[OrderResponse.model_validate(order) for order in orders],
+        next_cursor=next_cursor,
+    )
+
+
+@app.get(
+    "/api/v1/users/{user_id}/orders",
+    response_model=OrderListResponse,
+    tags=["Orders"],
+    summary="List user orders",
+)
+async def list_user_orders(
+    user_id: str,
+    order_status: Optional[str] = Query(None, alias="status"),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """List a user's orders, newest first."""
+    query = db.query(Order).filter(Order.user_id == user_id)
+    if order_status:
+        query = query.filter(Order.status == order_status)
+    return paginate_orders(query, cursor, limit)
+
+
+@app.get(
+    "/api/v1/orders",
+    response_model=OrderListResponse,
+    tags=["Orders"],
+    summary="List orders by status (admin)",
+)
+async def list_orders(
+    order_status: str = Query(..., alias="status"),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """List all orders with the given status, newest first."""
+    query = db.query(Order).filter(Order.status == order_status)
+    return paginate_orders(query, cursor, limit)
+
+
+@app.get(
+    "/api/v1/orders/analytics",
+    response_model=dict,
+    tags=["Orders"],
+    summary="Order analytics from the event log (admin)",
+)
+async def get_order_analytics():
+    """Summarize order statuses and transitions, tailing the event log."""
+    return await asyncio.to_thread(order_projection.summary)
+
+
+@app.get(
+    "/api/v1/orders/{order_id}/events",
+    response_model=List[OrderEventResponse],
+    tags=["Orders"],
+    summary="Get order history",
+)
+async def get_order_events(order_id: str, db: Session = Depends(get_db)):
+    """Get the state transitions of an order, oldest first."""
+    get_order_or_404(db, order_id)
+    return [
+        OrderEventResponse.model_validate(event)
+        for event in stream_events(db, order_id)
+    ]
+
+
 @app.get(
     "/api/v1/orders/{order_id}",
     response_model=OrderResponse,
@@ -326,6 +700,28 @@ async def get_order(order_id: str, db: Session = Depends(get_db)):
     return OrderResponse.model_validate(order)
 
 
+@app.get(
+    "/api/v1/notifications/metrics",
+    response_model=dict,
+    tags=["Notifications"],
+    summary="Notification dispatcher metrics",
+)
+async def get_notification_metrics():
+    """Get notification queue depth, delivery counters and send latency."""
+    return notification_dispatcher.metrics()
+
+
+@app.get(
+    "/api/v1/events/metrics",
+    response_model=dict,
+    tags=["Events"],
+    summary="Event consumer metrics",
+)
+async def get_event_metrics():
+    """Get per-queue consumer counters, queue lag and processing time."""
+    return consumer_metrics()
+
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     """Health check endpoint."""
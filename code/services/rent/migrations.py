@@ -0,0 +1,140 @@
+"""
+Startup schema migrations for Rent service.
+
+`Base.metadata.create_all` only creates missing tables. Columns and indexes
+added to existing tables are applied here, idempotently, after create_all.
+Rows an index added later would reject are fixed up before it is created.
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from database import Base
+from models import Order, OrderEvent
+from order_state import CANCEL, CANCELLED
+
+# (table, column) pairs added after the initial schema, in order
+ADDED_COLUMNS = [
+    ("orders", "due_date"),
+    ("orders", "reminder_sent_at"),
+    ("orders", "version"),
+    ("orders", "game_condition"),
+]
+
+# Indexes replaced by a later one, dropped if present
+DROPPED_INDEXES = [
+    # Superseded by the unique uq_orders_booking_id_live
+    "ix_orders_booking_id",
+]
+
+# Data fixes run once, right after the column they fill in has been added
+BACKFILLS = {
+    ("orders", "due_date"): {
+        "postgresql": (
+            "UPDATE orders SET due_date = pickup_date + rental_days * INTERVAL '1 day' "
+            "WHERE due_date IS NULL"
+        ),
+        "sqlite": (
+            "UPDATE orders SET due_date = datetime(pickup_date, '+' || rental_days "
+            "|| ' days') WHERE due_date IS NULL"
+        ),
+    },
+}
+
+
+def cancel_duplicate_live_orders(connection: Connection):
+    """
+    Cancel all but the newest live order of each booking.
+
+    Before uq_orders_booking_id_live nothing stopped two live orders for one
+    booking, and such rows would keep the index from being created. Each
+    cancellation is logged as a cancel event and printed for review.
+    """
+    orders = Order.__table__
+    live = orders.c.status != CANCELLED
+    duplicated = (
+        select(orders.c.booking_id)
+        .where(live)
+        .group_by(orders.c.booking_id)
+        .having(func.count() > 1)
+    )
+    rows = connection.execute(
+        select(orders.c.order_id, orders.c.booking_id, orders.c.status)
+        .where(live, orders.c.booking_id.in_(duplicated))
+        .order_by(
+            orders.c.booking_id, orders.c.created_at.desc(), orders.c.order_id.desc()
+        )
+    ).all()
+
+    kept = set()
+    for order_id, booking_id, status in rows:
+        if booking_id not in kept:
+            kept.add(booking_id)
+            continue
+        connection.execute(
+            orders.update()
+            .where(orders.c.order_id == order_id)
+            .values(status=CANCELLED, version=orders.c.version + 1)
+        )
+        connection.execute(
+            OrderEvent.__table__.insert().values(
+                order_id=order_id,
+                action=CANCEL,
+                from_status=status,
+                to_status=CANCELLED,
+                payload={"reason": f"Duplicate live order for booking {booking_id}"},
+                created_at=datetime.now(timezone.utc),
+            )
+        )
+        print(
+            f"Migration: cancelled order {order_id} ({status}), a duplicate live "
+            f"order for booking {booking_id}"
+        )
+
+
+# Fix-ups run right before an index is created, so existing rows satisfy it
+INDEX_PREPARATIONS = {
+    "uq_orders_booking_id_live": cancel_duplicate_live_orders,
+}
+
+
+def run_migrations(engine: Engine):
+    """Add missing columns and indexes declared on the models."""
+    dialect = engine.dialect
+
+    with engine.begin() as connection:
+        # Inspect through the migrating connection: a pooled one could be the
+        # same connection (SQLite), and returning it would roll this back
+        inspector = inspect(connection)
+        for table_name, column_name in ADDED_COLUMNS:
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            if column_name in existing:
+                continue
+            column = Base.metadata.tables[table_name].c[column_name]
+            ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} "
+            ddl += column.type.compile(dialect=dialect)
+            if column.server_default is not None:
+                # Existing rows get the default, so NOT NULL can be enforced
+                ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            connection.execute(text(ddl))
+            backfill = BACKFILLS.get((table_name, column_name), {}).get(dialect.name)
+            if backfill:
+                connection.execute(text(backfill))
+            print(f"Migration: added column {table_name}.{column_name}")
+
+        for index_name in DROPPED_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    prepare = INDEX_PREPARATIONS.get(index.name)
+                    if prepare is not None:
+                        prepare(connection)
+                    index.create(bind=connection)
+                    print(f"Migration: created index {index.name}")
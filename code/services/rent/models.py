@@ -2,9 +2,20 @@
 Database models for Rent service.
 """
 
-from sqlalchemy import Column, String, Integer, Float, DateTime, Text
-from sqlalchemy.sql import func
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    JSON,
+    String,
+    Text,
+)
+from sqlalchemy.sql import func, text
 from database import Base
+from datetime import datetime, timezone
 import uuid
 
 
@@ -13,10 +24,31 @@ def generate_id():
     return str(uuid.uuid4())
 
 
+def utc_now():
+    """Current time in UTC with microseconds (stable keyset pagination order)."""
+    return datetime.now(timezone.utc)
+
+
 class Order(Base):
     """Order model for the database."""
 
     __tablename__ = "orders"
+    __table_args__ = (
+        # Overdue scan: active orders ordered by due date (keyset on order_id)
+        Index("ix_orders_status_due_date", "status", "due_date", "order_id"),
+        # Per-user and per-status listings, newest first (keyset pagination)
+        Index("ix_orders_user_id_created_at", "user_id", "created_at", "order_id"),
+        Index("ix_orders_status_created_at", "status", "created_at", "order_id"),
+        # One live order per booking, enforced by the database: a cancelled
+        # order does not count, so the booking can be ordered again
+        Index(
+            "uq_orders_booking_id_live",
+            "booking_id",
+            unique=True,
+            postgresql_where=text("status <> 'cancelled'"),
+            sqlite_where=text("status <> 'cancelled'"),
+        ),
+    )
 
     order_id = Column(String, primary_key=True, default=generate_id)
     booking_id = Column(String, nullable=False)
@@ -24,15 +56,84 @@ class Order(Base):
     user_id = Column(String, nullable=False)
     status = Column(
         String, default="created", nullable=False
-    )  # created, confirmed, active, completed, returned
+    )  # created, confirmed, cancelled, active, ended, returned, completed
     pickup_date = Column(DateTime(timezone=True), nullable=False)
     pickup_location = Column(String, nullable=False)
     return_date = Column(DateTime(timezone=True), nullable=True)
     rental_days = Column(Integer, nullable=False)
+    due_date = Column(DateTime(timezone=True), nullable=True)  # pickup + rental_days
+    reminder_sent_at = Column(DateTime(timezone=True), nullable=True)
+    game_condition = Column(String, nullable=True)  # recorded on return check
     total_amount = Column(Float, nullable=False)
     penalty_amount = Column(Float, default=0.0, nullable=False)
     payment_id = Column(String, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Optimistic concurrency: every UPDATE checks and increments the version
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    created_at = Column(
+        DateTime(timezone=True), default=utc_now, server_default=func.now()
+    )
     updated_at = Column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
     )
+
+    __mapper_args__ = {"version_id_col": version}
+
+
+class OrderEvent(Base):
+    """Append-only log of order state transitions."""
+
+    __tablename__ = "order_events"
+    __table_args__ = (
+        # History of one order in log order
+        Index("ix_order_events_order_id_event_id", "order_id", "event_id"),
+    )
+
+    event_id = Column(Integer, primary_key=True, autoincrement=True)
+    order_id = Column(String, nullable=False)
+    action = Column(String, nullable=False)
+    from_status = Column(String, nullable=True)  # None for create
+    to_status = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    created_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+
+
+class OrderSaga(Base):
+    """Progress of the order payment saga (see payment_saga)."""
+
+    __tablename__ = "order_sagas"
+    __table_args__ = (
+        # Startup resume: sagas still compensating, in keyset order
+        Index("ix_order_sagas_state_order_id", "state", "order_id"),
+    )
+
+    order_id = Column(String, primary_key=True)
+    booking_id = Column(String, nullable=False)
+    game_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    payment_id = Column(String, nullable=True)
+    state = Column(
+        String, default="awaiting_payment", nullable=False
+    )  # awaiting_payment, completed, compensating, compensated
+    # Compensation steps already done (each runs at most once)
+    booking_cancelled = Column(Boolean, default=False, nullable=False)
+    failure_reason = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+    updated_at = Column(
+        DateTime(timezone=True), default=utc_now, onupdate=utc_now, nullable=False
+    )
+
+
+class ProcessedEvent(Base):
+    """Id of an event a consumer queue has processed (see processed_events)."""
+
+    __tablename__ = "processed_events"
+    __table_args__ = (
+        # Pruning of ids older than the dedup window
+        Index("ix_processed_events_processed_at", "processed_at"),
+    )
+
+    queue = Column(String, primary_key=True)
+    event_id = Column(String, primary_key=True)
+    processed_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
@@ -0,0 +1,322 @@
+"""
+Background notification dispatcher for Rent service.
+
+HTTP handlers enqueue notifications instead of awaiting OneSignal/SendGrid.
+A pool of workers drains a bounded queue per provider, sends notifications in
+batches, and retries failed messages with jittered exponential backoff.
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from notification_service import MockNotificationService, notification_service
+
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "10000"))
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", "2"))
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "100"))
+NOTIFICATION_BATCH_WAIT = float(os.getenv("NOTIFICATION_BATCH_WAIT", "0.05"))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "4"))
+NOTIFICATION_RETRY_BASE_DELAY = float(os.getenv("NOTIFICATION_RETRY_BASE_DELAY", "0.1"))
+
+PUSH = "push"  # OneSignal
+EMAIL = "email"  # SendGrid
+CHANNELS = (PUSH, EMAIL)
+
+DEFAULT_EMAIL = "user@example.com"
+
+
+class NotificationQueueFull(Exception):
+    """Raised when a notification cannot be accepted because the queue is full."""
+
+
+@dataclass
+class Notification:
+    """A single notification waiting to be delivered."""
+
+    channel: str
+    user_id: str
+    subject: str
+    body: str
+    email: Optional[str] = None
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class LatencyWindow:
+    """Rolling window of latency samples (in seconds) with percentile summary."""
+
+    def __init__(self, size: int = 1000):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        """Return count and p50/p95/p99/max of the window in milliseconds."""
+        if not self.samples:
+            return {"count": self.count, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        ordered = sorted(self.samples)
+        last = len(ordered) - 1
+
+        def percentile(p: float) -> float:
+            return round(ordered[min(last, int(p * len(ordered)))] * 1000, 3)
+
+        return {
+            "count": self.count,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(ordered[-1] * 1000, 3),
+        }
+
+
+class NotificationDispatcher:
+    """Queue-backed worker pool that batches notifications per provider."""
+
+    def __init__(
+        self,
+        service: MockNotificationService,
+        queue_size: int = NOTIFICATION_QUEUE_SIZE,
+        workers: int = NOTIFICATION_WORKERS,
+        batch_size: int = NOTIFICATION_BATCH_SIZE,
+        batch_wait: float = NOTIFICATION_BATCH_WAIT,
+        max_attempts: int = NOTIFICATION_MAX_ATTEMPTS,
+        retry_base_delay: float = NOTIFICATION_RETRY_BASE_DELAY,
+    ):
+        self.service = service
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.resolve_email: Optional[Callable[[str], Awaitable[str]]] = None
+
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._counters: Dict[str, int] = {}
+        self._send_latency: Dict[str, LatencyWindow] = {}
+        self._delivery_latency: Dict[str, LatencyWindow] = {}
+        self._reset_metrics()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def _reset_metrics(self):
+        self._counters = {
+            "enqueued": 0,
+            "rejected": 0,
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "batches": 0,
+        }
+        self._send_latency = {channel: LatencyWindow() for channel in CHANNELS}
+        self._delivery_latency = {channel: LatencyWindow() for channel in CHANNELS}
+
+    async def start(
+        self, resolve_email: Optional[Callable[[str], Awaitable[str]]] = None
+    ):
+        """
+        Create the queues and start the worker pool on the running event loop.
+
+        Args:
+            resolve_email: Coroutine returning the email address of a user.
+                Used for email notifications enqueued without an address.
+        """
+        if self.running:
+            return
+        self.resolve_email = resolve_email
+        self._reset_metrics()
+        self._queues = {
+            channel: asyncio.Queue(maxsize=self.queue_size) for channel in CHANNELS
+        }
+        for channel in CHANNELS:
+            for _ in range(self.workers):
+                self._tasks.append(asyncio.create_task(self._worker(channel)))
+
+    async def stop(self, timeout: float = 5.0):
+        """Drain queued notifications (up to timeout seconds) and stop workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues.values())),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            print("Notification dispatcher stopped with undelivered notifications")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, notification: Notification):
+        queue = self._queues.get(notification.channel)
+        if queue is None or not self.running:
+            raise RuntimeError("Notification dispatcher is not running")
+        try:
+            queue.put_nowait(notification)
+        except asyncio.QueueFull:
+            self._counters["rejected"] += 1
+            raise NotificationQueueFull(
+                f"{notification.channel} notification queue is full"
+            )
+        self._counters["enqueued"] += 1
+
+    async def _put(self, notification: Notification):
+        queue = self._queues.get(notification.channel)
+        if queue is None or not self.running:
+            raise RuntimeError("Notification dispatcher is not running")
+        await queue.put(notification)
+        self._counters["enqueued"] += 1
+
+    async def put_push(self, user_id: str, title: str, message: str):
+        """Queue a push notification, waiting for room (for background jobs)."""
+        await self._put(Notification(PUSH, user_id, title, message))
+
+    async def put_email(
+        self, user_id: str, subject: str, body: str, email: Optional[str] = None
+    ):
+        """Queue an email, waiting for room (for background jobs)."""
+        await self._put(Notification(EMAIL, user_id, subject, body, email=email))
+
+    def enqueue_push(self, user_id: str, title: str, message: str):
+        """Queue a OneSignal push notification without waiting for delivery."""
+        self._enqueue(Notification(PUSH, user_id, title, message))
+
+    def enqueue_email(
+        self, user_id: str, subject: str, body: str, email: Optional[str] = None
+    ):
+        """Queue a SendGrid email; the address is resolved by a worker if omitted."""
+        self._enqueue(Notification(EMAIL, user_id, subject, body, email=email))
+
+    async def _collect_batch(self, queue: asyncio.Queue) -> List[Notification]:
+        """Wait for one notification, then gather more for up to batch_wait."""
+        batch = [await queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self, channel: str):
+        queue = self._queues[channel]
+        while True:
+            batch = await self._collect_batch(queue)
+            try:
+                await self._deliver(channel, batch)
+            except Exception as e:
+                self._counters["failed"] += len(batch)
+                print(f"Error delivering {channel} notifications: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _resolve_addresses(self, batch: List[Notification]):
+        missing = [n for n in batch if n.email is None]
+        if not missing:
+            return
+        if self.resolve_email is None:
+            for notification in missing:
+                notification.email = DEFAULT_EMAIL
+            return
+        user_ids = list({n.user_id for n in missing})
+        addresses = await asyncio.gather(
+            *(self.resolve_email(user_id) for user_id in user_ids),
+            return_exceptions=True,
+        )
+        by_user = {
+            user_id: address if isinstance(address, str) else DEFAULT_EMAIL
+            for user_id, address in zip(user_ids, addresses)
+        }
+        for notification in missing:
+            notification.email = by_user[notification.user_id]
+
+    async def _send(self, channel: str, batch: List[Notification]) -> List[bool]:
+        started = time.monotonic()
+        if channel == PUSH:
+            results = await self.service.send_push_notifications(
+                [
+                    {"user_id": n.user_id, "title": n.subject, "message": n.body}
+                    for n in batch
+                ]
+            )
+        else:
+            results = await self.service.send_emails(
+                [
+                    {"email": n.email, "subject": n.subject, "body": n.body}
+                    for n in batch
+                ]
+            )
+        self._send_latency[channel].add(time.monotonic() - started)
+        self._counters["batches"] += 1
+        return results
+
+    async def _deliver(self, channel: str, batch: List[Notification]):
+        """Send a batch, retrying only the failed notifications with backoff."""
+        if channel == EMAIL:
+            await self._resolve_addresses(batch)
+
+        pending = batch
+        while pending:
+            results = await self._send(channel, pending)
+            retry = []
+            now = time.monotonic()
+            for notification, success in zip(pending, results):
+                notification.attempts += 1
+                if success:
+                    self._counters["sent"] += 1
+                    self._delivery_latency[channel].add(now - notification.enqueued_at)
+                elif notification.attempts >= self.max_attempts:
+                    self._counters["failed"] += 1
+                else:
+                    retry.append(notification)
+            if retry:
+                self._counters["retried"] += len(retry)
+                # Full jitter: spread retries so failed batches don't synchronize
+                attempt = max(n.attempts for n in retry)
+                await asyncio.sleep(
+                    random.uniform(0, self.retry_base_delay * 2 ** (attempt - 1))
+                )
+            pending = retry
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, delivery counters and latency percentiles per provider."""
+        return {
+            "running": self.running,
+            "queue_depth": {
+                channel: self._queues[channel].qsize() if self._queues else 0
+                for channel in CHANNELS
+            },
+            "queue_capacity": self.queue_size,
+            **self._counters,
+            "send_latency_ms": {
+                channel: window.summary()
+                for channel, window in self._send_latency.items()
+            },
+            "delivery_latency_ms": {
+                channel: window.summary()
+                for channel, window in self._delivery_latency.items()
+            },
+        }
+
+
+# Global instance
+notification_dispatcher = NotificationDispatcher(notification_service)
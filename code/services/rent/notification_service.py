@@ -4,7 +4,7 @@ Mocked notification services (OneSignal and SendGrid) for Rent service.
 
 import random
 import asyncio
-from typing import Dict
+from typing import Dict, List
 
 
 class MockNotificationService:
@@ -60,6 +60,54 @@ class MockNotificationService:
 
         return {"success": success}
 
+    async def send_push_notifications(
+        self, notifications: List[Dict[str, str]]
+    ) -> List[bool]:
+        """
+        Simulate a batch send via OneSignal (one API call for many recipients).
+
+        Args:
+            notifications: List of dictionaries with user_id, title and message
+
+        Returns:
+            Success flag for every notification, in input order
+        """
+        # One network round trip for the whole batch
+        await asyncio.sleep(0.2)
+
+        # Every message in the batch still succeeds or fails on its own
+        results = [random.random() > 0.05 for _ in notifications]
+
+        print(
+            f"[OneSignal] Batch of {len(notifications)} push notifications "
+            f"({sum(results)} sent, {len(results) - sum(results)} failed)"
+        )
+
+        return results
+
+    async def send_emails(self, emails: List[Dict[str, str]]) -> List[bool]:
+        """
+        Simulate a batch send via SendGrid (one request with many personalizations).
+
+        Args:
+            emails: List of dictionaries with email, subject and body
+
+        Returns:
+            Success flag for every email, in input order
+        """
+        # One network round trip for the whole batch
+        await asyncio.sleep(0.3)
+
+        # Every message in the batch still succeeds or fails on its own
+        results = [random.random() > 0.05 for _ in emails]
+
+        print(
+            f"[SendGrid] Batch of {len(emails)} emails "
+            f"({sum(results)} sent, {len(results) - sum(results)} failed)"
+        )
+
+        return results
+
 
 # Global instance
 notification_service = MockNotificationService()
@@ -0,0 +1,268 @@
+"""
+Order state machine for Rent service.
+
+Every status change goes through `apply_transition`, which checks the action
+against the transition table and appends an `OrderEvent` to the same session,
+so the event is committed (or rolled back) together with the order change.
+The append-only log can be replayed with `stream_events` to rebuild order
+statuses or compute analytics without scanning the orders table, and
+`LiveOrderProjection` keeps such a projection up to date by applying only the
+events appended since its last catch-up.
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Order, OrderEvent
+
+# How long an event id skipped by the tail is looked for again: ids are
+# assigned when a transaction inserts the event, so a transaction that commits
+# later than one with a higher id shows up behind the tail
+EVENT_GAP_TIMEOUT = float(os.getenv("ORDER_EVENT_GAP_TIMEOUT", "60"))
+
+# Statuses
+CREATED = "created"
+CONFIRMED = "confirmed"
+CANCELLED = "cancelled"
+ACTIVE = "active"
+ENDED = "ended"
+RETURNED = "returned"
+COMPLETED = "completed"
+
+# Actions
+CREATE = "create"
+CONFIRM_PAYMENT = "confirm_payment"
+CANCEL = "cancel"
+CONFIRM_RECEIPT = "confirm_receipt"
+EXTEND = "extend"
+END_RENTAL = "end_rental"
+RETURN_GAME = "return_game"
+CONFIRM_RETURN = "confirm_return"
+CHARGE_PENALTY = "charge_penalty"
+
+# action -> (statuses it is allowed from, resulting status or None to keep it)
+TRANSITIONS: Dict[str, Tuple[Tuple[Optional[str], ...], Optional[str]]] = {
+    CREATE: ((None,), CREATED),
+    CONFIRM_PAYMENT: ((CREATED,), CONFIRMED),
+    CANCEL: ((CREATED, CONFIRMED), CANCELLED),
+    # Payment confirmation is asynchronous, so pickup may come first
+    CONFIRM_RECEIPT: ((CREATED, CONFIRMED), ACTIVE),
+    EXTEND: ((ACTIVE,), ACTIVE),
+    END_RENTAL: ((ACTIVE,), ENDED),
+    RETURN_GAME: ((ACTIVE, ENDED), RETURNED),
+    CONFIRM_RETURN: ((RETURNED,), COMPLETED),
+    CHARGE_PENALTY: ((CREATED, CONFIRMED, ACTIVE, ENDED, RETURNED, COMPLETED), None),
+}
+
+TERMINAL_STATUSES = (CANCELLED, COMPLETED)
+
+
+class InvalidTransitionError(Exception):
+    """Raised when an action is not allowed in the order's current status."""
+
+    def __init__(self, order_id: Optional[str], status: Optional[str], action: str):
+        self.order_id = order_id
+        self.status = status
+        self.action = action
+        super().__init__(f"Cannot {action} order {order_id} in status {status}")
+
+
+def next_status(status: Optional[str], action: str) -> str:
+    """
+    Resolve the status an action leads to.
+
+    Raises:
+        InvalidTransitionError: If the action is unknown or not allowed from
+            the given status
+    """
+    transition = TRANSITIONS.get(action)
+    if transition is None or status not in transition[0]:
+        raise InvalidTransitionError(None, status, action)
+    return transition[1] or status
+
+
+def apply_transition(
+    db: Session,
+    order: Order,
+    action: str,
+    payload: Optional[Dict[str, Any]] = None,
+) -> OrderEvent:
+    """
+    Move an order to its next status and append the matching event.
+
+    The caller commits; the event and the order change share the transaction.
+
+    Args:
+        db: Session the order belongs to (or will be added to, for create)
+        order: Order to transition; a new, unsaved order for CREATE
+        action: One of the TRANSITIONS actions
+        payload: Extra event data (amounts, dates, ...); must be JSON-serializable
+
+    Returns:
+        The pending OrderEvent
+
+    Raises:
+        InvalidTransitionError: If the action is not allowed
+    """
+    from_status = None if action == CREATE else order.status
+    try:
+        to_status = next_status(from_status, action)
+    except InvalidTransitionError as e:
+        raise InvalidTransitionError(order.order_id, from_status, action) from e
+
+    if action == CREATE:
+        db.add(order)
+        # Assigns order_id for the event
+        db.flush()
+    order.status = to_status
+    event = OrderEvent(
+        order_id=order.order_id,
+        action=action,
+        from_status=from_status,
+        to_status=to_status,
+        payload=payload or {},
+    )
+    db.add(event)
+    return event
+
+
+def stream_events(
+    db: Session, order_id: Optional[str] = None, batch_size: int = 1000
+) -> Iterator[OrderEvent]:
+    """Yield events in log order, fetching batch_size rows at a time."""
+    query = db.query(OrderEvent)
+    if order_id is not None:
+        query = query.filter(OrderEvent.order_id == order_id)
+    yield from query.order_by(OrderEvent.event_id).yield_per(batch_size)
+
+
+@dataclass
+class OrderProjection:
+    """State rebuilt from the event log in a single streaming pass."""
+
+    statuses: Dict[str, str] = field(default_factory=dict)
+    transitions: Counter = field(default_factory=Counter)
+    # Total seconds orders spent in each status before leaving it, and how
+    # many times an order left it
+    time_in_status: Dict[str, float] = field(default_factory=dict)
+    exits: Counter = field(default_factory=Counter)
+    events: int = 0
+    _entered_at: Dict[str, datetime] = field(default_factory=dict, repr=False)
+
+    def apply(self, event: OrderEvent):
+        self.events += 1
+        self.transitions[event.action] += 1
+        if event.from_status is not None and event.to_status != event.from_status:
+            entered = self._entered_at.get(event.order_id)
+            if entered is not None:
+                seconds = (event.created_at - entered).total_seconds()
+                self.time_in_status[event.from_status] = (
+                    self.time_in_status.get(event.from_status, 0.0) + seconds
+                )
+                self.exits[event.from_status] += 1
+        if event.to_status != self.statuses.get(event.order_id):
+            self._entered_at[event.order_id] = event.created_at
+        self.statuses[event.order_id] = event.to_status
+        if event.to_status in TERMINAL_STATUSES:
+            # Nothing more will be timed for this order
+            self._entered_at.pop(event.order_id, None)
+
+    def summary(self) -> Dict[str, Any]:
+        """Order counts per status, transition counts and mean time in status."""
+        return {
+            "events": self.events,
+            "orders": len(self.statuses),
+            "by_status": dict(Counter(self.statuses.values())),
+            "transitions": dict(self.transitions),
+            "mean_seconds_in_status": {
+                status: round(total / self.exits[status], 3)
+                for status, total in self.time_in_status.items()
+            },
+        }
+
+
+def rebuild(db: Session, batch_size: int = 1000) -> OrderProjection:
+    """Replay the whole event log into a projection."""
+    projection = OrderProjection()
+    for event in stream_events(db, batch_size=batch_size):
+        projection.apply(event)
+    return projection
+
+
+class LiveOrderProjection:
+    """
+    Order projection kept up to date by tailing the event log.
+
+    Each catch-up reads only the events after the last event id it applied,
+    plus ids it skipped over that may still be committed by transactions that
+    were in flight, so a request costs the events appended since the previous
+    one instead of a replay of the whole log. Catch-ups are blocking and are
+    meant to run in a worker thread; a lock serializes them.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        gap_timeout: float = EVENT_GAP_TIMEOUT,
+        batch_size: int = 1000,
+    ):
+        self.session_factory = session_factory
+        self.gap_timeout = gap_timeout
+        self.batch_size = batch_size
+        self.projection = OrderProjection()
+        self.last_event_id = 0
+        # Skipped event id -> monotonic time it was first skipped
+        self._gaps: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _catch_up(self) -> int:
+        now = time.monotonic()
+        self._gaps = {
+            event_id: skipped_at
+            for event_id, skipped_at in self._gaps.items()
+            if now - skipped_at < self.gap_timeout
+        }
+        condition = OrderEvent.event_id > self.last_event_id
+        if self._gaps:
+            condition = or_(condition, OrderEvent.event_id.in_(list(self._gaps)))
+
+        applied = 0
+        db = self.session_factory()
+        try:
+            query = db.query(OrderEvent).filter(condition)
+            for event in query.order_by(OrderEvent.event_id).yield_per(self.batch_size):
+                if event.event_id > self.last_event_id:
+                    for skipped in range(self.last_event_id + 1, event.event_id):
+                        self._gaps[skipped] = now
+                    self.last_event_id = event.event_id
+                else:
+                    self._gaps.pop(event.event_id, None)
+                self.projection.apply(event)
+                applied += 1
+        finally:
+            db.close()
+        return applied
+
+    def catch_up(self) -> int:
+        """Apply the events appended since the last catch-up; returns their count."""
+        with self._lock:
+            return self._catch_up()
+
+    def summary(self) -> Dict[str, Any]:
+        """Catch up and summarize the projection."""
+        with self._lock:
+            self._catch_up()
+            return self.projection.summary()
+
+
+# Global instance
+order_projection = LiveOrderProjection()
@@ -0,0 +1,359 @@
+"""
+Periodic return-reminder and overdue-penalty job for Rent service.
+
+Orders still held by customers (active, or ended but not yet returned) that
+are close to or past their due date (pickup_date + rental_days) are streamed
+in keyset-paginated chunks over the (status, due_date, order_id) index, so
+memory stays bounded regardless of the number of orders. Penalties for each
+chunk are computed in one pass and written back with a single UPDATE joined
+to the chunk's (order_id, version, ...) rows, which only matches orders whose
+version is unchanged, so an order changed concurrently is left for the next
+run instead of being overwritten. Only the orders the UPDATE returns count as
+penalized, with a CHARGE_PENALTY event appended in the same transaction, and
+get their reminder, which is handed to the notification dispatcher.
+"""
+
+import asyncio
+import math
+import os
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import (
+    DateTime,
+    Float,
+    Integer,
+    String,
+    TextClause,
+    bindparam,
+    insert,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Order, OrderEvent
+from notification_dispatcher import NotificationDispatcher, notification_dispatcher
+from order_state import CHARGE_PENALTY, next_status
+
+OVERDUE_SCAN_INTERVAL = float(os.getenv("OVERDUE_SCAN_INTERVAL", "3600"))
+OVERDUE_SCAN_CHUNK_SIZE = int(os.getenv("OVERDUE_SCAN_CHUNK_SIZE", "1000"))
+# Orders due within this window get a "return soon" reminder
+REMINDER_WINDOW = timedelta(hours=float(os.getenv("REMINDER_WINDOW_HOURS", "24")))
+# Penalty per overdue day, as a multiple of the order's daily price
+PENALTY_RATE = float(os.getenv("OVERDUE_PENALTY_RATE", "1.5"))
+
+SECONDS_PER_DAY = 86400
+
+# Statuses in which the game is still with the customer
+OUTSTANDING_STATUSES = ("active", "ended")
+
+
+@dataclass
+class ScanResult:
+    """Summary of one overdue scan run."""
+
+    scanned: int = 0
+    chunks: int = 0
+    penalized: int = 0
+    reminders: int = 0
+    duration_seconds: float = 0.0
+
+
+@dataclass
+class PendingReminder:
+    """Reminder selected by a chunk, sent after the chunk is committed."""
+
+    user_id: str
+    order_id: str
+    due_date: datetime
+    overdue: bool
+
+
+@dataclass
+class OrderUpdate:
+    """Penalty and reminder change of one order, applied if its version holds."""
+
+    order_id: str
+    version: int
+    penalty_amount: float
+    reminder_sent_at: Optional[datetime]
+    penalized: bool
+    reminder: Optional[PendingReminder]
+
+
+def _local_now(now: datetime, reference: datetime) -> datetime:
+    """Align a naive local `now` with the timezone awareness of a DB value."""
+    if reference.tzinfo is not None and now.tzinfo is None:
+        return now.astimezone(reference.tzinfo)
+    if reference.tzinfo is None and now.tzinfo is not None:
+        return now.replace(tzinfo=None)
+    return now
+
+
+def compute_chunk(
+    rows: List[Tuple], now: datetime, penalty_rate: float = PENALTY_RATE
+) -> List[OrderUpdate]:
+    """
+    Compute penalty updates and reminders for a chunk of outstanding orders.
+
+    Args:
+        rows: Tuples of (order_id, user_id, due_date, rental_days, total_amount,
+            penalty_amount, reminder_sent_at, version)
+        now: Scan time
+        penalty_rate: Penalty per overdue day as a multiple of the daily price
+
+    Returns:
+        Updates of the orders whose penalty increased or that get a reminder
+    """
+    updates = []
+    for (
+        order_id,
+        user_id,
+        due_date,
+        rental_days,
+        total_amount,
+        penalty_amount,
+        reminder_sent_at,
+        version,
+    ) in rows:
+        current = _local_now(now, due_date)
+        overdue_seconds = (current - due_date).total_seconds()
+        overdue = overdue_seconds > 0
+
+        penalty = penalty_amount or 0.0
+        if overdue:
+            overdue_days = math.ceil(overdue_seconds / SECONDS_PER_DAY)
+            daily_price = total_amount / rental_days
+            penalty = max(penalty, round(overdue_days * daily_price * penalty_rate, 2))
+
+        # One "due soon" reminder, and one more once the order becomes overdue
+        remind = reminder_sent_at is None or (
+            overdue and _local_now(reminder_sent_at, due_date) < due_date
+        )
+
+        penalized = penalty != (penalty_amount or 0.0)
+        if penalized or remind:
+            updates.append(
+                OrderUpdate(
+                    order_id=order_id,
+                    version=version,
+                    penalty_amount=penalty,
+                    reminder_sent_at=now if remind else reminder_sent_at,
+                    penalized=penalized,
+                    reminder=(
+                        PendingReminder(user_id, order_id, due_date, overdue)
+                        if remind
+                        else None
+                    ),
+                )
+            )
+    return updates
+
+
+@lru_cache(maxsize=16)
+def _chunk_update(size: int) -> TextClause:
+    """
+    UPDATE joined to `size` (order_id, version, penalty_amount,
+    reminder_sent_at) rows that only matches orders whose version is unchanged.
+
+    Row values are bound as b_order_id_<i>, b_version_<i>, ... SQLAlchemy does
+    not cache statements with a multi-row VALUES, so the statement is written
+    as text and kept per chunk size instead of being compiled for every chunk.
+    """
+    rows = ", ".join(
+        f"(:b_order_id_{i}, :b_version_{i}, :b_penalty_amount_{i}, "
+        f":b_reminder_sent_at_{i})"
+        for i in range(size)
+    )
+    statement = text(
+        "WITH v (order_id, version, penalty_amount, reminder_sent_at) AS "
+        f"(VALUES {rows}) "
+        "UPDATE orders SET penalty_amount = v.penalty_amount, "
+        "reminder_sent_at = v.reminder_sent_at, version = orders.version + 1, "
+        "updated_at = CURRENT_TIMESTAMP "
+        "FROM v WHERE orders.order_id = v.order_id AND orders.version = v.version "
+        "RETURNING orders.order_id"
+    )
+    return statement.bindparams(
+        *(
+            binding
+            for i in range(size)
+            for binding in (
+                bindparam(f"b_order_id_{i}", type_=String),
+                bindparam(f"b_version_{i}", type_=Integer),
+                bindparam(f"b_penalty_amount_{i}", type_=Float),
+                bindparam(f"b_reminder_sent_at_{i}", type_=DateTime(timezone=True)),
+            )
+        )
+    ).columns(order_id=String)
+
+
+class OverdueScheduler:
+    """Runs the overdue scan periodically in the background."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        dispatcher: NotificationDispatcher = notification_dispatcher,
+        interval: float = OVERDUE_SCAN_INTERVAL,
+        chunk_size: int = OVERDUE_SCAN_CHUNK_SIZE,
+        reminder_window: timedelta = REMINDER_WINDOW,
+        penalty_rate: float = PENALTY_RATE,
+    ):
+        self.session_factory = session_factory
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.reminder_window = reminder_window
+        self.penalty_rate = penalty_rate
+        self.last_result: Optional[ScanResult] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _process_chunk(
+        self, status: str, now: datetime, after: Optional[Tuple[datetime, str]]
+    ) -> Tuple[int, Optional[Tuple[datetime, str]], int, List[PendingReminder]]:
+        """Read one chunk, write its updates and return the next cursor."""
+        table = Order.__table__
+        query = (
+            select(
+                table.c.order_id,
+                table.c.user_id,
+                table.c.due_date,
+                table.c.rental_days,
+                table.c.total_amount,
+                table.c.penalty_amount,
+                table.c.reminder_sent_at,
+                table.c.version,
+            )
+            .where(
+                table.c.status == status,
+                table.c.due_date <= now + self.reminder_window,
+            )
+            .order_by(table.c.due_date, table.c.order_id)
+            .limit(self.chunk_size)
+        )
+        if after is not None:
+            query = query.where(
+                tuple_(table.c.due_date, table.c.order_id) > tuple_(*after)
+            )
+
+        db = self.session_factory()
+        try:
+            rows = db.execute(query).all()
+            if not rows:
+                return 0, None, 0, []
+            changes = compute_chunk(rows, now, self.penalty_rate)
+            penalized = 0
+            reminders = []
+            if changes:
+                statement = _chunk_update(len(changes))
+                parameters = {}
+                for i, change in enumerate(changes):
+                    parameters[f"b_order_id_{i}"] = change.order_id
+                    parameters[f"b_version_{i}"] = change.version
+                    parameters[f"b_penalty_amount_{i}"] = change.penalty_amount
+                    parameters[f"b_reminder_sent_at_{i}"] = change.reminder_sent_at
+                # Orders changed since they were read are not returned: the
+                # next run sees them again
+                updated = set(db.execute(statement, parameters).scalars())
+                events = []
+                for change in changes:
+                    if change.order_id not in updated:
+                        continue
+                    if change.penalized:
+                        events.append(
+                            {
+                                "order_id": change.order_id,
+                                "action": CHARGE_PENALTY,
+                                "from_status": status,
+                                "to_status": next_status(status, CHARGE_PENALTY),
+                                "payload": {
+                                    "penalty_amount": change.penalty_amount,
+                                    "reason": "overdue",
+                                },
+                            }
+                        )
+                    if change.reminder is not None:
+                        reminders.append(change.reminder)
+                if events:
+                    db.execute(insert(OrderEvent), events)
+                penalized = len(events)
+            db.commit()
+            last = rows[-1]
+            return len(rows), (last.due_date, last.order_id), penalized, reminders
+        finally:
+            db.close()
+
+    async def _send_reminder(self, reminder: PendingReminder):
+        if reminder.overdue:
+            title = "Rental overdue"
+            message = (
+                f"Your rental {reminder.order_id} was due on {reminder.due_date}. "
+                "Late return penalties apply until the game is returned."
+            )
+        else:
+            title = "Return reminder"
+            message = (
+                f"Please return the game for order {reminder.order_id} "
+                f"by {reminder.due_date}."
+            )
+        await self.dispatcher.put_push(reminder.user_id, title, message)
+        await self.dispatcher.put_email(reminder.user_id, title, message)
+
+    async def run_once(self, now: Optional[datetime] = None) -> ScanResult:
+        """Scan all outstanding orders that are due soon or overdue."""
+        async with self._lock:
+            now = now or datetime.now()
+            started = time.monotonic()
+            result = ScanResult()
+            for status in OUTSTANDING_STATUSES:
+                cursor = None
+                while True:
+                    scanned, cursor, penalized, reminders = await asyncio.to_thread(
+                        self._process_chunk, status, now, cursor
+                    )
+                    if not scanned:
+                        break
+                    result.scanned += scanned
+                    result.chunks += 1
+                    result.penalized += penalized
+                    for reminder in reminders:
+                        await self._send_reminder(reminder)
+                    result.reminders += len(reminders)
+                    if scanned < self.chunk_size:
+                        break
+            result.duration_seconds = round(time.monotonic() - started, 3)
+            self.last_result = result
+            print(f"Overdue scan finished: {asdict(result)}")
+            return result
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Error running overdue scan: {e}")
+
+    def start(self):
+        """Start the periodic scan on the running event loop."""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Cancel the periodic scan."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# Global instance
+overdue_scheduler = OverdueScheduler()
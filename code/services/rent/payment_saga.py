@@ -0,0 +1,342 @@
+"""
+Order payment saga for Rent service.
+
+An order starts a saga in the same transaction that creates it. Payment
+events from the `payment_events` exchange advance the saga: a successful
+payment confirms the order, a declined one (or a payment that could not be
+initiated) cancels it and runs the compensation - cancel the booking. The
+catalog's availability is left alone: no step of the order reserves a copy,
+so there is none to give back. Saga state is stored in
+`order_sagas`, so compensations interrupted by a restart are resumed on
+startup; sagas waiting for payment need no polling, their events stay queued
+in RabbitMQ.
+"""
+
+import asyncio
+import os
+import random
+from typing import Any, Callable, Dict, Optional, Set
+
+import httpx
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from database import SessionLocal
+from models import Order, OrderSaga
+from order_state import (
+    CANCEL,
+    CONFIRM_PAYMENT,
+    CREATED,
+    InvalidTransitionError,
+    apply_transition,
+)
+from processed_events import ProcessedEvents
+from rabbitmq_client import Consumer, publish_event
+
+BOOKING_SERVICE_URL = os.getenv("BOOKING_SERVICE_URL", "http://booking:8003")
+SAGA_QUEUE = os.getenv("PAYMENT_SAGA_QUEUE", "rent_payment_saga")
+SAGA_CONCURRENCY = int(os.getenv("PAYMENT_SAGA_CONCURRENCY", "20"))
+# Payment events handled at once (sagas of one order are guarded by versioning)
+SAGA_CONSUMER_CONCURRENCY = int(os.getenv("PAYMENT_SAGA_CONSUMER_CONCURRENCY", "8"))
+SAGA_MAX_ATTEMPTS = int(os.getenv("PAYMENT_SAGA_MAX_ATTEMPTS", "5"))
+SAGA_RETRY_BASE_DELAY = float(os.getenv("PAYMENT_SAGA_RETRY_BASE_DELAY", "1.0"))
+SAGA_RESUME_CHUNK_SIZE = 500
+
+# Saga states
+AWAITING_PAYMENT = "awaiting_payment"
+COMPLETED = "completed"
+COMPENSATING = "compensating"
+COMPENSATED = "compensated"
+
+# Payment gateway status of a successful payment
+PAYMENT_COMPLETED = "completed"
+
+
+class CompensationError(Exception):
+    """Raised when a compensation step fails and should be retried."""
+
+
+def begin_saga(db: Session, order: Order) -> OrderSaga:
+    """Start the saga of a new order; the caller commits with the order."""
+    saga = OrderSaga(
+        order_id=order.order_id,
+        booking_id=order.booking_id,
+        game_id=order.game_id,
+        user_id=order.user_id,
+        payment_id=order.payment_id,
+        state=AWAITING_PAYMENT,
+    )
+    db.add(saga)
+    return saga
+
+
+def fail_saga(db: Session, order: Order, saga: OrderSaga, reason: str) -> bool:
+    """
+    Cancel the order and mark the saga for compensation.
+
+    The caller commits. Orders the customer already picked up cannot be
+    cancelled; their saga only records the failure.
+
+    Returns:
+        True if compensation should be scheduled
+    """
+    saga.failure_reason = reason
+    try:
+        apply_transition(db, order, CANCEL, {"reason": reason})
+    except InvalidTransitionError as e:
+        saga.state = COMPLETED
+        saga.last_error = str(e)
+        return False
+    saga.state = COMPENSATING
+    return True
+
+
+class PaymentSagaCoordinator:
+    """Consumes payment events and drives order sagas to completion."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        booking_url: str = BOOKING_SERVICE_URL,
+        concurrency: int = SAGA_CONCURRENCY,
+        max_attempts: int = SAGA_MAX_ATTEMPTS,
+        retry_base_delay: float = SAGA_RETRY_BASE_DELAY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.session_factory = session_factory
+        self.booking_url = booking_url
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._scheduled: Set[str] = set()
+        self._consumer: Optional[Consumer] = None
+        self._consumer_task: Optional[asyncio.Task] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=5.0, transport=self.transport)
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _apply_payment_result(
+        self, order_id: str, succeeded: bool, payment_id: Optional[str], reason: str
+    ) -> Optional[str]:
+        """Advance a saga on a payment result; returns the new state if changed."""
+        for _ in range(3):
+            db = self.session_factory()
+            try:
+                saga = db.get(OrderSaga, order_id)
+                order = db.get(Order, order_id)
+                if saga is None or order is None or saga.state != AWAITING_PAYMENT:
+                    # Unknown order or a redelivered event
+                    return None
+                if payment_id and not order.payment_id:
+                    order.payment_id = payment_id
+                    saga.payment_id = payment_id
+                if succeeded:
+                    if order.status == CREATED:
+                        apply_transition(
+                            db, order, CONFIRM_PAYMENT, {"payment_id": payment_id}
+                        )
+                    saga.state = COMPLETED
+                else:
+                    fail_saga(db, order, saga, reason)
+                db.commit()
+                return saga.state
+            except StaleDataError:
+                # The order changed under us; re-read and decide again
+                db.rollback()
+            finally:
+                db.close()
+        raise RuntimeError(f"Order {order_id} kept changing, payment event not applied")
+
+    async def handle_payment_event(self, event: Dict[str, Any]):
+        """Handle a payment.* event; events without a result are ignored."""
+        order_id = event.get("order_id")
+        payment_status = event.get("status")
+        if not order_id or payment_status is None:
+            return
+        succeeded = payment_status == PAYMENT_COMPLETED
+        state = await asyncio.to_thread(
+            self._apply_payment_result,
+            order_id,
+            succeeded,
+            event.get("payment_id"),
+            f"Payment {payment_status}",
+        )
+        if state == COMPLETED and succeeded:
+            await publish_event(
+                "rent.order.confirmed",
+                {"order_id": order_id, "payment_id": event.get("payment_id")},
+                event_id=f"rent.order.confirmed:{order_id}",
+            )
+        elif state == COMPENSATING:
+            await publish_event(
+                "rent.order.cancelled",
+                {"order_id": order_id, "reason": f"Payment {payment_status}"},
+                event_id=f"rent.order.cancelled:{order_id}",
+            )
+            self.schedule_compensation(order_id)
+
+    def schedule_compensation(self, order_id: str):
+        """Run compensation for a saga in the background (once at a time)."""
+        if order_id in self._scheduled:
+            return
+        self._scheduled.add(order_id)
+        task = asyncio.create_task(self._run_compensation(order_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_compensation(self, order_id: str):
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                async with self._get_semaphore():
+                    done = await self.compensate(order_id)
+                if done:
+                    return
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(
+                        random.uniform(0, self.retry_base_delay * 2 ** (attempt - 1))
+                    )
+            print(f"Saga for order {order_id} still compensating, retried on restart")
+        finally:
+            self._scheduled.discard(order_id)
+
+    def _load_saga(self, order_id: str) -> Optional[OrderSaga]:
+        db = self.session_factory()
+        try:
+            saga = db.get(OrderSaga, order_id)
+            if saga is not None:
+                db.expunge(saga)
+            return saga
+        finally:
+            db.close()
+
+    def _record(self, order_id: str, **values):
+        db = self.session_factory()
+        try:
+            saga = db.get(OrderSaga, order_id)
+            for name, value in values.items():
+                setattr(saga, name, value)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _cancel_booking(self, saga: OrderSaga):
+        response = await self._get_client().post(
+            f"{self.booking_url}/api/v1/bookings/{saga.booking_id}/cancel",
+            json={"user_id": saga.user_id, "reason": saga.failure_reason},
+        )
+        # A booking that no longer exists has nothing to cancel
+        if response.status_code not in (200, 404):
+            raise CompensationError(
+                f"Booking cancel returned {response.status_code}: {response.text}"
+            )
+
+    async def compensate(self, order_id: str) -> bool:
+        """
+        Run the remaining compensation steps of a saga once.
+
+        Each step is recorded as soon as it succeeds, so a retry (or a resume
+        after restart) continues with the first step not done yet. Booking
+        cancellation is idempotent, so a step interrupted before it was
+        recorded may run again.
+
+        Returns:
+            True if the saga is fully compensated (or needs no compensation)
+        """
+        saga = await asyncio.to_thread(self._load_saga, order_id)
+        if saga is None or saga.state != COMPENSATING:
+            return True
+        try:
+            if not saga.booking_cancelled:
+                await self._cancel_booking(saga)
+            await asyncio.to_thread(
+                self._record, order_id, booking_cancelled=True, state=COMPENSATED
+            )
+        except (CompensationError, httpx.HTTPError) as e:
+            await asyncio.to_thread(
+                self._record,
+                order_id,
+                attempts=saga.attempts + 1,
+                last_error=str(e),
+            )
+            print(f"Compensation for order {order_id} failed: {e}")
+            return False
+        return True
+
+    def _compensating_ids(self, after: Optional[str]) -> list:
+        db = self.session_factory()
+        try:
+            query = db.query(OrderSaga.order_id).filter(OrderSaga.state == COMPENSATING)
+            if after is not None:
+                query = query.filter(OrderSaga.order_id > after)
+            rows = (
+                query.order_by(OrderSaga.order_id).limit(SAGA_RESUME_CHUNK_SIZE).all()
+            )
+            return [row.order_id for row in rows]
+        finally:
+            db.close()
+
+    async def resume(self) -> int:
+        """Schedule compensation for every saga left compensating; returns count."""
+        resumed = 0
+        after = None
+        while True:
+            order_ids = await asyncio.to_thread(self._compensating_ids, after)
+            for order_id in order_ids:
+                self.schedule_compensation(order_id)
+            resumed += len(order_ids)
+            if len(order_ids) < SAGA_RESUME_CHUNK_SIZE:
+                return resumed
+            after = order_ids[-1]
+
+    async def start(self):
+        """Resume interrupted sagas and start consuming payment events."""
+        try:
+            resumed = await self.resume()
+            if resumed:
+                print(f"Resumed {resumed} compensating payment sagas")
+        except Exception as e:
+            print(f"Error resuming payment sagas: {e}")
+        self._consumer = Consumer(
+            SAGA_QUEUE,
+            self.handle_payment_event,
+            concurrency=SAGA_CONSUMER_CONCURRENCY,
+            prefetch_count=2 * SAGA_CONSUMER_CONCURRENCY,
+            # Payment events are republished when payment requests are retried
+            dedup=ProcessedEvents(SAGA_QUEUE, self.session_factory),
+        )
+        self._consumer_task = asyncio.create_task(
+            self._consumer.run("payment_events", "payment.*")
+        )
+
+    async def stop(self):
+        """Drain the consumer; unfinished compensations resume on next start."""
+        if self._consumer is not None:
+            await self._consumer.stop()
+            self._consumer = None
+        tasks = list(self._tasks)
+        if self._consumer_task is not None:
+            tasks.append(self._consumer_task)
+            self._consumer_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._scheduled.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._semaphore = None
+
+
+# Global instance
+payment_saga = PaymentSagaCoordinator()
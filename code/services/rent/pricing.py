@@ -0,0 +1,268 @@
+"""
+Order pricing for Rent service.
+
+Prices come from Game Catalog (`Game.price_per_day`) through a pooled HTTP
+client with an in-process cache. Fresh entries are served directly; stale
+entries are served immediately while a background refresh runs, so the order
+hot path only waits on the catalog for games it has never priced. Concurrent
+misses for the same game share one request.
+
+There is no made-up price: a game the catalog does not know raises
+GameNotFoundError, and a game that cannot be priced because the catalog is
+unreachable and nothing is cached raises PriceUnavailableError.
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+GAME_CATALOG_SERVICE_URL = os.getenv(
+    "GAME_CATALOG_SERVICE_URL", "http://game-catalog:8002"
+)
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "300"))
+PRICE_CACHE_STALE_TTL = float(os.getenv("PRICE_CACHE_STALE_TTL", "3600"))
+CATALOG_TIMEOUT = float(os.getenv("CATALOG_TIMEOUT", "2.0"))
+CATALOG_MAX_CONNECTIONS = int(os.getenv("CATALOG_MAX_CONNECTIONS", "20"))
+
+
+def parse_discount_tiers(value: str) -> List[Tuple[int, float]]:
+    """Parse "7:0.1,14:0.2" into [(14, 0.2), (7, 0.1)] (longest first)."""
+    tiers = []
+    for item in value.split(","):
+        if item.strip():
+            days, rate = item.split(":")
+            tiers.append((int(days), float(rate)))
+    return sorted(tiers, reverse=True)
+
+
+# Long-rental discounts: minimum rental days -> discount rate
+DISCOUNT_TIERS = parse_discount_tiers(
+    os.getenv("PRICING_DISCOUNT_TIERS", "7:0.10,14:0.20")
+)
+
+SOURCE_CACHE = "cache"
+SOURCE_CATALOG = "catalog"
+
+
+class GameNotFoundError(Exception):
+    """Raised when Game Catalog has no game with the requested id."""
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        super().__init__(f"Game {game_id} not found in catalog")
+
+
+class PriceUnavailableError(Exception):
+    """Raised when a game has no cached price and the catalog cannot be reached."""
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        super().__init__(f"Price of game {game_id} is unavailable, catalog unreachable")
+
+
+@dataclass
+class Quote:
+    """Price quote for renting one game for a number of days."""
+
+    game_id: str
+    rental_days: int
+    price_per_day: float
+    base_amount: float
+    discount_rate: float
+    total_amount: float
+    price_source: str
+
+
+class CatalogPriceClient:
+    """Cached, connection-pooled client for game prices from Game Catalog."""
+
+    def __init__(
+        self,
+        base_url: str = GAME_CATALOG_SERVICE_URL,
+        ttl: float = PRICE_CACHE_TTL,
+        stale_ttl: float = PRICE_CACHE_STALE_TTL,
+        timeout: float = CATALOG_TIMEOUT,
+        max_connections: int = CATALOG_MAX_CONNECTIONS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._prices: Dict[str, Tuple[float, float]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: set = set()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled connections (the cache is kept)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._inflight.clear()
+        self._refreshing.clear()
+
+    def update_price(self, game_id: str, price_per_day: float):
+        """Store a known price, e.g. from a catalog response or event."""
+        self._prices[game_id] = (price_per_day, time.monotonic())
+
+    async def _fetch(self, game_id: str) -> Optional[float]:
+        """
+        Fetch a price from the catalog; None if the catalog is unreachable.
+
+        Raises:
+            GameNotFoundError: If the catalog answers 404 (a cached price of
+                the game is dropped)
+        """
+        try:
+            response = await self._get_client().get(f"/api/v1/games/{game_id}")
+            if response.status_code == 200:
+                price = float(response.json()["price_per_day"])
+                self.update_price(game_id, price)
+                return price
+            if response.status_code == 404:
+                self._prices.pop(game_id, None)
+                raise GameNotFoundError(game_id)
+            print(f"Catalog returned {response.status_code} for game {game_id}")
+        except GameNotFoundError:
+            raise
+        except Exception as e:
+            print(f"Error fetching price for game {game_id}: {e}")
+        return None
+
+    async def _fetch_shared(self, game_id: str) -> Optional[float]:
+        """Fetch a price, joining an in-flight request for the same game."""
+        future = self._inflight.get(game_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(game_id))
+            self._inflight[game_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(game_id, None))
+        return await asyncio.shield(future)
+
+    async def _refresh(self, game_id: str):
+        try:
+            await self._fetch_shared(game_id)
+        except GameNotFoundError:
+            pass  # Removed from the catalog: the next lookup reports it
+        finally:
+            self._refreshing.discard(game_id)
+
+    async def get_price(self, game_id: str) -> Tuple[float, str]:
+        """
+        Get the daily price of a game.
+
+        Returns:
+            Tuple of (price_per_day, source), source being cache or catalog
+
+        Raises:
+            GameNotFoundError: If the catalog does not know the game
+            PriceUnavailableError: If the catalog is unreachable and the game
+                has no cached price
+        """
+        cached = self._prices.get(game_id)
+        if cached is not None:
+            price, fetched_at = cached
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                return price, SOURCE_CACHE
+            if age < self.stale_ttl:
+                if game_id not in self._refreshing:
+                    self._refreshing.add(game_id)
+                    asyncio.ensure_future(self._refresh(game_id))
+                return price, SOURCE_CACHE
+
+        price = await self._fetch_shared(game_id)
+        if price is not None:
+            return price, SOURCE_CATALOG
+        if cached is not None:
+            # Catalog is down: an expired price beats the flat default
+            return cached[0], SOURCE_CACHE
+        raise PriceUnavailableError(game_id)
+
+    async def get_prices(self, game_ids: Iterable[str]) -> Dict[str, Tuple[float, str]]:
+        """
+        Get prices for many games, fetching cache misses concurrently.
+
+        Raises:
+            GameNotFoundError, PriceUnavailableError: As get_price, for the
+                first game in order that could not be priced
+        """
+        unique = list(dict.fromkeys(game_ids))
+        prices = await asyncio.gather(
+            *(self.get_price(g) for g in unique), return_exceptions=True
+        )
+        for price in prices:
+            if isinstance(price, Exception):
+                raise price
+        return dict(zip(unique, prices))
+
+
+class PricingEngine:
+    """Computes rental quotes from catalog prices and long-rental discounts."""
+
+    def __init__(
+        self,
+        price_client: CatalogPriceClient,
+        discount_tiers: List[Tuple[int, float]] = DISCOUNT_TIERS,
+    ):
+        self.price_client = price_client
+        self.discount_tiers = sorted(discount_tiers, reverse=True)
+
+    def discount_rate(self, rental_days: int) -> float:
+        """Discount for the longest tier the rental qualifies for."""
+        for min_days, rate in self.discount_tiers:
+            if rental_days >= min_days:
+                return rate
+        return 0.0
+
+    def build_quote(
+        self, game_id: str, rental_days: int, price_per_day: float, source: str
+    ) -> Quote:
+        base_amount = round(price_per_day * rental_days, 2)
+        discount_rate = self.discount_rate(rental_days)
+        return Quote(
+            game_id=game_id,
+            rental_days=rental_days,
+            price_per_day=price_per_day,
+            base_amount=base_amount,
+            discount_rate=discount_rate,
+            total_amount=round(base_amount * (1 - discount_rate), 2),
+            price_source=source,
+        )
+
+    async def quote(self, game_id: str, rental_days: int) -> Quote:
+        """Quote a single rental."""
+        price, source = await self.price_client.get_price(game_id)
+        return self.build_quote(game_id, rental_days, price, source)
+
+    async def quote_many(self, items: Iterable[Tuple[str, int]]) -> List[Quote]:
+        """Quote many rentals, looking up each distinct game only once."""
+        items = list(items)
+        prices = await self.price_client.get_prices(game_id for game_id, _ in items)
+        return [
+            self.build_quote(game_id, days, *prices[game_id]) for game_id, days in items
+        ]
+
+
+# Global instances
+catalog_price_client = CatalogPriceClient()
+pricing_engine = PricingEngine(catalog_price_client)
@@ -0,0 +1,108 @@
+"""
+Persistent event deduplication for Rent service consumers.
+
+A consumer skips events whose message_id it already processed (see
+`rabbitmq_client.DedupSet`). The in-memory set forgets everything on
+restart and knows nothing of other replicas consuming the same queue, while
+a broker redelivers every unacked event after a crash. `ProcessedEvents`
+also stores the ids in `processed_events`: an id missing from memory is
+looked up by primary key before the event is handled, the ids of the last
+window are loaded into memory on start, and rows older than the window are
+pruned.
+"""
+
+import asyncio
+from datetime import timedelta
+from typing import Callable, List
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import ProcessedEvent, utc_now
+from rabbitmq_client import CONSUMER_DEDUP_MAX_IDS, CONSUMER_DEDUP_WINDOW, DedupSet
+
+# Rows older than the window are deleted after this many recorded events
+PRUNE_EVERY = 1000
+
+
+class ProcessedEvents(DedupSet):
+    """Processed event ids of a queue, kept in memory and in the database."""
+
+    def __init__(
+        self,
+        queue: str,
+        session_factory: Callable[[], Session] = SessionLocal,
+        window: float = CONSUMER_DEDUP_WINDOW,
+        max_ids: int = CONSUMER_DEDUP_MAX_IDS,
+    ):
+        super().__init__(window, max_ids)
+        self.queue = queue
+        self.session_factory = session_factory
+        self.window = window
+        self.max_ids = max_ids
+        self._recorded = 0
+
+    def _prune(self, db: Session):
+        cutoff = utc_now() - timedelta(seconds=self.window)
+        db.query(ProcessedEvent).filter(
+            ProcessedEvent.queue == self.queue, ProcessedEvent.processed_at < cutoff
+        ).delete(synchronize_session=False)
+
+    def _load(self) -> List[str]:
+        db = self.session_factory()
+        try:
+            self._prune(db)
+            db.commit()
+            rows = (
+                db.query(ProcessedEvent.event_id)
+                .filter(ProcessedEvent.queue == self.queue)
+                .order_by(ProcessedEvent.processed_at.desc())
+                .limit(self.max_ids)
+                .all()
+            )
+            return [row.event_id for row in rows]
+        finally:
+            db.close()
+
+    def _exists(self, event_id: str) -> bool:
+        db = self.session_factory()
+        try:
+            return db.get(ProcessedEvent, (self.queue, event_id)) is not None
+        finally:
+            db.close()
+
+    def _insert(self, event_id: str, prune: bool):
+        db = self.session_factory()
+        try:
+            db.add(ProcessedEvent(queue=self.queue, event_id=event_id))
+            db.commit()
+        except IntegrityError:
+            # Recorded by another replica
+            db.rollback()
+        try:
+            if prune:
+                self._prune(db)
+                db.commit()
+        finally:
+            db.close()
+
+    async def load(self):
+        """Remember the ids processed within the window, oldest first."""
+        for event_id in reversed(await asyncio.to_thread(self._load)):
+            self.add(event_id)
+
+    async def seen(self, event_id: str) -> bool:
+        if event_id in self:
+            return True
+        if await asyncio.to_thread(self._exists, event_id):
+            self.add(event_id)
+            return True
+        return False
+
+    async def record(self, event_id: str):
+        self.add(event_id)
+        self._recorded += 1
+        await asyncio.to_thread(
+            self._insert, event_id, self._recorded % PRUNE_EVERY == 0
+        )
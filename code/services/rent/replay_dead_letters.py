@@ -0,0 +1,41 @@
+"""
+Replay dead-lettered events of a Rent service consumer queue.
+
+Events that kept failing (or could not be decoded) are parked in
+`<queue>.dead` by the consumer's retry topology. Once the cause is fixed,
+this moves them back into the queue with a fresh attempt count; `--list`
+only prints them.
+
+Usage:
+    python replay_dead_letters.py QUEUE [--limit 100] [--list]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+
+from rabbitmq_client import replay_dead_letters
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay dead-lettered events back into their queue"
+    )
+    parser.add_argument("queue", help="Consumer queue, e.g. rent_payment_saga")
+    parser.add_argument("--limit", type=int, help="Maximum events (default: all)")
+    parser.add_argument(
+        "--list", action="store_true", help="Print the events without replaying"
+    )
+    args = parser.parse_args(argv)
+
+    events = asyncio.run(replay_dead_letters(args.queue, args.limit, peek=args.list))
+    for event in events:
+        print(json.dumps(event, ensure_ascii=False))
+    action = "dead-lettered" if args.list else "replayed"
+    print(f"{len(events)} events {action}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
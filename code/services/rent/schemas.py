@@ -3,7 +3,7 @@ Pydantic schemas for Rent service.
 """
 
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -92,10 +92,61 @@ class OrderResponse(BaseModel):
     pickup_location: str
     return_date: Optional[datetime]
     rental_days: int
+    due_date: Optional[datetime]
     total_amount: float
     penalty_amount: Optional[float]
     payment_id: Optional[str]
+    game_condition: Optional[str]
+    version: int  # incremented on every change
     created_at: datetime
     updated_at: datetime
 
     model_config = {"from_attributes": True}
+
+
+class OrderEventResponse(BaseModel):
+    """Response schema for an order state transition."""
+
+    event_id: int
+    order_id: str
+    action: str
+    from_status: Optional[str]
+    to_status: str
+    payload: Dict[str, Any]
+    created_at: datetime
+
+    model_config = {"from_attributes": True}
+
+
+class QuoteItem(BaseModel):
+    """A single rental to quote."""
+
+    game_id: str
+    rental_days: int = Field(..., ge=1, le=30)
+
+
+class QuoteRequest(BaseModel):
+    """Request schema for quoting many rentals at once."""
+
+    items: List[QuoteItem] = Field(..., min_length=1, max_length=1000)
+
+
+class QuoteResponse(BaseModel):
+    """Response schema for a rental price quote."""
+
+    game_id: str
+    rental_days: int
+    price_per_day: float
+    base_amount: float
+    discount_rate: float
+    total_amount: float
+    price_source: str  # cache, catalog
+
+    model_config = {"from_attributes": True}
+
+
+class OrderListResponse(BaseModel):
+    """Response schema for a page of orders."""
+
+    items: List[OrderResponse]
+    next_cursor: Optional[str]  # pass back as ?cursor= for the next page
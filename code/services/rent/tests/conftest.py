@@ -30,14 +30,26 @@ import database
 
 database.engine = test_engine
 
+import main
 from main import app
 from database import get_db
+from order_state import LiveOrderProjection
+from payment_saga import payment_saga
+
+# Sagas open their own sessions outside of request handlers
+payment_saga.session_factory = sessionmaker(bind=test_engine)
+# No broker in tests: resume sagas on startup but do not consume payment
+# events, whose dedup load would share the single test connection with the
+# test from a worker thread
+payment_saga.start = payment_saga.resume
 
 
 @pytest.fixture(scope="function", autouse=True)
 def setup_test_db():
     """Set up and tear down test database for each test."""
     Base.metadata.create_all(bind=test_engine)
+    # The event log starts empty again, so analytics tail it from the start
+    main.order_projection = LiveOrderProjection(sessionmaker(bind=test_engine))
     yield
     Base.metadata.drop_all(bind=test_engine)
 
@@ -1,10 +1,21 @@
 """Integration tests for Rent service."""
 
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
+import pytest
 from fastapi import status
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from models import Order, OrderSaga
 from schemas import BookingResponse
+from notification_dispatcher import notification_dispatcher
+from payment_saga import payment_saga
+from pricing import GameNotFoundError, PriceUnavailableError, catalog_price_client
+
+
+@pytest.fixture(autouse=True)
+def priced_game():
+    """Give the game most tests order a catalog price (the catalog is not running)."""
+    catalog_price_client.update_price("game-456", 100.0)
 
 
 class TestRentIntegration:
@@ -197,3 +208,397 @@ class TestRentIntegration:
             data = response.json()
             assert data["order_id"] == order_id
             assert data["booking_id"] == "booking-123"
+
+    def test_pickup_notification_is_queued(self, client):
+        """Test that pickup notifications are queued instead of sent inline."""
+        with (
+            patch("main.get_booking") as mock_booking,
+            patch("main.initiate_payment_grpc") as mock_payment,
+            patch.object(notification_dispatcher, "service") as mock_service,
+        ):
+            mock_booking.return_value = BookingResponse(
+                booking_id="booking-123",
+                game_id="game-456",
+                user_id="user-789",
+                status="confirmed",
+                pickup_date=datetime.now(),
+            )
+            mock_payment.return_value = {"payment_id": "pay-123", "status": "initiated"}
+            mock_service.send_push_notifications = AsyncMock(return_value=[True])
+            mock_service.send_emails = AsyncMock(return_value=[True])
+
+            create_response = client.post(
+                "/api/v1/orders",
+                json={
+                    "booking_id": "booking-123",
+                    "user_id": "user-789",
+                    "pickup_location": "Москва",
+                    "rental_days": 7,
+                },
+            )
+            order_id = create_response.json()["order_id"]
+
+            response = client.post(
+                f"/api/v1/orders/{order_id}/pickup-notification",
+                json={
+                    "pickup_date": "2024-01-21T10:00:00",
+                    "pickup_location": "Москва",
+                },
+            )
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["message"] == "Notifications queued"
+
+            metrics = client.get("/api/v1/notifications/metrics").json()
+            assert metrics["enqueued"] == 2
+
+    def test_create_order_uses_catalog_price(self, client):
+        """Test that order total comes from the catalog price with discounts."""
+        catalog_price_client.update_price("game-priced", 50.0)
+        with (
+            patch("main.get_booking") as mock_booking,
+            patch("main.initiate_payment_grpc") as mock_payment,
+        ):
+            mock_booking.return_value = BookingResponse(
+                booking_id="booking-123",
+                game_id="game-priced",
+                user_id="user-789",
+                status="confirmed",
+                pickup_date=datetime.now(),
+            )
+            mock_payment.return_value = {"payment_id": "pay-123", "status": "initiated"}
+
+            response = client.post(
+                "/api/v1/orders",
+                json={
+                    "booking_id": "booking-123",
+                    "user_id": "user-789",
+                    "pickup_location": "Москва",
+                    "rental_days": 7,
+                },
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            # 7 days * 50 with the 10% weekly discount
+            assert response.json()["total_amount"] == 315.0
+
+    def test_quote_orders(self, client):
+        """Test quoting several rentals at once."""
+        catalog_price_client.update_price("game-a", 100.0)
+        catalog_price_client.update_price("game-b", 40.0)
+
+        response = client.post(
+            "/api/v1/orders/quotes",
+            json={
+                "items": [
+                    {"game_id": "game-a", "rental_days": 3},
+                    {"game_id": "game-b", "rental_days": 14},
+                ]
+            },
+        )
+        assert response.status_code == status.HTTP_200_OK
+        quotes = response.json()
+        assert [q["total_amount"] for q in quotes] == [300.0, 448.0]
+        assert quotes[1]["discount_rate"] == 0.2
+
+    def test_create_order_without_price_is_rejected(self, client, test_db):
+        """Test that an order is not created for a game that cannot be priced."""
+        order = {
+            "booking_id": "booking-123",
+            "user_id": "user-789",
+            "pickup_location": "Москва",
+            "rental_days": 7,
+        }
+        with (
+            patch("main.get_booking") as mock_booking,
+            patch("main.pricing_engine.quote", new_callable=AsyncMock) as mock_quote,
+        ):
+            mock_booking.return_value = BookingResponse(
+                booking_id="booking-123",
+                game_id="game-gone",
+                user_id="user-789",
+                status="confirmed",
+                pickup_date=datetime.now(),
+            )
+
+            mock_quote.side_effect = GameNotFoundError("game-gone")
+            response = client.post("/api/v1/orders", json=order)
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+
+            mock_quote.side_effect = PriceUnavailableError("game-gone")
+            response = client.post("/api/v1/orders", json=order)
+            assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+        assert test_db.query(Order).count() == 0
+
+    def test_create_order_rejects_duplicate_booking(self, client):
+        """Test that a second order for the same booking is rejected."""
+        with (
+            patch("main.get_booking") as mock_booking,
+            patch("main.initiate_payment_grpc") as mock_payment,
+        ):
+            mock_booking.return_value = BookingResponse(
+                booking_id="booking-123",
+                game_id="game-456",
+                user_id="user-789",
+                status="confirmed",
+                pickup_date=datetime.now(),
+            )
+            mock_payment.return_value = {"payment_id": "pay-123", "status": "initiated"}
+            order = {
+                "booking_id": "booking-123",
+                "user_id": "user-789",
+                "pickup_location": "Москва",
+                "rental_days": 7,
+            }
+
+            first = client.post("/api/v1/orders", json=order)
+            second = client.post("/api/v1/orders", json=order)
+            assert first.status_code == status.HTTP_201_CREATED
+            assert second.status_code == status.HTTP_409_CONFLICT
+
+    def test_concurrent_orders_for_one_booking(self, client, test_db):
+        """Test that the unique index rejects an order created meanwhile."""
+        booking = BookingResponse(
+            booking_id="booking-123",
+            game_id="game-456",
+            user_id="user-789",
+            status="confirmed",
+            pickup_date=datetime.now(),
+        )
+
+        async def booking_after_competing_order(booking_id):
+            # The other request commits its order while this one awaits
+            test_db.add(
+                Order(
+                    order_id="order-other",
+                    booking_id=booking_id,
+                    game_id="game-456",
+                    user_id="user-789",
+                    pickup_date=booking.pickup_date,
+                    pickup_location="Москва",
+                    rental_days=7,
+                    total_amount=700.0,
+                )
+            )
+            test_db.commit()
+            return booking
+
+        with (
+            patch("main.get_booking", side_effect=booking_after_competing_order),
+            patch("main.initiate_payment_grpc") as mock_payment,
+        ):
+            response = client.post(
+                "/api/v1/orders",
+                json={
+                    "booking_id": "booking-123",
+                    "user_id": "user-789",
+                    "pickup_location": "Москва",
+                    "rental_days": 7,
+                },
+            )
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        mock_payment.assert_not_called()
+        assert [o.order_id for o in test_db.query(Order)] == ["order-other"]
+
+    def test_list_user_orders_paginates(self, client, test_db):
+        """Test keyset pagination over a user's orders, newest first."""
+        created = datetime(2024, 1, 1, 12, 0)
+        for i in range(5):
+            test_db.add(
+                Order(
+                    order_id=f"order-{i}",
+                    booking_id=f"booking-{i}",
+                    game_id="game-1",
+                    user_id="user-1" if i != 2 else "user-2",
+                    status="active",
+                    pickup_date=created,
+                    pickup_location="Москва",
+                    rental_days=7,
+                    total_amount=700.0,
+                    # Two orders share a timestamp to exercise the tiebreaker
+                    created_at=created + timedelta(minutes=min(i, 3)),
+                )
+            )
+        test_db.commit()
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/api/v1/users/user-1/orders", params=params)
+            assert response.status_code == status.HTTP_200_OK
+            page = response.json()
+            seen.extend(order["order_id"] for order in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+        assert seen == ["order-4", "order-3", "order-1", "order-0"]
+
+    def test_list_orders_by_status(self, client, test_db):
+        """Test the admin listing filtered by status."""
+        for i, order_status in enumerate(["active", "returned", "active"]):
+            test_db.add(
+                Order(
+                    order_id=f"order-{i}",
+                    booking_id=f"booking-{i}",
+                    game_id="game-1",
+                    user_id="user-1",
+                    status=order_status,
+                    pickup_date=datetime(2024, 1, 1),
+                    pickup_location="Москва",
+                    rental_days=7,
+                    total_amount=700.0,
+                )
+            )
+        test_db.commit()
+
+        response = client.get("/api/v1/orders", params={"status": "active"})
+        assert response.status_code == status.HTTP_200_OK
+        page = response.json()
+        assert {order["order_id"] for order in page["items"]} == {
+            "order-0",
+            "order-2",
+        }
+        assert page["next_cursor"] is None
+
+        invalid = client.get(
+            "/api/v1/orders", params={"status": "active", "cursor": "not-a-cursor"}
+        )
+        assert invalid.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_rental_lifecycle_with_extension(self, client):
+        """Test extend, end, return and confirm-return on one order."""
+        catalog_price_client.update_price("game-priced", 50.0)
+        pickup_date = datetime(2024, 6, 1, 12, 0)
+        with (
+            patch("main.get_booking") as mock_booking,
+            patch("main.initiate_payment_grpc") as mock_payment,
+        ):
+            mock_booking.return_value = BookingResponse(
+                booking_id="booking-123",
+                game_id="game-priced",
+                user_id="user-789",
+                status="confirmed",
+                pickup_date=pickup_date,
+            )
+            mock_payment.return_value = {"payment_id": "pay-123", "status": "initiated"}
+
+            order = client.post(
+                "/api/v1/orders",
+                json={
+                    "booking_id": "booking-123",
+                    "user_id": "user-789",
+                    "pickup_location": "Москва",
+                    "rental_days": 5,
+                },
+            ).json()
+            order_id = order["order_id"]
+            # Inserted, then updated with the payment id
+            assert order["version"] == 2
+
+            client.post(
+                f"/api/v1/orders/{order_id}/confirm-receipt",
+                json={"user_id": "user-789"},
+            )
+
+            forbidden = client.post(
+                f"/api/v1/orders/{order_id}/extend",
+                json={"user_id": "someone-else", "additional_days": 2},
+            )
+            assert forbidden.status_code == status.HTTP_403_FORBIDDEN
+
+            extended = client.post(
+                f"/api/v1/orders/{order_id}/extend",
+                json={"user_id": "user-789", "additional_days": 2},
+            )
+            assert extended.status_code == status.HTTP_200_OK
+            data = extended.json()
+            assert data["rental_days"] == 7
+            # Repriced for 7 days, which qualifies for the weekly discount
+            assert data["total_amount"] == 315.0
+            assert data["due_date"] == (pickup_date + timedelta(days=7)).isoformat()
+            assert data["version"] == 4
+
+            ended = client.post(f"/api/v1/orders/{order_id}/end", json={})
+            assert ended.json()["status"] == "ended"
+
+            too_late = client.post(
+                f"/api/v1/orders/{order_id}/extend",
+                json={"user_id": "user-789", "additional_days": 1},
+            )
+            assert too_late.status_code == status.HTTP_409_CONFLICT
+
+            returned = client.post(
+                f"/api/v1/orders/{order_id}/return",
+                json={"user_id": "user-789", "return_location": "Москва"},
+            )
+            assert returned.json()["status"] == "returned"
+
+            confirmed = client.post(
+                f"/api/v1/orders/{order_id}/confirm-return",
+                json={"game_condition": "good"},
+            )
+            assert confirmed.status_code == status.HTTP_200_OK
+            data = confirmed.json()
+            assert data["status"] == "completed"
+            assert data["game_condition"] == "good"
+
+            events = client.get(f"/api/v1/orders/{order_id}/events").json()
+            assert [event["action"] for event in events] == [
+                "create",
+                "confirm_receipt",
+                "extend",
+                "end_rental",
+                "return_game",
+                "confirm_return",
+            ]
+            assert events[2]["payload"]["rental_days"] == 7
+
+            again = client.post(
+                f"/api/v1/orders/{order_id}/confirm-return",
+                json={"game_condition": "bad"},
+            )
+            assert again.status_code == status.HTTP_409_CONFLICT
+
+            analytics = client.get("/api/v1/orders/analytics").json()
+            assert analytics["by_status"] == {"completed": 1}
+            assert analytics["events"] == 6
+
+    def test_failed_payment_initiation_cancels_order(self, client, test_db):
+        """Test that an order whose payment cannot be initiated is compensated."""
+        with (
+            patch("main.get_booking") as mock_booking,
+            patch("main.initiate_payment_grpc") as mock_payment,
+            patch.object(payment_saga, "schedule_compensation") as mock_compensate,
+        ):
+            mock_booking.return_value = BookingResponse(
+                booking_id="booking-123",
+                game_id="game-456",
+                user_id="user-789",
+                status="confirmed",
+                pickup_date=datetime.now(),
+            )
+            mock_payment.return_value = None
+            order = {
+                "booking_id": "booking-123",
+                "user_id": "user-789",
+                "pickup_location": "Москва",
+                "rental_days": 7,
+            }
+
+            response = client.post("/api/v1/orders", json=order)
+            assert response.status_code == status.HTTP_502_BAD_GATEWAY
+
+            cancelled = test_db.query(Order).one()
+            assert cancelled.status == "cancelled"
+            mock_compensate.assert_called_once_with(cancelled.order_id)
+            saga = test_db.get(OrderSaga, cancelled.order_id)
+            assert saga.state == "compensating"
+
+            # A cancelled order does not block a new one for the booking
+            mock_payment.return_value = {"payment_id": "pay-1", "status": "initiated"}
+            retry = client.post("/api/v1/orders", json=order)
+            assert retry.status_code == status.HTTP_201_CREATED
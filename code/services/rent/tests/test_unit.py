@@ -0,0 +1,1264 @@
+"""Unit tests for Rent service components."""
+
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.pool import StaticPool
+
+from tests.conftest import test_engine
+from database import Base
+from event_codec import (
+    DEFLATE,
+    JSON,
+    LATEST,
+    MSGPACK,
+    EventDecodeError,
+    decode_event,
+    encode_event,
+    register_schema,
+)
+from models import Order, OrderEvent, OrderSaga, ProcessedEvent
+from notification_dispatcher import (
+    NotificationDispatcher,
+    NotificationQueueFull,
+)
+from order_state import (
+    CANCEL,
+    CONFIRM_PAYMENT,
+    CONFIRM_RECEIPT,
+    CREATE,
+    RETURN_GAME,
+    InvalidTransitionError,
+    LiveOrderProjection,
+    apply_transition,
+    next_status,
+    rebuild,
+)
+from migrations import run_migrations
+from overdue_scheduler import OverdueScheduler
+from payment_saga import (
+    COMPENSATED,
+    COMPENSATING,
+    COMPLETED,
+    PaymentSagaCoordinator,
+    begin_saga,
+)
+from pricing import (
+    CatalogPriceClient,
+    GameNotFoundError,
+    PriceUnavailableError,
+    PricingEngine,
+    parse_discount_tiers,
+)
+from processed_events import ProcessedEvents
+from rabbitmq_client import (
+    DEAD_LETTERED,
+    RETRIED,
+    Consumer,
+    DedupSet,
+    RetryTopology,
+)
+
+
+class FakeNotificationService:
+    """Provider stub that records batches and fails chosen attempts."""
+
+    def __init__(self, fail_first: int = 0):
+        self.push_batches = []
+        self.email_batches = []
+        self.fail_first = fail_first
+
+    async def send_push_notifications(self, notifications):
+        self.push_batches.append(notifications)
+        return self._results(notifications)
+
+    async def send_emails(self, emails):
+        self.email_batches.append(emails)
+        return self._results(emails)
+
+    def _results(self, batch):
+        results = []
+        for _ in batch:
+            results.append(self.fail_first <= 0)
+            self.fail_first -= 1
+        return results
+
+
+class TestNotificationDispatcher:
+    @pytest.mark.asyncio
+    async def test_batches_notifications_per_provider(self):
+        service = FakeNotificationService()
+        dispatcher = NotificationDispatcher(
+            service, workers=1, batch_size=50, batch_wait=0.05
+        )
+        await dispatcher.start()
+
+        for i in range(10):
+            dispatcher.enqueue_push(f"user-{i}", "Title", "Message")
+            dispatcher.enqueue_email(f"user-{i}", "Subject", "Body", email="a@b.c")
+
+        await dispatcher.stop()
+
+        assert len(service.push_batches) == 1
+        assert len(service.push_batches[0]) == 10
+        assert len(service.email_batches) == 1
+        metrics = dispatcher.metrics()
+        assert metrics["sent"] == 20
+        assert metrics["batches"] == 2
+        assert metrics["send_latency_ms"]["push"]["count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_retries_failed_notifications(self):
+        service = FakeNotificationService(fail_first=2)
+        dispatcher = NotificationDispatcher(
+            service, workers=1, batch_wait=0.01, retry_base_delay=0.001
+        )
+        await dispatcher.start()
+
+        for i in range(3):
+            dispatcher.enqueue_push(f"user-{i}", "Title", "Message")
+
+        await dispatcher.stop()
+
+        assert [len(batch) for batch in service.push_batches] == [3, 2]
+        metrics = dispatcher.metrics()
+        assert metrics["sent"] == 3
+        assert metrics["retried"] == 2
+        assert metrics["failed"] == 0
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_attempts(self):
+        service = FakeNotificationService(fail_first=100)
+        dispatcher = NotificationDispatcher(
+            service, workers=1, max_attempts=3, retry_base_delay=0.001
+        )
+        await dispatcher.start()
+
+        dispatcher.enqueue_push("user-1", "Title", "Message")
+
+        await dispatcher.stop()
+
+        assert len(service.push_batches) == 3
+        assert dispatcher.metrics()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_resolves_missing_email_addresses(self):
+        service = FakeNotificationService()
+        dispatcher = NotificationDispatcher(service, workers=1)
+
+        async def resolve_email(user_id):
+            return f"{user_id}@example.com"
+
+        await dispatcher.start(resolve_email=resolve_email)
+        dispatcher.enqueue_email("user-1", "Subject", "Body")
+        await dispatcher.stop()
+
+        assert service.email_batches[0][0]["email"] == "user-1@example.com"
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_queue_is_full(self):
+        dispatcher = NotificationDispatcher(FakeNotificationService(), queue_size=1)
+        await dispatcher.start()
+        # Keep workers from draining the queue during the test
+        for task in dispatcher._tasks:
+            task.cancel()
+        await asyncio.gather(*dispatcher._tasks, return_exceptions=True)
+
+        dispatcher.enqueue_push("user-1", "Title", "Message")
+        with pytest.raises(NotificationQueueFull):
+            dispatcher.enqueue_push("user-2", "Title", "Message")
+
+        assert dispatcher.metrics()["queue_depth"]["push"] == 1
+        assert dispatcher.metrics()["rejected"] == 1
+
+
+class FakeDispatcher:
+    """Dispatcher stub that records queued reminders."""
+
+    def __init__(self):
+        self.pushes = []
+        self.emails = []
+
+    async def put_push(self, user_id, title, message):
+        self.pushes.append((user_id, title))
+
+    async def put_email(self, user_id, subject, body, email=None):
+        self.emails.append((user_id, subject))
+
+
+def make_order(db, order_id, due_date, status="active", total_amount=700.0):
+    db.add(
+        Order(
+            order_id=order_id,
+            booking_id=f"booking-{order_id}",
+            game_id="game-1",
+            user_id=f"user-{order_id}",
+            status=status,
+            pickup_date=due_date - timedelta(days=7),
+            pickup_location="Москва",
+            rental_days=7,
+            due_date=due_date,
+            total_amount=total_amount,
+        )
+    )
+
+
+class TestOverdueScheduler:
+    @pytest.mark.asyncio
+    async def test_penalizes_overdue_and_reminds_due_soon_orders(self):
+        Session = sessionmaker(bind=test_engine)
+        now = datetime(2024, 6, 10, 12, 0)
+        db = Session()
+        make_order(db, "overdue", now - timedelta(days=1, hours=2))
+        make_order(db, "due-soon", now + timedelta(hours=5))
+        make_order(db, "later", now + timedelta(days=3))
+        make_order(db, "returned", now - timedelta(days=5), status="returned")
+        db.commit()
+        db.close()
+
+        dispatcher = FakeDispatcher()
+        scheduler = OverdueScheduler(
+            session_factory=Session, dispatcher=dispatcher, chunk_size=1
+        )
+        result = await scheduler.run_once(now=now)
+
+        assert result.scanned == 2
+        assert result.chunks == 2
+        assert result.penalized == 1
+        assert result.reminders == 2
+        assert sorted(dispatcher.pushes) == [
+            ("user-due-soon", "Return reminder"),
+            ("user-overdue", "Rental overdue"),
+        ]
+
+        db = Session()
+        orders = {o.order_id: o for o in db.query(Order).all()}
+        # 2 started days overdue * 100 per day * 1.5
+        assert orders["overdue"].penalty_amount == 300.0
+        assert orders["due-soon"].penalty_amount == 0.0
+        assert orders["later"].reminder_sent_at is None
+        assert orders["returned"].penalty_amount == 0.0
+        # The penalty is in the order event log
+        [event] = db.query(OrderEvent).all()
+        assert event.order_id == "overdue"
+        assert event.action == "charge_penalty"
+        assert (event.from_status, event.to_status) == ("active", "active")
+        assert event.payload == {"penalty_amount": 300.0, "reason": "overdue"}
+        db.close()
+
+    @pytest.mark.asyncio
+    async def test_rerun_does_not_repeat_reminders(self):
+        Session = sessionmaker(bind=test_engine)
+        now = datetime(2024, 6, 10, 12, 0)
+        db = Session()
+        make_order(db, "due-soon", now + timedelta(hours=5))
+        db.commit()
+        db.close()
+
+        dispatcher = FakeDispatcher()
+        scheduler = OverdueScheduler(session_factory=Session, dispatcher=dispatcher)
+        await scheduler.run_once(now=now)
+        second = await scheduler.run_once(now=now + timedelta(hours=1))
+        assert second.reminders == 0
+
+        # Once the order becomes overdue it gets one more reminder and a penalty
+        third = await scheduler.run_once(now=now + timedelta(hours=6))
+        assert third.reminders == 1
+        assert third.penalized == 1
+        assert len(dispatcher.pushes) == 2
+
+    @pytest.mark.asyncio
+    async def test_scans_ended_orders_and_bumps_version(self):
+        Session = sessionmaker(bind=test_engine)
+        now = datetime(2024, 6, 10, 12, 0)
+        db = Session()
+        make_order(db, "ended", now - timedelta(hours=2), status="ended")
+        db.commit()
+        db.close()
+
+        scheduler = OverdueScheduler(
+            session_factory=Session, dispatcher=FakeDispatcher()
+        )
+        result = await scheduler.run_once(now=now)
+        assert result.penalized == 1
+
+        db = Session()
+        order = db.query(Order).one()
+        assert order.penalty_amount == 150.0
+        assert order.version == 2
+        db.close()
+
+    @pytest.mark.asyncio
+    async def test_skips_orders_changed_during_scan(self):
+        Session = sessionmaker(bind=test_engine)
+        now = datetime(2024, 6, 10, 12, 0)
+        db = Session()
+        make_order(db, "overdue", now - timedelta(hours=2))
+        make_order(db, "untouched", now - timedelta(hours=3))
+        db.commit()
+        db.close()
+
+        class ConcurrentSession:
+            """Session that lets another writer change the order mid-chunk."""
+
+            def __init__(self):
+                self.db = Session()
+                self.reads = 0
+
+            def execute(self, statement, *args):
+                result = self.db.execute(statement, *args)
+                self.reads += 1
+                if self.reads == 1:
+                    # After the chunk was read, before it is written
+                    rows = result.freeze()
+                    other = Session()
+                    order = other.get(Order, "overdue")
+                    order.penalty_amount = 999.0
+                    other.commit()
+                    other.close()
+                    return rows()
+                return result
+
+            def __getattr__(self, name):
+                return getattr(self.db, name)
+
+        dispatcher = FakeDispatcher()
+        scheduler = OverdueScheduler(
+            session_factory=ConcurrentSession, dispatcher=dispatcher
+        )
+        result = await scheduler.run_once(now=now)
+
+        # The changed order is not written, so neither penalized nor reminded
+        # in this run; the rest of the chunk is
+        assert result.penalized == 1
+        assert result.reminders == 1
+        assert dispatcher.pushes == [("user-untouched", "Rental overdue")]
+        db = Session()
+        order = db.get(Order, "overdue")
+        assert order.penalty_amount == 999.0
+        assert order.reminder_sent_at is None
+        assert order.version == 2
+        assert db.get(Order, "untouched").penalty_amount == 150.0
+        assert [e.order_id for e in db.query(OrderEvent).all()] == ["untouched"]
+        db.close()
+
+        # The next run reminds it once
+        second = await OverdueScheduler(
+            session_factory=Session, dispatcher=dispatcher
+        ).run_once(now=now)
+        assert second.reminders == 1
+        assert len(dispatcher.pushes) == 2
+
+
+class TestOptimisticConcurrency:
+    def test_stale_write_is_rejected(self):
+        Session = sessionmaker(bind=test_engine)
+        db = Session()
+        make_order(db, "order-1", datetime(2024, 6, 10))
+        db.commit()
+        db.close()
+
+        first, second = Session(), Session()
+        staff = first.query(Order).one()
+        customer = second.query(Order).one()
+        staff.penalty_amount = 50.0
+        first.commit()
+
+        customer.rental_days = 10
+        with pytest.raises(StaleDataError):
+            second.commit()
+        second.rollback()
+
+        assert second.query(Order).one().rental_days == 7
+        first.close()
+        second.close()
+
+    def test_concurrent_updates_are_not_lost(self, tmp_path):
+        engine = create_engine(
+            f"sqlite:///{tmp_path / 'rent.db'}",
+            connect_args={"check_same_thread": False, "timeout": 30},
+        )
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        make_order(db, "order-1", datetime(2024, 6, 10))
+        db.commit()
+        db.close()
+
+        workers, increments = 4, 25
+
+        def worker():
+            db = Session()
+            for _ in range(increments):
+                while True:
+                    order = db.query(Order).one()
+                    order.penalty_amount += 1.0
+                    try:
+                        db.commit()
+                        break
+                    except StaleDataError:
+                        db.rollback()
+            db.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        db = Session()
+        order = db.query(Order).one()
+        assert order.penalty_amount == workers * increments
+        assert order.version == 1 + workers * increments
+        db.close()
+        engine.dispose()
+
+
+class TestMigrations:
+    def test_duplicate_live_orders_are_cancelled_before_unique_index(self):
+        engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            # A database from before the index, with two live orders for a booking
+            connection.execute(text("DROP INDEX uq_orders_booking_id_live"))
+        db = sessionmaker(bind=engine)()
+        for order_id, created_at, status in (
+            ("old", datetime(2024, 6, 1), "confirmed"),
+            ("new", datetime(2024, 6, 2), "created"),
+            ("gone", datetime(2024, 6, 3), "cancelled"),
+        ):
+            make_order(db, order_id, datetime(2024, 6, 10), status=status)
+            order = db.get(Order, order_id)
+            order.booking_id = "booking-1"
+            order.created_at = created_at
+        db.commit()
+        db.close()
+
+        run_migrations(engine)
+
+        db = sessionmaker(bind=engine)()
+        assert db.get(Order, "old").status == "cancelled"
+        assert db.get(Order, "new").status == "created"
+        [event] = db.query(OrderEvent).all()
+        assert (event.order_id, event.from_status) == ("old", "confirmed")
+        assert "uq_orders_booking_id_live" in {
+            index["name"] for index in inspect(engine).get_indexes("orders")
+        }
+        db.close()
+
+
+class TestOrderStateMachine:
+    def test_transition_table(self):
+        assert next_status(None, CREATE) == "created"
+        assert next_status("created", CONFIRM_PAYMENT) == "confirmed"
+        assert next_status("confirmed", CONFIRM_RECEIPT) == "active"
+        assert next_status("active", RETURN_GAME) == "returned"
+        with pytest.raises(InvalidTransitionError):
+            next_status("active", CANCEL)
+        with pytest.raises(InvalidTransitionError):
+            next_status("completed", RETURN_GAME)
+        with pytest.raises(InvalidTransitionError):
+            next_status("created", "teleport")
+
+    def test_invalid_transition_leaves_order_unchanged(self):
+        Session = sessionmaker(bind=test_engine)
+        db = Session()
+        make_order(db, "order-1", datetime(2024, 6, 10), status="created")
+        db.commit()
+        order = db.query(Order).one()
+
+        with pytest.raises(InvalidTransitionError) as error:
+            apply_transition(db, order, RETURN_GAME)
+        assert error.value.order_id == "order-1"
+        assert order.status == "created"
+        assert not db.new
+        db.close()
+
+    def test_rebuild_projection_from_events(self):
+        Session = sessionmaker(bind=test_engine)
+        db = Session()
+        for i, actions in enumerate(
+            [
+                [CONFIRM_PAYMENT, CONFIRM_RECEIPT, RETURN_GAME],
+                [CONFIRM_PAYMENT, CANCEL],
+                [],
+            ]
+        ):
+            order = Order(
+                booking_id=f"booking-{i}",
+                game_id="game-1",
+                user_id="user-1",
+                pickup_date=datetime(2024, 6, 1),
+                pickup_location="Москва",
+                rental_days=7,
+                total_amount=700.0,
+            )
+            apply_transition(db, order, CREATE)
+            for action in actions:
+                apply_transition(db, order, action)
+            db.commit()
+
+        projection = rebuild(db, batch_size=2)
+        db.close()
+
+        assert sorted(projection.statuses.values()) == [
+            "cancelled",
+            "created",
+            "returned",
+        ]
+        assert projection.events == 8
+        assert projection.transitions[CONFIRM_PAYMENT] == 2
+        summary = projection.summary()
+        assert summary["by_status"]["returned"] == 1
+        assert set(summary["mean_seconds_in_status"]) == {
+            "created",
+            "confirmed",
+            "active",
+        }
+
+    def test_live_projection_applies_only_new_events(self):
+        Session = sessionmaker(bind=test_engine)
+        db = Session()
+        live = LiveOrderProjection(Session)
+
+        def log(event_id, order_id, action, from_status, to_status):
+            db.add(
+                OrderEvent(
+                    event_id=event_id,
+                    order_id=order_id,
+                    action=action,
+                    from_status=from_status,
+                    to_status=to_status,
+                    created_at=datetime(2024, 6, 1, 12, event_id),
+                )
+            )
+            db.commit()
+
+        log(1, "order-1", CREATE, None, "created")
+        log(2, "order-1", CONFIRM_PAYMENT, "created", "confirmed")
+        assert live.catch_up() == 2
+        assert live.catch_up() == 0
+
+        # Event 3 belongs to a transaction that commits after event 4
+        log(4, "order-2", CREATE, None, "created")
+        assert live.catch_up() == 1
+        log(3, "order-1", CANCEL, "confirmed", "cancelled")
+        assert live.catch_up() == 1
+        assert live.catch_up() == 0
+        db.close()
+
+        summary = live.summary()
+        assert summary["events"] == 4
+        assert summary["by_status"] == {"cancelled": 1, "created": 1}
+
+    def test_live_projection_forgets_gaps_after_timeout(self):
+        Session = sessionmaker(bind=test_engine)
+        db = Session()
+        db.add(
+            OrderEvent(
+                event_id=5, order_id="order-1", action=CREATE, to_status="created"
+            )
+        )
+        db.commit()
+        db.close()
+
+        live = LiveOrderProjection(Session, gap_timeout=0)
+        assert live.catch_up() == 1
+        assert live.last_event_id == 5
+        # Ids 1-4 were never committed (rolled back): no longer looked for
+        assert live.catch_up() == 0
+        assert not live._gaps
+
+
+def saga_transport(calls, fail_booking=False):
+    """Mock Booking answering the compensation calls."""
+
+    async def handler(request):
+        calls.append((request.method, request.url.path))
+        if fail_booking:
+            return httpx.Response(503, json={"detail": "unavailable"})
+        return httpx.Response(200, json={"status": "canceled"})
+
+    return httpx.MockTransport(handler)
+
+
+def start_order(Session, order_id):
+    db = Session()
+    order = Order(
+        order_id=order_id,
+        booking_id=f"booking-{order_id}",
+        game_id="game-1",
+        user_id="user-1",
+        pickup_date=datetime(2024, 6, 1),
+        pickup_location="Москва",
+        rental_days=7,
+        total_amount=700.0,
+    )
+    apply_transition(db, order, CREATE)
+    begin_saga(db, order)
+    db.commit()
+    db.close()
+
+
+class TestPaymentSaga:
+    def coordinator(self, transport):
+        return PaymentSagaCoordinator(
+            session_factory=sessionmaker(bind=test_engine),
+            booking_url="http://booking",
+            retry_base_delay=0,
+            transport=transport,
+        )
+
+    @pytest.mark.asyncio
+    async def test_successful_payment_confirms_order(self):
+        Session = sessionmaker(bind=test_engine)
+        start_order(Session, "order-1")
+        calls = []
+        saga = self.coordinator(saga_transport(calls))
+
+        event = {"order_id": "order-1", "payment_id": "pay-1", "status": "completed"}
+        await saga.handle_payment_event(event)
+        # Redelivery is a no-op
+        await saga.handle_payment_event(event)
+        await saga.stop()
+
+        db = Session()
+        order = db.get(Order, "order-1")
+        assert order.status == "confirmed"
+        assert order.payment_id == "pay-1"
+        assert db.get(OrderSaga, "order-1").state == COMPLETED
+        db.close()
+        assert calls == []
+
+    @pytest.mark.asyncio
+    async def test_declined_payment_compensates(self):
+        Session = sessionmaker(bind=test_engine)
+        start_order(Session, "order-1")
+        calls = []
+        saga = self.coordinator(saga_transport(calls))
+
+        await saga.handle_payment_event({"order_id": "order-1", "status": "declined"})
+        # Events without a result (payment.initiated) are ignored
+        await saga.handle_payment_event({"order_id": "order-1", "payment_id": "p"})
+        await asyncio.gather(*saga._tasks)
+        await saga.stop()
+
+        db = Session()
+        assert db.get(Order, "order-1").status == "cancelled"
+        assert db.get(OrderSaga, "order-1").state == COMPENSATED
+        db.close()
+        # Nothing was reserved in the catalog, so nothing is given back there
+        assert calls == [("POST", "/api/v1/bookings/booking-order-1/cancel")]
+
+    @pytest.mark.asyncio
+    async def test_failed_compensation_resumes_after_restart(self):
+        Session = sessionmaker(bind=test_engine)
+        start_order(Session, "order-1")
+        calls = []
+        saga = self.coordinator(saga_transport(calls, fail_booking=True))
+        saga.max_attempts = 2
+
+        await saga.handle_payment_event({"order_id": "order-1", "status": "declined"})
+        await asyncio.gather(*saga._tasks)
+        await saga.stop()
+
+        db = Session()
+        record = db.get(OrderSaga, "order-1")
+        assert record.state == COMPENSATING
+        assert record.attempts == 2
+        assert not record.booking_cancelled
+        db.close()
+
+        # "Restart" with the booking service back up
+        restarted = self.coordinator(saga_transport(calls))
+        assert await restarted.resume() == 1
+        await asyncio.gather(*restarted._tasks)
+        await restarted.stop()
+
+        db = Session()
+        assert db.get(OrderSaga, "order-1").state == COMPENSATED
+        db.close()
+
+
+def catalog_transport(prices, calls, delay=0.0):
+    """Mock Game Catalog transport answering GET /api/v1/games/{game_id}."""
+
+    async def handler(request):
+        game_id = request.url.path.rsplit("/", 1)[-1]
+        calls.append(game_id)
+        if delay:
+            await asyncio.sleep(delay)
+        if game_id not in prices:
+            return httpx.Response(404, json={"detail": "Game not found"})
+        return httpx.Response(200, json={"price_per_day": prices[game_id]})
+
+    return httpx.MockTransport(handler)
+
+
+class TestPricingEngine:
+    def test_discount_tiers(self):
+        engine = PricingEngine(
+            CatalogPriceClient(), discount_tiers=parse_discount_tiers("7:0.1,14:0.2")
+        )
+        assert engine.discount_rate(3) == 0.0
+        assert engine.discount_rate(7) == 0.1
+        assert engine.discount_rate(20) == 0.2
+
+        quote = engine.build_quote("game-1", 14, 50.0, "cache")
+        assert quote.base_amount == 700.0
+        assert quote.total_amount == 560.0
+
+    @pytest.mark.asyncio
+    async def test_quote_uses_catalog_price_and_caches_it(self):
+        calls = []
+        client = CatalogPriceClient(
+            base_url="http://catalog", transport=catalog_transport({"g1": 80.0}, calls)
+        )
+        engine = PricingEngine(client, discount_tiers=[])
+
+        first = await engine.quote("g1", 3)
+        second = await engine.quote("g1", 5)
+        await client.close()
+
+        assert first.total_amount == 240.0
+        assert first.price_source == "catalog"
+        assert second.price_source == "cache"
+        assert calls == ["g1"]
+
+    @pytest.mark.asyncio
+    async def test_quote_many_fetches_each_game_once(self):
+        calls = []
+        client = CatalogPriceClient(
+            base_url="http://catalog",
+            transport=catalog_transport({"g1": 10.0, "g2": 20.0}, calls, delay=0.01),
+        )
+        engine = PricingEngine(client, discount_tiers=[])
+
+        quotes = await engine.quote_many([("g1", 1), ("g2", 2), ("g1", 3)] * 10)
+        await client.close()
+
+        assert [q.total_amount for q in quotes[:3]] == [10.0, 40.0, 30.0]
+        assert sorted(calls) == ["g1", "g2"]
+
+    @pytest.mark.asyncio
+    async def test_unknown_game_is_not_priced(self):
+        calls = []
+        client = CatalogPriceClient(
+            base_url="http://catalog", transport=catalog_transport({}, calls)
+        )
+        engine = PricingEngine(client, discount_tiers=[])
+
+        with pytest.raises(GameNotFoundError):
+            await engine.quote("missing", 2)
+        with pytest.raises(GameNotFoundError):
+            await engine.quote_many([("missing", 1), ("missing", 2)])
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_unreachable_catalog_serves_expired_price_only(self):
+        def handler(request):
+            raise httpx.ConnectError("catalog down", request=request)
+
+        client = CatalogPriceClient(
+            base_url="http://catalog",
+            ttl=0,
+            stale_ttl=0,
+            transport=httpx.MockTransport(handler),
+        )
+        engine = PricingEngine(client, discount_tiers=[])
+        client.update_price("g1", 30.0)
+
+        quote = await engine.quote("g1", 2)
+        assert quote.price_source == "cache"
+        assert quote.total_amount == 60.0
+        with pytest.raises(PriceUnavailableError):
+            await engine.quote("never-priced", 2)
+        await client.close()
+
+
+class FakeChannel:
+    """Records acks like a broker: multiple acks cover every earlier tag."""
+
+    def __init__(self):
+        self.unacked = []
+        self.acked = []
+        self.requeued = []
+        self.ack_frames = 0
+        self.tags = 0
+
+    def message(self, event, headers=None, message_id=None):
+        self.tags += 1
+        self.unacked.append(self.tags)
+        return FakeMessage(self, self.tags, event, headers, message_id)
+
+    def ack(self, delivery_tag, multiple):
+        # Acking an unknown tag closes a real channel
+        assert delivery_tag in self.unacked
+        tags = (
+            [t for t in self.unacked if t <= delivery_tag]
+            if multiple
+            else [delivery_tag]
+        )
+        self.unacked = [t for t in self.unacked if t not in tags]
+        self.acked.extend(tags)
+        self.ack_frames += 1
+
+    def nack(self, delivery_tag):
+        self.unacked.remove(delivery_tag)
+        self.requeued.append(delivery_tag)
+
+
+class FakeMessage:
+    def __init__(self, channel, delivery_tag, event, headers=None, message_id=None):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = event if isinstance(event, bytes) else json.dumps(event).encode()
+        self.headers = headers or {}
+        self.routing_key = "payment.completed"
+        self.content_type = "application/json"
+        self.content_encoding = None
+        self.message_id = message_id
+
+    async def ack(self, multiple=False):
+        self.channel.ack(self.delivery_tag, multiple)
+
+    async def nack(self, requeue=True):
+        self.channel.nack(self.delivery_tag)
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+async def endless(messages):
+    """Yield messages, then wait for more like an idle queue."""
+    for message in messages:
+        yield message
+    await asyncio.Event().wait()
+
+
+class TestConsumer:
+    @pytest.mark.asyncio
+    async def test_acks_in_delivery_order(self):
+        first_released = asyncio.Event()
+        handled = []
+
+        async def handler(event):
+            if event["n"] == 0:
+                await first_released.wait()
+            handled.append(event["n"])
+
+        channel = FakeChannel()
+        messages = [channel.message({"n": n}) for n in range(4)]
+        consumer = Consumer("test_queue", handler, concurrency=4)
+        task = asyncio.create_task(consumer.process(endless(messages)))
+        while len(handled) < 3:
+            await asyncio.sleep(0)
+
+        # Later messages are done but wait behind the first one
+        assert channel.acked == []
+        assert consumer.metrics()["unacked"] == 4
+
+        first_released.set()
+        while channel.unacked:
+            await asyncio.sleep(0)
+        assert channel.acked == [1, 2, 3, 4]
+        assert channel.ack_frames == 1
+
+        await consumer.stop()
+        await task
+
+    @pytest.mark.asyncio
+    async def test_stop_drains_running_handlers(self):
+        started = asyncio.Event()
+        handled = []
+
+        async def handler(event):
+            started.set()
+            await asyncio.sleep(0.02)
+            handled.append(event["n"])
+
+        channel = FakeChannel()
+        messages = [channel.message({"n": n}) for n in range(3)]
+        consumer = Consumer("test_queue", handler, concurrency=3)
+        task = asyncio.create_task(consumer.process(endless(messages)))
+        await started.wait()
+        await consumer.stop()
+
+        assert sorted(handled) == [0, 1, 2]
+        assert channel.acked == [1, 2, 3]
+        assert channel.requeued == []
+        assert task.done()
+
+    @pytest.mark.asyncio
+    async def test_stop_requeues_handlers_past_drain_timeout(self):
+        async def handler(event):
+            if event["n"] == 1:
+                await asyncio.sleep(10)
+
+        channel = FakeChannel()
+        messages = [channel.message({"n": n}) for n in range(3)]
+        consumer = Consumer("test_queue", handler, concurrency=3, drain_timeout=0.01)
+        task = asyncio.create_task(consumer.process(endless(messages)))
+        while consumer.metrics()["processed"] < 2:
+            await asyncio.sleep(0)
+        await consumer.stop()
+        await task
+
+        # The stuck message goes back to the queue, finished ones are acked
+        assert channel.requeued == [2]
+        assert sorted(channel.acked) == [1, 3]
+        assert consumer.metrics()["requeued"] == 1
+
+    @pytest.mark.asyncio
+    async def test_metrics(self):
+        def handler(event):
+            if event["n"] == 2:
+                raise ValueError("broken event")
+
+        channel = FakeChannel()
+        published_at = time.time() - 1.5
+        messages = [
+            channel.message({"n": n}, {"published_at": published_at}) for n in range(3)
+        ]
+        consumer = Consumer("test_queue", handler, concurrency=2, prefetch_count=10)
+        await consumer.process(iterate(messages))
+
+        metrics = consumer.metrics()
+        assert metrics["delivered"] == 3
+        assert metrics["processed"] == 2
+        assert metrics["failed"] == 1
+        assert metrics["in_flight"] == 0
+        assert metrics["unacked"] == 0
+        assert metrics["prefetch_count"] == 10
+        assert metrics["lag_ms"]["p50"] >= 1500
+        assert metrics["processing_ms"]["max"] < 1000
+
+
+class FakeExchange:
+    def __init__(self, fail=False):
+        self.published = []
+        self.fail = fail
+
+    async def publish(self, message, routing_key):
+        if self.fail:
+            raise ConnectionError("channel closed")
+        self.published.append((routing_key, message))
+
+
+def retry_topology(fail=False):
+    topology = RetryTopology("test_queue", delays=[1, 5], max_attempts=3)
+    topology.retry_exchange = FakeExchange(fail)
+    topology.dead_letter_exchange = FakeExchange(fail)
+    return topology
+
+
+class TestRetryTopology:
+    @pytest.mark.asyncio
+    async def test_failed_events_back_off_then_dead_letter(self):
+        def handler(event):
+            raise RuntimeError("booking service down")
+
+        channel = FakeChannel()
+        messages = [
+            channel.message({"n": n}, {"x-attempts": attempts} if attempts else None)
+            for n, attempts in enumerate([0, 1, 2])
+        ]
+        topology = retry_topology()
+        consumer = Consumer("test_queue", handler, concurrency=3, retry=topology)
+        await consumer.process(iterate(messages))
+
+        retries = topology.retry_exchange.published
+        assert [key for key, _ in retries] == ["1000", "5000"]
+        assert [m.headers["x-attempts"] for _, m in retries] == [1, 2]
+        [(key, dead)] = topology.dead_letter_exchange.published
+        assert key == "test_queue.dead"
+        assert dead.headers["x-attempts"] == 3
+        assert dead.headers["x-last-error"] == "RuntimeError: booking service down"
+        assert dead.headers["x-original-routing-key"] == "payment.completed"
+        # The originals are done with once republished
+        assert channel.acked == [1, 2, 3]
+        metrics = consumer.metrics()
+        assert (metrics[RETRIED], metrics[DEAD_LETTERED]) == (2, 1)
+
+    @pytest.mark.asyncio
+    async def test_malformed_event_is_dead_lettered_at_once(self):
+        handled = []
+        channel = FakeChannel()
+        topology = retry_topology()
+        consumer = Consumer("test_queue", handled.append, retry=topology)
+        await consumer.process(iterate([channel.message(b"{not json")]))
+
+        assert handled == []
+        assert topology.retry_exchange.published == []
+        [(key, dead)] = topology.dead_letter_exchange.published
+        assert key == "test_queue.dead"
+        assert dead.body == b"{not json"
+
+    @pytest.mark.asyncio
+    async def test_event_is_requeued_when_retry_cannot_be_published(self):
+        def handler(event):
+            if event["n"] == 0:
+                raise RuntimeError("booking service down")
+
+        channel = FakeChannel()
+        messages = [channel.message({"n": n}) for n in range(3)]
+        consumer = Consumer("test_queue", handler, retry=retry_topology(fail=True))
+        await consumer.process(iterate(messages))
+
+        assert channel.requeued == [1]
+        assert channel.acked == [2, 3]
+
+    @pytest.mark.asyncio
+    async def test_declares_delay_tiers(self):
+        channel = MagicMock()
+        channel.declare_exchange = AsyncMock()
+        channel.declare_queue = AsyncMock()
+
+        await RetryTopology("test_queue", delays=[1, 30]).declare(channel)
+
+        declared = {
+            call.args[0]: call.kwargs.get("arguments")
+            for call in channel.declare_queue.call_args_list
+        }
+        assert declared == {
+            "test_queue.retry.1000ms": {
+                "x-message-ttl": 1000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": "test_queue",
+            },
+            "test_queue.retry.30000ms": {
+                "x-message-ttl": 30000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": "test_queue",
+            },
+            "test_queue.dead": None,
+        }
+
+
+class TestEventDedup:
+    def test_ids_expire_with_their_partition(self):
+        now = [0.0]
+        dedup = DedupSet(window=40, max_ids=100, clock=lambda: now[0])
+        dedup.add("a")
+        now[0] = 15
+        dedup.add("b")
+
+        now[0] = 39
+        assert "a" in dedup and "b" in dedup
+        now[0] = 41
+        assert "a" not in dedup
+        assert "b" in dedup
+        # An idle period longer than the window forgets everything
+        now[0] = 200
+        assert len(dedup) == 0
+
+    def test_size_is_bounded(self):
+        dedup = DedupSet(window=3600, max_ids=100, clock=lambda: 0.0)
+        for n in range(1000):
+            dedup.add(f"event-{n}")
+
+        assert len(dedup) <= 100
+        assert "event-999" in dedup
+        assert "event-0" not in dedup
+
+    @pytest.mark.asyncio
+    async def test_redelivered_events_are_acked_without_handling(self):
+        handled = []
+        channel = FakeChannel()
+        messages = [
+            channel.message({"n": n}, message_id=message_id)
+            for n, message_id in enumerate(["a", "b", "a", None, None])
+        ]
+        consumer = Consumer("test_queue", lambda e: handled.append(e["n"]))
+        await consumer.process(iterate(messages))
+
+        assert handled == [0, 1, 3, 4]
+        assert channel.acked == [1, 2, 3, 4, 5]
+        assert consumer.metrics()["duplicates"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_events_are_not_remembered(self):
+        attempts = []
+
+        def handler(event):
+            attempts.append(event["n"])
+            if len(attempts) == 1:
+                raise RuntimeError("booking service down")
+
+        channel = FakeChannel()
+        consumer = Consumer("test_queue", handler, retry=retry_topology())
+        await consumer.process(iterate([channel.message({"n": 0}, message_id="a")]))
+        # The retry arrives as a new delivery with the same id
+        await consumer.process(iterate([channel.message({"n": 0}, message_id="a")]))
+
+        assert attempts == [0, 0]
+        assert "a" in consumer.dedup
+
+    @pytest.mark.asyncio
+    async def test_concurrent_duplicate_waits_for_the_first_copy(self):
+        released = asyncio.Event()
+        handled = []
+
+        async def handler(event):
+            await released.wait()
+            handled.append(event["n"])
+
+        channel = FakeChannel()
+        messages = [channel.message({"n": n}, message_id="a") for n in range(2)]
+        consumer = Consumer("test_queue", handler, concurrency=2)
+        task = asyncio.create_task(consumer.process(iterate(messages)))
+        while consumer.metrics()["delivered"] < 2:
+            await asyncio.sleep(0)
+        released.set()
+        await task
+
+        assert handled == [0]
+        assert channel.acked == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_processed_events_survive_restart(self):
+        Session = sessionmaker(bind=test_engine)
+        handled = []
+        channel = FakeChannel()
+        first = Consumer(
+            "test_queue",
+            lambda e: handled.append(e["n"]),
+            dedup=ProcessedEvents("test_queue", Session),
+        )
+        await first.process(iterate([channel.message({"n": 0}, message_id="a")]))
+
+        # A new consumer (restart or another replica) skips the redelivery
+        dedup = ProcessedEvents("test_queue", Session)
+        second = Consumer("test_queue", lambda e: handled.append(e["n"]), dedup=dedup)
+        await second.process(
+            iterate(
+                [
+                    channel.message({"n": 1}, message_id="a"),
+                    channel.message({"n": 2}, message_id="b"),
+                ]
+            )
+        )
+        assert handled == [0, 2]
+        assert second.metrics()["duplicates"] == 1
+
+        await ProcessedEvents("other_queue", Session).record("a")
+        restarted = ProcessedEvents("test_queue", Session)
+        await restarted.load()
+        assert "a" in restarted and "b" in restarted
+        assert len(restarted) == 2
+
+    @pytest.mark.asyncio
+    async def test_processed_events_outside_window_are_pruned(self):
+        Session = sessionmaker(bind=test_engine)
+        db = Session()
+        db.add(
+            ProcessedEvent(
+                queue="test_queue",
+                event_id="old",
+                processed_at=datetime.now() - timedelta(hours=2),
+            )
+        )
+        db.commit()
+        db.close()
+
+        dedup = ProcessedEvents("test_queue", Session, window=3600)
+        await dedup.load()
+        await dedup.record("new")
+
+        assert "old" not in dedup
+        db = Session()
+        assert [row.event_id for row in db.query(ProcessedEvent)] == ["new"]
+        db.close()
+
+
+class TestEventCodec:
+    def test_every_schema_round_trips_as_msgpack(self):
+        for event_type, schema in LATEST.items():
+            event = {name: f"{name}-value" for name in schema.fields}
+            encoded = encode_event(event_type, event, "msgpack")
+
+            assert encoded.content_type == MSGPACK
+            assert decode_event(encoded.body, MSGPACK, None, event_type) == event
+
+    def test_positional_encoding_omits_field_names(self):
+        event = {"order_id": "order-1", "payment_id": "payment-1"}
+        encoded = encode_event("rent.order.confirmed", event, "msgpack")
+
+        assert b"order_id" not in encoded.body
+        assert len(encoded.body) < len(encode_event("x", event, "json").body)
+
+    def test_extra_and_missing_fields(self):
+        event = {"order_id": "order-1", "event_id": "evt-1"}
+        encoded = encode_event("rent.order.confirmed", event, "msgpack")
+
+        decoded = decode_event(encoded.body, MSGPACK, None, "rent.order.confirmed")
+        assert decoded == {
+            "order_id": "order-1",
+            "payment_id": None,
+            "event_id": "evt-1",
+        }
+
+    def test_unregistered_event_type_is_packed_as_map(self):
+        event = {"anything": [1, 2.5, None, True]}
+        encoded = encode_event("unknown.event", event, "msgpack")
+
+        assert decode_event(encoded.body, MSGPACK, None, "unknown.event") == event
+
+    def test_json_and_legacy_events(self):
+        event = {"order_id": "order-1", "status": "completed"}
+        encoded = encode_event("payment.successful", event, "json")
+
+        assert encoded.content_type == JSON
+        assert decode_event(encoded.body, JSON) == event
+        # Publishers predating content types sent JSON without one
+        assert decode_event(json.dumps(event).encode(), None) == event
+
+    def test_large_events_are_compressed(self):
+        event = {"order_id": "order-1", "reason": "out of stock " * 200}
+        for encoding in ("json", "msgpack"):
+            encoded = encode_event("rent.order.cancelled", event, encoding, 1024)
+
+            assert encoded.content_encoding == DEFLATE
+            assert len(encoded.body) < 1024
+            assert decode_event(*encoded, event_type="rent.order.cancelled") == event
+
+        small = encode_event("rent.order.cancelled", {"order_id": "o"}, "json", 1024)
+        assert small.content_encoding is None
+
+    def test_new_schema_version_decodes_old_events(self):
+        register_schema("test.versioned", ("a", "b"))
+        old = encode_event("test.versioned", {"a": 1, "b": 2}, "msgpack")
+        register_schema("test.versioned", ("a", "c"), version=2)
+        new = encode_event("test.versioned", {"a": 1, "c": 3}, "msgpack")
+
+        assert decode_event(*old, event_type="test.versioned") == {"a": 1, "b": 2}
+        assert decode_event(*new, event_type="test.versioned") == {"a": 1, "c": 3}
+
+    @pytest.mark.parametrize(
+        "body, content_type, content_encoding, event_type",
+        [
+            (b"{}", "text/plain", None, None),
+            (b"{}", JSON, "gzip", None),
+            (b"\xc1", MSGPACK, None, None),
+            (b"not deflated", JSON, DEFLATE, None),
+            (encode_event("rent.period.ended", {}, "msgpack").body, MSGPACK, None, "x"),
+        ],
+    )
+    def test_undecodable_events(self, body, content_type, content_encoding, event_type):
+        with pytest.raises(EventDecodeError):
+            decode_event(body, content_type, content_encoding, event_type)
+
+    def test_unknown_encoding(self):
+        with pytest.raises(ValueError):
+            encode_event("rent.period.ended", {}, "xml")